@@ -1,14 +1,31 @@
 # access_control.py
 
+import asyncio
+import logging
+import time
+from functools import lru_cache
+
+from aiogram import Bot
+from aiogram.filters import BaseFilter
+from aiogram.types import BotCommand, BotCommandScopeChat, TelegramObject, User
+from aiogram.exceptions import TelegramAPIError
+
+from utils.metrics import ROLE_FILTER_REJECTIONS_TOTAL
+
+logger = logging.getLogger(__name__)
+
 # Словарь ролей и их прав
 ROLE_PERMISSIONS = {
     "admin": {
         "menu": ["orders", "reports", "settings"],
-        "reports": ["sales", "clients", "inventory"]
+        "reports": ["sales", "clients", "inventory"],
+        "orders": ["create", "confirm", "edit_any"],
+        "inventory": ["deliveries", "adjustments"]
     },
     "manager": {
         "menu": ["orders", "reports"],
-        "reports": ["sales", "clients"]
+        "reports": ["sales", "clients"],
+        "orders": ["create"]
     },
     "viewer": {
         "menu": ["reports"],
@@ -16,6 +33,26 @@ ROLE_PERMISSIONS = {
     }
 }
 
+# Команды бокового меню: (команда, описание, раздел, пункт раздела).
+# Пользователь видит команду, только если его роль имеет доступ к разделу/пункту.
+MENU_COMMANDS = [
+    ("/new_order", "➕ Создать новый заказ", "orders", "create"),
+    ("/my_orders", "📄 Посмотреть мои заказы", "reports", "sales"),
+    ("/sales_report", "📊 Отчет о продажах", "reports", "sales"),
+    ("/show_unconfirmed_orders", "📝 Показать draft заказы", "orders", "confirm"),
+    ("/payments", "💰 Оплаты клиентов", "reports", "clients"),
+    ("/financial_report_today", "📊 Отчет об оплатах за сегодня", "reports", "clients"),
+    ("/add_delivery", "🚚 Добавить поступление товара", "inventory", "deliveries"),
+    ("/inventory_report", "📈 Отчет об остатках товара", "reports", "inventory"),
+    ("/edit_order_admin", "✍️ Редактировать заказ", "orders", "edit_any"),
+    ("/adjust_inventory", "📦 Корректировка/Возврат по складу", "inventory", "adjustments"),
+]
+
+# Через сколько секунд кэш ролей сотрудников считается устаревшим
+ROLE_CACHE_TTL_SECONDS = 300
+# Через сколько секунд повторить загрузку ролей, если БД не ответила
+ROLE_CACHE_RETRY_SECONDS = 30
+
 def get_permissions(role):
     return ROLE_PERMISSIONS.get(role, {"menu": [], "reports": []})
 
@@ -23,4 +60,135 @@ def has_access(role, section, item=None):
     permissions = get_permissions(role)
     if item:
         return item in permissions.get(section, [])
-    return section in permissions
\ No newline at end of file
+    return section in permissions
+
+@lru_cache(maxsize=None)
+def get_commands_for_role(role) -> tuple:
+    """Возвращает команды меню, доступные роли. Вычисляется один раз на роль."""
+    return tuple(
+        BotCommand(command=command, description=description)
+        for command, description, section, item in MENU_COMMANDS
+        if has_access(role, section, item)
+    )
+
+
+class EmployeeRoleCache:
+    """
+    Кэш таблицы employees: telegram_id -> роль.
+    Загружается одним запросом и перечитывается целиком не чаще раза в ROLE_CACHE_TTL_SECONDS.
+    Также хранит, какой набор команд уже опубликован каждому сотруднику.
+    """
+
+    def __init__(self, ttl: float = ROLE_CACHE_TTL_SECONDS):
+        self.ttl = ttl
+        self.roles: dict[int, str] = {}
+        self.published_roles: dict[int, str] = {}
+        self._loaded_at = 0.0
+        self._lock = asyncio.Lock()
+
+    def is_stale(self) -> bool:
+        return time.monotonic() - self._loaded_at > self.ttl
+
+    async def refresh(self, pool, force: bool = False) -> bool:
+        """
+        Перечитывает роли из БД. Возвращает True, если набор ролей изменился.
+        Без force ничего не делает, если кэш уже свежий: апдейты, ждавшие блокировку,
+        пока роли перечитывал другой, не повторяют запрос.
+        При ошибке БД оставляет прежние данные и повторяет попытку не раньше чем через ROLE_CACHE_RETRY_SECONDS.
+        """
+        from db_operations import get_employee_roles
+
+        async with self._lock:
+            if not force and not self.is_stale():
+                return False
+            roles = await get_employee_roles(pool)
+            if roles is None:
+                # Без отсрочки каждый апдейт на каждом роутере заново обращался бы к недоступной БД
+                self._loaded_at = time.monotonic() - self.ttl + ROLE_CACHE_RETRY_SECONDS
+                return False
+            changed = roles != self.roles
+            self.roles = roles
+            self._loaded_at = time.monotonic()
+            if changed:
+                logger.info("Кэш ролей сотрудников обновлен: %d сотрудников.", len(roles))
+            return changed
+
+    async def get_role(self, pool, telegram_id: int):
+        if self.is_stale() and pool is not None:
+            await self.refresh(pool)
+        return self.roles.get(telegram_id)
+
+
+employee_roles = EmployeeRoleCache()
+
+# Ссылки на фоновые задачи публикации меню, чтобы их не собрал сборщик мусора
+_background_tasks: set[asyncio.Task] = set()
+
+
+async def publish_role_commands(bot: Bot, cache: EmployeeRoleCache = employee_roles) -> None:
+    """
+    Публикует каждому сотруднику меню команд его роли (BotCommandScopeChat).
+    Сотрудникам, чья роль не менялась с прошлой публикации, запросы не отправляются;
+    у удаленных сотрудников персональное меню снимается.
+    """
+    to_publish = {
+        telegram_id: role for telegram_id, role in cache.roles.items()
+        if cache.published_roles.get(telegram_id) != role
+    }
+    to_remove = [telegram_id for telegram_id in cache.published_roles if telegram_id not in cache.roles]
+
+    async def publish(telegram_id: int, role: str):
+        try:
+            await bot.set_my_commands(list(get_commands_for_role(role)), scope=BotCommandScopeChat(chat_id=telegram_id))
+            cache.published_roles[telegram_id] = role
+        except TelegramAPIError as e:
+            # Например, сотрудник еще ни разу не писал боту
+            logger.warning("Не удалось установить меню для %s (роль %s): %s", telegram_id, role, e)
+
+    async def remove(telegram_id: int):
+        try:
+            await bot.delete_my_commands(scope=BotCommandScopeChat(chat_id=telegram_id))
+        except TelegramAPIError as e:
+            logger.warning("Не удалось снять меню для %s: %s", telegram_id, e)
+        cache.published_roles.pop(telegram_id, None)
+
+    await asyncio.gather(
+        *(publish(telegram_id, role) for telegram_id, role in to_publish.items()),
+        *(remove(telegram_id) for telegram_id in to_remove)
+    )
+    if to_publish or to_remove:
+        logger.info("Меню команд по ролям: опубликовано %d, снято %d.", len(to_publish), len(to_remove))
+
+
+class RoleAccessFilter(BaseFilter):
+    """
+    Фильтр уровня роутера: пропускает апдейт, только если роль пользователя
+    имеет доступ к разделу/пункту. Проверка идет по кэшу ролей, поэтому
+    неавторизованные апдейты отсекаются до любой работы с БД в хендлерах.
+    """
+
+    def __init__(self, section: str, item: str | None = None):
+        self.section = section
+        self.item = item
+
+    async def __call__(self, event: TelegramObject, event_from_user: User | None = None, db_pool=None, bot: Bot | None = None) -> bool:
+        if event_from_user is None:
+            return False
+
+        roles_changed = False
+        if employee_roles.is_stale() and db_pool is not None:
+            roles_changed = await employee_roles.refresh(db_pool)
+            if roles_changed and bot is not None:
+                task = asyncio.create_task(publish_role_commands(bot))
+                _background_tasks.add(task)
+                task.add_done_callback(_background_tasks.discard)
+
+        role = employee_roles.roles.get(event_from_user.id)
+        if has_access(role, self.section, self.item):
+            return True
+
+        # Фильтр стоит на каждом роутере, поэтому отказ здесь — обычно просто «не этот роутер»,
+        # а не попытка доступа: только счетчик и отладочный лог
+        ROLE_FILTER_REJECTIONS_TOTAL.inc(self.section)
+        logger.debug("Роутер %s/%s пропущен: пользователь %s (роль %s).", self.section, self.item, event_from_user.id, role)
+        return False
@@ -0,0 +1,318 @@
+# benchmarks/fake_bot_api.py
+"""
+Локальный фейковый Telegram Bot API сервер для тестов и бенчмарков.
+
+Понимает основные методы, которые использует бот (sendMessage, editMessageText,
+answerCallbackQuery, setMyCommands, getUpdates и т.д.), ведет статистику запросов
+и имитирует flood control Telegram: при превышении лимитов отвечает 429
+с parameters.retry_after, как настоящий API.
+
+Запуск отдельно:
+    python benchmarks/fake_bot_api.py --port 8081 --chat-limit 1 --global-limit 30
+и в config.py: TELEGRAM_API_SERVER = "http://127.0.0.1:8081"
+
+Статистика: GET http://127.0.0.1:8081/stats, сброс: POST /reset.
+Использование из кода — класс FakeBotAPI (start/stop/push_update/stats).
+Последнее состояние сообщений бота хранится по чатам (chat_messages, find_button),
+чтобы сценарии бенчмарков могли «нажимать» inline-кнопки из ответов бота.
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+from collections import OrderedDict, defaultdict, deque
+
+from aiohttp import web
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "FakeBot", "username": "fake_bot"}
+
+# Сколько последних сообщений бота помнить в каждом чате
+CHAT_HISTORY_SIZE = 50
+
+
+class FakeBotAPI:
+    def __init__(self, chat_limit: float = 1.0, chat_burst: int = 3, global_limit: int = 30,
+                 retry_after: int = 1, random_429_rate: float = 0.0, latency: float = 0.0):
+        """
+        chat_limit / chat_burst — в чат можно chat_burst сообщений сразу, дальше chat_limit в секунду;
+        global_limit — сообщений в секунду на бота; random_429_rate — доля случайных 429;
+        latency — искусственная задержка ответа (сек).
+        """
+        self.chat_limit = chat_limit
+        self.chat_burst = chat_burst
+        self.global_limit = global_limit
+        self.retry_after = retry_after
+        self.random_429_rate = random_429_rate
+        self.latency = latency
+
+        self.app = web.Application()
+        self.app.router.add_route("*", "/bot{token}/{method}", self._handle)
+        self.app.router.add_get("/stats", self._handle_stats)
+        self.app.router.add_post("/reset", self._handle_reset)
+        self._runner = None
+        self.url = None
+
+        self._updates: asyncio.Queue = asyncio.Queue()
+        self._update_id = 0
+        self.reset()
+
+    def reset(self) -> None:
+        self.requests = defaultdict(int)
+        self.rejected_429 = 0
+        self.sent_messages: list[dict] = []
+        self.chat_messages: dict[int, OrderedDict] = defaultdict(OrderedDict)
+        self._message_id = 0
+        self._chat_tokens = {}
+        self._global_history = deque()
+        self._blocked_until = {}
+
+    # --- Жизненный цикл ---
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        self._runner = web.AppRunner(self.app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        actual_port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://{host}:{actual_port}"
+        return self.url
+
+    async def stop(self) -> None:
+        if self._runner:
+            await self._runner.cleanup()
+
+    def push_update(self, update: dict) -> None:
+        """Кладет апдейт в очередь, его получит getUpdates."""
+        self._update_id += 1
+        update = dict(update, update_id=self._update_id)
+        self._updates.put_nowait(update)
+
+    def next_message_id(self) -> int:
+        """ID для входящего сообщения пользователя (нумерация общая с сообщениями бота, как в Telegram)."""
+        self._message_id += 1
+        return self._message_id
+
+    def find_button(self, chat_id: int, prefix: str) -> tuple[dict, list[str]] | None:
+        """
+        Ищет самое свежее сообщение бота в чате с inline-кнопками, callback_data которых
+        начинается с prefix. Возвращает (сообщение, список подходящих callback_data) или None.
+        """
+        for message in reversed(self.chat_messages.get(chat_id, {}).values()):
+            rows = (message.get("reply_markup") or {}).get("inline_keyboard") or []
+            matches = [
+                button["callback_data"] for row in rows for button in row
+                if button.get("callback_data", "").startswith(prefix)
+            ]
+            if matches:
+                return message, matches
+        return None
+
+    def _remember(self, message: dict) -> None:
+        history = self.chat_messages[message["chat"]["id"]]
+        history[message["message_id"]] = message
+        history.move_to_end(message["message_id"])
+        while len(history) > CHAT_HISTORY_SIZE:
+            history.popitem(last=False)
+
+    def stats(self) -> dict:
+        return {
+            "requests": dict(self.requests),
+            "total_requests": sum(self.requests.values()),
+            "rejected_429": self.rejected_429,
+            "sent_messages": len(self.sent_messages),
+        }
+
+    # --- Flood control ---
+
+    def _check_flood(self, chat_id) -> int | None:
+        """Возвращает retry_after, если запрос нужно отклонить."""
+        now = time.monotonic()
+
+        if chat_id is not None and self._blocked_until.get(chat_id, 0) > now:
+            return max(1, int(self._blocked_until[chat_id] - now + 0.999))
+
+        if self.random_429_rate and random.random() < self.random_429_rate:
+            return self.retry_after
+
+        window = 1.0
+        while self._global_history and now - self._global_history[0] > window:
+            self._global_history.popleft()
+        if len(self._global_history) >= self.global_limit:
+            return self.retry_after
+
+        if chat_id is not None:
+            # Лимит на чат — токен-бакет: chat_burst сообщений сразу, дальше chat_limit в секунду
+            tokens, updated = self._chat_tokens.get(chat_id, (self.chat_burst, now))
+            tokens = min(self.chat_burst, tokens + (now - updated) * self.chat_limit)
+            if tokens < 1:
+                self._chat_tokens[chat_id] = (tokens, now)
+                self._blocked_until[chat_id] = now + self.retry_after
+                return self.retry_after
+            self._chat_tokens[chat_id] = (tokens - 1, now)
+
+        self._global_history.append(now)
+        return None
+
+    # --- HTTP ---
+
+    @staticmethod
+    def _ok(result) -> web.Response:
+        return web.json_response({"ok": True, "result": result})
+
+    @staticmethod
+    def _bad_request(description: str) -> web.Response:
+        return web.json_response({"ok": False, "error_code": 400, "description": f"Bad Request: {description}"}, status=400)
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        self.requests[method] += 1
+
+        if request.content_type == "application/json":
+            params = await request.json()
+        else:
+            params = dict(await request.post())
+            params.update(request.query)
+
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        handler = getattr(self, f"_method_{method.lower()}", None)
+        if handler is None:
+            return self._ok(True)
+
+        if method.lower() in ("sendmessage", "editmessagetext", "editmessagereplymarkup", "senddocument", "deletemessage"):
+            retry_after = self._check_flood(params.get("chat_id"))
+            if retry_after is not None:
+                self.rejected_429 += 1
+                return web.json_response({
+                    "ok": False,
+                    "error_code": 429,
+                    "description": f"Too Many Requests: retry after {retry_after}",
+                    "parameters": {"retry_after": retry_after},
+                }, status=429)
+
+        result = await handler(params)
+        if isinstance(result, web.Response):
+            return result
+        return self._ok(result)
+
+    async def _handle_stats(self, request: web.Request) -> web.Response:
+        return web.json_response(self.stats())
+
+    async def _handle_reset(self, request: web.Request) -> web.Response:
+        self.reset()
+        return web.json_response({"ok": True})
+
+    # --- Методы Bot API ---
+
+    def _message(self, params: dict, message_id: int | None = None) -> dict:
+        chat_id = int(params.get("chat_id", 0))
+        if message_id is None:
+            self._message_id += 1
+            message_id = self._message_id
+        message = {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": BOT_USER,
+        }
+        if "text" in params:
+            message["text"] = params["text"]
+        reply_markup = self._inline_markup(params)
+        if reply_markup:
+            message["reply_markup"] = reply_markup
+        return message
+
+    @staticmethod
+    def _inline_markup(params: dict) -> dict | None:
+        """В сообщении Telegram возвращает только inline-клавиатуру (reply-клавиатуры к нему не прикрепляются)."""
+        reply_markup = params.get("reply_markup")
+        if isinstance(reply_markup, str):
+            reply_markup = json.loads(reply_markup)
+        if reply_markup and "inline_keyboard" in reply_markup:
+            return reply_markup
+        return None
+
+    async def _method_getme(self, params):
+        return BOT_USER
+
+    async def _method_sendmessage(self, params):
+        message = self._message(params)
+        self.sent_messages.append(message)
+        self._remember(message)
+        return message
+
+    async def _method_senddocument(self, params):
+        message = self._message(params)
+        message["document"] = {"file_id": f"fake-file-{message['message_id']}", "file_unique_id": f"u{message['message_id']}"}
+        self.sent_messages.append(message)
+        self._remember(message)
+        return message
+
+    def _edit(self, params, **changes):
+        chat_id, message_id = int(params.get("chat_id", 0)), int(params.get("message_id", 0))
+        current = self.chat_messages.get(chat_id, {}).get(message_id)
+        if current is None:
+            # Как и Telegram, не даем редактировать чужие (или неизвестные) сообщения
+            return self._bad_request("message can't be edited")
+        message = dict(current, **changes)
+        reply_markup = self._inline_markup(params)
+        if reply_markup:
+            message["reply_markup"] = reply_markup
+        else:
+            message.pop("reply_markup", None)
+        self._remember(message)
+        return message
+
+    async def _method_editmessagetext(self, params):
+        return self._edit(params, text=params.get("text", ""))
+
+    async def _method_editmessagereplymarkup(self, params):
+        return self._edit(params)
+
+    async def _method_getupdates(self, params):
+        timeout = float(params.get("timeout", 0) or 0)
+        updates = []
+        try:
+            updates.append(await asyncio.wait_for(self._updates.get(), timeout=max(timeout, 0.01)))
+        except asyncio.TimeoutError:
+            return []
+        while not self._updates.empty():
+            updates.append(self._updates.get_nowait())
+        return updates
+
+
+async def _serve(args) -> None:
+    api = FakeBotAPI(
+        chat_limit=args.chat_limit, chat_burst=args.chat_burst, global_limit=args.global_limit,
+        retry_after=args.retry_after, random_429_rate=args.random_429_rate, latency=args.latency
+    )
+    url = await api.start(args.host, args.port)
+    print(f"Фейковый Bot API слушает {url} (Ctrl+C для остановки)")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await api.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Фейковый Telegram Bot API с имитацией flood control.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--chat-limit", type=float, default=1.0, help="Сообщений в секунду на чат")
+    parser.add_argument("--chat-burst", type=int, default=3, help="Допустимый всплеск сообщений в чат")
+    parser.add_argument("--global-limit", type=int, default=30, help="Сообщений в секунду на бота")
+    parser.add_argument("--retry-after", type=int, default=1, help="retry_after в ответах 429 (сек)")
+    parser.add_argument("--random-429-rate", type=float, default=0.0, help="Доля случайных ответов 429")
+    parser.add_argument("--latency", type=float, default=0.0, help="Задержка ответа (сек)")
+    args = parser.parse_args()
+    try:
+        asyncio.run(_serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+# benchmarks/send_queue_flood.py
+"""
+Проверка планировщика исходящих запросов (utils/send_queue.py) против фейкового Bot API,
+который отвечает 429 при превышении лимитов.
+
+Сценарий: всплеск сообщений в несколько чатов, серия правок одного сообщения
+и интерактивный ответ, отправленный на фоне длинной низкоприоритетной рассылки.
+Прогоняется два раза — с планировщиком и без него — и печатает, сколько
+запросов получил 429, сколько правок склеено и сколько ждал интерактивный ответ.
+
+Запуск из корня репозитория:
+    python benchmarks/send_queue_flood.py --chats 5 --messages 10 --edits 20
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.exceptions import TelegramRetryAfter
+
+from benchmarks.fake_bot_api import FakeBotAPI
+from utils.send_queue import OutboundScheduler, bulk_sends
+
+FAKE_TOKEN = "123456:FAKE-TOKEN"
+
+
+def make_bot(api_url: str, scheduler: OutboundScheduler | None) -> Bot:
+    session = AiohttpSession(api=TelegramAPIServer.from_base(api_url))
+    if scheduler is not None:
+        session.middleware(scheduler)
+    return Bot(token=FAKE_TOKEN, session=session)
+
+
+async def run_scenario(api: FakeBotAPI, use_scheduler: bool, chats: int, messages: int, edits: int) -> dict:
+    api.reset()
+    scheduler = OutboundScheduler() if use_scheduler else None
+    bot = make_bot(api.url, scheduler)
+    errors = 0
+
+    async def guarded(coro):
+        nonlocal errors
+        try:
+            return await coro
+        except TelegramRetryAfter:
+            errors += 1
+
+    try:
+        started = time.perf_counter()
+
+        # 1. Всплеск сообщений (низкий приоритет, как длинный отчет)
+        async def bulk():
+            with bulk_sends():
+                await asyncio.gather(*(
+                    guarded(bot.send_message(chat_id=1000 + chat, text=f"Отчет {chat}: часть {i}"))
+                    for chat in range(chats) for i in range(messages)
+                ))
+        bulk_task = asyncio.create_task(bulk())
+
+        # 2. Интерактивный ответ в отдельный чат на фоне рассылки
+        await asyncio.sleep(0.05)
+        interactive_started = time.perf_counter()
+        await guarded(bot.send_message(chat_id=1, text="Ответ пользователю"))
+        interactive_latency = time.perf_counter() - interactive_started
+
+        # 3. Серия правок одного сообщения (как обновление корзины)
+        message = await guarded(bot.send_message(chat_id=2, text="Корзина"))
+        if message is not None:
+            await asyncio.gather(*(
+                guarded(bot.edit_message_text(chat_id=2, message_id=message.message_id, text=f"Корзина v{i}"))
+                for i in range(edits)
+            ))
+
+        await bulk_task
+        elapsed = time.perf_counter() - started
+    finally:
+        await bot.session.close()
+
+    return {
+        "scheduler": use_scheduler,
+        "elapsed_s": round(elapsed, 2),
+        "interactive_latency_ms": round(interactive_latency * 1000, 1),
+        "api_requests": api.stats()["total_requests"],
+        "api_429": api.rejected_429,
+        "failed_with_retry_after": errors,
+        "coalesced_edits": scheduler.coalesced if scheduler else 0,
+        "retried_after_429": scheduler.retry_after if scheduler else 0,
+    }
+
+
+async def main_async(args) -> None:
+    api = FakeBotAPI(chat_limit=args.chat_limit, chat_burst=args.chat_burst, global_limit=args.global_limit, retry_after=1)
+    await api.start()
+    try:
+        for use_scheduler in (False, True):
+            result = await run_scenario(api, use_scheduler, args.chats, args.messages, args.edits)
+            title = "С планировщиком" if use_scheduler else "Без планировщика"
+            print(f"{title}:")
+            for key, value in result.items():
+                if key != "scheduler":
+                    print(f"  {key}: {value}")
+    finally:
+        await api.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Проверка OutboundScheduler против фейкового Bot API с 429.")
+    parser.add_argument("--chats", type=int, default=5)
+    parser.add_argument("--messages", type=int, default=6, help="Сообщений в каждый чат")
+    parser.add_argument("--edits", type=int, default=20, help="Правок одного сообщения подряд")
+    parser.add_argument("--chat-limit", type=float, default=1.0)
+    parser.add_argument("--chat-burst", type=int, default=3)
+    parser.add_argument("--global-limit", type=int, default=30)
+    args = parser.parse_args()
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+# benchmarks/startup_importtime.py
+"""
+Бенчмарк времени старта бота на основе `python -X importtime`.
+
+Запускает в отдельном процессе импорт tg_bot и загрузку всех роутеров,
+разбирает вывод -X importtime и печатает самые дорогие модули,
+а также медиану полного времени старта интерпретатора за несколько прогонов.
+
+Запуск из корня репозитория:
+    python benchmarks/startup_importtime.py --runs 5 --top 25
+    python benchmarks/startup_importtime.py --json startup.json
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+# Код, который выполняется в дочернем процессе: то же, что делает tg_bot.main() до start_polling,
+# без сетевых вызовов.
+STARTUP_SNIPPET = "import tg_bot; tg_bot.include_routers(tg_bot.dp)"
+
+# Префиксы модулей проекта, чтобы отделить их от сторонних библиотек
+PROJECT_PACKAGES = ("tg_bot", "config", "handlers", "db_operations", "keyboards", "states", "utils", "access_control")
+
+
+def run_importtime() -> list[tuple[str, int, int]]:
+    """
+    Выполняет STARTUP_SNIPPET с -X importtime.
+    Возвращает список (модуль, self_us, cumulative_us).
+    """
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", STARTUP_SNIPPET],
+        cwd=REPO_ROOT, capture_output=True, text=True, check=True
+    )
+    rows = []
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        # Формат строки: "import time:   self_us |   cumulative_us |   <отступ>module"
+        self_us, cumulative_us, name = line.split(":", 1)[1].split("|")
+        rows.append((name.strip(), int(self_us), int(cumulative_us)))
+    return rows
+
+
+def measure_wall_time(runs: int) -> list[float]:
+    """Полное время (сек) запуска интерпретатора и выполнения STARTUP_SNIPPET."""
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        subprocess.run([sys.executable, "-c", STARTUP_SNIPPET], cwd=REPO_ROOT, check=True, capture_output=True)
+        timings.append(time.perf_counter() - started)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк времени старта бота (python -X importtime).")
+    parser.add_argument("--runs", type=int, default=5, help="Количество прогонов для замера полного времени старта")
+    parser.add_argument("--top", type=int, default=20, help="Сколько самых тяжелых модулей показать")
+    parser.add_argument("--json", dest="json_path", help="Сохранить результаты в JSON-файл")
+    args = parser.parse_args()
+
+    rows = run_importtime()
+    wall = measure_wall_time(args.runs)
+
+    by_cumulative = sorted(rows, key=lambda row: row[2], reverse=True)
+    project_rows = [row for row in by_cumulative if row[0].split(".")[0] in PROJECT_PACKAGES]
+
+    print(f"Полное время старта (медиана из {args.runs}): {statistics.median(wall) * 1000:.0f} мс "
+          f"(min {min(wall) * 1000:.0f} мс, max {max(wall) * 1000:.0f} мс)")
+    print(f"Всего импортировано модулей: {len(rows)}\n")
+
+    print(f"Топ-{args.top} модулей по кумулятивному времени импорта:")
+    for name, self_us, cumulative_us in by_cumulative[:args.top]:
+        print(f"  {cumulative_us / 1000:8.1f} мс  (self {self_us / 1000:6.1f} мс)  {name}")
+
+    print("\nМодули проекта:")
+    for name, self_us, cumulative_us in project_rows:
+        print(f"  {cumulative_us / 1000:8.1f} мс  (self {self_us / 1000:6.1f} мс)  {name}")
+
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "wall_time_ms": [round(t * 1000, 1) for t in wall],
+                "wall_time_median_ms": round(statistics.median(wall) * 1000, 1),
+                "modules": [
+                    {"module": name, "self_us": self_us, "cumulative_us": cumulative_us}
+                    for name, self_us, cumulative_us in by_cumulative
+                ],
+            }, f, ensure_ascii=False, indent=2)
+        print(f"\nРезультаты сохранены в {args.json_path}")
+
+
+if __name__ == "__main__":
+    main()
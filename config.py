@@ -8,12 +8,67 @@
 
 TELEGRAM_TOKEN = "8045202719:AAEJ_9W43zSto6hoeZNal1QusoArT-URuE8"
 
+# Адрес Bot API. None — официальный api.telegram.org; для тестов можно указать
+# локальный фейковый сервер, например "http://127.0.0.1:8081" (benchmarks/fake_bot_api.py)
+TELEGRAM_API_SERVER = None
+
+# Эндпоинт метрик в формате Prometheus (GET http://METRICS_HOST:METRICS_PORT/metrics, см. utils/metrics.py).
+# METRICS_PORT = None — эндпоинт не поднимается.
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 9108
+
+# Логи (utils/logging_setup.py): уровень, JSON по строке на запись (False — обычный текст)
+# и ограничение частых INFO/DEBUG сообщений: не больше LOG_SAMPLE_BURST с одного места за LOG_SAMPLE_INTERVAL сек.
+LOG_LEVEL = "INFO"
+LOG_JSON = True
+LOG_SAMPLE_BURST = 20
+LOG_SAMPLE_INTERVAL = 1.0
+
+# Печатные документы (utils/documents.py): число процессов для верстки PDF/XLSX
+# и TTF-шрифты с кириллицей для PDF
+DOCUMENT_WORKERS = 2
+DOCUMENT_FONT_PATH = "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf"
+DOCUMENT_FONT_BOLD_PATH = "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf"
+
 DB_NAME = "privlechenka"
 DB_USER = "slavik_admin"
 DB_PASSWORD = "1234"
 DB_HOST = "146.19.238.53" #если не работает - попробовать этот 172.19.235.103 или 10.255.255.254
 DB_PORT = 5432
 
+# Реплика для отчетов (db_operations/replica.py): тяжелые отчеты читаются с нее, записи и чтения
+# перед подтверждением — всегда с основной БД. REPLICA_DB_HOST = None — реплики нет, все идет в основную.
+# Если реплика отстает больше REPLICA_MAX_LAG_SECONDS или недоступна, отчеты читаются с основной БД.
+REPLICA_DB_HOST = None
+REPLICA_DB_PORT = 5432
+REPLICA_POOL_MIN_SIZE = 1
+REPLICA_POOL_MAX_SIZE = 5
+REPLICA_MAX_LAG_SECONDS = 30
+REPLICA_CHECK_SECONDS = 5
+
+# Классы запросов (db_operations/query_classes.py): клиентский таймаут в секундах для каждого класса.
+# interactive — обычные запросы хендлеров, report — отчеты, bulk — выгрузки, пересчеты и отчеты,
+# досчитываемые в фоне. statement_timeout на сервере больше клиентского на QUERY_TIMEOUT_MARGIN,
+# чтобы запрос снимал клиент (с понятным пользователю ответом), а сервер страховал от зависших соединений.
+QUERY_TIMEOUTS = {"interactive": 10, "report": 20, "bulk": 300}
+QUERY_TIMEOUT_MARGIN = 2
+
+# Локальный журнал записей (db_operations/write_journal.py): заказы и оплаты, принятые,
+# пока БД недоступна. Файл SQLite; проигрывается в БД автоматически после восстановления связи.
+WRITE_JOURNAL_PATH = "write_journal.sqlite3"
+
+# Секции inventory_movements по месяцам (db_operations/movement_partitions.py): секции создаются на
+# MOVEMENT_PARTITIONS_AHEAD месяцев вперед, секции старше MOVEMENT_RETENTION_MONTHS выгружаются
+# в MOVEMENT_ARCHIVE_DIR (csv.gz) и отсоединяются. Проверка — раз в PARTITION_MAINTENANCE_INTERVAL_SECONDS.
+MOVEMENT_PARTITIONS_AHEAD = 3
+MOVEMENT_RETENTION_MONTHS = 24
+MOVEMENT_ARCHIVE_DIR = "archive/inventory_movements"
+PARTITION_MAINTENANCE_INTERVAL_SECONDS = 6 * 60 * 60
+
+# Миграции схемы (sql/migrations, db_operations/migrations.py) применяются при старте бота.
+# False — только вручную: python -m db_operations.migrations
+APPLY_MIGRATIONS_ON_STARTUP = True
+
 
 # DB_CONFIG = {
 #     "dbname": "privlechenka",
@@ -1,15 +1,38 @@
+import asyncio
 import logging
 import asyncpg
 from datetime import date, timedelta
-from config import DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, DB_PORT
+from config import (
+    DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, DB_PORT,
+    REPLICA_DB_HOST, REPLICA_DB_PORT, REPLICA_POOL_MIN_SIZE, REPLICA_POOL_MAX_SIZE
+)
+from db_operations.query_classes import REPORT, server_settings
+from utils.metrics import observe_query
 
 logger = logging.getLogger(__name__)
 
+# Ошибки, означающие недоступность БД (нет сети, сервер перезапускается, соединение оборвано),
+# а не ошибку самого запроса. Записи заказов и оплат при них уходят в локальный журнал (write_journal.py).
+DB_UNAVAILABLE_ERRORS = (
+    OSError,
+    asyncio.TimeoutError,
+    asyncpg.exceptions.PostgresConnectionError,
+    asyncpg.exceptions.CannotConnectNowError,
+    asyncpg.exceptions.AdminShutdownError,
+    asyncpg.exceptions.CrashShutdownError,
+    asyncpg.exceptions.ConnectionDoesNotExistError,
+)
+
 # Объявляем переменную для пула соединений, инициализируем её None
 # Эту строку db_pool = None можно удалить, так как пул теперь передается
 # или, если вы оставили её для справки, просто знайте, что она не используется
 # для текущей архитектуры передачи пула.
 
+async def _init_connection(conn):
+    """Настройка каждого нового соединения пула: запросы попадают в метрики (utils/metrics.py)."""
+    conn.add_query_logger(observe_query)
+
+
 async def init_db_pool():
     """Инициализирует пул соединений asyncpg. Вызывается при старте бота."""
     try:
@@ -22,7 +45,10 @@ async def init_db_pool():
             port=DB_PORT,
             min_size=5,
             max_size=10,
-            timeout=60
+            timeout=60,
+            init=_init_connection,
+            # statement_timeout класса interactive; отчеты и выгрузки задают свой (query_classes.py)
+            server_settings=server_settings()
         )
         logger.info("Пул соединений asyncpg успешно инициализирован.")
         return pool # Возвращаем локальный 'pool'
@@ -30,6 +56,33 @@ async def init_db_pool():
         logger.critical(f"Ошибка при инициализации пула соединений asyncpg: {e}", exc_info=True)
         raise # Перевызываем исключение, чтобы остановить запуск бота, если нет подключения к БД
 
+async def init_replica_pool():
+    """
+    Пул соединений к реплике для отчетов (db_operations/replica.py).
+    Возвращает None, если реплика не настроена или недоступна: бот работает только с основной БД.
+    """
+    if not REPLICA_DB_HOST:
+        return None
+    try:
+        pool = await asyncpg.create_pool(
+            user=DB_USER,
+            password=DB_PASSWORD,
+            database=DB_NAME,
+            host=REPLICA_DB_HOST,
+            port=REPLICA_DB_PORT,
+            min_size=REPLICA_POOL_MIN_SIZE,
+            max_size=REPLICA_POOL_MAX_SIZE,
+            timeout=60,
+            init=_init_connection,
+            # Реплика обслуживает только отчеты
+            server_settings=server_settings(REPORT)
+        )
+        logger.info("Пул соединений реплики %s:%s инициализирован.", REPLICA_DB_HOST, REPLICA_DB_PORT)
+        return pool
+    except Exception as e:
+        logger.error(f"Не удалось подключиться к реплике, отчеты будут читаться с основной БД: {e}", exc_info=True)
+        return None
+
 async def close_db_pool(pool): # Теперь 'pool' - это аргумент
     """Закрывает пул соединений asyncpg. Вызывается при остановке бота."""
     if pool:
@@ -62,3 +115,22 @@ async def get_employee_id(pool, telegram_id: int): # Добавили 'pool' к
             await pool.release(conn) # Используем 'pool'
 
 
+
+async def get_employee_roles(pool):
+    """
+    Загружает роли всех сотрудников одним запросом: {id_telegram: role}.
+    Возвращает None при ошибке, чтобы вызывающий код мог оставить прежние данные.
+    """
+    conn = None
+    try:
+        conn = await pool.acquire()
+        rows = await conn.fetch(
+            "SELECT id_telegram, role FROM employees WHERE id_telegram IS NOT NULL AND role IS NOT NULL"
+        )
+        return {row['id_telegram']: row['role'] for row in rows}
+    except Exception as e:
+        logger.error(f"Ошибка при загрузке ролей сотрудников: {e}", exc_info=True)
+        return None
+    finally:
+        if conn:
+            await pool.release(conn)
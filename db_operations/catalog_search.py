@@ -0,0 +1,270 @@
+# db_operations/catalog_search.py
+"""
+Поиск товаров и клиентов для inline-режима (@bot <текст>, handlers/orders/inline_search.py).
+
+Индекс n-грамм держится в памяти, поэтому ответ на каждое нажатие клавиши не обращается к БД:
+- каждое слово названия индексируется триграммами с отступом, как в pg_trgm ("  мо", " мол", "мол", ...),
+  поэтому запрос из 1–2 букв ищется по началу слов, а из 3 и более — по любой части слова;
+- кандидаты — пересечение списков по n-граммам всех слов запроса, затем проверка подстрокой.
+
+Изменения приходят уведомлениями PostgreSQL (LISTEN catalog_changed, payload "products:<id>" или
+"clients:<id>", триггеры — в sql/edit_tables&collumns.sql): пересобираются только изменившиеся записи.
+Без уведомлений индекс перестраивается целиком раз в FALLBACK_REFRESH_SECONDS.
+"""
+
+import asyncio
+import heapq
+import logging
+import time
+from decimal import Decimal
+from typing import NamedTuple, Optional
+
+import asyncpg
+
+from config import DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, DB_PORT
+from db_operations.query_classes import BULK, with_query_class
+
+logger = logging.getLogger(__name__)
+
+NOTIFY_CHANNEL = "catalog_changed"
+NOTIFY_DEBOUNCE_SECONDS = 0.3
+FALLBACK_REFRESH_SECONDS = 300
+
+PRODUCTS = "products"
+CLIENTS = "clients"
+
+_QUERIES = {
+    PRODUCTS: "SELECT product_id AS entry_id, name, price FROM products",
+    CLIENTS: "SELECT client_id AS entry_id, name, NULL::numeric AS price FROM clients",
+}
+_ID_COLUMNS = {PRODUCTS: "product_id", CLIENTS: "client_id"}
+
+
+class SearchEntry(NamedTuple):
+    entry_id: int
+    name: str
+    price: Optional[Decimal]    # только для товаров
+
+
+def normalize(text: str) -> str:
+    return text.casefold().replace("ё", "е")
+
+
+def word_grams(word: str) -> set[str]:
+    """Триграммы слова с отступом: два пробела в начале и один в конце."""
+    padded = f"  {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def query_grams(term: str) -> set[str]:
+    """N-граммы, которые обязаны быть у слова названия, содержащего term."""
+    if len(term) == 1:
+        return {f"  {term}"}
+    if len(term) == 2:
+        return {f" {term}"}
+    return {term[i:i + 3] for i in range(len(term) - 2)}
+
+
+class _Index:
+    """Индекс одного вида записей: записи, нормализованные названия и списки по n-граммам."""
+
+    def __init__(self):
+        self.entries: dict[int, SearchEntry] = {}
+        self.normalized: dict[int, str] = {}
+        self.postings: dict[str, set[int]] = {}
+        self._sorted: Optional[list[SearchEntry]] = None   # все записи по алфавиту, для пустого запроса
+
+    def add(self, entry: SearchEntry) -> None:
+        self.remove(entry.entry_id)
+        self._sorted = None
+        name = normalize(entry.name)
+        self.entries[entry.entry_id] = entry
+        self.normalized[entry.entry_id] = name
+        for word in name.split():
+            for gram in word_grams(word):
+                self.postings.setdefault(gram, set()).add(entry.entry_id)
+
+    def remove(self, entry_id: int) -> None:
+        name = self.normalized.pop(entry_id, None)
+        self.entries.pop(entry_id, None)
+        if name is None:
+            return
+        self._sorted = None
+        for word in name.split():
+            for gram in word_grams(word):
+                ids = self.postings.get(gram)
+                if ids is not None:
+                    ids.discard(entry_id)
+                    if not ids:
+                        del self.postings[gram]
+
+    def search(self, query: str, offset: int = 0, limit: int = 20) -> tuple[list[SearchEntry], int]:
+        """Страница результатов и общее число найденных записей."""
+        terms = normalize(query).split()
+        if not terms:
+            if self._sorted is None:
+                self._sorted = sorted(self.entries.values(), key=lambda entry: (self.normalized[entry.entry_id], entry.entry_id))
+            return self._sorted[offset:offset + limit], len(self._sorted)
+
+        # Сначала самые редкие n-граммы: пересечение быстро сужается
+        grams = sorted({gram for term in terms for gram in query_grams(term)}, key=lambda gram: len(self.postings.get(gram, ())))
+        candidates = self.postings.get(grams[0])
+        for gram in grams[1:]:
+            if not candidates:
+                break
+            candidates = candidates & self.postings.get(gram, set())
+        if not candidates:
+            return [], 0
+
+        if len(grams) == 1:
+            # Одна n-грамма однозначно задает совпадение — проверка подстрокой не нужна
+            matches = candidates
+        else:
+            matches = [
+                entry_id for entry_id in candidates
+                if all(
+                    term in self.normalized[entry_id] if len(term) > 2
+                    else any(word.startswith(term) for word in self.normalized[entry_id].split())
+                    for term in terms
+                )
+            ]
+
+        query_text = " ".join(terms)
+        # Выше — названия, которые начинаются с запроса; сортируется только нужная страница
+        page = heapq.nsmallest(
+            offset + limit, matches,
+            key=lambda entry_id: (not self.normalized[entry_id].startswith(query_text), self.normalized[entry_id], entry_id)
+        )[offset:]
+        return [self.entries[entry_id] for entry_id in page], len(matches)
+
+
+@with_query_class(BULK)
+async def _fetch_all_rows(pool) -> dict:
+    """Все товары и клиенты для полной перестройки индекса (фоновая работа, таймаут bulk)."""
+    async with pool.acquire() as conn:
+        return {kind: await conn.fetch(query) for kind, query in _QUERIES.items()}
+
+
+class CatalogSearch:
+    def __init__(self):
+        self.indexes = {PRODUCTS: _Index(), CLIENTS: _Index()}
+        self.loaded_at: Optional[float] = None
+
+        self._pool = None
+        self._listener: Optional[asyncpg.Connection] = None
+        self._listen = True
+        self._pending: dict[str, set[int]] = {PRODUCTS: set(), CLIENTS: set()}
+        self._flush_task: Optional[asyncio.Task] = None
+        self._fallback_task: Optional[asyncio.Task] = None
+        self._refresh_lock = asyncio.Lock()
+
+    # --- Жизненный цикл ---
+
+    async def start(self, pool, listen: bool = True) -> None:
+        self._pool = pool
+        await self.refresh_all()
+        if listen:
+            await self._connect_listener()
+        self._listen = listen
+        self._fallback_task = asyncio.create_task(self._fallback_loop())
+
+    async def stop(self) -> None:
+        for task in (self._fallback_task, self._flush_task):
+            if task:
+                task.cancel()
+        if self._listener and not self._listener.is_closed():
+            await self._listener.close()
+        self._listener = None
+
+    async def _connect_listener(self) -> None:
+        try:
+            self._listener = await asyncpg.connect(
+                user=DB_USER, password=DB_PASSWORD, database=DB_NAME, host=DB_HOST, port=DB_PORT
+            )
+            await self._listener.add_listener(NOTIFY_CHANNEL, self._on_notify)
+            logger.info(f"Подписка на уведомления '{NOTIFY_CHANNEL}' установлена.")
+        except Exception as e:
+            self._listener = None
+            logger.warning(f"Не удалось подписаться на '{NOTIFY_CHANNEL}', индекс поиска будет обновляться по таймеру: {e}")
+
+    async def _fallback_loop(self) -> None:
+        while True:
+            await asyncio.sleep(FALLBACK_REFRESH_SECONDS)
+            try:
+                if self._listen and (self._listener is None or self._listener.is_closed()):
+                    await self._connect_listener()
+                await self.refresh_all()
+            except Exception as e:
+                logger.error(f"Ошибка при плановом обновлении индекса поиска: {e}", exc_info=True)
+
+    # --- Обработка уведомлений ---
+
+    def _on_notify(self, connection, pid, channel, payload: str) -> None:
+        kind, _, entry_id = payload.partition(":")
+        if kind not in self._pending or not entry_id.isdigit():
+            return
+        self._pending[kind].add(int(entry_id))
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush())
+
+    async def _flush(self) -> None:
+        await asyncio.sleep(NOTIFY_DEBOUNCE_SECONDS)
+        # Уведомления, пришедшие во время обновления, не запускают новую задачу (эта еще не завершена),
+        # поэтому разбираем их здесь же, пока есть что обновлять
+        while any(self._pending.values()):
+            pending, self._pending = self._pending, {PRODUCTS: set(), CLIENTS: set()}
+            try:
+                for kind, entry_ids in pending.items():
+                    if entry_ids:
+                        await self.refresh_entries(kind, entry_ids)
+            except Exception as e:
+                logger.error(f"Ошибка при обновлении индекса поиска по уведомлению: {e}", exc_info=True)
+                return
+
+    # --- Загрузка ---
+
+    async def refresh_all(self) -> None:
+        async with self._refresh_lock:
+            started = time.perf_counter()
+            rows = await _fetch_all_rows(self._pool)
+
+            indexes = {}
+            for kind, kind_rows in rows.items():
+                index = _Index()
+                for row in kind_rows:
+                    if row['name']:
+                        index.add(SearchEntry(row['entry_id'], row['name'], row['price']))
+                indexes[kind] = index
+            self.indexes = indexes
+            self.loaded_at = time.monotonic()
+            logger.debug(
+                "Индекс поиска перестроен: товаров %d, клиентов %d, %.1f мс",
+                len(indexes[PRODUCTS].entries), len(indexes[CLIENTS].entries), (time.perf_counter() - started) * 1000
+            )
+
+    async def refresh_entries(self, kind: str, entry_ids) -> None:
+        entry_ids = list(entry_ids)
+        async with self._refresh_lock:
+            async with self._pool.acquire() as conn:
+                rows = await conn.fetch(f"{_QUERIES[kind]} WHERE {_ID_COLUMNS[kind]} = ANY($1::int[])", entry_ids)
+            index = self.indexes[kind]
+            for entry_id in entry_ids:
+                index.remove(entry_id)
+            for row in rows:
+                if row['name']:
+                    index.add(SearchEntry(row['entry_id'], row['name'], row['price']))
+
+    # --- Чтение ---
+
+    def search(self, kind: str, query: str, offset: int = 0, limit: int = 20) -> tuple[list[SearchEntry], Optional[int]]:
+        """Страница результатов и смещение следующей страницы (None, если это последняя)."""
+        page, total = self.indexes[kind].search(query, offset, limit)
+        next_offset = offset + limit if offset + limit < total else None
+        return page, next_offset
+
+    def get(self, kind: str, entry_id: int) -> Optional[SearchEntry]:
+        return self.indexes[kind].entries.get(entry_id)
+
+
+# Глобальный экземпляр
+catalog_search = CatalogSearch()
@@ -0,0 +1,35 @@
+# db_operations/client_keys.py
+"""
+Ключи идемпотентности записей (applied_client_keys).
+
+Ключ (uuid) создается на стороне бота до записи: одна корзина — один ключ, одно нажатие оплаты —
+один ключ. Запись выполняется в транзакции вместе с claim_client_key, поэтому повтор того же
+ключа (повторное нажатие, проигрывание журнала после обрыва связи на COMMIT) ничего не меняет.
+"""
+
+from typing import Optional
+
+import asyncpg
+
+
+async def claim_client_key(conn: asyncpg.Connection, client_key: str, kind: str) -> bool:
+    """
+    Занимает ключ в текущей транзакции. False — ключ уже применен (или занят
+    параллельной транзакцией, которая его применит), запись выполнять не нужно.
+    """
+    claimed = await conn.fetchval("""
+        INSERT INTO applied_client_keys (client_key, kind)
+        VALUES ($1, $2)
+        ON CONFLICT (client_key) DO NOTHING
+        RETURNING TRUE;
+    """, client_key, kind)
+    return bool(claimed)
+
+
+async def set_client_key_result(conn: asyncpg.Connection, client_key: str, result_id: Optional[int]) -> None:
+    """Запоминает результат записи (например, номер созданного заказа) для повторов."""
+    await conn.execute("UPDATE applied_client_keys SET result_id = $2 WHERE client_key = $1;", client_key, result_id)
+
+
+async def get_client_key_result(conn: asyncpg.Connection, client_key: str) -> Optional[int]:
+    return await conn.fetchval("SELECT result_id FROM applied_client_keys WHERE client_key = $1;", client_key)
@@ -0,0 +1,216 @@
+# db_operations/documents.py
+"""
+Данные для печатных документов (utils/documents.py) и кэш их Telegram file_id.
+
+- get_invoice_document: накладная подтвержденного заказа.
+- spool_rows: потоковое чтение выгрузки курсором во временный файл для воркера XLSX;
+  заодно считает хэш строк, по которому ищется уже отправленный документ.
+- document_files: ключ документа -> file_id. Дублируется в памяти, поэтому повторная
+  отправка того же документа не обращается к БД за file_id.
+"""
+
+import hashlib
+import logging
+import pickle
+import tempfile
+from decimal import Decimal
+from typing import NamedTuple, Optional
+
+import asyncpg
+
+from db_operations.order_details import CACHEABLE_STATUSES, get_order_details
+from db_operations.replica import reads_from_replica
+from db_operations.query_classes import BULK, with_query_class
+from utils.documents import InvoiceDocument, InvoiceLine, TEMPLATE_VERSION, remove_spool
+
+logger = logging.getLogger(__name__)
+
+# Размер пачки строк курсора и записи в spool-файл
+SPOOL_CHUNK_SIZE = 500
+
+
+class SpooledRows(NamedTuple):
+    path: str
+    key: str
+    row_count: int
+    sums: tuple      # суммы столбцов sum_columns
+
+
+# --- Накладная ---
+
+async def get_invoice_document(pool, order_id: int) -> Optional[InvoiceDocument]:
+    """Накладная для заказа в статусе confirmed/shipped или None."""
+    order = await get_order_details(pool, order_id, statuses=CACHEABLE_STATUSES)
+    if order is None:
+        return None
+
+    conn = None
+    try:
+        conn = await pool.acquire()
+        row = await conn.fetchrow("""
+            SELECT o.invoice_number, o.confirmation_date, o.due_date, e.name AS employee_name
+            FROM orders o
+            LEFT JOIN employees e ON e.employee_id = o.employee_id
+            WHERE o.order_id = $1;
+        """, order_id)
+    except asyncpg.exceptions.PostgresError as e:
+        logger.error("Ошибка БД при получении данных накладной заказа #%s: %s", order_id, e, exc_info=True)
+        return None
+    finally:
+        if conn:
+            await pool.release(conn)
+
+    if row is None or not row['invoice_number']:
+        return None
+    invoice_date = row['confirmation_date'] or order.delivery_date
+    due_date = row['due_date']
+    return InvoiceDocument(
+        order_id=order.order_id,
+        invoice_number=row['invoice_number'],
+        invoice_date=invoice_date.date() if hasattr(invoice_date, "date") else invoice_date,
+        due_date=due_date.date() if hasattr(due_date, "date") else due_date,
+        client_name=order.client_name,
+        address_text=order.address_text,
+        employee_name=row['employee_name'],
+        total_amount=order.total_amount,
+        lines=tuple(InvoiceLine(line.product_name, line.quantity, line.unit_price) for line in order.lines)
+    )
+
+
+async def find_order_by_invoice(pool, invoice: str) -> Optional[int]:
+    """ID заказа по номеру накладной (INV-...) или по самому ID заказа."""
+    conn = None
+    try:
+        conn = await pool.acquire()
+        if invoice.isdigit():
+            return await conn.fetchval("SELECT order_id FROM orders WHERE order_id = $1;", int(invoice))
+        return await conn.fetchval("SELECT order_id FROM orders WHERE invoice_number = $1;", invoice.upper())
+    except asyncpg.exceptions.PostgresError as e:
+        logger.error("Ошибка БД при поиске накладной %s: %s", invoice, e, exc_info=True)
+        return None
+    finally:
+        if conn:
+            await pool.release(conn)
+
+
+# --- Выгрузки ---
+
+INVENTORY_EXPORT_QUERY = """
+    SELECT p.name, c.name AS category_name, COALESCE(s.quantity, 0) AS quantity, p.cost_per_unit,
+           COALESCE(s.quantity, 0) * p.cost_per_unit AS stock_value
+    FROM products p
+    LEFT JOIN categories c ON c.category_id = p.category_id
+    LEFT JOIN stock s ON s.product_id = p.product_id
+    ORDER BY p.name;
+"""
+
+UNPAID_INVOICES_EXPORT_QUERY = """
+    SELECT o.invoice_number, o.confirmation_date::date, o.due_date::date, c.name AS client_name,
+           o.total_amount, o.amount_paid, o.total_amount - o.amount_paid AS amount_due, o.payment_status
+    FROM orders o
+    JOIN clients c ON c.client_id = o.client_id
+    WHERE o.status = 'confirmed'
+      AND o.payment_status IN ('unpaid', 'partially_paid', 'overdue')
+    ORDER BY o.confirmation_date, o.order_id;
+"""
+
+
+@reads_from_replica
+@with_query_class(BULK)
+async def spool_rows(pool, kind: str, query: str, *args, sum_columns: tuple = ()) -> SpooledRows:
+    """
+    Читает результат запроса курсором пачками по SPOOL_CHUNK_SIZE и пишет их во временный файл
+    (pickle по пачке). Ключ документа — хэш записанных данных. Файл удаляет вызывающий (remove_spool).
+    """
+    hasher = hashlib.blake2b(digest_size=20)
+    hasher.update(f"{kind}:{TEMPLATE_VERSION}".encode("utf-8"))
+    sums = [Decimal('0')] * len(sum_columns)
+    row_count = 0
+
+    spool = tempfile.NamedTemporaryFile(prefix=f"{kind}_", suffix=".spool", delete=False)
+    try:
+        async with pool.acquire() as conn:
+            async with conn.transaction(readonly=True):
+                chunk = []
+                async for record in conn.cursor(query, *args, prefetch=SPOOL_CHUNK_SIZE):
+                    row = tuple(record.values())
+                    for index, column in enumerate(sum_columns):
+                        sums[index] += row[column] or 0
+                    chunk.append(row)
+                    if len(chunk) >= SPOOL_CHUNK_SIZE:
+                        row_count += _write_chunk(spool, hasher, chunk)
+                        chunk = []
+                if chunk:
+                    row_count += _write_chunk(spool, hasher, chunk)
+        spool.close()
+    except BaseException:
+        spool.close()
+        remove_spool(spool.name)
+        raise
+    return SpooledRows(spool.name, f"{kind}:{hasher.hexdigest()}", row_count, tuple(sums))
+
+
+def _write_chunk(spool, hasher, chunk: list) -> int:
+    data = pickle.dumps(chunk, protocol=pickle.HIGHEST_PROTOCOL)
+    hasher.update(data)
+    spool.write(data)
+    return len(chunk)
+
+
+# --- Кэш file_id ---
+
+# Ограничение кэша в памяти; при переполнении он очищается и заполняется заново из БД
+FILE_ID_CACHE_SIZE = 5000
+
+_file_ids: dict[str, str] = {}
+
+
+async def get_document_file_id(pool, key: str) -> Optional[str]:
+    file_id = _file_ids.get(key)
+    if file_id is not None:
+        return file_id
+    conn = None
+    try:
+        conn = await pool.acquire()
+        file_id = await conn.fetchval("SELECT file_id FROM document_files WHERE content_key = $1;", key)
+    except asyncpg.exceptions.PostgresError as e:
+        logger.warning("Не удалось прочитать file_id документа %s: %s", key, e)
+        return None
+    finally:
+        if conn:
+            await pool.release(conn)
+    if file_id is not None:
+        _file_ids[key] = file_id
+    return file_id
+
+
+async def save_document_file_id(pool, key: str, file_name: str, file_id: str) -> None:
+    if len(_file_ids) >= FILE_ID_CACHE_SIZE:
+        _file_ids.clear()
+    _file_ids[key] = file_id
+    conn = None
+    try:
+        conn = await pool.acquire()
+        await conn.execute("""
+            INSERT INTO document_files (content_key, file_name, file_id)
+            VALUES ($1, $2, $3)
+            ON CONFLICT (content_key) DO UPDATE SET file_id = EXCLUDED.file_id, created_at = now();
+        """, key, file_name, file_id)
+    except asyncpg.exceptions.PostgresError as e:
+        logger.warning("Не удалось сохранить file_id документа %s: %s", key, e)
+    finally:
+        if conn:
+            await pool.release(conn)
+
+
+async def forget_document_file_id(pool, key: str) -> None:
+    _file_ids.pop(key, None)
+    conn = None
+    try:
+        conn = await pool.acquire()
+        await conn.execute("DELETE FROM document_files WHERE content_key = $1;", key)
+    except asyncpg.exceptions.PostgresError as e:
+        logger.warning("Не удалось удалить file_id документа %s: %s", key, e)
+    finally:
+        if conn:
+            await pool.release(conn)
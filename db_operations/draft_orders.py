@@ -0,0 +1,191 @@
+# db_operations/draft_orders.py
+"""
+Сервис списков заказов для экранов подтверждения и админского редактирования.
+
+Фильтрация (дата доставки, сотрудник, клиент) выполняется на стороне БД,
+выборка идет постранично по ключу (order_date, order_id) — keyset-пагинация,
+поэтому на экран попадает одна страница, а не все черновики сразу.
+Общее число заказов считается только на первой странице; при листании экраны
+передают сохраненное в FSM значение (total_count), чтобы не считать весь список заново.
+Для массовых действий есть отдельный запрос, возвращающий только ID.
+"""
+
+import logging
+from datetime import date
+from typing import NamedTuple, Optional
+
+import asyncpg
+
+from db_operations.report_order_confirmation import UnconfirmedOrder
+
+logger = logging.getLogger(__name__)
+
+# Количество заказов на одной странице списка
+DEFAULT_PAGE_SIZE = 10
+
+# Статусы, по которым разрешено фильтровать. Подставляются в SQL литералами,
+# чтобы планировщик мог использовать частичные индексы по статусу.
+ALLOWED_STATUSES = ("draft", "confirmed", "shipped", "cancelled")
+
+
+class OrderListFilter(NamedTuple):
+    statuses: tuple = ("draft",)
+    delivery_date: Optional[date] = None
+    employee_id: Optional[int] = None
+    client_id: Optional[int] = None
+
+    def to_state(self) -> dict:
+        """Сериализует фильтр для хранения в данных FSM."""
+        return {
+            "statuses": list(self.statuses),
+            "delivery_date": self.delivery_date.isoformat() if self.delivery_date else None,
+            "employee_id": self.employee_id,
+            "client_id": self.client_id,
+        }
+
+    @classmethod
+    def from_state(cls, data: Optional[dict], default: "OrderListFilter" = None) -> "OrderListFilter":
+        """Восстанавливает фильтр из данных FSM."""
+        if not data:
+            return default or cls()
+        return cls(
+            statuses=tuple(data.get("statuses") or ("draft",)),
+            delivery_date=date.fromisoformat(data["delivery_date"]) if data.get("delivery_date") else None,
+            employee_id=data.get("employee_id"),
+            client_id=data.get("client_id"),
+        )
+
+
+class OrderPage(NamedTuple):
+    orders: list            # list[UnconfirmedOrder]
+    has_prev: bool
+    has_next: bool
+    total_count: int
+
+
+def encode_cursor(order: UnconfirmedOrder) -> str:
+    """Курсор страницы для callback_data: 'YYYY-MM-DD:order_id'."""
+    return f"{order.order_date.isoformat()}:{order.order_id}"
+
+
+def decode_cursor(cursor: str) -> tuple[date, int]:
+    order_date, order_id = cursor.rsplit(":", 1)
+    return date.fromisoformat(order_date), int(order_id)
+
+
+def _build_where(order_filter: OrderListFilter, params: list) -> str:
+    statuses = [status for status in order_filter.statuses if status in ALLOWED_STATUSES]
+    if not statuses:
+        raise ValueError(f"Недопустимый набор статусов: {order_filter.statuses}")
+    conditions = ["o.status IN (" + ", ".join(f"'{status}'" for status in statuses) + ")"]
+
+    if order_filter.delivery_date is not None:
+        params.append(order_filter.delivery_date)
+        conditions.append(f"o.delivery_date = ${len(params)}")
+    if order_filter.employee_id is not None:
+        params.append(order_filter.employee_id)
+        conditions.append(f"o.employee_id = ${len(params)}")
+    if order_filter.client_id is not None:
+        params.append(order_filter.client_id)
+        conditions.append(f"o.client_id = ${len(params)}")
+    return " AND ".join(conditions)
+
+
+async def get_orders_page(
+    pool,
+    order_filter: OrderListFilter = OrderListFilter(),
+    page_size: int = DEFAULT_PAGE_SIZE,
+    after: Optional[str] = None,
+    before: Optional[str] = None,
+    total_count: Optional[int] = None
+) -> OrderPage:
+    """
+    Возвращает страницу заказов, отсортированных по (order_date, order_id) по убыванию.
+    after  — курсор последнего заказа предыдущей страницы (листаем вперед);
+    before — курсор первого заказа следующей страницы (листаем назад);
+    total_count — уже известное число заказов по фильтру (COUNT(*) не выполняется).
+    """
+    params: list = []
+    where = _build_where(order_filter, params)
+    count_query = f"SELECT COUNT(*) FROM orders o WHERE {where}"
+    count_params = list(params)
+
+    order_by = "o.order_date DESC, o.order_id DESC"
+    if after:
+        params.extend(decode_cursor(after))
+        where += f" AND (o.order_date, o.order_id) < (${len(params) - 1}, ${len(params)})"
+    elif before:
+        params.extend(decode_cursor(before))
+        where += f" AND (o.order_date, o.order_id) > (${len(params) - 1}, ${len(params)})"
+        order_by = "o.order_date ASC, o.order_id ASC"
+
+    params.append(page_size + 1)
+    page_query = f"""
+        SELECT
+            o.order_id,
+            o.order_date,
+            o.delivery_date,
+            c.name AS client_name,
+            a.address_text,
+            o.total_amount
+        FROM
+            orders o
+        JOIN
+            clients c ON o.client_id = c.client_id
+        JOIN
+            addresses a ON o.address_id = a.address_id
+        WHERE
+            {where}
+        ORDER BY
+            {order_by}
+        LIMIT ${len(params)};
+    """
+
+    conn = None
+    try:
+        conn = await pool.acquire()
+        rows = await conn.fetch(page_query, *params)
+        if total_count is None:
+            total_count = await conn.fetchval(count_query, *count_params)
+    except asyncpg.exceptions.PostgresError as e:
+        logger.error(f"Ошибка asyncpg при получении страницы заказов ({order_filter}): {e}", exc_info=True)
+        return OrderPage([], False, False, 0)
+    finally:
+        if conn:
+            await pool.release(conn)
+
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    orders = [UnconfirmedOrder(**row) for row in rows]
+
+    if before:
+        # Выбирали в обратном порядке — возвращаем к порядку отображения
+        orders.reverse()
+        has_prev, has_next = has_more, True
+    else:
+        has_prev, has_next = after is not None, has_more
+
+    return OrderPage(orders, has_prev, has_next, total_count)
+
+
+async def get_order_ids(pool, order_filter: OrderListFilter = OrderListFilter()) -> list[int]:
+    """
+    Возвращает только ID заказов, подходящих под фильтр (для массовых действий),
+    без соединения с клиентами и адресами.
+    """
+    params: list = []
+    where = _build_where(order_filter, params)
+    conn = None
+    try:
+        conn = await pool.acquire()
+        rows = await conn.fetch(
+            f"SELECT o.order_id FROM orders o WHERE {where} ORDER BY o.order_date DESC, o.order_id DESC",
+            *params
+        )
+        return [row['order_id'] for row in rows]
+    except asyncpg.exceptions.PostgresError as e:
+        logger.error(f"Ошибка asyncpg при получении ID заказов ({order_filter}): {e}", exc_info=True)
+        return []
+    finally:
+        if conn:
+            await pool.release(conn)
@@ -0,0 +1,174 @@
+# db_operations/migrations.py
+"""
+Версионные миграции схемы: sql/migrations/NNNN_описание.sql.
+
+Миграции применяются при старте бота (APPLY_MIGRATIONS_ON_STARTUP) или вручную
+    python -m db_operations.migrations
+строго по возрастанию номера. Примененные записываются в schema_migrations (номер, имя,
+контрольная сумма файла). Несколько экземпляров бота, стартующих одновременно, не мешают
+друг другу: раннер работает под advisory-блокировкой, второй ждет и находит миграции уже примененными.
+Ждет он опросом pg_try_advisory_lock с паузой между попытками, а не в pg_advisory_lock:
+ожидающий оператор держал бы снимок, а CREATE INDEX CONCURRENTLY первого экземпляра ждет
+завершения всех транзакций со старыми снимками — взаимная блокировка.
+
+Обычная миграция выполняется одной транзакцией вместе с записью в schema_migrations.
+Файл, первая строка которого "-- migrate: no-transaction" (например, CREATE INDEX CONCURRENTLY),
+выполняется по одному оператору без транзакции. Такие файлы должны состоять из простых
+операторов, разделенных ';' в конце строки (без функций и $$). Индексы, оставшиеся
+недостроенными (INVALID) после сбоя такой миграции, удаляются перед повтором.
+
+sql/Create_tables.sql и sql/edit_tables&collumns.sql — история схемы до миграций;
+новые изменения схемы добавляются только сюда.
+"""
+
+import argparse
+import asyncio
+import hashlib
+import logging
+import os
+import re
+from typing import NamedTuple
+
+import asyncpg
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "sql", "migrations")
+NO_TRANSACTION_MARK = "-- migrate: no-transaction"
+# Ключ advisory-блокировки раннера (произвольная константа, общая для всех экземпляров бота)
+MIGRATIONS_LOCK_KEY = 7_310_050
+# Пауза между попытками взять блокировку раннера, секунды
+MIGRATIONS_LOCK_POLL_SECONDS = 1.0
+
+_file_re = re.compile(r"^(\d{4})_(\w+)\.sql$")
+_concurrent_index_re = re.compile(r"CREATE\s+(?:UNIQUE\s+)?INDEX\s+CONCURRENTLY\s+(?:IF\s+NOT\s+EXISTS\s+)?(\w+)", re.I)
+
+_SCHEMA_MIGRATIONS = """
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        checksum TEXT NOT NULL,
+        applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    );
+"""
+
+
+class Migration(NamedTuple):
+    version: int
+    name: str
+    sql: str
+    checksum: str
+
+    @property
+    def in_transaction(self) -> bool:
+        return not self.sql.lstrip().startswith(NO_TRANSACTION_MARK)
+
+
+def load_migrations(directory: str = MIGRATIONS_DIR) -> list[Migration]:
+    """Файлы миграций по возрастанию номера. Повтор номера — ошибка."""
+    migrations = {}
+    for file_name in sorted(os.listdir(directory)):
+        match = _file_re.match(file_name)
+        if not match:
+            continue
+        version = int(match.group(1))
+        if version in migrations:
+            raise ValueError(f"Два файла миграции с номером {version}: {migrations[version].name} и {match.group(2)}")
+        with open(os.path.join(directory, file_name), encoding="utf-8") as f:
+            sql = f.read()
+        migrations[version] = Migration(version, match.group(2), sql, hashlib.sha256(sql.encode()).hexdigest())
+    return [migrations[version] for version in sorted(migrations)]
+
+
+def _statements(sql: str) -> list[str]:
+    """Операторы миграции без транзакции: комментарии убираются, разделитель — ';' в конце строки."""
+    text = "\n".join(line for line in sql.splitlines() if not line.lstrip().startswith("--"))
+    return [statement.strip() for statement in re.split(r";\s*$", text, flags=re.M) if statement.strip()]
+
+
+async def _apply(conn: asyncpg.Connection, migration: Migration) -> None:
+    record = ("INSERT INTO schema_migrations (version, name, checksum) VALUES ($1, $2, $3);",
+              migration.version, migration.name, migration.checksum)
+    if migration.in_transaction:
+        async with conn.transaction():
+            await conn.execute(migration.sql)
+            await conn.execute(*record)
+        return
+
+    statements = _statements(migration.sql)
+    # Недостроенные индексы прошлой попытки: IF NOT EXISTS их пропустил бы
+    index_names = [match.group(1) for statement in statements for match in _concurrent_index_re.finditer(statement)]
+    invalid = await conn.fetch("""
+        SELECT c.relname FROM pg_index i
+        JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE NOT i.indisvalid AND c.relname = ANY($1::text[]) AND pg_table_is_visible(c.oid);
+    """, index_names)
+    for row in invalid:
+        logger.warning("Миграция %04d: удаляем недостроенный индекс %s.", migration.version, row['relname'])
+        await conn.execute(f'DROP INDEX CONCURRENTLY IF EXISTS "{row["relname"]}"')
+    for statement in statements:
+        await conn.execute(statement)
+    await conn.execute(*record)
+
+
+async def _acquire_runner_lock(conn: asyncpg.Connection) -> None:
+    """Берет блокировку раннера, не оставляя открытого оператора на время ожидания."""
+    waiting = False
+    while not await conn.fetchval("SELECT pg_try_advisory_lock($1)", MIGRATIONS_LOCK_KEY):
+        if not waiting:
+            logger.info("Миграции применяет другой экземпляр бота, ждем...")
+            waiting = True
+        await asyncio.sleep(MIGRATIONS_LOCK_POLL_SECONDS)
+
+
+async def apply_migrations(pool, directory: str = MIGRATIONS_DIR) -> list[int]:
+    """Применяет новые миграции. Возвращает номера примененных."""
+    migrations = load_migrations(directory)
+    applied_now = []
+    conn = await pool.acquire()
+    try:
+        # statement_timeout пула рассчитан на интерактивные запросы; RESET ALL при release вернет его
+        await conn.execute("SET statement_timeout = 0")
+        await _acquire_runner_lock(conn)
+        try:
+            await conn.execute(_SCHEMA_MIGRATIONS)
+            applied = {row['version']: row['checksum'] for row in await conn.fetch("SELECT version, checksum FROM schema_migrations")}
+            for migration in migrations:
+                if migration.version in applied:
+                    if applied[migration.version] != migration.checksum:
+                        logger.warning("Миграция %04d_%s изменена после применения; повторно не применяется.",
+                                       migration.version, migration.name)
+                    continue
+                logger.info("Применяем миграцию %04d_%s...", migration.version, migration.name)
+                await _apply(conn, migration)
+                applied_now.append(migration.version)
+        finally:
+            await conn.execute("SELECT pg_advisory_unlock($1)", MIGRATIONS_LOCK_KEY)
+    finally:
+        await pool.release(conn)
+    if applied_now:
+        logger.info("Применены миграции: %s.", ", ".join(f"{version:04d}" for version in applied_now))
+    return applied_now
+
+
+async def _migrate(args) -> None:
+    from db_operations import init_db_pool, close_db_pool
+
+    pool = await init_db_pool()
+    try:
+        applied = await apply_migrations(pool, args.directory)
+        print(f"Применено миграций: {len(applied)}")
+    finally:
+        await close_db_pool(pool)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Применение миграций схемы из sql/migrations.")
+    parser.add_argument("--directory", default=MIGRATIONS_DIR, help="Каталог миграций")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+    asyncio.run(_migrate(args))
+
+
+if __name__ == "__main__":
+    main()
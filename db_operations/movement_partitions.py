@@ -0,0 +1,231 @@
+# db_operations/movement_partitions.py
+"""
+Секции inventory_movements по месяцам (миграция — sql/edit_tables&collumns.sql).
+
+Фоновая задача run_partition_maintenance раз в PARTITION_MAINTENANCE_INTERVAL_SECONDS:
+- создает секции на MOVEMENT_PARTITIONS_AHEAD месяцев вперед, чтобы вставки не попадали в секцию
+  по умолчанию (если попали — create_inventory_movements_partition перенесет их в новую секцию);
+- выгружает секции старше MOVEMENT_RETENTION_MONTHS в MOVEMENT_ARCHIVE_DIR/<секция>.csv.gz
+  (COPY ... CSV HEADER, gzip; без таймаута класса запросов), затем короткой транзакцией
+  под таймаутом BULK добавляет их стоимости поступлений в inventory_movement_archive_totals,
+  отсоединяет и удаляет секцию. Файл пишется целиком и сверяется по числу строк до отсоединения секции.
+
+Запросы по movement_date отсекают лишние секции, поиск по документу-источнику
+(idx_inventory_movements_source_document) и по товару идет по индексам каждой секции.
+
+Вручную (например, сразу после миграции):
+    python -m db_operations.movement_partitions            # только создать секции
+    python -m db_operations.movement_partitions --archive  # и выгрузить старые
+"""
+
+import argparse
+import asyncio
+import csv
+import gzip
+import logging
+import os
+import shutil
+from datetime import date
+from typing import NamedTuple
+
+import asyncpg
+
+from config import (
+    MOVEMENT_ARCHIVE_DIR, MOVEMENT_PARTITIONS_AHEAD, MOVEMENT_RETENTION_MONTHS,
+    PARTITION_MAINTENANCE_INTERVAL_SECONDS
+)
+from db_operations.query_classes import BULK, with_query_class
+
+logger = logging.getLogger(__name__)
+
+# Отсоединение секции коротко блокирует inventory_movements; не ждем дольше, чтобы не задерживать списания
+DETACH_LOCK_TIMEOUT = "5s"
+
+
+class MovementPartition(NamedTuple):
+    name: str
+    range_from: date
+    range_to: date
+
+
+def _add_months(day: date, months: int) -> date:
+    month_index = day.year * 12 + day.month - 1 + months
+    return date(month_index // 12, month_index % 12 + 1, 1)
+
+
+@with_query_class(BULK)
+async def ensure_partitions(pool, months_ahead: int = MOVEMENT_PARTITIONS_AHEAD) -> list[str]:
+    """
+    Создает секции с текущего месяца на months_ahead вперед. Возвращает имена всех этих секций.
+    Класс bulk: при создании секции функция переносит в нее строки из секции по умолчанию.
+    """
+    first = date.today().replace(day=1)
+    async with pool.acquire() as conn:
+        return [
+            await conn.fetchval("SELECT create_inventory_movements_partition($1)", _add_months(first, i))
+            for i in range(months_ahead + 1)
+        ]
+
+
+async def list_partitions(pool) -> list[MovementPartition]:
+    """Секции с диапазоном (без секции по умолчанию), от старых к новым."""
+    async with pool.acquire() as conn:
+        rows = await conn.fetch("""
+            SELECT c.relname AS name
+            FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = 'inventory_movements'::regclass AND c.relname LIKE 'inventory\\_movements\\_y%'
+            ORDER BY c.relname;
+        """)
+    partitions = []
+    for row in rows:
+        # Имя секции — inventory_movements_yYYYYmMM, диапазон всегда один месяц
+        year, month = int(row['name'][-7:-3]), int(row['name'][-2:])
+        range_from = date(year, month, 1)
+        partitions.append(MovementPartition(row['name'], range_from, _add_months(range_from, 1)))
+    return partitions
+
+
+def _compress(raw_path: str, path: str) -> None:
+    """Сжимает выгрузку. Входной файл удаляет сам поток: при отмене задачи он дорабатывает без нее."""
+    tmp_path = path + ".tmp"
+    try:
+        with open(raw_path, "rb") as raw, gzip.open(tmp_path, "wb") as packed:
+            shutil.copyfileobj(raw, packed, 1024 * 1024)
+        with open(tmp_path, "rb") as packed:
+            os.fsync(packed.fileno())
+        os.replace(tmp_path, path)
+    finally:
+        for leftover in (raw_path, tmp_path):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+
+
+def _count_archived_rows(path: str) -> int:
+    # csv.reader, а не подсчет строк файла: описание движения может содержать перевод строки
+    with gzip.open(path, "rt", encoding="utf-8", newline="") as packed:
+        return sum(1 for _ in csv.reader(packed)) - 1  # без строки заголовка
+
+
+async def _export_partition(pool, partition: MovementPartition, path: str) -> int:
+    """
+    Выгружает секцию в path (csv.gz) и возвращает число строк в файле.
+    Выполняется без таймаута класса запросов: выгрузка месяца движений может идти дольше BULK.
+    """
+    raw_path = path + ".csv"
+    compressing = False
+    conn = None
+    try:
+        conn = await pool.acquire()
+        # statement_timeout пула рассчитан на интерактивные запросы; RESET ALL при release вернет его
+        await conn.execute("SET statement_timeout = 0")
+        # Старая секция больше не меняется (движения пишутся текущей датой), поэтому выгрузка до отсоединения
+        await conn.copy_from_table(partition.name, output=raw_path, format="csv", header=True)
+        await pool.release(conn)
+        conn = None
+        compressing = True
+        await asyncio.to_thread(_compress, raw_path, path)
+        return await asyncio.to_thread(_count_archived_rows, path)
+    finally:
+        if not compressing and os.path.exists(raw_path):
+            os.remove(raw_path)
+        if conn:
+            await pool.release(conn)
+
+
+@with_query_class(BULK)
+async def _detach_partition(pool, partition: MovementPartition, path: str, archived_rows: int) -> int:
+    """Сверяет файл с секцией, переносит итоги стоимостей и отсоединяет секцию. Возвращает число строк."""
+    conn = None
+    try:
+        conn = await pool.acquire()
+        async with conn.transaction():
+            await conn.execute(f"SET LOCAL lock_timeout = '{DETACH_LOCK_TIMEOUT}'")
+            await conn.execute(f'LOCK TABLE "{partition.name}" IN SHARE MODE')
+            rows_count = await conn.fetchval(f'SELECT COUNT(*) FROM "{partition.name}"')
+            if rows_count != archived_rows:
+                raise RuntimeError(f"в файле {path} {archived_rows} строк, в секции {partition.name} — {rows_count}")
+            await conn.execute(f"""
+                INSERT INTO inventory_movement_archive_totals (product_id, incoming_cost_sum, incoming_cost_count)
+                SELECT product_id, COALESCE(SUM(unit_cost), 0), COUNT(unit_cost)
+                FROM "{partition.name}"
+                WHERE movement_type = 'incoming'
+                GROUP BY product_id
+                ON CONFLICT (product_id) DO UPDATE SET
+                    incoming_cost_sum = inventory_movement_archive_totals.incoming_cost_sum + EXCLUDED.incoming_cost_sum,
+                    incoming_cost_count = inventory_movement_archive_totals.incoming_cost_count + EXCLUDED.incoming_cost_count;
+            """)
+            await conn.execute("""
+                INSERT INTO inventory_movement_archives (partition_name, range_from, range_to, rows_count, file_path)
+                VALUES ($1, $2, $3, $4, $5);
+            """, partition.name, partition.range_from, partition.range_to, rows_count, os.path.abspath(path))
+            await conn.execute(f'ALTER TABLE inventory_movements DETACH PARTITION "{partition.name}"')
+            await conn.execute(f'DROP TABLE "{partition.name}"')
+        return rows_count
+    finally:
+        if conn:
+            await pool.release(conn)
+
+
+async def archive_partition(pool, partition: MovementPartition, archive_dir: str = MOVEMENT_ARCHIVE_DIR) -> int:
+    """Выгружает секцию в archive_dir/<секция>.csv.gz и отсоединяет ее. Возвращает число строк."""
+    os.makedirs(archive_dir, exist_ok=True)
+    path = os.path.join(archive_dir, f"{partition.name}.csv.gz")
+    archived_rows = await _export_partition(pool, partition, path)
+    rows_count = await _detach_partition(pool, partition, path, archived_rows)
+    logger.info("Секция %s (%d строк) выгружена в %s и отсоединена.", partition.name, rows_count, path)
+    return rows_count
+
+
+async def archive_old_partitions(pool, retention_months: int = MOVEMENT_RETENTION_MONTHS,
+                                 archive_dir: str = MOVEMENT_ARCHIVE_DIR) -> list[str]:
+    """Выгружает секции, которые целиком старше retention_months. Возвращает имена выгруженных секций."""
+    cutoff = _add_months(date.today().replace(day=1), -retention_months)
+    archived = []
+    for partition in await list_partitions(pool):
+        if partition.range_to > cutoff:
+            break
+        await archive_partition(pool, partition, archive_dir)
+        archived.append(partition.name)
+    return archived
+
+
+async def run_partition_maintenance(pool, interval: float = PARTITION_MAINTENANCE_INTERVAL_SECONDS) -> None:
+    """Фоновая задача: секции вперед и выгрузка старых секций."""
+    while True:
+        try:
+            await ensure_partitions(pool)
+            await archive_old_partitions(pool)
+        except (asyncpg.exceptions.PostgresError, OSError, RuntimeError, asyncio.TimeoutError) as e:
+            # Повторим на следующем проходе; секции вперед созданы с запасом
+            logger.error("Ошибка обслуживания секций inventory_movements: %s", e, exc_info=True)
+        await asyncio.sleep(interval)
+
+
+async def _maintain(args) -> None:
+    from db_operations import init_db_pool, close_db_pool
+
+    pool = await init_db_pool()
+    try:
+        for name in await ensure_partitions(pool, args.months_ahead):
+            print(f"секция {name}")
+        if args.archive:
+            for name in await archive_old_partitions(pool, args.retention_months, args.archive_dir):
+                print(f"выгружена {name}")
+    finally:
+        await close_db_pool(pool)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Обслуживание секций inventory_movements.")
+    parser.add_argument("--months-ahead", type=int, default=MOVEMENT_PARTITIONS_AHEAD, help="Секции на столько месяцев вперед")
+    parser.add_argument("--archive", action="store_true", help="Выгрузить и отсоединить старые секции")
+    parser.add_argument("--retention-months", type=int, default=MOVEMENT_RETENTION_MONTHS, help="Сколько месяцев хранить в БД")
+    parser.add_argument("--archive-dir", default=MOVEMENT_ARCHIVE_DIR, help="Каталог для выгрузок")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+    asyncio.run(_maintain(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+# db_operations/order_details.py
+"""
+Единый загрузчик полной информации о заказе: шапка и строки одним запросом.
+
+Строки заказа собираются в JSON через json_agg в LATERAL-подзапросе, поэтому
+на просмотр заказа уходит один round trip вместо двух. Детали заказов
+в неизменяемых статусах кэшируются в памяти (LRU); при редактировании
+или отмене такого заказа запись нужно сбросить через invalidate_order_details().
+"""
+
+import json
+import logging
+from collections import OrderedDict
+from datetime import date
+from decimal import Decimal
+from typing import Iterable, NamedTuple, Optional
+
+import asyncpg
+
+logger = logging.getLogger(__name__)
+
+# Статусы, в которых состав заказа больше не меняется штатным процессом
+CACHEABLE_STATUSES = ("confirmed", "shipped")
+
+# Максимальное количество заказов в кэше
+ORDER_DETAILS_CACHE_SIZE = 500
+
+
+class OrderLine(NamedTuple):
+    product_id: int
+    product_name: str
+    quantity: int
+    unit_price: Decimal
+
+    @property
+    def total_item_amount(self) -> Decimal:
+        return self.quantity * self.unit_price
+
+
+class OrderFull(NamedTuple):
+    order_id: int
+    order_date: date
+    delivery_date: date
+    employee_id: Optional[int]
+    client_id: int
+    client_name: str
+    address_id: int
+    address_text: str
+    total_amount: Decimal
+    status: str
+    lines: tuple  # tuple[OrderLine, ...]
+
+
+# Денежные значения передаются в JSON текстом, чтобы не терять точность NUMERIC
+ORDER_DETAILS_QUERY = """
+    SELECT
+        o.order_id,
+        o.order_date,
+        o.delivery_date,
+        o.employee_id,
+        o.client_id,
+        c.name AS client_name,
+        o.address_id,
+        a.address_text,
+        o.total_amount,
+        o.status,
+        COALESCE(l.lines, '[]') AS lines
+    FROM
+        orders o
+    JOIN
+        clients c ON o.client_id = c.client_id
+    JOIN
+        addresses a ON o.address_id = a.address_id
+    LEFT JOIN LATERAL (
+        SELECT json_agg(json_build_object(
+                   'product_id', ol.product_id,
+                   'product_name', p.name,
+                   'quantity', ol.quantity,
+                   'unit_price', ol.unit_price::text
+               ) ORDER BY ol.order_line_id) AS lines
+        FROM order_lines ol
+        JOIN products p ON ol.product_id = p.product_id
+        WHERE ol.order_id = o.order_id
+    ) l ON TRUE
+    WHERE
+        o.order_id = ANY($1::int[]);
+"""
+
+_cache: "OrderedDict[int, OrderFull]" = OrderedDict()
+
+
+def _row_to_order(row) -> OrderFull:
+    lines = tuple(
+        OrderLine(
+            product_id=line['product_id'],
+            product_name=line['product_name'],
+            quantity=line['quantity'],
+            unit_price=Decimal(line['unit_price'])
+        )
+        for line in json.loads(row['lines'])
+    )
+    return OrderFull(
+        order_id=row['order_id'],
+        order_date=row['order_date'],
+        delivery_date=row['delivery_date'],
+        employee_id=row['employee_id'],
+        client_id=row['client_id'],
+        client_name=row['client_name'],
+        address_id=row['address_id'],
+        address_text=row['address_text'],
+        total_amount=row['total_amount'],
+        status=row['status'],
+        lines=lines
+    )
+
+
+def _cache_put(order: OrderFull) -> None:
+    if order.status not in CACHEABLE_STATUSES:
+        return
+    _cache[order.order_id] = order
+    _cache.move_to_end(order.order_id)
+    while len(_cache) > ORDER_DETAILS_CACHE_SIZE:
+        _cache.popitem(last=False)
+
+
+def invalidate_order_details(*order_ids: int) -> None:
+    """Сбрасывает кэш деталей указанных заказов (после редактирования/отмены)."""
+    for order_id in order_ids:
+        _cache.pop(order_id, None)
+
+
+async def get_orders_details(pool, order_ids: Iterable[int]) -> dict[int, OrderFull]:
+    """
+    Загружает детали нескольких заказов: закэшированные берутся из памяти,
+    остальные — одним запросом. Возвращает {order_id: OrderFull}; отсутствующих заказов в словаре нет.
+    """
+    result: dict[int, OrderFull] = {}
+    missing = []
+    for order_id in dict.fromkeys(order_ids):
+        cached = _cache.get(order_id)
+        if cached is not None:
+            _cache.move_to_end(order_id)
+            result[order_id] = cached
+        else:
+            missing.append(order_id)
+
+    if not missing:
+        return result
+
+    conn = None
+    try:
+        conn = await pool.acquire()
+        rows = await conn.fetch(ORDER_DETAILS_QUERY, missing)
+    except asyncpg.exceptions.PostgresError as e:
+        logger.error(f"Ошибка asyncpg при загрузке деталей заказов {missing}: {e}", exc_info=True)
+        return result
+    finally:
+        if conn:
+            await pool.release(conn)
+
+    for row in rows:
+        order = _row_to_order(row)
+        _cache_put(order)
+        result[order.order_id] = order
+    return result
+
+
+async def get_order_details(pool, order_id: int, statuses: Optional[Iterable[str]] = None) -> Optional[OrderFull]:
+    """
+    Возвращает полную информацию о заказе (шапка + строки) или None.
+    Если задан statuses, заказ в другом статусе считается ненайденным.
+    """
+    order = (await get_orders_details(pool, [order_id])).get(order_id)
+    if order is None:
+        return None
+    if statuses is not None and order.status not in statuses:
+        return None
+    return order
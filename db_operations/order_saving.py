@@ -0,0 +1,191 @@
+# db_operations/order_saving.py
+"""
+Сохранение заказа из корзины: создание черновика или обновление редактируемого заказа.
+
+Вызывается хендлером подтверждения корзины (handlers/orders/order_editor.py) и проигрывателем
+локального журнала (db_operations/write_journal.py), поэтому заказ описывается OrderToSave,
+который сериализуется в JSON без потерь. Повтор с тем же client_key не создает второй заказ.
+"""
+
+import logging
+from datetime import date
+from decimal import Decimal
+from typing import NamedTuple, Optional
+
+import asyncpg
+
+from db_operations.client_keys import claim_client_key, get_client_key_result, set_client_key_result
+from db_operations.order_details import invalidate_order_details
+from db_operations.outbox import DRAFT_CREATED, add_event
+from db_operations.sales_rollups import SALES_STATUSES, apply_orders_to_rollups, lock_sales_orders
+from db_operations.stock_availability import stock_availability
+from db_operations.stock_reservations import ReservationResult, reserve_order_lines
+from utils.metrics import ORDERS_CREATED_TOTAL
+
+logger = logging.getLogger(__name__)
+
+ORDER_SAVE = "order.save"
+
+
+class OrderStatusChanged(ValueError):
+    """Редактируемый заказ уже не в том статусе, в котором его открыли (подтвержден или отменен)."""
+
+
+class OrderToSave(NamedTuple):
+    telegram_id: int
+    client_id: int
+    address_id: int
+    delivery_date: date
+    items: tuple                      # строки корзины: product_id, product_name, quantity, price
+    editing_order_id: Optional[int] = None
+    original_order_status: Optional[str] = None
+    order_date: Optional[date] = None  # дата оформления: при проигрывании журнала — день, когда заказ приняли
+
+    @property
+    def total(self) -> Decimal:
+        return sum((item["quantity"] * item["price"] for item in self.items), Decimal('0'))
+
+    @classmethod
+    def from_state(cls, telegram_id: int, state_data: dict) -> "OrderToSave":
+        """Заказ из данных FSM корзины."""
+        return cls(
+            telegram_id=telegram_id,
+            client_id=state_data.get("client_id"),
+            address_id=state_data.get("address_id"),
+            delivery_date=state_data.get("delivery_date"),
+            items=tuple(
+                {"product_id": item["product_id"], "product_name": item.get("product_name"),
+                 "quantity": item["quantity"], "price": Decimal(str(item["price"]))}
+                for item in state_data.get("cart", [])
+            ),
+            editing_order_id=state_data.get("editing_order_id"),
+            original_order_status=state_data.get("original_order_status"),
+            order_date=date.today(),
+        )
+
+    def to_payload(self) -> dict:
+        """Сериализует заказ для локального журнала."""
+        return {
+            "telegram_id": self.telegram_id,
+            "client_id": self.client_id,
+            "address_id": self.address_id,
+            "delivery_date": self.delivery_date.isoformat(),
+            "items": [dict(item, price=str(item["price"])) for item in self.items],
+            "editing_order_id": self.editing_order_id,
+            "original_order_status": self.original_order_status,
+            "order_date": self.order_date.isoformat() if self.order_date else None,
+        }
+
+    @classmethod
+    def from_payload(cls, data: dict) -> "OrderToSave":
+        return cls(
+            telegram_id=data["telegram_id"],
+            client_id=data["client_id"],
+            address_id=data["address_id"],
+            delivery_date=date.fromisoformat(data["delivery_date"]),
+            items=tuple(dict(item, price=Decimal(item["price"])) for item in data["items"]),
+            editing_order_id=data.get("editing_order_id"),
+            original_order_status=data.get("original_order_status"),
+            order_date=date.fromisoformat(data["order_date"]) if data.get("order_date") else None,
+        )
+
+
+class SavedOrder(NamedTuple):
+    order_id: Optional[int]
+    created: bool
+    reservation: Optional[ReservationResult] = None
+    duplicate: bool = False            # ключ уже применен: заказ был сохранен раньше
+
+
+async def save_order(conn: asyncpg.Connection, order: OrderToSave, client_key: str) -> Optional[SavedOrder]:
+    """
+    Сохраняет заказ в уже открытой транзакции. None — сотрудник не найден, заказ не сохранен.
+    После коммита вызывающий должен вызвать after_order_saved.
+    """
+    employee_id = await conn.fetchval("SELECT employee_id FROM employees WHERE id_telegram = $1", order.telegram_id)
+    if employee_id is None:
+        logger.error(f"Не удалось получить employee_id для пользователя {order.telegram_id}. Заказ не сохранен.")
+        return None
+
+    if not await claim_client_key(conn, client_key, ORDER_SAVE):
+        order_id = await get_client_key_result(conn, client_key)
+        logger.info(f"Заказ с ключом {client_key} уже сохранен (№{order_id}), повтор пропущен.")
+        return SavedOrder(order_id, created=False, duplicate=True)
+
+    total = order.total
+    editing_order_id = order.editing_order_id
+    if editing_order_id: # Если редактируем существующий заказ
+        logger.info(f"Обновление существующего заказа #{editing_order_id} пользователем {order.telegram_id}.")
+
+        # Если заказ уже учтен в агрегатах продаж, вычитаем старую версию до изменений
+        await apply_orders_to_rollups(conn, await lock_sales_orders(conn, [editing_order_id]), -1)
+
+        # Обновляем основные поля заказа. Статус должен быть тем же, что при открытии: иначе
+        # (например, изменение из журнала после подтверждения заказа) заказ вернулся бы в черновик
+        # с уже списанным товаром. Исключение откатывает транзакцию вместе с ключом.
+        result = await conn.execute("""
+            UPDATE orders
+            SET delivery_date = $1, client_id = $2, address_id = $3, total_amount = $4
+            WHERE order_id = $5 AND status = $6;
+        """, order.delivery_date, order.client_id, order.address_id, total, editing_order_id, order.original_order_status)
+        if result != "UPDATE 1":
+            raise OrderStatusChanged(
+                f"заказ №{editing_order_id} не найден или уже не в статусе '{order.original_order_status}'"
+            )
+
+        # Удаляем все старые строки заказа
+        await conn.execute("DELETE FROM order_lines WHERE order_id = $1;", editing_order_id)
+
+        # Вставляем все новые/измененные строки заказа
+        await conn.executemany("""
+            INSERT INTO order_lines (order_id, product_id, quantity, unit_price)
+            VALUES ($1, $2, $3, $4)
+        """, [(editing_order_id, item["product_id"], item["quantity"], item["price"]) for item in order.items])
+
+        if order.original_order_status in SALES_STATUSES:
+            await apply_orders_to_rollups(conn, [editing_order_id], 1)
+        order_id = editing_order_id
+
+    else: # Если создаем новый заказ
+        logger.info(f"Создание нового заказа пользователем {order.telegram_id}.")
+
+        # Вставка в таблицу orders с начальным статусом 'draft'
+        order_id = await conn.fetchval("""
+            INSERT INTO orders (order_date, delivery_date, employee_id, client_id, address_id, total_amount, status)
+            VALUES ($1, $2, $3, $4, $5, $6, 'draft')
+            RETURNING order_id;
+        """, order.order_date or date.today(), order.delivery_date, employee_id, order.client_id, order.address_id, total)
+
+        # Вставка строк заказа
+        await conn.executemany("""
+            INSERT INTO order_lines (order_id, product_id, quantity, unit_price)
+            VALUES ($1, $2, $3, $4)
+        """, [(order_id, item["product_id"], item["quantity"], item["price"]) for item in order.items])
+
+        # Уведомление подтверждающим (сводкой, см. db_operations/outbox.py)
+        await add_event(conn, DRAFT_CREATED, order_id, {"total": total})
+
+    await set_client_key_result(conn, client_key, order_id)
+
+    # Черновик резервирует товар (при редактировании резерв пересоздается и продлевается)
+    reservation = None
+    if not editing_order_id or order.original_order_status == 'draft':
+        quantities = {}
+        for item in order.items:
+            quantities[item["product_id"]] = quantities.get(item["product_id"], 0) + item["quantity"]
+        reservation = await reserve_order_lines(conn, order_id, quantities)
+
+    return SavedOrder(order_id, created=not editing_order_id, reservation=reservation)
+
+
+def after_order_saved(saved: SavedOrder) -> None:
+    """Обновляет кэши и метрики процесса после коммита save_order."""
+    if saved.duplicate:
+        return
+    if saved.created:
+        ORDERS_CREATED_TOTAL.inc()
+    else:
+        # Состав и шапка заказа изменились — сбрасываем закэшированные детали
+        invalidate_order_details(saved.order_id)
+    if saved.reservation is not None:
+        stock_availability.set_order_reservation(saved.order_id, saved.reservation.reserved)
@@ -0,0 +1,388 @@
+# db_operations/outbox.py
+"""
+Transactional outbox: доменные события и сводные уведомления сотрудникам.
+
+События пишутся в outbox_events функцией add_event/add_events в той же транзакции,
+что и само изменение (заказ, оплата, склад): откат транзакции откатывает и событие,
+а закоммиченное изменение гарантированно будет доставлено.
+
+Фоновая задача run_outbox_dispatcher (запускается в tg_bot.main) раз в OUTBOX_POLL_INTERVAL_SECONDS:
+1. Берет события тех типов, у которых самое старое необработанное событие ждет дольше
+   окна склейки (COALESCE_WINDOWS), пачкой до OUTBOX_BATCH_SIZE (FOR UPDATE SKIP LOCKED —
+   несколько экземпляров бота не разберут одно событие дважды).
+2. Склеивает их в сводки по получателям ("📝 Новых черновиков: 12 за 5 мин"), записывает сводки
+   в outbox_deliveries и отмечает события обработанными — одной короткой транзакцией.
+3. Отправляет сводки из outbox_deliveries вне транзакции через очередь отправки
+   (utils/send_queue.py) с приоритетом BULK. Сводка берется в работу на OUTBOX_DELIVERY_LEASE_SECONDS;
+   доставленная удаляется, недоставленная повторяется с паузой до OUTBOX_MAX_SEND_ATTEMPTS раз.
+   Ошибка одного получателя не приводит к повторной отправке остальным. Если бот упал
+   во время отправки, сводка будет отправлена повторно после истечения аренды — для уведомлений это допустимо.
+Обработанные события старше OUTBOX_RETENTION_DAYS удаляются.
+"""
+
+import asyncio
+import json
+import logging
+from collections import defaultdict
+from decimal import Decimal
+from typing import Iterable, NamedTuple, Optional
+
+import asyncpg
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+
+from access_control import employee_roles, has_access
+from utils.markdown_utils import escape_markdown_v2
+from utils.metrics import OUTBOX_EVENTS_DISPATCHED_TOTAL
+from utils.send_queue import bulk_sends
+
+logger = logging.getLogger(__name__)
+
+# Типы событий
+DRAFT_CREATED = "order.draft_created"
+ORDER_CONFIRMED = "order.confirmed"
+ORDER_CANCELLED = "order.cancelled"
+PAYMENT_APPLIED = "payment.applied"
+STOCK_RECEIVED = "stock.received"
+
+# Сколько секунд копить события каждого типа перед отправкой сводки
+COALESCE_WINDOWS = {
+    DRAFT_CREATED: 300,
+    ORDER_CONFIRMED: 60,
+    ORDER_CANCELLED: 60,
+    PAYMENT_APPLIED: 300,
+    STOCK_RECEIVED: 300,
+}
+
+OUTBOX_POLL_INTERVAL_SECONDS = 15
+OUTBOX_BATCH_SIZE = 500
+OUTBOX_RETENTION_DAYS = 7
+
+# Доставка сводок: сколько брать за проход, на сколько занимать, сколько раз пробовать
+OUTBOX_DELIVERY_BATCH_SIZE = 200
+OUTBOX_DELIVERY_LEASE_SECONDS = 300
+OUTBOX_MAX_SEND_ATTEMPTS = 5
+OUTBOX_RETRY_DELAY_SECONDS = 60
+
+# Сколько заказов перечислять в сводке поименно
+DIGEST_MAX_ITEMS = 15
+
+
+class OutboxEvent(NamedTuple):
+    event_id: int
+    event_type: str
+    aggregate_id: Optional[int]
+    payload: dict
+
+
+# --- Запись событий (внутри транзакции вызывающего) ---
+
+async def add_event(conn: asyncpg.Connection, event_type: str, aggregate_id: Optional[int], payload: Optional[dict] = None) -> None:
+    await conn.execute(
+        "INSERT INTO outbox_events (event_type, aggregate_id, payload) VALUES ($1, $2, $3::jsonb)",
+        event_type, aggregate_id, json.dumps(payload or {}, default=str)
+    )
+
+
+async def add_events(conn: asyncpg.Connection, event_type: str, aggregate_ids: Iterable[int], payload: Optional[dict] = None) -> None:
+    """Одно событие на каждый aggregate_id одним запросом (массовая отмена и т.п.)."""
+    aggregate_ids = list(aggregate_ids)
+    if aggregate_ids:
+        await conn.execute("""
+            INSERT INTO outbox_events (event_type, aggregate_id, payload)
+            SELECT $1, aggregate_id, $3::jsonb FROM unnest($2::int[]) AS aggregate_id
+        """, event_type, aggregate_ids, json.dumps(payload or {}, default=str))
+
+
+# --- Разбор очереди ---
+
+_CLAIM_SQL = """
+    WITH windows AS (
+        SELECT * FROM unnest($1::text[], $2::float8[]) AS w(event_type, seconds)
+    ),
+    due AS (
+        SELECT e.event_type
+        FROM outbox_events e
+        JOIN windows w ON w.event_type = e.event_type
+        WHERE e.processed_at IS NULL
+        GROUP BY e.event_type, w.seconds
+        HAVING min(e.created_at) <= now() - make_interval(secs => w.seconds)
+    )
+    SELECT event_id, event_type, aggregate_id, payload
+    FROM outbox_events
+    WHERE processed_at IS NULL AND event_type IN (SELECT event_type FROM due)
+    ORDER BY event_id
+    LIMIT $3
+    FOR UPDATE SKIP LOCKED;
+"""
+
+_ORDERS_SQL = """
+    SELECT o.order_id, o.invoice_number, o.total_amount, c.name AS client_name,
+           e.name AS employee_name, e.id_telegram
+    FROM orders o
+    JOIN clients c ON c.client_id = o.client_id
+    LEFT JOIN employees e ON e.employee_id = o.employee_id
+    WHERE o.order_id = ANY($1::int[]);
+"""
+
+
+async def dispatch_outbox(bot: Bot, pool) -> int:
+    """Один проход: забирает созревшие события, рассылает сводки. Возвращает число обработанных событий."""
+    processed = await _collect_digests(pool)
+    await deliver_digests(bot, pool)
+    return processed
+
+
+async def _collect_digests(pool) -> int:
+    """События -> сводки в outbox_deliveries; события отмечаются обработанными в той же транзакции."""
+    types = list(COALESCE_WINDOWS)
+    windows = [float(COALESCE_WINDOWS[event_type]) for event_type in types]
+    # Роли обновляем до взятия соединения: refresh берет свое соединение из пула
+    if employee_roles.is_stale():
+        await employee_roles.refresh(pool, force=True)
+    conn = None
+    try:
+        conn = await pool.acquire()
+        async with conn.transaction():
+            rows = await conn.fetch(_CLAIM_SQL, types, windows, OUTBOX_BATCH_SIZE)
+            if not rows:
+                return 0
+            events = [
+                OutboxEvent(r['event_id'], r['event_type'], r['aggregate_id'], json.loads(r['payload']))
+                for r in rows
+            ]
+            order_ids = list({event.aggregate_id for event in events if event.event_type.startswith("order.")})
+            orders = {r['order_id']: r for r in await conn.fetch(_ORDERS_SQL, order_ids)} if order_ids else {}
+            product_ids = list({event.aggregate_id for event in events if event.event_type == STOCK_RECEIVED})
+            products = {
+                r['product_id']: r['name']
+                for r in await conn.fetch("SELECT product_id, name FROM products WHERE product_id = ANY($1::int[])", product_ids)
+            } if product_ids else {}
+
+            digests = build_digests(events, orders, products, employee_roles.roles)
+            if digests:
+                await conn.executemany(
+                    "INSERT INTO outbox_deliveries (chat_id, text, reply_markup) VALUES ($1, $2, $3::jsonb)",
+                    [
+                        (digest.chat_id, digest.text, digest.reply_markup.model_dump_json() if digest.reply_markup else None)
+                        for digest in digests
+                    ]
+                )
+            await conn.execute(
+                "UPDATE outbox_events SET processed_at = now() WHERE event_id = ANY($1::bigint[])",
+                [event.event_id for event in events]
+            )
+        for event in events:
+            OUTBOX_EVENTS_DISPATCHED_TOTAL.inc(event.event_type)
+        logger.info("Outbox: обработано событий %d, сводок к отправке %d.", len(events), len(digests))
+        return len(events)
+    except asyncpg.exceptions.PostgresError as e:
+        logger.error("Ошибка БД при разборе outbox: %s", e, exc_info=True)
+        return 0
+    except Exception as e:
+        logger.error("Неизвестная ошибка при разборе outbox: %s", e, exc_info=True)
+        return 0
+    finally:
+        if conn:
+            await pool.release(conn)
+
+
+_CLAIM_DELIVERIES_SQL = """
+    UPDATE outbox_deliveries d
+    SET next_attempt_at = now() + make_interval(secs => $2), attempts = d.attempts + 1
+    WHERE d.delivery_id IN (
+        SELECT delivery_id FROM outbox_deliveries
+        WHERE next_attempt_at <= now()
+        ORDER BY delivery_id
+        LIMIT $1
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING d.delivery_id, d.chat_id, d.text, d.reply_markup, d.attempts;
+"""
+
+
+async def deliver_digests(bot: Bot, pool) -> int:
+    """
+    Отправляет сводки из outbox_deliveries. Соединение не держится во время отправки:
+    сводки берутся в аренду короткой транзакцией, итог записывается после рассылки.
+    Возвращает число доставленных сводок.
+    """
+    try:
+        async with pool.acquire() as conn:
+            rows = await conn.fetch(_CLAIM_DELIVERIES_SQL, OUTBOX_DELIVERY_BATCH_SIZE, float(OUTBOX_DELIVERY_LEASE_SECONDS))
+    except asyncpg.exceptions.PostgresError as e:
+        logger.error("Ошибка БД при выборе сводок outbox для отправки: %s", e, exc_info=True)
+        return 0
+    if not rows:
+        return 0
+
+    digests = [
+        Digest(
+            r['chat_id'], r['text'],
+            InlineKeyboardMarkup.model_validate_json(r['reply_markup']) if r['reply_markup'] else None
+        )
+        for r in rows
+    ]
+    errors = await send_digests(bot, digests)
+
+    delivered, retry, dropped = [], [], []
+    for row, error in zip(rows, errors):
+        if error is None:
+            delivered.append(row['delivery_id'])
+        elif isinstance(error, (TelegramForbiddenError, TelegramBadRequest)) or row['attempts'] >= OUTBOX_MAX_SEND_ATTEMPTS:
+            # Бот заблокирован, неверный текст или попытки исчерпаны — повтор не поможет
+            logger.warning("Сводка outbox для %s не доставлена (попытка %d), отправка прекращена: %s",
+                           row['chat_id'], row['attempts'], error)
+            dropped.append(row['delivery_id'])
+        else:
+            retry.append((row['delivery_id'], str(error)))
+    try:
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                if delivered or dropped:
+                    await conn.execute("DELETE FROM outbox_deliveries WHERE delivery_id = ANY($1::bigint[])", delivered + dropped)
+                if retry:
+                    await conn.executemany("""
+                        UPDATE outbox_deliveries
+                        SET next_attempt_at = now() + make_interval(secs => $3 * attempts), last_error = $2
+                        WHERE delivery_id = $1
+                    """, [(delivery_id, error, float(OUTBOX_RETRY_DELAY_SECONDS)) for delivery_id, error in retry])
+    except asyncpg.exceptions.PostgresError as e:
+        # Итог не записан: по истечении аренды доставленные сводки уйдут повторно
+        logger.error("Ошибка БД при записи итога отправки сводок outbox: %s", e, exc_info=True)
+    if retry:
+        logger.info("Outbox: %d сводок будут отправлены повторно.", len(retry))
+    return len(delivered)
+
+
+async def purge_processed_events(pool) -> None:
+    conn = None
+    try:
+        conn = await pool.acquire()
+        result = await conn.execute(
+            "DELETE FROM outbox_events WHERE processed_at < now() - make_interval(days => $1)", OUTBOX_RETENTION_DAYS
+        )
+        logger.debug("Outbox: удалены старые события (%s).", result)
+    except Exception as e:
+        logger.error("Ошибка при очистке outbox: %s", e, exc_info=True)
+    finally:
+        if conn:
+            await pool.release(conn)
+
+
+# --- Сводки ---
+
+class Digest(NamedTuple):
+    chat_id: int
+    text: str                      # MarkdownV2
+    reply_markup: Optional[InlineKeyboardMarkup] = None
+
+
+def _recipients(roles: dict[int, str], section: str, item: str) -> list[int]:
+    return [telegram_id for telegram_id, role in roles.items() if has_access(role, section, item)]
+
+
+def _minutes(event_type: str) -> int:
+    return max(1, COALESCE_WINDOWS[event_type] // 60)
+
+
+def _order_list(order_ids: list[int], orders: dict) -> str:
+    lines = []
+    for order_id in order_ids[:DIGEST_MAX_ITEMS]:
+        order = orders.get(order_id)
+        lines.append(f"• №{order_id} — {order['client_name']}" if order else f"• №{order_id}")
+    if len(order_ids) > DIGEST_MAX_ITEMS:
+        lines.append(f"… и еще {len(order_ids) - DIGEST_MAX_ITEMS}")
+    return "\n".join(lines)
+
+
+def build_digests(events: list[OutboxEvent], orders: dict, products: dict, roles: dict[int, str]) -> list[Digest]:
+    """События -> сводки по получателям. Чистая функция: все данные переданы аргументами."""
+    by_type: dict[str, list[OutboxEvent]] = defaultdict(list)
+    for event in events:
+        by_type[event.event_type].append(event)
+    digests = []
+
+    # Новые черновики — тем, кто подтверждает заказы
+    drafts = by_type.get(DRAFT_CREATED)
+    if drafts:
+        total = sum((Decimal(str(event.payload.get("total", 0))) for event in drafts), Decimal("0"))
+        authors: dict[str, int] = defaultdict(int)
+        for event in drafts:
+            order = orders.get(event.aggregate_id)
+            authors[(order and order['employee_name']) or "без сотрудника"] += 1
+        text = escape_markdown_v2(
+            f"📝 Новых черновиков: {len(drafts)} за последние {_minutes(DRAFT_CREATED)} мин на сумму {total:.2f} грн\n"
+            + ", ".join(f"{name} ({count})" for name, count in sorted(authors.items(), key=lambda item: -item[1]))
+        )
+        keyboard = InlineKeyboardMarkup(inline_keyboard=[[
+            InlineKeyboardButton(text="Открыть черновики", callback_data="show_unconfirmed_orders_report_list")
+        ]])
+        digests += [Digest(chat_id, text, keyboard) for chat_id in _recipients(roles, "orders", "confirm")]
+
+    # Подтверждения и отмены — автору заказа
+    for event_type, title in ((ORDER_CONFIRMED, "✅ Подтверждены ваши заказы"), (ORDER_CANCELLED, "❌ Отменены ваши заказы")):
+        per_employee: dict[int, list[int]] = defaultdict(list)
+        for event in by_type.get(event_type, ()):
+            order = orders.get(event.aggregate_id)
+            if order is not None and order['id_telegram']:
+                per_employee[order['id_telegram']].append(event.aggregate_id)
+        for chat_id, order_ids in per_employee.items():
+            text = escape_markdown_v2(f"{title} ({len(order_ids)}):\n{_order_list(order_ids, orders)}")
+            digests.append(Digest(chat_id, text))
+
+    # Оплаты — тем, кто ведет оплаты клиентов
+    payments = by_type.get(PAYMENT_APPLIED)
+    if payments:
+        total = sum((Decimal(str(event.payload.get("amount", 0))) for event in payments), Decimal("0"))
+        text = escape_markdown_v2(
+            f"💰 Проведено оплат: {len(payments)} за последние {_minutes(PAYMENT_APPLIED)} мин, итого {total:.2f} грн"
+        )
+        digests += [Digest(chat_id, text) for chat_id in _recipients(roles, "reports", "clients")]
+
+    # Поступления товара — тем, кто оформляет заказы
+    received = by_type.get(STOCK_RECEIVED)
+    if received:
+        quantities: dict[int, Decimal] = defaultdict(Decimal)
+        for event in received:
+            quantities[event.aggregate_id] += Decimal(str(event.payload.get("quantity", 0)))
+        lines = [f"• {products.get(product_id, f'Товар {product_id}')}: +{quantity:g}"
+                 for product_id, quantity in list(quantities.items())[:DIGEST_MAX_ITEMS]]
+        if len(quantities) > DIGEST_MAX_ITEMS:
+            lines.append(f"… и еще {len(quantities) - DIGEST_MAX_ITEMS}")
+        text = escape_markdown_v2("📦 Поступил товар:\n" + "\n".join(lines))
+        digests += [Digest(chat_id, text) for chat_id in _recipients(roles, "orders", "create")]
+
+    return digests
+
+
+async def send_digests(bot: Bot, digests: list[Digest]) -> list[Optional[Exception]]:
+    """
+    Отправка через очередь отправки с приоритетом BULK; ошибки отдельных получателей не прерывают рассылку.
+    Возвращает ошибку по каждой сводке (None — доставлена).
+    """
+    async def send(digest: Digest) -> Optional[Exception]:
+        try:
+            await bot.send_message(digest.chat_id, digest.text, parse_mode="MarkdownV2", reply_markup=digest.reply_markup)
+            return None
+        except Exception as e:
+            logger.warning("Не удалось отправить уведомление сотруднику %s: %s", digest.chat_id, e)
+            return e
+
+    with bulk_sends():
+        return list(await asyncio.gather(*(send(digest) for digest in digests)))
+
+
+async def run_outbox_dispatcher(bot: Bot, pool, interval: float = OUTBOX_POLL_INTERVAL_SECONDS) -> None:
+    """Фоновая задача: разбор outbox и периодическая очистка обработанных событий."""
+    purge_every = max(1, int(3600 // interval))
+    ticks = 0
+    while True:
+        # Пока пачки полные, разбираем без паузы
+        while await dispatch_outbox(bot, pool) >= OUTBOX_BATCH_SIZE:
+            pass
+        ticks += 1
+        if ticks % purge_every == 0:
+            await purge_processed_events(pool)
+        await asyncio.sleep(interval)
@@ -0,0 +1,200 @@
+# db_operations/overdue_invoices.py
+"""
+Просроченные накладные.
+
+Фоновая задача (run_overdue_invoice_job, запускается в tg_bot.main) раз в OVERDUE_CHECK_INTERVAL_SECONDS:
+1. Одним UPDATE переводит в 'overdue' все подтвержденные неоплаченные/частично оплаченные накладные
+   с due_date в прошлом (частичный индекс idx_orders_unpaid_due_date) и в том же запросе
+   записывает переходы в invoice_overdue_history.
+2. Отправляет каждому ответственному сотруднику (orders.employee_id) одну сводку по всем
+   новым просрочкам его клиентов и отмечает записи истории как отправленные.
+
+Сводка отправляется только при первой просрочке накладной: если после частичной оплаты
+накладная снова становится просроченной, переход записывается, но повторно не рассылается.
+Неотправленные сводки (ошибка сети, остановка бота) досылаются при следующем запуске.
+"""
+
+import asyncio
+import logging
+from datetime import date
+from decimal import Decimal
+from typing import NamedTuple
+
+import asyncpg
+from aiogram import Bot
+
+from db_operations.query_classes import BULK, with_query_class
+from utils.markdown_utils import escape_markdown_v2
+from utils.metrics import INVOICES_MARKED_OVERDUE_TOTAL
+from utils.send_queue import bulk_sends
+
+logger = logging.getLogger(__name__)
+
+# Как часто проверять просрочку (просрочка считается по дням, поэтому чаще раза в час не нужно)
+OVERDUE_CHECK_INTERVAL_SECONDS = 3600
+
+# Telegram ограничивает сообщение 4096 символами; оставляем запас на экранирование
+DIGEST_MAX_LENGTH = 3500
+
+
+class OverdueInvoice(NamedTuple):
+    history_id: int
+    order_id: int
+    invoice_number: str | None
+    client_name: str
+    due_date: date
+    amount_due: Decimal
+
+
+@with_query_class(BULK)
+async def _flip_overdue_invoices(pool, today: date) -> list:
+    """Просмотр всех подтвержденных накладных — фоновая работа, под таймаутом bulk."""
+    conn = None
+    try:
+        conn = await pool.acquire()
+        rows = await conn.fetch("""
+            WITH candidates AS (
+                SELECT order_id, payment_status
+                FROM orders
+                WHERE status = 'confirmed'
+                  AND payment_status IN ('unpaid', 'partially_paid')
+                  AND due_date < $1
+                FOR UPDATE
+            ),
+            flipped AS (
+                UPDATE orders o
+                SET payment_status = 'overdue'
+                FROM candidates c
+                WHERE o.order_id = c.order_id
+                RETURNING o.order_id, o.employee_id, o.due_date, o.total_amount - o.amount_paid AS amount_due,
+                          c.payment_status AS previous_status
+            )
+            INSERT INTO invoice_overdue_history (order_id, previous_status, due_date, amount_due, notify)
+            SELECT f.order_id, f.previous_status, f.due_date, f.amount_due,
+                   -- CTE не видит строк, вставленных этим же запросом, поэтому NOT EXISTS проверяет прошлые просрочки
+                   f.employee_id IS NOT NULL
+                   AND NOT EXISTS (SELECT 1 FROM invoice_overdue_history h WHERE h.order_id = f.order_id)
+            FROM flipped f
+            RETURNING order_id;
+        """, today)
+        return rows
+    finally:
+        if conn:
+            await pool.release(conn)
+
+
+async def mark_overdue_invoices(pool, today: date | None = None) -> int:
+    """
+    Переводит просроченные накладные в 'overdue' и записывает переходы в историю.
+    Возвращает количество переведенных накладных.
+    """
+    try:
+        rows = await _flip_overdue_invoices(pool, today or date.today())
+        if rows:
+            INVOICES_MARKED_OVERDUE_TOTAL.inc(amount=len(rows))
+            logger.info("Просроченными отмечено накладных: %d.", len(rows))
+        return len(rows)
+    except asyncpg.exceptions.PostgresError as e:
+        logger.error("Ошибка БД при отметке просроченных накладных: %s", e, exc_info=True)
+        return 0
+    except Exception as e:
+        logger.error("Неизвестная ошибка при отметке просроченных накладных: %s", e, exc_info=True)
+        return 0
+
+
+async def get_pending_overdue_digests(pool) -> dict[int, list[OverdueInvoice]]:
+    """Неотправленные новые просрочки, сгруппированные по Telegram ID ответственного сотрудника."""
+    conn = None
+    try:
+        conn = await pool.acquire()
+        rows = await conn.fetch("""
+            SELECT h.history_id, h.order_id, o.invoice_number, c.name AS client_name, h.due_date, h.amount_due,
+                   e.id_telegram
+            FROM invoice_overdue_history h
+            JOIN orders o ON o.order_id = h.order_id
+            JOIN employees e ON e.employee_id = o.employee_id
+            JOIN clients c ON c.client_id = o.client_id
+            WHERE h.notify AND h.notified_at IS NULL
+            ORDER BY e.id_telegram, h.due_date, h.order_id;
+        """)
+        digests: dict[int, list[OverdueInvoice]] = {}
+        for r in rows:
+            digests.setdefault(r['id_telegram'], []).append(OverdueInvoice(
+                history_id=r['history_id'],
+                order_id=r['order_id'],
+                invoice_number=r['invoice_number'],
+                client_name=r['client_name'],
+                due_date=r['due_date'],
+                amount_due=r['amount_due']
+            ))
+        return digests
+    except Exception as e:
+        logger.error("Ошибка при получении сводок по просроченным накладным: %s", e, exc_info=True)
+        return {}
+    finally:
+        if conn:
+            await pool.release(conn)
+
+
+async def mark_digest_sent(pool, history_ids: list[int]) -> None:
+    conn = None
+    try:
+        conn = await pool.acquire()
+        await conn.execute(
+            "UPDATE invoice_overdue_history SET notified_at = now() WHERE history_id = ANY($1::bigint[])",
+            history_ids
+        )
+    except Exception as e:
+        logger.error("Ошибка при отметке отправленных сводок о просрочке: %s", e, exc_info=True)
+    finally:
+        if conn:
+            await pool.release(conn)
+
+
+def format_overdue_digest(invoices: list[OverdueInvoice]) -> list[str]:
+    """Текст сводки (MarkdownV2), разбитый на части по DIGEST_MAX_LENGTH."""
+    total_due = sum((invoice.amount_due for invoice in invoices), Decimal('0'))
+    header = escape_markdown_v2(
+        f"⏰ Просроченные накладные ваших клиентов: {len(invoices)} на сумму {total_due:.2f} грн"
+    )
+    parts, current = [], f"*{header}*\n"
+    for invoice in invoices:
+        number = invoice.invoice_number or f"#{invoice.order_id}"
+        line = escape_markdown_v2(
+            f"• {number} — {invoice.client_name}: долг {invoice.amount_due:.2f} грн, "
+            f"срок {invoice.due_date.strftime('%d.%m.%Y')}"
+        ) + "\n"
+        if len(current) + len(line) > DIGEST_MAX_LENGTH:
+            parts.append(current)
+            current = ""
+        current += line
+    parts.append(current)
+    return parts
+
+
+async def send_overdue_digests(bot: Bot, pool) -> int:
+    """Рассылает накопившиеся сводки. Возвращает число сотрудников, получивших сводку."""
+    digests = await get_pending_overdue_digests(pool)
+    sent = 0
+    for telegram_id, invoices in digests.items():
+        try:
+            with bulk_sends():
+                for text in format_overdue_digest(invoices):
+                    await bot.send_message(chat_id=telegram_id, text=text, parse_mode="MarkdownV2")
+        except Exception as e:
+            # Запись останется неотправленной и уйдет при следующем запуске
+            logger.warning("Не удалось отправить сводку о просрочке сотруднику %s: %s", telegram_id, e)
+            continue
+        await mark_digest_sent(pool, [invoice.history_id for invoice in invoices])
+        sent += 1
+    if sent:
+        logger.info("Сводки о просроченных накладных отправлены %d сотрудникам.", sent)
+    return sent
+
+
+async def run_overdue_invoice_job(bot: Bot, pool, interval: float = OVERDUE_CHECK_INTERVAL_SECONDS) -> None:
+    """Фоновая задача: отметка просрочки и рассылка сводок."""
+    while True:
+        await mark_overdue_invoices(pool)
+        await send_overdue_digests(bot, pool)
+        await asyncio.sleep(interval)
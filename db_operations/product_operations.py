@@ -1,9 +1,14 @@
 # db_operations/product_operations.py
 import asyncpg
 import logging
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, NamedTuple
 from decimal import Decimal
-from datetime import datetime
+from datetime import date, datetime
+
+from db_operations.sales_rollups import SALES_STATUSES
+from db_operations.replica import reads_from_replica
+from db_operations.query_classes import REPORT, with_query_class
+from db_operations.stock_mutations import INCOMING_TYPES, OUTGOING_TYPES, StockChange, apply_stock_changes
 
 logger = logging.getLogger(__name__)
 
@@ -50,28 +55,43 @@ async def get_product_by_id(db_pool: asyncpg.Pool, product_id: int) -> Optional[
             return ProductItem(record['product_id'], record['name'], None, record['cost_per_unit'])
         return None
 
+@reads_from_replica
+@with_query_class(REPORT)
 async def get_all_product_stock(db_pool: asyncpg.Pool) -> List[ProductStockItem]:
     """
     Получает список всех продуктов с их текущим остатком на складе
     и средней стоимостью поступления из inventory_movements.
+    Средняя считается по частичному индексу поступлений (idx_inventory_movements_incoming_cost)
+    и по итогам выгруженных секций (inventory_movement_archive_totals, db_operations/movement_partitions.py),
+    а не соединением products со всеми движениями.
     """
     query = """
+    WITH incoming AS (
+        SELECT product_id, SUM(unit_cost) AS cost_sum, COUNT(unit_cost) AS cost_count
+        FROM inventory_movements
+        WHERE movement_type = 'incoming'
+        GROUP BY product_id
+        UNION ALL
+        SELECT product_id, incoming_cost_sum, incoming_cost_count
+        FROM inventory_movement_archive_totals
+    ),
+    average_cost AS (
+        SELECT product_id, SUM(cost_sum) / NULLIF(SUM(cost_count), 0) AS average_cost
+        FROM incoming
+        GROUP BY product_id
+    )
     SELECT
         p.product_id,
         p.name,
         p.cost_per_unit, -- Базовая стоимость из таблицы products
         COALESCE(s.quantity, 0) AS current_stock, -- ИСПРАВЛЕНО: Берем напрямую из stock.quantity
-        -- Расчет средней стоимости поступления из inventory_movements
-        -- Используем im.quantity_change для фильтрации, если это необходимо для AVG
-        COALESCE(AVG(im.unit_cost) FILTER (WHERE im.movement_type = 'incoming'), p.cost_per_unit) AS average_movement_cost
+        COALESCE(ac.average_cost, p.cost_per_unit) AS average_movement_cost
     FROM
         products p
     LEFT JOIN
         stock s ON p.product_id = s.product_id
     LEFT JOIN
-        inventory_movements im ON p.product_id = im.product_id
-    GROUP BY
-        p.product_id, p.name, p.cost_per_unit, s.quantity -- ИСПРАВЛЕНО: Добавлен s.quantity в GROUP BY
+        average_cost ac ON p.product_id = ac.product_id
     ORDER BY
         p.name;
     """
@@ -79,11 +99,10 @@ async def get_all_product_stock(db_pool: asyncpg.Pool) -> List[ProductStockItem]
         try:
             records = await conn.fetch(query)
             
-            # --- DEBUGGING START ---
-            logger.info("DEBUG: Данные, полученные из БД для отчета об остатках:")
-            for r in records:
-                logger.info(f"  Product ID: {r['product_id']}, Name: {r['name']}, Current Stock: {r['current_stock']}")
-            # --- DEBUGGING END ---
+            logger.info("Отчет об остатках: получено %d товаров.", len(records))
+            if logger.isEnabledFor(logging.DEBUG):
+                for r in records:
+                    logger.debug("  Product ID: %s, Name: %s, Current Stock: %s", r['product_id'], r['name'], r['current_stock'])
 
             return [ProductStockItem(
                 r['product_id'],
@@ -94,7 +113,7 @@ async def get_all_product_stock(db_pool: asyncpg.Pool) -> List[ProductStockItem]
                 r['average_movement_cost'] # Средняя стоимость из движений
             ) for r in records]
         except Exception as e:
-            logger.error(f"Ошибка БД при получении остатков товаров: {e}", exc_info=True)
+            logger.error("Ошибка БД при получении остатков товаров: %s", e, exc_info=True)
             return []
 
 async def get_all_products(pool: asyncpg.Pool) -> List[Dict]:
@@ -165,60 +184,51 @@ async def delete_product(db_pool: asyncpg.Pool, product_id: int) -> bool:
             logger.error(f"Ошибка при удалении продукта ID {product_id}: {e}", exc_info=True)
             return False
 
-async def update_stock_on_order_confirmation(db_pool: asyncpg.Pool, order_id: int) -> bool:
+async def update_stock_on_order_confirmation(db_pool: asyncpg.Pool, order_id: int, conn: Optional[asyncpg.Connection] = None) -> bool:
     """
     Обновляет остаток товара на складе и записывает исходящее движение в inventory_movements
     при подтверждении заказа.
     Теперь принимает только order_id и получает детали из order_lines.
+    Все строки заказа списываются одним оператором (db_operations/stock_mutations.py).
+    Если передан conn, работа идет в транзакции вызывающего кода (видны его незакоммиченные строки).
     """
-    conn = None
+    own_conn = conn is None
     try:
-        conn = await db_pool.acquire()
+        if own_conn:
+            conn = await db_pool.acquire()
         async with conn.transaction():
+            # Для исходящих движений unit_cost берем из products.cost_per_unit
             order_lines = await conn.fetch("""
-                SELECT product_id, quantity, unit_price FROM order_lines WHERE order_id = $1;
+                SELECT ol.product_id, ol.quantity, p.cost_per_unit
+                FROM order_lines ol
+                LEFT JOIN products p ON p.product_id = ol.product_id
+                WHERE ol.order_id = $1;
             """, order_id)
 
             if not order_lines:
-                logger.warning(f"Для заказа #{order_id} не найдено позиций для списания со склада.")
+                logger.warning("Для заказа #%s не найдено позиций для списания со склада.", order_id)
                 return False
 
-            for item in order_lines:
-                product_id = item['product_id']
-                quantity_ordered = item['quantity']
-                # Для исходящих движений unit_cost берем из products.cost_per_unit
-                product_info = await conn.fetchrow("SELECT cost_per_unit FROM products WHERE product_id = $1", product_id)
-                if not product_info:
-                    logger.error(f"Продукт ID {product_id} не найден при попытке записать исходящее движение инвентаря для заказа #{order_id}.")
-                    raise ValueError(f"Product {product_id} not found.")
-                
-                unit_cost = product_info['cost_per_unit']
-
-                # Используем универсальную функцию record_stock_movement
-                success = await record_stock_movement(
-                    db_pool=db_pool,
-                    product_id=product_id,
-                    quantity=quantity_ordered, # Количество для списания
-                    movement_type='outgoing',
-                    source_document_type='order', # Тип документа-источника
-                    source_document_id=order_id, # ID документа-источника
-                    unit_cost=unit_cost, # Себестоимость для исходящего движения
-                    description=f"Продажа по заказу #{order_id}"
-                )
-                if not success:
-                    logger.error(f"Не удалось записать исходящее движение для продукта {product_id} по заказу #{order_id}.")
-                    raise Exception(f"Failed to record outgoing stock movement for product {product_id} on order {order_id}.")
-            
-            logger.info(f"Все исходящие движения для заказа #{order_id} успешно записаны.")
+            missing = [item['product_id'] for item in order_lines if item['cost_per_unit'] is None]
+            if missing:
+                logger.error("Продукты %s не найдены при попытке записать исходящее движение инвентаря для заказа #%s.", missing, order_id)
+                raise ValueError(f"Products {missing} not found.")
+
+            await apply_stock_changes(conn, [
+                StockChange(item['product_id'], -item['quantity'], 'outgoing', item['cost_per_unit'], f"Продажа по заказу #{order_id}")
+                for item in order_lines
+            ], source_document_type='order', source_document_id=order_id)
+
+            logger.info("Все исходящие движения для заказа #%s успешно записаны.", order_id)
             return True
     except asyncpg.exceptions.PostgresError as e:
-        logger.error(f"Ошибка БД при обновлении остатков для заказа {order_id}: {e}", exc_info=True)
+        logger.error("Ошибка БД при обновлении остатков для заказа %s: %s", order_id, e, exc_info=True)
         return False
     except Exception as e:
-        logger.error(f"Неизвестная ошибка при обновлении остатков для заказа {order_id}: {e}", exc_info=True)
+        logger.error("Неизвестная ошибка при обновлении остатков для заказа %s: %s", order_id, e, exc_info=True)
         return False
     finally:
-        if conn:
+        if own_conn and conn:
             await db_pool.release(conn)
 
 
@@ -237,74 +247,46 @@ async def get_product_current_stock(db_pool: asyncpg.Pool, product_id: int) -> D
             logger.error(f"Ошибка БД при получении текущего остатка для продукта ID {product_id}: {e}", exc_info=True)
             return Decimal('0.00') # Возвращаем 0 в случае ошибки
 
-async def record_stock_movement(db_pool: asyncpg.Pool, product_id: int, quantity: Decimal, movement_type: str, source_document_type: Optional[str] = None, source_document_id: Optional[int] = None, unit_cost: Optional[Decimal] = None, description: Optional[str] = None) -> bool:
+async def record_stock_movement(db_pool: asyncpg.Pool, product_id: int, quantity: Decimal, movement_type: str, source_document_type: Optional[str] = None, source_document_id: Optional[int] = None, unit_cost: Optional[Decimal] = None, description: Optional[str] = None, conn: Optional[asyncpg.Connection] = None) -> bool:
     """
     Записывает движение товара на складе (incoming/outgoing) и обновляет таблицу stock.
     Гарантирует, что остаток не уходит в минус при исходящих движениях.
+    Остаток и движение меняются одним оператором (db_operations/stock_mutations.py), поэтому
+    строка stock заблокирована только на время этого оператора.
+    Если передан conn, движение пишется в транзакции вызывающего кода.
     """
-    conn = None
+    if movement_type in INCOMING_TYPES: # Это все типы "прихода"
+        quantity_change = quantity
+    elif movement_type in OUTGOING_TYPES: # Это все типы "расхода"
+        # quantity_change в БД должна быть отрицательной для списаний, положительной для приходов
+        quantity_change = -quantity
+    else:
+        logger.error("Неизвестный или неподдерживаемый тип движения: %s", movement_type)
+        return False
+
+    # unit_cost для 'incoming', 'return_in', 'adjustment_in' должен быть предоставлен
+    if movement_type in INCOMING_TYPES and unit_cost is None:
+        logger.error("Для входящего движения (%s) unit_cost должен быть предоставлен.", movement_type)
+        return False
+
+    own_conn = conn is None
     try:
-        conn = await db_pool.acquire()
-        async with conn.transaction():
-            # Обновление таблицы 'stock'
-            existing_stock = await conn.fetchrow("SELECT quantity FROM stock WHERE product_id = $1 FOR UPDATE", product_id)
-            
-            current_stock_quantity = existing_stock['quantity'] if existing_stock else Decimal('0.00')
-
-            new_quantity: Decimal
-
-            # --- ИСПРАВЛЕНИЕ ЗДЕСЬ: РАСШИРЯЕМ ПОНИМАНИЕ ТИПОВ ДВИЖЕНИЙ ---
-            if movement_type in ['incoming', 'return_in', 'adjustment_in']: # Это все типы "прихода"
-                new_quantity = current_stock_quantity + quantity
-            elif movement_type in ['outgoing', 'adjustment_out']: # Это все типы "расхода"
-                if current_stock_quantity < quantity:
-                    logger.warning(f"Попытка списать {quantity} ед. продукта {product_id}, но в наличии только {current_stock_quantity}. Списание до 0.")
-                    new_quantity = Decimal('0.00')
-                else:
-                    new_quantity = current_stock_quantity - quantity
-            else:
-                logger.error(f"Неизвестный или неподдерживаемый тип движения: {movement_type}")
-                return False
-            # --- КОНЕЦ ИСПРАВЛЕНИЯ ---
-
-            if existing_stock: # Если запись в stock уже есть
-                await conn.execute("UPDATE stock SET quantity = $1 WHERE product_id = $2", new_quantity, product_id)
-                logger.info(f"Обновлен остаток для продукта ID {product_id} на {new_quantity}.")
-            else: # Если записи в stock нет, создаем новую
-                await conn.execute("INSERT INTO stock (product_id, quantity) VALUES ($1, $2)", product_id, new_quantity)
-                logger.info(f"Создан новый остаток для продукта ID {product_id} с количеством {new_quantity}.")
-
-            # Запись движения в 'inventory_movements'
-            # unit_cost для 'incoming', 'return_in', 'adjustment_in' должен быть предоставлен
-            if movement_type in ['incoming', 'return_in', 'adjustment_in'] and unit_cost is None:
-                logger.error(f"Для входящего движения ({movement_type}) unit_cost должен быть предоставлен.")
-                raise ValueError(f"unit_cost is required for '{movement_type}' movement type.")
-            
-            # Для movement_type adjustment_out, quantity_change уже может быть отрицательным
-            # Поэтому передаем его как есть, а не меняем знак.
-            # quantity_change в БД должна быть отрицательной для списаний, положительной для приходов.
-            # В adjustment_handler.py мы уже передаем правильный знак через movement_quantity_change
-            # Так что здесь просто используем 'quantity' из аргументов функции,
-            # но для clarity, можно переименовать в 'quantity_change_for_db'
-            quantity_change_for_db = quantity
-            if movement_type in ['outgoing', 'adjustment_out']:
-                quantity_change_for_db = -quantity_change_for_db # Убедимся, что знак отрицательный для исходящих
-
-            await conn.execute("""
-                INSERT INTO inventory_movements (product_id, quantity_change, movement_type, movement_date, unit_cost, source_document_type, source_document_id, description)
-                VALUES ($1, $2, $3, $4, $5, $6, $7, $8);
-            """, product_id, quantity_change_for_db, movement_type, datetime.now(), unit_cost, source_document_type, source_document_id, description)
-            
-            logger.info(f"Записано {movement_type} движение для продукта ID {product_id}: {quantity}. Новый остаток: {new_quantity}.")
-            return True
+        if own_conn:
+            conn = await db_pool.acquire()
+        results = await apply_stock_changes(
+            conn, [StockChange(product_id, quantity_change, movement_type, unit_cost, description)],
+            source_document_type, source_document_id
+        )
+        logger.info("Записано %s движение для продукта ID %s: %s. Новый остаток: %s.", movement_type, product_id, quantity, results[product_id].new_quantity)
+        return True
     except asyncpg.exceptions.PostgresError as e:
-        logger.error(f"Ошибка БД при записи движения инвентаря для продукта {product_id}, тип {movement_type}: {e}", exc_info=True)
+        logger.error("Ошибка БД при записи движения инвентаря для продукта %s, тип %s: %s", product_id, movement_type, e, exc_info=True)
         return False
     except Exception as e:
-        logger.error(f"Неизвестная ошибка при записи движения инвентаря для продукта {product_id}, тип {movement_type}: {e}", exc_info=True)
+        logger.error("Неизвестная ошибка при записи движения инвентаря для продукта %s, тип %s: %s", product_id, movement_type, e, exc_info=True)
         return False
     finally:
-        if conn:
+        if own_conn and conn:
             await db_pool.release(conn)
 
 async def get_products_sold_to_client(pool: asyncpg.Pool, client_id: int) -> List[Dict]:
@@ -337,3 +319,79 @@ async def get_products_sold_to_client(pool: asyncpg.Pool, client_id: int) -> Lis
         if conn:
             await pool.release(conn)
 
+
+# Сколько часто покупаемых товаров предлагать для повтора заказа
+REORDER_TOP_PRODUCTS = 15
+
+
+class ReorderItem(NamedTuple):
+    product_id: int
+    product_name: str
+    price: Decimal          # текущая цена из products
+    quantity: int           # количество из последнего заказа или обычное количество клиента
+
+
+class ReorderSuggestions(NamedTuple):
+    last_order_id: Optional[int]
+    last_order_date: Optional[date]
+    last_order: List[ReorderItem]
+    frequent: List[ReorderItem]
+
+
+async def get_reorder_suggestions(pool: asyncpg.Pool, client_id: int, limit: int = REORDER_TOP_PRODUCTS) -> Optional[ReorderSuggestions]:
+    """
+    Последний подтвержденный заказ клиента и его часто покупаемые товары — одним запросом.
+    Часто покупаемые берутся из матрицы client_product_stats (ведется в sales_rollups при подтверждении),
+    их количество — среднее по заказам клиента. Цены — текущие из products.
+    """
+    conn = None
+    try:
+        conn = await pool.acquire()
+        rows = await conn.fetch("""
+            WITH last_order AS (
+                SELECT order_id, delivery_date
+                FROM orders
+                WHERE client_id = $1 AND status = ANY($2::text[])
+                ORDER BY delivery_date DESC, order_id DESC
+                LIMIT 1
+            ),
+            last_lines AS (
+                SELECT 'last' AS source, 0::bigint AS rank, ol.product_id, SUM(ol.quantity)::int AS quantity,
+                       lo.order_id, lo.delivery_date
+                FROM last_order lo
+                JOIN order_lines ol ON ol.order_id = lo.order_id
+                GROUP BY ol.product_id, lo.order_id, lo.delivery_date
+            ),
+            frequent AS (
+                SELECT 'frequent' AS source,
+                       row_number() OVER (ORDER BY s.orders_count DESC, s.last_order_date DESC, s.product_id) AS rank,
+                       s.product_id, GREATEST(ROUND(s.quantity / s.orders_count), 1)::int AS quantity,
+                       NULL::int AS order_id, NULL::date AS delivery_date
+                FROM client_product_stats s
+                WHERE s.client_id = $1 AND s.orders_count > 0
+                ORDER BY s.orders_count DESC, s.last_order_date DESC, s.product_id
+                LIMIT $3
+            )
+            SELECT x.source, x.product_id, x.quantity, x.order_id, x.delivery_date, p.name, p.price
+            FROM (SELECT * FROM last_lines UNION ALL SELECT * FROM frequent) x
+            JOIN products p ON p.product_id = x.product_id
+            ORDER BY x.source DESC, x.rank, p.name;
+        """, client_id, list(SALES_STATUSES), limit)
+    except asyncpg.exceptions.PostgresError as e:
+        logger.error(f"Ошибка БД при подборе товаров для повтора заказа клиента {client_id}: {e}", exc_info=True)
+        return None
+    finally:
+        if conn:
+            await pool.release(conn)
+
+    last_order, frequent = [], []
+    last_order_id = last_order_date = None
+    for row in rows:
+        item = ReorderItem(row['product_id'], row['name'], row['price'], row['quantity'])
+        if row['source'] == 'last':
+            last_order.append(item)
+            last_order_id, last_order_date = row['order_id'], row['delivery_date']
+        else:
+            frequent.append(item)
+    return ReorderSuggestions(last_order_id, last_order_date, last_order, frequent)
+
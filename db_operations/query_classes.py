@@ -0,0 +1,144 @@
+# db_operations/query_classes.py
+"""
+Классы запросов и их таймауты (QUERY_TIMEOUTS в config.py).
+
+- interactive — обычные запросы хендлеров. Это класс по умолчанию: statement_timeout задается
+  пулу при создании (init_db_pool), и asyncpg возвращает его RESET ALL при каждом release.
+- report — отчеты (@with_query_class(REPORT)).
+- bulk — выгрузки, пересчет агрегатов, фоновые задачи по целым таблицам (снимки остатков
+  и поиска, прогрев справочников, отметка просрочки, секции движений) и отчеты,
+  которые досчитываются в фоне (utils/slow_reports.py).
+
+Функция, помеченная @with_query_class, получает вместо пула обертку: каждое взятое соединение
+сначала получает SET statement_timeout своего класса. Весь вызов выполняется под asyncio.timeout
+с клиентским таймаутом класса. По таймауту задача отменяется: asyncpg отменяет запрос на сервере,
+блоки finally функций возвращают соединения в пул (RESET ALL вернет statement_timeout по умолчанию),
+вызывающий получает QueryTimeout. Серверный таймаут больше клиентского на QUERY_TIMEOUT_MARGIN
+и срабатывает, только если клиент не смог снять запрос.
+
+Класс можно переопределить для всего кода внутри блока: with query_class_override(BULK): ...
+"""
+
+import asyncio
+import functools
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+from config import QUERY_TIMEOUTS, QUERY_TIMEOUT_MARGIN
+from utils.metrics import DB_QUERY_TIMEOUTS_TOTAL
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE = "interactive"
+REPORT = "report"
+BULK = "bulk"
+
+_override: ContextVar[Optional[str]] = ContextVar("query_class_override", default=None)
+
+
+class QueryTimeout(asyncio.TimeoutError):
+    """Вызов не уложился в клиентский таймаут своего класса запросов."""
+
+    def __init__(self, query_class: str, seconds: float):
+        super().__init__(f"запрос класса {query_class} не уложился в {seconds} с")
+        self.query_class = query_class
+        self.seconds = seconds
+
+
+def client_timeout(query_class: str) -> float:
+    return QUERY_TIMEOUTS[query_class]
+
+
+def statement_timeout_ms(query_class: str) -> int:
+    return int((QUERY_TIMEOUTS[query_class] + QUERY_TIMEOUT_MARGIN) * 1000)
+
+
+def server_settings(query_class: str = INTERACTIVE) -> dict[str, str]:
+    """Настройки соединений пула: statement_timeout класса по умолчанию."""
+    return {"statement_timeout": str(statement_timeout_ms(query_class))}
+
+
+@contextmanager
+def query_class_override(query_class: str):
+    """Все вызовы @with_query_class внутри блока выполняются с классом query_class."""
+    token = _override.set(query_class)
+    try:
+        yield
+    finally:
+        _override.reset(token)
+
+
+class _TimedAcquire:
+    """Результат TimedPool.acquire(): работает и как await pool.acquire(), и как async with."""
+
+    def __init__(self, pool: "TimedPool", timeout: Optional[float]):
+        self._pool = pool
+        self._timeout = timeout
+        self._conn = None
+
+    def __await__(self):
+        return self._acquire().__await__()
+
+    async def _acquire(self):
+        pool = self._pool.pool
+        conn = await pool.acquire(timeout=self._timeout)
+        try:
+            await conn.execute(f"SET statement_timeout = {self._pool.statement_timeout_ms}")
+        except BaseException:
+            await pool.release(conn)
+            raise
+        return conn
+
+    async def __aenter__(self):
+        self._conn = await self._acquire()
+        return self._conn
+
+    async def __aexit__(self, *exc_info):
+        conn, self._conn = self._conn, None
+        await self._pool.pool.release(conn)
+
+
+class TimedPool:
+    """Обертка пула: соединения выдаются с statement_timeout класса, остальное — как у пула."""
+
+    def __init__(self, pool, query_class: str):
+        self.pool = pool
+        self.query_class = query_class
+        self.statement_timeout_ms = statement_timeout_ms(query_class)
+
+    def acquire(self, *, timeout: Optional[float] = None) -> _TimedAcquire:
+        return _TimedAcquire(self, timeout)
+
+    def __getattr__(self, name):
+        # release, get_size и прочее — напрямую у пула
+        return getattr(self.pool, name)
+
+
+def with_query_class(query_class: str):
+    """
+    Помечает функцию БД классом запросов: первый аргумент (пул) оборачивается в TimedPool,
+    вызов ограничивается клиентским таймаутом класса. По таймауту — QueryTimeout.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(pool, *args, **kwargs):
+            effective = _override.get() or query_class
+            seconds = client_timeout(effective)
+            if isinstance(pool, TimedPool):
+                # Вложенный вызов: оборачиваем исходный пул, а не обертку уровнем выше
+                pool = pool.pool
+            deadline = asyncio.timeout(seconds)
+            try:
+                async with deadline:
+                    return await func(TimedPool(pool, effective), *args, **kwargs)
+            except TimeoutError:
+                if not deadline.expired():
+                    # Например, таймаут ожидания соединения внутри функции
+                    raise
+                DB_QUERY_TIMEOUTS_TOTAL.inc(effective)
+                logger.warning("%s: запрос класса %s снят по таймауту %s с.", func.__name__, effective, seconds)
+                raise QueryTimeout(effective, seconds) from None
+        return wrapper
+    return decorator
@@ -0,0 +1,252 @@
+# db_operations/reference_cache.py
+"""
+Кэш справочников: поставщики и адреса клиентов.
+
+Эти таблицы меняются редко (правками в БД), а читаются на каждом шаге оформления заказа,
+поступления и возврата. Кэш отдает их из памяти:
+- поставщики хранятся целиком (таблица небольшая) — поиск по имени
+  и постраничный выбор поставщика работают без запросов к БД;
+- адреса хранятся по клиентам в LRU на ADDRESS_CACHE_CLIENTS клиентов.
+
+Инвалидация по версиям: триггеры на suppliers/addresses увеличивают
+счетчик в reference_versions (sql/edit_tables&collumns.sql). Кэш сверяет версии
+не чаще раза в VERSION_CHECK_SECONDS одним запросом и сбрасывает только изменившийся справочник.
+Если таблицы версий нет, справочники перечитываются раз в FALLBACK_TTL_SECONDS.
+
+warm_up() (запускается в tg_bot.main) загружает справочники и адреса недавно
+заказывавших клиентов двумя запросами.
+"""
+
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+
+import asyncpg
+
+from db_operations.query_classes import BULK, with_query_class
+from db_operations.supplier_operations import Supplier
+
+logger = logging.getLogger(__name__)
+
+# Сколько клиентов держать в кэше адресов
+ADDRESS_CACHE_CLIENTS = 2000
+
+# Сколько недавно заказывавших клиентов загружать при старте
+ADDRESS_WARMUP_CLIENTS = 500
+
+VERSION_CHECK_SECONDS = 10
+FALLBACK_TTL_SECONDS = 300
+
+SUPPLIERS = "suppliers"
+ADDRESSES = "addresses"
+
+
+class Address(NamedTuple):
+    address_id: int
+    client_id: int
+    address_text: str
+
+
+class _WarmUpRows(NamedTuple):
+    versions: Optional[dict[str, int]]   # None — таблицы reference_versions нет
+    suppliers: list
+    addresses: list
+
+
+@with_query_class(BULK)
+async def _load_warm_up(pool, clients: int) -> _WarmUpRows:
+    """Запросы прогрева. Группировка всех заказов по клиентам — фоновая работа, под таймаутом bulk."""
+    async with pool.acquire() as conn:
+        try:
+            rows = await conn.fetch("SELECT name, version FROM reference_versions;")
+            versions = {row['name']: row['version'] for row in rows}
+        except asyncpg.exceptions.UndefinedTableError:
+            versions = None
+        return _WarmUpRows(
+            versions,
+            await conn.fetch("SELECT supplier_id, name FROM suppliers ORDER BY name;"),
+            await conn.fetch("""
+                SELECT a.address_id, a.client_id, a.address_text
+                FROM addresses a
+                JOIN (
+                    SELECT client_id FROM orders
+                    GROUP BY client_id
+                    ORDER BY max(order_date) DESC
+                    LIMIT $1
+                ) recent ON recent.client_id = a.client_id
+                ORDER BY a.client_id, a.address_id;
+            """, clients)
+        )
+
+
+class ReferenceCache:
+    def __init__(self, max_clients: int = ADDRESS_CACHE_CLIENTS):
+        self.max_clients = max_clients
+
+        self._suppliers: Optional[list[Supplier]] = None
+        self._suppliers_by_id: dict[int, Supplier] = {}
+        self._addresses: "OrderedDict[int, tuple[Address, ...]]" = OrderedDict()
+        self._address_by_id: dict[int, Address] = {}
+
+        self._versions: dict[str, int] = {}
+        self._versions_available = True
+        self._checked_at = 0.0
+        self._loaded_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+        # Счетчики для логов
+        self.hits = 0
+        self.misses = 0
+
+    # --- Инвалидация ---
+
+    def invalidate(self, name: str) -> None:
+        if name == SUPPLIERS:
+            self._suppliers = None
+            self._suppliers_by_id = {}
+        elif name == ADDRESSES:
+            self._addresses.clear()
+            self._address_by_id.clear()
+
+    async def _check_versions(self, pool) -> None:
+        now = time.monotonic()
+        if now - self._checked_at < VERSION_CHECK_SECONDS:
+            return
+        self._checked_at = now
+
+        if not self._versions_available:
+            if now - self._loaded_at > FALLBACK_TTL_SECONDS:
+                for name in (SUPPLIERS, ADDRESSES):
+                    self.invalidate(name)
+                self._loaded_at = now
+            return
+
+        try:
+            async with pool.acquire() as conn:
+                rows = await conn.fetch("SELECT name, version FROM reference_versions;")
+        except asyncpg.exceptions.UndefinedTableError:
+            logger.warning("Таблица reference_versions не найдена: справочники будут перечитываться раз в %d с.", FALLBACK_TTL_SECONDS)
+            self._versions_available = False
+            return
+        except Exception as e:
+            logger.warning("Не удалось проверить версии справочников: %s", e)
+            return
+
+        versions = {row['name']: row['version'] for row in rows}
+        for name, version in versions.items():
+            previous = self._versions.get(name)
+            if previous is not None and previous != version:
+                logger.info("Справочник %s изменился (версия %s -> %s), кэш сброшен.", name, previous, version)
+                self.invalidate(name)
+        self._versions = versions
+
+    # --- Поставщики ---
+
+    async def get_suppliers(self, pool) -> list[Supplier]:
+        """Все поставщики, отсортированные по имени."""
+        await self._check_versions(pool)
+        if self._suppliers is None:
+            async with self._lock:
+                if self._suppliers is None:
+                    async with pool.acquire() as conn:
+                        self._set_suppliers(await conn.fetch("SELECT supplier_id, name FROM suppliers ORDER BY name;"))
+                    self.misses += 1
+                    return self._suppliers
+        self.hits += 1
+        return self._suppliers
+
+    def _set_suppliers(self, rows) -> None:
+        self._suppliers = [Supplier(row['supplier_id'], row['name']) for row in rows]
+        self._suppliers_by_id = {supplier.supplier_id: supplier for supplier in self._suppliers}
+
+    async def get_supplier(self, pool, supplier_id: int) -> Optional[Supplier]:
+        await self.get_suppliers(pool)
+        return self._suppliers_by_id.get(supplier_id)
+
+    async def find_suppliers(self, pool, name_query: str) -> list[Supplier]:
+        """Поставщики, в имени которых есть name_query (без учета регистра), по алфавиту."""
+        needle = name_query.casefold()
+        return [supplier for supplier in await self.get_suppliers(pool) if needle in supplier.name.casefold()]
+
+    # --- Адреса ---
+
+    async def get_client_addresses(self, pool, client_id: int) -> tuple[Address, ...]:
+        await self._check_versions(pool)
+        addresses = self._addresses.get(client_id)
+        if addresses is not None:
+            self._addresses.move_to_end(client_id)
+            self.hits += 1
+            return addresses
+
+        self.misses += 1
+        async with pool.acquire() as conn:
+            rows = await conn.fetch(
+                "SELECT address_id, client_id, address_text FROM addresses WHERE client_id = $1 ORDER BY address_id;",
+                client_id
+            )
+        addresses = tuple(Address(row['address_id'], row['client_id'], row['address_text']) for row in rows)
+        self._put_addresses(client_id, addresses)
+        return addresses
+
+    async def get_address(self, pool, address_id: int) -> Optional[Address]:
+        await self._check_versions(pool)
+        address = self._address_by_id.get(address_id)
+        if address is not None:
+            self.hits += 1
+            return address
+
+        async with pool.acquire() as conn:
+            client_id = await conn.fetchval("SELECT client_id FROM addresses WHERE address_id = $1;", address_id)
+        if client_id is None:
+            return None
+        # Загружаем все адреса клиента: следующий шаг оформления, скорее всего, понадобится им же
+        addresses = await self.get_client_addresses(pool, client_id)
+        return next((address for address in addresses if address.address_id == address_id), None)
+
+    def _put_addresses(self, client_id: int, addresses: tuple) -> None:
+        self._drop_client(client_id)
+        self._addresses[client_id] = addresses
+        for address in addresses:
+            self._address_by_id[address.address_id] = address
+        while len(self._addresses) > self.max_clients:
+            self._drop_client(next(iter(self._addresses)))
+
+    def _drop_client(self, client_id: int) -> None:
+        for address in self._addresses.pop(client_id, ()):
+            self._address_by_id.pop(address.address_id, None)
+
+    # --- Прогрев ---
+
+    async def warm_up(self, pool, clients: int = ADDRESS_WARMUP_CLIENTS) -> None:
+        """Загружает справочники и адреса недавно заказывавших клиентов."""
+        started = time.perf_counter()
+        try:
+            warm = await _load_warm_up(pool, min(clients, self.max_clients))
+        except Exception as e:
+            logger.error("Ошибка при прогреве кэша справочников: %s", e, exc_info=True)
+            return
+
+        if warm.versions is None:
+            self._versions_available = False
+        else:
+            self._versions = warm.versions
+        self._checked_at = self._loaded_at = time.monotonic()
+        self._set_suppliers(warm.suppliers)
+        rows = warm.addresses
+
+        by_client: dict[int, list[Address]] = {}
+        for row in rows:
+            by_client.setdefault(row['client_id'], []).append(Address(row['address_id'], row['client_id'], row['address_text']))
+        for client_id, addresses in by_client.items():
+            self._put_addresses(client_id, tuple(addresses))
+
+        logger.info(
+            "Кэш справочников загружен за %.0f мс: поставщиков %d, клиентов с адресами %d.",
+            (time.perf_counter() - started) * 1000, len(self._suppliers), len(by_client)
+        )
+
+
+# Глобальный экземпляр
+reference_cache = ReferenceCache()
@@ -0,0 +1,132 @@
+# db_operations/replica.py
+"""
+Маршрутизация чтений отчетов на реплику (потоковая репликация PostgreSQL).
+
+У реплики свой пул (init_replica_pool, размер — REPLICA_POOL_MIN_SIZE/MAX_SIZE), поэтому тяжелые
+отчеты не занимают соединения основного пула, через который идут заказы.
+Маршрут задается на уровне функции: функции отчетов помечены @reads_from_replica и получают
+пул реплики вместо переданного основного. Все остальные функции (записи, чтения перед
+подтверждением заказа или оплаты) работают с основным пулом, как и раньше.
+
+После записи этим процессом (note_write: оплаты, подтверждение и отмена заказов, поступления)
+отчеты какое-то время читаются с основной БД, чтобы список, который показывается сразу после
+изменения, уже его содержал.
+
+Отставание реплики проверяется раз в REPLICA_CHECK_SECONDS. Если оно больше REPLICA_MAX_LAG_SECONDS,
+реплика не получает WAL (нет потока от основной) или недоступна, отчеты читаются с основной БД.
+
+Проверка на двух локальных экземплярах: benchmarks/replica_routing.py.
+"""
+
+import asyncio
+import functools
+import logging
+import time
+from typing import Optional
+
+import asyncpg
+
+from config import REPLICA_CHECK_SECONDS, REPLICA_MAX_LAG_SECONDS
+from utils.metrics import DB_READS_ROUTED_TOTAL
+
+logger = logging.getLogger(__name__)
+
+# Отставание в секундах. Если реплика проиграла все полученные записи, отставания нет,
+# даже если последняя транзакция была давно (на основной просто нет изменений).
+LAG_QUERY = """
+    SELECT pg_is_in_recovery() AS in_recovery,
+           EXISTS (SELECT 1 FROM pg_stat_wal_receiver WHERE status = 'streaming') AS streaming,
+           CASE
+               WHEN NOT pg_is_in_recovery() THEN 0
+               WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+               ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+           END::float8 AS lag_seconds
+"""
+
+
+class ReplicaRouter:
+    def __init__(self, max_lag_seconds: float = REPLICA_MAX_LAG_SECONDS, check_seconds: float = REPLICA_CHECK_SECONDS):
+        self.max_lag_seconds = max_lag_seconds
+        self.check_seconds = check_seconds
+        self.pool = None
+        self.lag_seconds: Optional[float] = None
+        self.healthy = False
+        self._last_write = float("-inf")
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self, pool) -> None:
+        """Подключает пул реплики и запускает проверку отставания."""
+        self.pool = pool
+        await self.check()
+        self._task = asyncio.create_task(self._check_loop())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        pool, self.pool, self.healthy = self.pool, None, False
+        if pool is not None:
+            await pool.close()
+            logger.info("Пул соединений реплики закрыт.")
+
+    async def _check_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.check_seconds)
+            await self.check()
+
+    async def check(self) -> bool:
+        """Обновляет отставание реплики. Возвращает True, если отчеты можно читать с нее."""
+        if self.pool is None:
+            return False
+        was_healthy = self.healthy
+        try:
+            async with self.pool.acquire(timeout=self.check_seconds) as conn:
+                row = await conn.fetchrow(LAG_QUERY)
+        except (asyncpg.exceptions.PostgresError, OSError, asyncio.TimeoutError) as e:
+            self.healthy, self.lag_seconds = False, None
+            if was_healthy:
+                logger.warning("Реплика недоступна, отчеты читаются с основной БД: %s", e)
+            return False
+
+        self.lag_seconds = row['lag_seconds']
+        lagging = row['in_recovery'] and not row['streaming']
+        self.healthy = not lagging and self.lag_seconds <= self.max_lag_seconds
+        if was_healthy and not self.healthy:
+            logger.warning(
+                "Реплика отстает (%.1f с, поток WAL: %s), отчеты читаются с основной БД.",
+                self.lag_seconds, "есть" if row['streaming'] else "нет"
+            )
+        elif self.healthy and not was_healthy:
+            logger.info("Реплика доступна (отставание %.1f с), отчеты читаются с нее.", self.lag_seconds)
+        return self.healthy
+
+    def note_write(self) -> None:
+        """Отмечает запись в основную БД: ближайшие отчеты должны ее увидеть."""
+        self._last_write = time.monotonic()
+
+    def _write_visible(self) -> bool:
+        # Пока с записи не прошло измеренное отставание плюс интервал проверки, реплика может ее не содержать
+        return time.monotonic() - self._last_write > (self.lag_seconds or 0) + self.check_seconds
+
+    def for_reads(self, primary_pool):
+        """Пул для чтения отчета: реплика, если она в порядке и уже содержит свежие записи, иначе основной."""
+        if self.pool is not None and self.healthy and self._write_visible():
+            DB_READS_ROUTED_TOTAL.inc("replica")
+            return self.pool
+        DB_READS_ROUTED_TOTAL.inc("primary")
+        return primary_pool
+
+
+# Глобальный экземпляр
+replica = ReplicaRouter()
+
+
+def reads_from_replica(func):
+    """
+    Помечает функцию отчета: первый аргумент (основной пул) заменяется пулом реплики,
+    если реплика подключена и не отстает.
+    """
+    @functools.wraps(func)
+    async def wrapper(pool, *args, **kwargs):
+        return await func(replica.for_reads(pool), *args, **kwargs)
+    return wrapper
@@ -6,7 +6,14 @@ from collections import namedtuple
 import logging
 from typing import Optional, List, Dict
 from decimal import Decimal
-from db_operations.product_operations import update_stock_on_order_confirmation, get_product_current_stock
+from db_operations.product_operations import update_stock_on_order_confirmation
+from db_operations.order_details import invalidate_order_details
+from db_operations.stock_reservations import lock_stock_rows, get_reserved_by_others, release_order_reservations
+from db_operations.stock_availability import stock_availability
+from db_operations.sales_rollups import apply_orders_to_rollups, lock_sales_orders
+from db_operations.outbox import ORDER_CANCELLED, ORDER_CONFIRMED, add_event, add_events
+from db_operations.replica import replica
+from utils.metrics import ORDERS_CONFIRMED_TOTAL, ORDERS_CANCELLED_TOTAL
 
 logger = logging.getLogger(__name__)
 
@@ -22,16 +29,6 @@ UnconfirmedOrder = namedtuple(
     ]
 )
 
-OrderDetail = namedtuple(
-    "OrderDetail",
-    [
-        "product_name",
-        "quantity",
-        "unit_price",
-        "total_item_amount"
-    ]
-)
-
 # НОВЫЙ namedtuple для отображения неоплаченных накладных (если вы его переместили сюда)
 UnpaidInvoice = namedtuple(
     "UnpaidInvoice",
@@ -49,128 +46,8 @@ UnpaidInvoice = namedtuple(
 )
 
 
-async def get_unconfirmed_orders(pool):
-    # ... (ваш существующий код) ...
-    conn = None
-    try:
-        conn = await pool.acquire()
-
-        query = """
-        SELECT
-            o.order_id,
-            o.order_date,
-            o.delivery_date,
-            c.name,
-            a.address_text,
-            o.total_amount
-        FROM
-            orders o
-        JOIN
-            clients c ON o.client_id = c.client_id
-        JOIN
-            addresses a ON o.address_id = a.address_id
-        WHERE
-            o.status = 'draft'
-        ORDER BY
-            o.order_date DESC, o.order_id DESC;
-        """
-        
-        rows = await conn.fetch(query)
-        
-        unconfirmed_orders = [
-            UnconfirmedOrder(
-                row['order_id'],
-                row['order_date'],
-                row['delivery_date'],
-                row['name'],
-                row['address_text'],
-                row['total_amount']
-            ) for row in rows
-        ]
-        
-        logger.info(f"Получено {len(unconfirmed_orders)} неподтвержденных заказов.")
-        return unconfirmed_orders
-
-    except asyncpg.exceptions.PostgresError as e:
-        logger.error(f"Ошибка asyncpg при получении неподтвержденных заказов: {e}", exc_info=True)
-        return []
-    except Exception as e:
-        logger.error(f"Неизвестная ошибка при получении неподтвержденных заказов: {e}", exc_info=True)
-        return []
-    finally:
-        if conn:
-            await pool.release(conn)
-
-
-async def get_unconfirmed_order_full_details(pool, order_id: int) -> Optional[Dict]:
-    # ... (ваш существующий код) ...
-    conn = None
-    try:
-        conn = await pool.acquire()
-        order_row = await conn.fetchrow("""
-            SELECT
-                o.order_id,
-                o.order_date,
-                o.delivery_date,
-                c.name,
-                a.address_text,
-                o.total_amount,
-                o.status
-            FROM
-                orders o
-            JOIN
-                clients c ON o.client_id = c.client_id
-            JOIN
-                addresses a ON o.address_id = a.address_id
-            WHERE
-                o.order_id = $1 AND o.status = 'draft';
-        """, order_id)
-
-        if not order_row:
-            return None
-
-        order_details = {
-            "order_id": order_row['order_id'],
-            "order_date": order_row['order_date'],
-            "delivery_date": order_row['delivery_date'],
-            "client_name": order_row['name'],
-            "address_text": order_row['address_text'],
-            "total_amount": order_row['total_amount'],
-            "status": order_row['status'],
-            "items": []
-        }
+# Список черновиков с фильтрами и постраничной выборкой: db_operations/draft_orders.py
 
-        item_rows = await conn.fetch("""
-            SELECT
-                ol.quantity,
-                ol.unit_price,
-                p.name
-            FROM
-                order_lines ol
-            JOIN
-                products p ON ol.product_id = p.product_id
-            WHERE
-                ol.order_id = $1;
-        """, order_id)
-
-        for item_row in item_rows:
-            order_details["items"].append(OrderDetail(
-                product_name=item_row['name'],
-                quantity=item_row['quantity'],
-                unit_price=item_row['unit_price'],
-                total_item_amount=item_row['quantity'] * item_row['unit_price']
-            ))
-        
-        return order_details
-    except asyncpg.exceptions.PostgresError as e:
-        logger.error(f"Ошибка asyncpg при получении полной информации о неподтвержденном заказе {order_id}: {e}", exc_info=True)
-        return None
-    except Exception as e:
-        logger.error(f"Неизвестная ошибка при получении полной информации о неподтвержденном заказе {order_id}: {e}", exc_info=True)
-        return None
-    finally:
-        if conn:
-            await pool.release(conn)
 
 async def confirm_order_in_db(pool, order_id: int) -> bool:
     """
@@ -178,8 +55,11 @@ async def confirm_order_in_db(pool, order_id: int) -> bool:
     генерируя номер накладной (дата из delivery_date), устанавливая confirmation_date = delivery_date и due_date.
     КЛЮЧЕВОЕ: Сначала проверяет и корректирует количества в order_lines по реальным остаткам,
     затем списывает скорректированные количества.
+    Доступный остаток = остаток на складе минус действующие резервы ДРУГИХ черновиков,
+    поэтому зарезервированные позиции подтверждаются без конфликтов. Собственный резерв снимается.
     """
     conn = None
+    released = False
     try:
         conn = await pool.acquire()
 
@@ -187,7 +67,7 @@ async def confirm_order_in_db(pool, order_id: int) -> bool:
             # Шаг 1: Получаем основную информацию о заказе и его текущие строки
             order_info = await conn.fetchrow("SELECT delivery_date, client_id, address_id, employee_id FROM orders WHERE order_id = $1 AND status = 'draft';", order_id)
             if not order_info:
-                logger.warning(f"Заказ #{order_id} не найден или уже не в статусе 'draft' для подтверждения.")
+                logger.warning("Заказ #%s не найден или уже не в статусе 'draft' для подтверждения.", order_id)
                 return False
 
             current_order_lines = await conn.fetch("""
@@ -195,9 +75,14 @@ async def confirm_order_in_db(pool, order_id: int) -> bool:
             """, order_id)
 
             if not current_order_lines:
-                logger.warning(f"Заказ #{order_id} не содержит товаров. Невозможно подтвердить.")
+                logger.warning("Заказ #%s не содержит товаров. Невозможно подтвердить.", order_id)
                 return False
 
+            # Блокируем строки stock на время подтверждения и учитываем резервы других черновиков
+            product_ids = [item['product_id'] for item in current_order_lines]
+            stock_on_hand = await lock_stock_rows(conn, product_ids)
+            reserved_by_others = await get_reserved_by_others(conn, order_id, product_ids)
+
             # Переменные для отслеживания изменений
             adjusted_items_info = [] # Для логирования корректировок
             new_order_lines_for_db = [] # Новые строки, которые будут записаны
@@ -209,13 +94,8 @@ async def confirm_order_in_db(pool, order_id: int) -> bool:
                 requested_quantity = item['quantity']
                 unit_price = item['unit_price']
                 
-                # Получаем текущий остаток товара
-                current_stock = await get_product_current_stock(pool, product_id) # Используем pool, а не conn
-
-                if current_stock is None: # Если товар не найден в stock (ошибка)
-                    logger.error(f"Продукт ID {product_id} не найден в таблице stock при проверке остатков для заказа #{order_id}. Откат.")
-                    # Лучше не подтверждать заказ, если данные о продукте некорректны
-                    raise Exception(f"Продукт ID {product_id} не найден в остатках.")
+                # Остаток, доступный этому заказу
+                current_stock = max(stock_on_hand[product_id] - reserved_by_others.get(product_id, Decimal('0')), Decimal('0'))
 
                 actual_quantity_to_ship = requested_quantity # Изначально, отгружаем столько, сколько заказано
 
@@ -225,7 +105,10 @@ async def confirm_order_in_db(pool, order_id: int) -> bool:
                     adjusted_items_info.append(
                         f"Товар ID {product_id}: заказано {requested_quantity}, отгружено {actual_quantity_to_ship} (доступно: {current_stock})."
                     )
-                    logger.warning(f"Заказ #{order_id} - Недостаточно товара (ID: {product_id}). Заказано: {requested_quantity}, Доступно: {current_stock}. Количество скорректировано до {actual_quantity_to_ship}.")
+                    logger.warning(
+                        "Заказ #%s - Недостаточно товара (ID: %s). Заказано: %s, Доступно: %s. Количество скорректировано до %s.",
+                        order_id, product_id, requested_quantity, current_stock, actual_quantity_to_ship
+                    )
                 
                 if actual_quantity_to_ship > 0:
                     # Добавляем позицию в список для новой записи, если количество больше 0
@@ -240,14 +123,17 @@ async def confirm_order_in_db(pool, order_id: int) -> bool:
                     adjusted_items_info.append(
                         f"Товар ID {product_id} (заказано {requested_quantity}) отсутствует на складе (0 ед.) и удален из накладной."
                     )
-                    logger.warning(f"Заказ #{order_id} - Товар (ID: {product_id}) будет удален из накладной, т.к. остаток 0.")
+                    logger.warning("Заказ #%s - Товар (ID: %s) будет удален из накладной, т.к. остаток 0.", order_id, product_id)
 
 
             # Если после всех корректировок в заказе не осталось товаров
             if not new_order_lines_for_db:
-                logger.warning(f"Заказ #{order_id} стал пустым после корректировки остатков. Отменяем заказ.")
+                logger.warning("Заказ #%s стал пустым после корректировки остатков. Отменяем заказ.", order_id)
                 # Опционально: можно сменить статус на 'cancelled' и вернуть False
                 await conn.execute("UPDATE orders SET status = 'cancelled' WHERE order_id = $1;", order_id)
+                await add_event(conn, ORDER_CANCELLED, order_id, {"reason": "out_of_stock"})
+                await release_order_reservations(conn, [order_id])
+                released = True
                 return False # Возвращаем False, так как заказ не подтвержден, а отменен
 
             # Шаг 3: Обновляем order_lines в БД с новыми количествами
@@ -275,28 +161,46 @@ async def confirm_order_in_db(pool, order_id: int) -> bool:
             """, invoice_number, confirmation_date_val, due_date_calculated, new_total_amount, order_id)
             
             if result != 'UPDATE 1':
-                logger.warning(f"Заказ #{order_id} не был подтвержден (статус не 'draft' или не найден) после корректировки остатков.")
+                logger.warning("Заказ #%s не был подтвержден (статус не 'draft' или не найден) после корректировки остатков.", order_id)
                 return False
 
             # Шаг 5: Списываем остатки и записываем движения в inventory_movements
             # update_stock_on_order_confirmation будет использовать уже скорректированные order_lines
-            stock_updated = await update_stock_on_order_confirmation(pool, order_id) # Используем pool, а не conn
+            # Списание идет в этой же транзакции, чтобы видеть скорректированные order_lines
+            stock_updated = await update_stock_on_order_confirmation(pool, order_id, conn=conn)
             if not stock_updated:
-                logger.error(f"Не удалось записать движения расхода для заказа #{order_id}. Откат транзакции.")
+                logger.error("Не удалось записать движения расхода для заказа #%s. Откат транзакции.", order_id)
                 raise Exception(f"Ошибка записи движений по складу для заказа #{order_id}.")
-            
-            logger.info(f"Заказ #{order_id} успешно подтвержден. Новая общая сумма: {new_total_amount:.2f}. Корректировки остатков: {adjusted_items_info if adjusted_items_info else 'нет'}.")
-            return True
+
+            # Шаг 6: Дневные агрегаты продаж — в той же транзакции, по уже скорректированным строкам
+            await apply_orders_to_rollups(conn, [order_id], 1)
+            await add_event(conn, ORDER_CONFIRMED, order_id, {"total": new_total_amount, "invoice_number": invoice_number})
+
+            await release_order_reservations(conn, [order_id])
+            released = True
+
+            logger.info(
+                "Заказ #%s успешно подтвержден. Новая общая сумма: %.2f. Корректировки остатков: %s.",
+                order_id, new_total_amount, "; ".join(adjusted_items_info) if adjusted_items_info else "нет"
+            )
+        ORDERS_CONFIRMED_TOTAL.inc()
+        replica.note_write()
+        return True
 
     except asyncpg.exceptions.PostgresError as e:
-        logger.error(f"Ошибка БД при подтверждении заказа #{order_id} с корректировкой остатков: {e}", exc_info=True)
+        released = False # Транзакция откатилась — резерв остался в БД
+        logger.error("Ошибка БД при подтверждении заказа #%s с корректировкой остатков: %s", order_id, e, exc_info=True)
         return False
     except Exception as e:
-        logger.error(f"Неизвестная ошибка при подтверждении заказа #{order_id} с корректировкой остатков: {e}", exc_info=True)
+        released = False
+        logger.error("Неизвестная ошибка при подтверждении заказа #%s с корректировкой остатков: %s", order_id, e, exc_info=True)
         return False
     finally:
         if conn:
             await pool.release(conn)
+        if released:
+            # Транзакция закоммичена — снимаем резерв и из снимка доступности
+            stock_availability.release_orders([order_id])
 
 async def cancel_order_in_db(pool, order_id: int):
     # ... (ваш существующий код) ...
@@ -304,13 +208,23 @@ async def cancel_order_in_db(pool, order_id: int):
     try:
         conn = await pool.acquire()
         
-        result = await conn.execute("""
-            UPDATE orders
-            SET status = 'cancelled'
-            WHERE order_id = $1;
-        """, order_id)
+        async with conn.transaction():
+            # Подтвержденный заказ уже учтен в агрегатах продаж — вычитаем его до смены статуса
+            await apply_orders_to_rollups(conn, await lock_sales_orders(conn, [order_id]), -1)
+            result = await conn.execute("""
+                UPDATE orders
+                SET status = 'cancelled'
+                WHERE order_id = $1;
+            """, order_id)
+            if result == 'UPDATE 1':
+                await add_event(conn, ORDER_CANCELLED, order_id)
+            await release_order_reservations(conn, [order_id])
         
         if result == 'UPDATE 1':
+            invalidate_order_details(order_id)
+            stock_availability.release_orders([order_id])
+            ORDERS_CANCELLED_TOTAL.inc()
+            replica.note_write()
             logger.info(f"Заказ #{order_id} успешно отменен (статус изменен на 'cancelled').")
             return True
         else:
@@ -359,13 +273,20 @@ async def cancel_all_orders_in_db(pool, order_ids: list[int]):
         conn = await pool.acquire()
         # Используем транзакцию для массовых операций
         async with conn.transaction():
+            await apply_orders_to_rollups(conn, await lock_sales_orders(conn, order_ids), -1)
             for order_id in order_ids:
                 await conn.execute("""
                     UPDATE orders
                     SET status = 'cancelled'
                     WHERE order_id = $1;
                 """, order_id)
+            await add_events(conn, ORDER_CANCELLED, order_ids)
+            await release_order_reservations(conn, order_ids)
         
+        invalidate_order_details(*order_ids)
+        stock_availability.release_orders(order_ids)
+        ORDERS_CANCELLED_TOTAL.inc(amount=len(order_ids))
+        replica.note_write()
         logger.info(f"Все выбранные заказы ({len(order_ids)}) отменены.")
         return True
     except asyncpg.exceptions.PostgresError as e:
@@ -6,6 +6,12 @@ from typing import Optional, List, Dict
 from datetime import datetime, date, timedelta
 from collections import namedtuple
 from decimal import Decimal
+from utils.metrics import PAYMENTS_APPLIED_TOTAL
+from db_operations.outbox import PAYMENT_APPLIED, add_event
+from db_operations.replica import reads_from_replica, replica
+from db_operations.query_classes import REPORT, with_query_class
+from db_operations.client_keys import claim_client_key
+from db_operations import DB_UNAVAILABLE_ERRORS
 
 logger = logging.getLogger(__name__)
 
@@ -42,6 +48,8 @@ TodayPaidInvoice = namedtuple(
 
 # --- ФУНКЦИИ БД ДЛЯ УПРАВЛЕНИЯ ОПЛАТАМИ ---
 
+@reads_from_replica
+@with_query_class(REPORT)
 async def get_unpaid_invoices(pool) -> List[UnpaidInvoice]:
     """
     Получает список накладных со статусом оплаты 'unpaid' или 'partially_paid',
@@ -168,163 +176,201 @@ async def get_single_unpaid_invoice_details(pool, order_id: int) -> Optional[Unp
         if conn:
             await pool.release(conn)
 
-async def confirm_payment_in_db(pool, order_id: int) -> bool:
+PAYMENT_FULL = "payment.full"
+PAYMENT_PARTIAL = "payment.partial"
+PAYMENT_REVERSE = "payment.reverse"
+
+
+async def apply_full_payment(conn: asyncpg.Connection, order_id: int, client_key: Optional[str] = None, paid_at: Optional[datetime] = None) -> bool:
     """
-    Подтверждает полную оплату для накладной, обновляя amount_paid, payment_status и actual_payment_date.
-    Создает запись в client_payments.
+    Полная оплата в уже открытой транзакции: обновляет amount_paid, payment_status и actual_payment_date,
+    создает запись в client_payments. paid_at — время приема оплаты (при проигрывании журнала).
+    Повтор с тем же client_key ничего не меняет и возвращает True.
     """
-    conn = None
-    try:
-        conn = await pool.acquire()
-        async with conn.transaction():
-            total_amount_record = await conn.fetchrow("SELECT total_amount, client_id FROM orders WHERE order_id = $1 FOR UPDATE", order_id)
-            if not total_amount_record:
-                logger.warning(f"Накладная #{order_id} не найдена для подтверждения оплаты.")
-                return False
+    if client_key and not await claim_client_key(conn, client_key, PAYMENT_FULL):
+        logger.info(f"Оплата по накладной #{order_id} с ключом {client_key} уже проведена, повтор пропущен.")
+        return True
 
-            total_amount = total_amount_record['total_amount']
-            client_id = total_amount_record['client_id']
-            
-            current_datetime = datetime.now()
-
-            result = await conn.execute("""
-                UPDATE orders
-                SET payment_status = 'paid',
-                    amount_paid = $1,
-                    actual_payment_date = $2
-                WHERE order_id = $3 AND status = 'confirmed';
-            """, total_amount, current_datetime, order_id)
-
-            if result == 'UPDATE 1':
-                await conn.execute("""
-                    INSERT INTO client_payments (payment_date, client_id, order_id, amount, payment_method, description, payment_type)
-                    VALUES ($1, $2, $3, $4, $5, $6, $7);
-                """, date.today(), client_id, order_id, total_amount, 'full_payment', f"Полная оплата по накладной #{order_id}", 'payment')
-                logger.info(f"Оплата по накладной #{order_id} полностью подтверждена. Дата оплаты: {current_datetime}")
-                return True
-            else:
-                logger.warning(f"Оплата по накладной #{order_id} не была подтверждена (статус не 'confirmed' или не найдена).")
-                return False
-    except asyncpg.exceptions.PostgresError as e:
-        logger.error(f"Ошибка БД при подтверждении оплаты накладной #{order_id}: {e}", exc_info=True)
+    total_amount_record = await conn.fetchrow("SELECT total_amount, client_id FROM orders WHERE order_id = $1 FOR UPDATE", order_id)
+    if not total_amount_record:
+        logger.warning(f"Накладная #{order_id} не найдена для подтверждения оплаты.")
         return False
-    except Exception as e:
-        logger.error(f"Неизвестная ошибка при подтверждении оплаты накладной #{order_id}: {e}", exc_info=True)
+
+    total_amount = total_amount_record['total_amount']
+    client_id = total_amount_record['client_id']
+
+    current_datetime = paid_at or datetime.now()
+
+    result = await conn.execute("""
+        UPDATE orders
+        SET payment_status = 'paid',
+            amount_paid = $1,
+            actual_payment_date = $2
+        WHERE order_id = $3 AND status = 'confirmed';
+    """, total_amount, current_datetime, order_id)
+
+    if result == 'UPDATE 1':
+        await conn.execute("""
+            INSERT INTO client_payments (payment_date, client_id, order_id, amount, payment_method, description, payment_type)
+            VALUES ($1, $2, $3, $4, $5, $6, $7);
+        """, current_datetime.date(), client_id, order_id, total_amount, 'full_payment', f"Полная оплата по накладной #{order_id}", 'payment')
+        await add_event(conn, PAYMENT_APPLIED, order_id, {"kind": "full", "amount": total_amount})
+        logger.info(f"Оплата по накладной #{order_id} полностью подтверждена. Дата оплаты: {current_datetime}")
+        PAYMENTS_APPLIED_TOTAL.inc("full")
+        replica.note_write()
+        return True
+    else:
+        logger.warning(f"Оплата по накладной #{order_id} не была подтверждена (статус не 'confirmed' или не найдена).")
         return False
-    finally:
-        if conn:
-            await pool.release(conn)
 
-async def update_partial_payment_in_db(pool, order_id: int, new_amount_increase: Decimal) -> bool:
+
+async def apply_partial_payment(conn: asyncpg.Connection, order_id: int, new_amount_increase: Decimal, client_key: Optional[str] = None, paid_at: Optional[datetime] = None) -> bool:
     """
-    Обновляет частичную оплату для накладной, ДОБАВЛЯЯ new_amount_increase к amount_paid.
+    Частичная оплата в уже открытой транзакции: ДОБАВЛЯЕТ new_amount_increase к amount_paid.
+    Повтор с тем же client_key ничего не меняет и возвращает True.
     """
-    conn = None
-    try:
-        conn = await pool.acquire()
-        async with conn.transaction():
-            current_data = await conn.fetchrow("SELECT total_amount, amount_paid, client_id FROM orders WHERE order_id = $1 FOR UPDATE", order_id)
-            if not current_data:
-                logger.warning(f"Накладная #{order_id} не найдена для частичной оплаты.")
-                return False
-
-            total_amount = current_data['total_amount']
-            current_amount_paid = current_data['amount_paid']
-            client_id = current_data['client_id']
+    if new_amount_increase < 0:
+        logger.warning(f"Попытка внести отрицательную сумму частичной оплаты для накладной #{order_id}.")
+        return False
 
-            if new_amount_increase < 0:
-                logger.warning(f"Попытка внести отрицательную сумму частичной оплаты для накладной #{order_id}.")
-                return False
+    if client_key and not await claim_client_key(conn, client_key, PAYMENT_PARTIAL):
+        logger.info(f"Частичная оплата по накладной #{order_id} с ключом {client_key} уже проведена, повтор пропущен.")
+        return True
 
-            new_total_paid = current_amount_paid + new_amount_increase
-            
-            new_payment_status = 'unpaid'
-            current_datetime = None
-            if new_total_paid >= total_amount:
-                new_payment_status = 'paid'
-                new_total_paid = total_amount
-                current_datetime = datetime.now()
-            elif new_total_paid > 0 and new_total_paid < total_amount:
-                new_payment_status = 'partially_paid'
-                current_datetime = datetime.now()
-            elif new_total_paid <= 0:
-                new_payment_status = 'unpaid'
-                new_total_paid = Decimal('0.00')
-
-            result = await conn.execute("""
-                UPDATE orders
-                SET payment_status = $1,
-                    amount_paid = $2,
-                    actual_payment_date = $3
-                WHERE order_id = $4 AND status = 'confirmed';
-            """, new_payment_status, new_total_paid, current_datetime, order_id)
-
-            if result == 'UPDATE 1':
-                await conn.execute("""
-                    INSERT INTO client_payments (payment_date, client_id, order_id, amount, payment_method, description, payment_type)
-                    VALUES ($1, $2, $3, $4, $5, $6, $7);
-                """, date.today(), client_id, order_id, new_amount_increase, 'partial_payment', f"Частичная оплата по накладной #{order_id}", 'payment')
-                logger.info(f"Частичная оплата по накладной #{order_id} обновлена на {new_total_paid}. Статус: {new_payment_status}. Дата оплаты: {current_datetime}")
-                return True
-            else:
-                logger.warning(f"Частичная оплата по накладной #{order_id} не была обновлена (статус не 'confirmed' или не найдена).")
-                return False
-    except asyncpg.exceptions.PostgresError as e:
-        logger.error(f"Ошибка БД при обновлении частичной оплаты накладной #{order_id}: {e}", exc_info=True)
+    current_data = await conn.fetchrow("SELECT total_amount, amount_paid, client_id FROM orders WHERE order_id = $1 FOR UPDATE", order_id)
+    if not current_data:
+        logger.warning(f"Накладная #{order_id} не найдена для частичной оплаты.")
         return False
-    except Exception as e:
-        logger.error(f"Неизвестная ошибка при обновлении частичной оплаты накладной #{order_id}: {e}", exc_info=True)
+
+    total_amount = current_data['total_amount']
+    current_amount_paid = current_data['amount_paid']
+    client_id = current_data['client_id']
+
+    new_total_paid = current_amount_paid + new_amount_increase
+
+    new_payment_status = 'unpaid'
+    current_datetime = None
+    if new_total_paid >= total_amount:
+        new_payment_status = 'paid'
+        new_total_paid = total_amount
+        current_datetime = paid_at or datetime.now()
+    elif new_total_paid > 0 and new_total_paid < total_amount:
+        new_payment_status = 'partially_paid'
+        current_datetime = paid_at or datetime.now()
+    elif new_total_paid <= 0:
+        new_payment_status = 'unpaid'
+        new_total_paid = Decimal('0.00')
+
+    result = await conn.execute("""
+        UPDATE orders
+        SET payment_status = $1,
+            amount_paid = $2,
+            actual_payment_date = $3
+        WHERE order_id = $4 AND status = 'confirmed';
+    """, new_payment_status, new_total_paid, current_datetime, order_id)
+
+    if result == 'UPDATE 1':
+        await conn.execute("""
+            INSERT INTO client_payments (payment_date, client_id, order_id, amount, payment_method, description, payment_type)
+            VALUES ($1, $2, $3, $4, $5, $6, $7);
+        """, (paid_at or datetime.now()).date(), client_id, order_id, new_amount_increase, 'partial_payment', f"Частичная оплата по накладной #{order_id}", 'payment')
+        await add_event(conn, PAYMENT_APPLIED, order_id, {"kind": "partial", "amount": new_amount_increase})
+        logger.info(f"Частичная оплата по накладной #{order_id} обновлена на {new_total_paid}. Статус: {new_payment_status}. Дата оплаты: {current_datetime}")
+        PAYMENTS_APPLIED_TOTAL.inc("partial")
+        replica.note_write()
+        return True
+    else:
+        logger.warning(f"Частичная оплата по накладной #{order_id} не была обновлена (статус не 'confirmed' или не найдена).")
         return False
-    finally:
-        if conn:
-            await pool.release(conn)
 
-async def reverse_payment_in_db(pool, order_id: int) -> bool:
+
+async def apply_payment_reversal(conn: asyncpg.Connection, order_id: int, client_key: Optional[str] = None, reversed_at: Optional[datetime] = None) -> bool:
     """
-    Отменяет оплату (полную или частичную), сбрасывая amount_paid, payment_status на 'unpaid' и actual_payment_date на NULL.
-    Создает сторнирующую запись в client_payments.
+    Отмена оплаты в уже открытой транзакции: сбрасывает amount_paid, payment_status на 'unpaid'
+    и actual_payment_date на NULL, создает сторнирующую запись в client_payments.
+    Повтор с тем же client_key ничего не меняет и возвращает True.
     """
+    if client_key and not await claim_client_key(conn, client_key, PAYMENT_REVERSE):
+        logger.info(f"Отмена оплаты по накладной #{order_id} с ключом {client_key} уже проведена, повтор пропущен.")
+        return True
+
+    current_data = await conn.fetchrow("SELECT total_amount, amount_paid, client_id FROM orders WHERE order_id = $1 FOR UPDATE", order_id)
+    if not current_data:
+        logger.warning(f"Накладная #{order_id} не найдена для отмены оплаты.")
+        return False
+
+    client_id = current_data['client_id']
+    amount_to_reverse = current_data['amount_paid']
+
+    result = await conn.execute("""
+        UPDATE orders
+        SET payment_status = 'unpaid',
+            amount_paid = 0.00,
+            actual_payment_date = NULL
+        WHERE order_id = $1 AND status = 'confirmed';
+    """, order_id)
+
+    if result == 'UPDATE 1':
+        if amount_to_reverse > 0:
+            await conn.execute("""
+                INSERT INTO client_payments (payment_date, client_id, order_id, amount, payment_method, description, payment_type)
+                VALUES ($1, $2, $3, $4, $5, $6, $7);
+            """, (reversed_at or datetime.now()).date(), client_id, order_id, -amount_to_reverse, 'reverse_payment', f"Отмена оплаты по накладной #{order_id}", 'reverse_payment')
+            await add_event(conn, PAYMENT_APPLIED, order_id, {"kind": "reverse", "amount": -amount_to_reverse})
+        logger.info(f"Оплата по накладной #{order_id} отменена/сброшена.")
+        PAYMENTS_APPLIED_TOTAL.inc("reverse")
+        replica.note_write()
+        return True
+    else:
+        logger.warning(f"Оплата по накладной #{order_id} не была отменена (статус не 'confirmed' или не найдена).")
+        return False
+
+
+async def _run_payment(pool, action: str, order_id: int, apply, *args) -> bool:
     conn = None
     try:
         conn = await pool.acquire()
         async with conn.transaction():
-            current_data = await conn.fetchrow("SELECT total_amount, amount_paid, client_id FROM orders WHERE order_id = $1 FOR UPDATE", order_id)
-            if not current_data:
-                logger.warning(f"Накладная #{order_id} не найдена для отмены оплаты.")
-                return False
-            
-            client_id = current_data['client_id']
-            amount_to_reverse = current_data['amount_paid']
-
-            result = await conn.execute("""
-                UPDATE orders
-                SET payment_status = 'unpaid',
-                    amount_paid = 0.00,
-                    actual_payment_date = NULL
-                WHERE order_id = $1 AND status = 'confirmed';
-            """, order_id)
-
-            if result == 'UPDATE 1':
-                if amount_to_reverse > 0:
-                    await conn.execute("""
-                        INSERT INTO client_payments (payment_date, client_id, order_id, amount, payment_method, description, payment_type)
-                        VALUES ($1, $2, $3, $4, $5, $6, $7);
-                    """, date.today(), client_id, order_id, -amount_to_reverse, 'reverse_payment', f"Отмена оплаты по накладной #{order_id}", 'reverse_payment')
-                logger.info(f"Оплата по накладной #{order_id} отменена/сброшена.")
-                return True
-            else:
-                logger.warning(f"Оплата по накладной #{order_id} не была отменена (статус не 'confirmed' или не найдена).")
-                return False
+            return await apply(conn, order_id, *args)
+    except DB_UNAVAILABLE_ERRORS:
+        # БД недоступна — вызывающий запишет действие в локальный журнал (write_journal.py)
+        raise
     except asyncpg.exceptions.PostgresError as e:
-        logger.error(f"Ошибка БД при отмене оплаты накладной #{order_id}: {e}", exc_info=True)
+        logger.error(f"Ошибка БД при {action} накладной #{order_id}: {e}", exc_info=True)
         return False
     except Exception as e:
-        logger.error(f"Неизвестная ошибка при отмене оплаты накладной #{order_id}: {e}", exc_info=True)
+        logger.error(f"Неизвестная ошибка при {action} накладной #{order_id}: {e}", exc_info=True)
         return False
     finally:
         if conn:
             await pool.release(conn)
 
+
+async def confirm_payment_in_db(pool, order_id: int, client_key: Optional[str] = None) -> bool:
+    """
+    Подтверждает полную оплату для накладной (apply_full_payment).
+    При недоступности БД пробрасывает ошибку из DB_UNAVAILABLE_ERRORS.
+    """
+    return await _run_payment(pool, "подтверждении оплаты", order_id, apply_full_payment, client_key)
+
+
+async def update_partial_payment_in_db(pool, order_id: int, new_amount_increase: Decimal, client_key: Optional[str] = None) -> bool:
+    """
+    Обновляет частичную оплату для накладной, ДОБАВЛЯЯ new_amount_increase к amount_paid.
+    При недоступности БД пробрасывает ошибку из DB_UNAVAILABLE_ERRORS.
+    """
+    return await _run_payment(pool, "обновлении частичной оплаты", order_id, apply_partial_payment, new_amount_increase, client_key)
+
+
+async def reverse_payment_in_db(pool, order_id: int, client_key: Optional[str] = None) -> bool:
+    """
+    Отменяет оплату (полную или частичную), создавая сторнирующую запись в client_payments.
+    При недоступности БД пробрасывает ошибку из DB_UNAVAILABLE_ERRORS.
+    """
+    return await _run_payment(pool, "отмене оплаты", order_id, apply_payment_reversal, client_key)
+
+@reads_from_replica
+@with_query_class(REPORT)
 async def get_today_paid_invoices(pool) -> List[TodayPaidInvoice]:
     """
     Получает список накладных, которые были полностью оплачены сегодня.
@@ -0,0 +1,305 @@
+# db_operations/sales_rollups.py
+"""
+Дневные агрегаты продаж (sales_daily_employee / _client / _product / _category).
+
+Агрегаты обновляются инкрементально в транзакции, которая меняет продажи:
+- подтверждение заказа (confirm_order_in_db) добавляет заказ со знаком +1;
+- отмена подтвержденного заказа (cancel_order_in_db, cancel_all_orders_in_db) вычитает его;
+- редактирование подтвержденного заказа (order_editor.confirm_order) вычитает старую версию
+  и добавляет новую.
+Датой продажи считается delivery_date (она же дата накладной). Продажами считаются
+заказы в статусах SALES_STATUSES. Пустые employee_id/client_id/category_id пишутся как 0.
+
+/sales_report (handlers/reports/sales_report.py) читает только агрегаты, поэтому отчет
+за любой период стоит нескольких индексных чтений, а не пересчета orders/order_lines.
+
+Тем же запросом ведется матрица клиент × товар (client_product_stats): сколько раз и в каком
+количестве клиент брал товар. По ней product_operations.get_reorder_suggestions подбирает
+часто покупаемые товары для повтора заказа.
+
+Пересчет истории (первичное заполнение или сверка):
+    python -m db_operations.sales_rollups --from 2024-01-01 --to 2024-12-31
+Без --from/--to агрегаты строятся заново целиком.
+"""
+
+import argparse
+import asyncio
+import logging
+import time
+from datetime import date
+from decimal import Decimal
+from typing import NamedTuple, Optional
+
+import asyncpg
+
+from db_operations.replica import reads_from_replica
+from db_operations.query_classes import BULK, REPORT, with_query_class
+
+logger = logging.getLogger(__name__)
+
+# Статусы заказа, которые считаются продажей
+SALES_STATUSES = ('confirmed', 'shipped')
+
+ROLLUP_TABLES = ("sales_daily_employee", "sales_daily_client", "sales_daily_product", "sales_daily_category")
+CLIENT_PRODUCT_STATS_TABLE = "client_product_stats"
+
+# Сколько строк показывать в разрезах отчета
+REPORT_TOP_LIMIT = 10
+
+
+def _upsert(table: str, key: str) -> str:
+    return f"""
+        INSERT INTO {table} AS t (sale_date, {key}, orders_count, quantity, amount)
+        SELECT sale_date, {key}, orders_count, quantity, amount FROM {{source}}
+        ON CONFLICT (sale_date, {key}) DO UPDATE
+        SET orders_count = t.orders_count + EXCLUDED.orders_count,
+            quantity = t.quantity + EXCLUDED.quantity,
+            amount = t.amount + EXCLUDED.amount
+    """
+
+
+# Один запрос на весь набор заказов: строки заказов агрегируются один раз,
+# дальше каждый CTE дописывает свой разрез. $2 — знак (+1 при подтверждении, -1 при отмене).
+_APPLY_ORDERS_SQL = f"""
+    WITH lines AS (
+        SELECT o.order_id, o.delivery_date AS sale_date,
+               COALESCE(o.employee_id, 0) AS employee_id, COALESCE(o.client_id, 0) AS client_id,
+               ol.product_id, COALESCE(p.category_id, 0) AS category_id,
+               SUM(ol.quantity) * $2::int AS quantity, SUM(ol.quantity * ol.unit_price) * $2::int AS amount
+        FROM orders o
+        JOIN order_lines ol ON ol.order_id = o.order_id
+        JOIN products p ON p.product_id = ol.product_id
+        WHERE o.order_id = ANY($1::int[])
+        GROUP BY o.order_id, o.delivery_date, o.employee_id, o.client_id, ol.product_id, p.category_id
+    ),
+    by_employee AS (
+        SELECT sale_date, employee_id, COUNT(DISTINCT order_id) * $2::int AS orders_count, SUM(quantity) AS quantity, SUM(amount) AS amount
+        FROM lines GROUP BY sale_date, employee_id
+    ),
+    by_client AS (
+        SELECT sale_date, client_id, COUNT(DISTINCT order_id) * $2::int AS orders_count, SUM(quantity) AS quantity, SUM(amount) AS amount
+        FROM lines GROUP BY sale_date, client_id
+    ),
+    by_product AS (
+        SELECT sale_date, product_id, COUNT(DISTINCT order_id) * $2::int AS orders_count, SUM(quantity) AS quantity, SUM(amount) AS amount
+        FROM lines GROUP BY sale_date, product_id
+    ),
+    by_category AS (
+        SELECT sale_date, category_id, COUNT(DISTINCT order_id) * $2::int AS orders_count, SUM(quantity) AS quantity, SUM(amount) AS amount
+        FROM lines GROUP BY sale_date, category_id
+    ),
+    by_client_product AS (
+        SELECT client_id, product_id, COUNT(DISTINCT order_id) * $2::int AS orders_count, SUM(quantity) AS quantity,
+               MAX(sale_date) AS last_order_date
+        FROM lines WHERE client_id <> 0 GROUP BY client_id, product_id
+    ),
+    upsert_client_product AS (
+        INSERT INTO client_product_stats AS t (client_id, product_id, orders_count, quantity, last_order_date)
+        SELECT client_id, product_id, orders_count, quantity, last_order_date FROM by_client_product
+        ON CONFLICT (client_id, product_id) DO UPDATE
+        SET orders_count = t.orders_count + EXCLUDED.orders_count,
+            quantity = t.quantity + EXCLUDED.quantity,
+            -- при вычитании дата последней покупки не откатывается: она нужна только для сортировки
+            last_order_date = CASE WHEN $2::int > 0 THEN GREATEST(t.last_order_date, EXCLUDED.last_order_date)
+                                   ELSE t.last_order_date END
+    ),
+    upsert_employee AS ({_upsert("sales_daily_employee", "employee_id").format(source="by_employee")}),
+    upsert_client AS ({_upsert("sales_daily_client", "client_id").format(source="by_client")}),
+    upsert_product AS ({_upsert("sales_daily_product", "product_id").format(source="by_product")})
+    {_upsert("sales_daily_category", "category_id").format(source="by_category")};
+"""
+
+
+async def apply_orders_to_rollups(conn: asyncpg.Connection, order_ids: list[int], sign: int) -> None:
+    """
+    Добавляет (sign=1) или вычитает (sign=-1) заказы из дневных агрегатов.
+    Вызывается внутри транзакции, которая меняет статус или состав заказов.
+    """
+    if order_ids:
+        await conn.execute(_APPLY_ORDERS_SQL, list(order_ids), sign)
+
+
+async def lock_sales_orders(conn: asyncpg.Connection, order_ids: list[int]) -> list[int]:
+    """Блокирует заказы и возвращает те из них, что сейчас учтены в продажах."""
+    rows = await conn.fetch(
+        "SELECT order_id FROM orders WHERE order_id = ANY($1::int[]) AND status = ANY($2::text[]) ORDER BY order_id FOR UPDATE",
+        list(order_ids), list(SALES_STATUSES)
+    )
+    return [row['order_id'] for row in rows]
+
+
+# --- Отчет ---
+
+class SalesTotals(NamedTuple):
+    orders_count: int
+    quantity: Decimal
+    amount: Decimal
+
+
+class SalesBreakdownRow(NamedTuple):
+    name: str
+    orders_count: int
+    quantity: Decimal
+    amount: Decimal
+
+
+class SalesReport(NamedTuple):
+    date_from: date
+    date_to: date
+    totals: SalesTotals
+    own: Optional[SalesTotals]          # продажи сотрудника, запросившего отчет
+    by_employee: list[SalesBreakdownRow]
+    by_client: list[SalesBreakdownRow]
+    by_category: list[SalesBreakdownRow]
+    by_product: list[SalesBreakdownRow]
+
+
+_BREAKDOWN_QUERIES = {
+    "by_employee": ("sales_daily_employee", "employee_id", "employees", "employee_id"),
+    "by_client": ("sales_daily_client", "client_id", "clients", "client_id"),
+    "by_category": ("sales_daily_category", "category_id", "categories", "category_id"),
+    "by_product": ("sales_daily_product", "product_id", "products", "product_id"),
+}
+
+
+@reads_from_replica
+@with_query_class(REPORT)
+async def get_sales_report(pool, date_from: date, date_to: date, telegram_id: Optional[int] = None) -> Optional[SalesReport]:
+    """Отчет о продажах за период [date_from, date_to] по дневным агрегатам."""
+    conn = None
+    try:
+        conn = await pool.acquire()
+        totals_row = await conn.fetchrow("""
+            SELECT COALESCE(SUM(orders_count), 0) AS orders_count, COALESCE(SUM(quantity), 0) AS quantity,
+                   COALESCE(SUM(amount), 0) AS amount
+            FROM sales_daily_employee
+            WHERE sale_date BETWEEN $1 AND $2;
+        """, date_from, date_to)
+
+        own = None
+        if telegram_id is not None:
+            own_row = await conn.fetchrow("""
+                SELECT COALESCE(SUM(s.orders_count), 0) AS orders_count, COALESCE(SUM(s.quantity), 0) AS quantity,
+                       COALESCE(SUM(s.amount), 0) AS amount
+                FROM sales_daily_employee s
+                JOIN employees e ON e.employee_id = s.employee_id
+                WHERE s.sale_date BETWEEN $1 AND $2 AND e.id_telegram = $3;
+            """, date_from, date_to, telegram_id)
+            own = SalesTotals(own_row['orders_count'], own_row['quantity'], own_row['amount'])
+
+        breakdowns = {}
+        for name, (table, key, dictionary, dictionary_key) in _BREAKDOWN_QUERIES.items():
+            rows = await conn.fetch(f"""
+                SELECT COALESCE(d.name, 'Не указано') AS name, s.orders_count, s.quantity, s.amount
+                FROM (
+                    SELECT {key}, SUM(orders_count) AS orders_count, SUM(quantity) AS quantity, SUM(amount) AS amount
+                    FROM {table}
+                    WHERE sale_date BETWEEN $1 AND $2
+                    GROUP BY {key}
+                    HAVING SUM(amount) <> 0
+                    ORDER BY SUM(amount) DESC
+                    LIMIT $3
+                ) s
+                LEFT JOIN {dictionary} d ON d.{dictionary_key} = s.{key}
+                ORDER BY s.amount DESC;
+            """, date_from, date_to, REPORT_TOP_LIMIT)
+            breakdowns[name] = [SalesBreakdownRow(r['name'], r['orders_count'], r['quantity'], r['amount']) for r in rows]
+
+        return SalesReport(
+            date_from=date_from,
+            date_to=date_to,
+            totals=SalesTotals(totals_row['orders_count'], totals_row['quantity'], totals_row['amount']),
+            own=own,
+            **breakdowns
+        )
+    except asyncpg.exceptions.PostgresError as e:
+        logger.error("Ошибка БД при построении отчета о продажах за %s - %s: %s", date_from, date_to, e, exc_info=True)
+        return None
+    except Exception as e:
+        logger.error("Неизвестная ошибка при построении отчета о продажах за %s - %s: %s", date_from, date_to, e, exc_info=True)
+        return None
+    finally:
+        if conn:
+            await pool.release(conn)
+
+
+# --- Пересчет истории ---
+
+_REBUILD_SOURCE_SQL = """
+    SELECT o.order_id, o.delivery_date AS sale_date,
+           COALESCE(o.employee_id, 0) AS employee_id, COALESCE(o.client_id, 0) AS client_id,
+           ol.product_id, COALESCE(p.category_id, 0) AS category_id,
+           SUM(ol.quantity) AS quantity, SUM(ol.quantity * ol.unit_price) AS amount
+    FROM orders o
+    JOIN order_lines ol ON ol.order_id = o.order_id
+    JOIN products p ON p.product_id = ol.product_id
+    WHERE o.status = ANY($1::text[]) AND o.delivery_date BETWEEN $2 AND $3
+    GROUP BY o.order_id, o.delivery_date, o.employee_id, o.client_id, ol.product_id, p.category_id
+"""
+
+
+@with_query_class(BULK)
+async def rebuild_sales_rollups(pool, date_from: Optional[date] = None, date_to: Optional[date] = None) -> dict[str, int]:
+    """
+    Пересчитывает агрегаты за период (по умолчанию — за всю историю) одним проходом
+    по orders/order_lines на каждую таблицу. Таблицы агрегатов блокируются на время
+    пересчета, поэтому параллельные подтверждения дождутся его окончания и не потеряются.
+    Матрица client_product_stats не привязана к датам и всегда строится по всей истории.
+    Блокировка держится не дольше таймаута класса bulk; большую историю пересчитывайте
+    по периодам (--from/--to). Возвращает число строк в каждой таблице за период.
+    """
+    date_from = date_from or date.min
+    date_to = date_to or date.max
+    counts = {}
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            await conn.execute(f"LOCK TABLE {', '.join(ROLLUP_TABLES)}, {CLIENT_PRODUCT_STATS_TABLE} IN EXCLUSIVE MODE")
+            for table in ROLLUP_TABLES:
+                key = table.removeprefix("sales_daily_") + "_id"
+                await conn.execute(f"DELETE FROM {table} WHERE sale_date BETWEEN $1 AND $2", date_from, date_to)
+                result = await conn.execute(f"""
+                    INSERT INTO {table} (sale_date, {key}, orders_count, quantity, amount)
+                    SELECT sale_date, {key}, COUNT(DISTINCT order_id), SUM(quantity), SUM(amount)
+                    FROM ({_REBUILD_SOURCE_SQL}) lines
+                    GROUP BY sale_date, {key}
+                """, list(SALES_STATUSES), date_from, date_to)
+                counts[table] = int(result.split()[-1])
+
+            await conn.execute(f"DELETE FROM {CLIENT_PRODUCT_STATS_TABLE}")
+            result = await conn.execute(f"""
+                INSERT INTO {CLIENT_PRODUCT_STATS_TABLE} (client_id, product_id, orders_count, quantity, last_order_date)
+                SELECT client_id, product_id, COUNT(DISTINCT order_id), SUM(quantity), MAX(sale_date)
+                FROM ({_REBUILD_SOURCE_SQL}) lines
+                WHERE client_id <> 0
+                GROUP BY client_id, product_id
+            """, list(SALES_STATUSES), date.min, date.max)
+            counts[CLIENT_PRODUCT_STATS_TABLE] = int(result.split()[-1])
+    logger.info("Агрегаты продаж пересчитаны за %s - %s: %s", date_from, date_to, counts)
+    return counts
+
+
+async def _backfill(args) -> None:
+    from db_operations import init_db_pool, close_db_pool
+
+    pool = await init_db_pool()
+    try:
+        started = time.perf_counter()
+        counts = await rebuild_sales_rollups(pool, args.date_from, args.date_to)
+        for table, count in counts.items():
+            print(f"{table}: {count} строк")
+        print(f"Готово за {time.perf_counter() - started:.1f} с")
+    finally:
+        await close_db_pool(pool)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Пересчет дневных агрегатов продаж по истории заказов.")
+    parser.add_argument("--from", dest="date_from", type=date.fromisoformat, help="Начало периода (YYYY-MM-DD)")
+    parser.add_argument("--to", dest="date_to", type=date.fromisoformat, help="Конец периода (YYYY-MM-DD)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+    asyncio.run(_backfill(args))
+
+
+if __name__ == "__main__":
+    main()
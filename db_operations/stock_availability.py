@@ -0,0 +1,262 @@
+# db_operations/stock_availability.py
+"""
+Сервис доступности товаров для корзины.
+
+Держит в памяти available-to-promise: остатки (таблица stock) минус действующие
+резервы черновиков (таблица stock_reservations, см. db_operations/stock_reservations.py).
+Резервы, сделанные этим процессом, применяются к снимку сразу (set_order_reservation /
+release_orders); изменения из других процессов приходят уведомлениями PostgreSQL
+(LISTEN stock_changed, триггеры — в sql/edit_tables&collumns.sql). Поэтому проверка
+количества при вводе в корзину не делает запросов к БД.
+Если уведомления не приходят (триггеры не установлены, соединение потеряно),
+снимок перечитывается целиком раз в FALLBACK_REFRESH_SECONDS.
+"""
+
+import asyncio
+import logging
+import time
+from decimal import Decimal
+from typing import Optional
+
+import asyncpg
+
+from config import DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, DB_PORT
+from db_operations.query_classes import BULK, with_query_class
+
+logger = logging.getLogger(__name__)
+
+NOTIFY_CHANNEL = "stock_changed"
+
+# Уведомления копятся столько секунд, затем обрабатываются одной пачкой
+NOTIFY_DEBOUNCE_SECONDS = 0.3
+
+# Полное перечитывание снимка, даже если уведомлений не было
+FALLBACK_REFRESH_SECONDS = 60
+
+STOCK_QUERY = """
+    SELECT p.product_id, COALESCE(s.quantity, 0) AS quantity
+    FROM products p
+    LEFT JOIN stock s ON s.product_id = p.product_id
+"""
+
+RESERVATIONS_QUERY = """
+    SELECT r.order_id, r.product_id, r.quantity
+    FROM stock_reservations r
+    WHERE r.expires_at > now()
+"""
+
+
+async def _fetch_rows(pool, product_ids: Optional[list[int]] = None):
+    stock_query, lines_query, args = STOCK_QUERY, RESERVATIONS_QUERY, []
+    if product_ids is not None:
+        stock_query += " WHERE p.product_id = ANY($1::int[])"
+        lines_query += " AND r.product_id = ANY($1::int[])"
+        args = [product_ids]
+
+    conn = None
+    try:
+        conn = await pool.acquire()
+        # Остатки и резервы читаются из одного снимка БД
+        async with conn.transaction(isolation='repeatable_read', readonly=True):
+            stock_rows = await conn.fetch(stock_query, *args)
+            line_rows = await conn.fetch(lines_query, *args)
+        return stock_rows, line_rows
+    finally:
+        if conn:
+            await pool.release(conn)
+
+
+@with_query_class(BULK)
+async def _fetch_all_rows(pool):
+    """Снимок по всем товарам: при старте и по таймеру, под таймаутом bulk."""
+    return await _fetch_rows(pool)
+
+
+class StockAvailability:
+    def __init__(self):
+        self.on_hand: dict[int, Decimal] = {}
+        # Резервы черновиков: product_id -> количество и order_id -> {product_id: количество}
+        self.reserved: dict[int, Decimal] = {}
+        self.reserved_by_order: dict[int, dict[int, Decimal]] = {}
+        self.loaded_at: Optional[float] = None
+
+        self._pool = None
+        self._listener: Optional[asyncpg.Connection] = None
+        self._listen = True
+        self._pending_products: set[int] = set()
+        self._full_refresh_pending = False
+        self._flush_task: Optional[asyncio.Task] = None
+        self._fallback_task: Optional[asyncio.Task] = None
+        self._refresh_lock = asyncio.Lock()
+
+    # --- Жизненный цикл ---
+
+    async def start(self, pool, listen: bool = True) -> None:
+        """
+        Загружает снимок и подписывается на уведомления об изменениях.
+        listen=False — без LISTEN (бенчмарки с пулом к другой БД): снимок обновляется только по таймеру.
+        """
+        self._pool = pool
+        await self.refresh_all()
+        if listen:
+            await self._connect_listener()
+        self._listen = listen
+        self._fallback_task = asyncio.create_task(self._fallback_loop())
+
+    async def stop(self) -> None:
+        for task in (self._fallback_task, self._flush_task):
+            if task:
+                task.cancel()
+        if self._listener and not self._listener.is_closed():
+            await self._listener.close()
+        self._listener = None
+
+    async def _connect_listener(self) -> None:
+        # Отдельное соединение вне пула: LISTEN держит его постоянно
+        try:
+            self._listener = await asyncpg.connect(
+                user=DB_USER, password=DB_PASSWORD, database=DB_NAME, host=DB_HOST, port=DB_PORT
+            )
+            await self._listener.add_listener(NOTIFY_CHANNEL, self._on_notify)
+            logger.info(f"Подписка на уведомления '{NOTIFY_CHANNEL}' установлена.")
+        except Exception as e:
+            self._listener = None
+            logger.warning(f"Не удалось подписаться на '{NOTIFY_CHANNEL}', снимок остатков будет обновляться по таймеру: {e}")
+
+    async def _fallback_loop(self) -> None:
+        while True:
+            await asyncio.sleep(FALLBACK_REFRESH_SECONDS)
+            try:
+                if self._listen and (self._listener is None or self._listener.is_closed()):
+                    await self._connect_listener()
+                await self.refresh_all()
+            except Exception as e:
+                logger.error(f"Ошибка при плановом обновлении снимка остатков: {e}", exc_info=True)
+
+    # --- Обработка уведомлений ---
+
+    def _on_notify(self, connection, pid, channel, payload: str) -> None:
+        # payload — product_id; пустой payload означает «перечитать все» (например, смена статуса заказа)
+        if payload.isdigit():
+            self._pending_products.add(int(payload))
+        else:
+            self._full_refresh_pending = True
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush())
+
+    async def _flush(self) -> None:
+        await asyncio.sleep(NOTIFY_DEBOUNCE_SECONDS)
+        # Уведомления, пришедшие во время обновления, не запускают новую задачу (эта еще не завершена),
+        # поэтому разбираем их здесь же, пока есть что обновлять
+        while self._full_refresh_pending or self._pending_products:
+            full_refresh, products = self._full_refresh_pending, self._pending_products
+            self._full_refresh_pending, self._pending_products = False, set()
+            try:
+                if full_refresh:
+                    await self.refresh_all()
+                else:
+                    await self.refresh_products(products)
+            except Exception as e:
+                logger.error(f"Ошибка при обновлении снимка остатков по уведомлению: {e}", exc_info=True)
+                return
+
+    # --- Загрузка снимка ---
+
+    async def refresh_all(self) -> None:
+        async with self._refresh_lock:
+            started = time.perf_counter()
+            stock_rows, line_rows = await _fetch_all_rows(self._pool)
+
+            on_hand = {row['product_id']: Decimal(row['quantity']) for row in stock_rows}
+            reserved: dict[int, Decimal] = {}
+            reserved_by_order: dict[int, dict[int, Decimal]] = {}
+            for row in line_rows:
+                quantity = Decimal(row['quantity'])
+                reserved[row['product_id']] = reserved.get(row['product_id'], Decimal(0)) + quantity
+                reserved_by_order.setdefault(row['order_id'], {})[row['product_id']] = quantity
+
+            self.on_hand, self.reserved, self.reserved_by_order = on_hand, reserved, reserved_by_order
+            self.loaded_at = time.monotonic()
+            logger.debug(
+                "Снимок остатков обновлен: %d товаров, %d черновиков, %.1f мс",
+                len(on_hand), len(reserved_by_order), (time.perf_counter() - started) * 1000
+            )
+
+    async def refresh_products(self, product_ids) -> None:
+        product_ids = list(product_ids)
+        async with self._refresh_lock:
+            stock_rows, line_rows = await _fetch_rows(self._pool, product_ids)
+
+            for product_id in product_ids:
+                self.on_hand.pop(product_id, None)
+                self.reserved.pop(product_id, None)
+            for lines in self.reserved_by_order.values():
+                for product_id in product_ids:
+                    lines.pop(product_id, None)
+
+            for row in stock_rows:
+                self.on_hand[row['product_id']] = Decimal(row['quantity'])
+            for row in line_rows:
+                quantity = Decimal(row['quantity'])
+                self.reserved[row['product_id']] = self.reserved.get(row['product_id'], Decimal(0)) + quantity
+                self.reserved_by_order.setdefault(row['order_id'], {})[row['product_id']] = quantity
+
+            # Черновики, у которых не осталось строк, больше ничего не резервируют
+            self.reserved_by_order = {order_id: lines for order_id, lines in self.reserved_by_order.items() if lines}
+
+    # --- Инкрементальные изменения резервов ---
+
+    def set_order_reservation(self, order_id: int, quantities: dict) -> None:
+        """
+        Заменяет резерв черновика в снимке (после успешного коммита резервирования).
+        Суммарный резерв по товарам пересчитывается только на разницу.
+        """
+        previous = self.reserved_by_order.pop(order_id, {})
+        for product_id, quantity in previous.items():
+            self.reserved[product_id] = self.reserved.get(product_id, Decimal(0)) - quantity
+        current = {product_id: Decimal(quantity) for product_id, quantity in quantities.items() if quantity > 0}
+        for product_id, quantity in current.items():
+            self.reserved[product_id] = self.reserved.get(product_id, Decimal(0)) + quantity
+        if current:
+            self.reserved_by_order[order_id] = current
+
+    def release_orders(self, order_ids) -> None:
+        """Снимает резервы заказов из снимка (подтверждение, отмена, истечение срока)."""
+        for order_id in order_ids:
+            self.set_order_reservation(order_id, {})
+
+    # --- Чтение ---
+
+    def available(self, product_id: int, exclude_order_id: Optional[int] = None) -> Optional[Decimal]:
+        """
+        Сколько товара можно заказать: остаток минус действующие резервы черновиков.
+        exclude_order_id — редактируемый черновик, его собственный резерв не вычитается.
+        Возвращает None, если снимок еще не загружен или товар неизвестен.
+        """
+        if self.loaded_at is None or product_id not in self.on_hand:
+            return None
+        reserved = self.reserved.get(product_id, Decimal(0))
+        if exclude_order_id is not None:
+            reserved -= self.reserved_by_order.get(exclude_order_id, {}).get(product_id, Decimal(0))
+        return self.on_hand[product_id] - reserved
+
+
+stock_availability = StockAvailability()
+
+
+def format_quantity(quantity: Decimal) -> str:
+    """Количество без лишних нулей: Decimal('10.00') -> '10'."""
+    return f"{Decimal(quantity).normalize():f}"
+
+
+def format_shortage_warning(product_name: str, requested, available: Optional[Decimal]) -> Optional[str]:
+    """
+    Текст предупреждения (без экранирования), если запрошено больше доступного; иначе None.
+    """
+    if available is None or requested <= available:
+        return None
+    available_text = format_quantity(max(available, Decimal(0)))
+    return (
+        f"⚠️ {product_name}: в корзине {requested} шт., а доступно только {available_text} шт. "
+        f"(с учетом других черновиков). При подтверждении заказ будет скорректирован по остатку."
+    )
@@ -0,0 +1,152 @@
+# db_operations/stock_mutations.py
+"""
+Изменение остатков одним SQL-оператором.
+
+apply_stock_changes применяет пачку изменений (StockChange: товар, изменение со знаком, тип движения)
+одним запросом: блокирует строки stock в порядке product_id, обновляет их с отсечением на нуле,
+создает недостающие строки (INSERT ... ON CONFLICT) и пишет движения в inventory_movements.
+Запрос возвращает остаток до и после и нехватку (сколько не удалось списать).
+Строка stock блокируется на время одного оператора, а не нескольких обращений
+SELECT ... FOR UPDATE → расчет в Python → UPDATE → INSERT.
+
+Первый проход идет с SKIP LOCKED: строки, занятые другой транзакцией (популярный товар при
+массовом подтверждении), пропускаются, и по ним выполняется второй, блокирующий проход.
+Его время — ожидание блокировки; оно пишется в метрики по товару
+(stock_lock_waits_total, stock_lock_wait_seconds).
+
+Для одного товара оператор атомарен и без транзакции. Пачку из нескольких товаров вызывайте
+внутри транзакции вызывающего кода: проходы — два отдельных оператора.
+
+Бенчмарк конкуренции за популярный товар: benchmarks/stock_contention.py.
+"""
+
+import logging
+import time
+from datetime import datetime
+from decimal import Decimal
+from typing import NamedTuple, Optional
+
+import asyncpg
+
+from utils.metrics import STOCK_LOCK_WAIT_SECONDS, STOCK_LOCK_WAITS_TOTAL, stock_lock_product
+
+logger = logging.getLogger(__name__)
+
+INCOMING_TYPES = ('incoming', 'return_in', 'adjustment_in')     # Приход: остаток растет
+OUTGOING_TYPES = ('outgoing', 'adjustment_out')                 # Расход: остаток уменьшается, не ниже нуля
+
+
+class StockChange(NamedTuple):
+    product_id: int
+    quantity_change: Decimal        # положительное — приход, отрицательное — расход
+    movement_type: str
+    unit_cost: Optional[Decimal] = None
+    description: Optional[str] = None
+
+
+class StockResult(NamedTuple):
+    product_id: int
+    old_quantity: Decimal
+    new_quantity: Decimal
+    shortfall: Decimal              # сколько не удалось списать (остаток отсечен на нуле)
+
+
+# $1..$5 — строки движений, $6 — время движения, $7/$8 — документ-источник.
+# Строки, которых еще нет в stock, создаются в ветке inserted. Если такую строку параллельно
+# создала другая транзакция, приход добавляется к ней через ON CONFLICT, а расход по
+# несуществовавшей строке считается нехваткой целиком (остатка у товара не было).
+_MUTATION_SQL = """
+    WITH changes AS (
+        SELECT *
+        FROM unnest($1::int[], $2::numeric[], $3::text[], $4::numeric[], $5::text[])
+             AS c(product_id, quantity_change, movement_type, unit_cost, description)
+    ),
+    input AS (
+        SELECT product_id, SUM(quantity_change) AS delta FROM changes GROUP BY product_id
+    ),
+    locked AS (
+        SELECT s.product_id, s.quantity
+        FROM stock s
+        WHERE s.product_id IN (SELECT product_id FROM input)
+        ORDER BY s.product_id
+        FOR UPDATE OF s {wait_policy}
+    ),
+    updated AS (
+        UPDATE stock s
+        SET quantity = GREATEST(s.quantity + i.delta, 0)
+        FROM input i, locked l
+        WHERE s.product_id = i.product_id AND l.product_id = i.product_id
+        RETURNING s.product_id, l.quantity AS old_quantity, s.quantity AS new_quantity, i.delta
+    ),
+    inserted AS (
+        INSERT INTO stock AS s (product_id, quantity)
+        SELECT i.product_id, GREATEST(i.delta, 0)
+        FROM input i
+        WHERE NOT EXISTS (SELECT 1 FROM stock e WHERE e.product_id = i.product_id)
+        ON CONFLICT (product_id) DO UPDATE SET quantity = s.quantity + EXCLUDED.quantity
+        RETURNING s.product_id, s.quantity AS new_quantity
+    ),
+    applied AS (
+        SELECT product_id, old_quantity, new_quantity, delta FROM updated
+        UNION ALL
+        SELECT n.product_id, 0, n.new_quantity, i.delta FROM inserted n JOIN input i USING (product_id)
+    ),
+    movements AS (
+        INSERT INTO inventory_movements (product_id, quantity_change, movement_type, movement_date, unit_cost, source_document_type, source_document_id, description)
+        SELECT c.product_id, c.quantity_change, c.movement_type, $6::timestamptz, c.unit_cost, $7::varchar, $8::int, c.description
+        FROM changes c
+        WHERE c.product_id IN (SELECT product_id FROM applied)
+    )
+    SELECT product_id, old_quantity, new_quantity, GREATEST(-(old_quantity + delta), 0) AS shortfall
+    FROM applied;
+"""
+
+_SKIP_LOCKED_SQL = _MUTATION_SQL.format(wait_policy="SKIP LOCKED")
+_WAIT_SQL = _MUTATION_SQL.format(wait_policy="")
+
+
+async def _run(conn: asyncpg.Connection, sql: str, changes: list[StockChange], moved_at: datetime,
+               source_document_type: Optional[str], source_document_id: Optional[int]) -> dict[int, StockResult]:
+    rows = await conn.fetch(
+        sql,
+        [c.product_id for c in changes], [c.quantity_change for c in changes], [c.movement_type for c in changes],
+        [c.unit_cost for c in changes], [c.description for c in changes],
+        moved_at, source_document_type, source_document_id
+    )
+    return {row['product_id']: StockResult(row['product_id'], row['old_quantity'], row['new_quantity'], row['shortfall']) for row in rows}
+
+
+async def apply_stock_changes(
+    conn: asyncpg.Connection,
+    changes: list[StockChange],
+    source_document_type: Optional[str] = None,
+    source_document_id: Optional[int] = None
+) -> dict[int, StockResult]:
+    """
+    Применяет изменения остатков и пишет движения. Возвращает результат по каждому товару.
+    Нехватка (shortfall > 0) не ошибка: остаток отсекается на нуле, как и раньше.
+    """
+    if not changes:
+        return {}
+    moved_at = datetime.now()
+    results = await _run(conn, _SKIP_LOCKED_SQL, changes, moved_at, source_document_type, source_document_id)
+
+    contended = [c for c in changes if c.product_id not in results]
+    if contended:
+        # Строки заняты другой транзакцией — ждем их в отдельном проходе и учитываем ожидание
+        started = time.perf_counter()
+        results.update(await _run(conn, _WAIT_SQL, contended, moved_at, source_document_type, source_document_id))
+        waited = time.perf_counter() - started
+        for product_id in {c.product_id for c in contended}:
+            label = stock_lock_product(product_id)
+            STOCK_LOCK_WAITS_TOTAL.inc(label)
+            STOCK_LOCK_WAIT_SECONDS.observe(waited, label)
+        logger.debug("Ожидание блокировки остатков %s: %.3f с.", sorted({c.product_id for c in contended}), waited)
+
+    for result in results.values():
+        if result.shortfall > 0:
+            logger.warning(
+                "Попытка списать больше остатка по продукту %s (было %s, не хватило %s). Списание до 0.",
+                result.product_id, result.old_quantity, result.shortfall
+            )
+    return results
@@ -0,0 +1,127 @@
+# db_operations/stock_reservations.py
+"""
+Мягкие резервы товара под черновики заказов.
+
+При сохранении/редактировании черновика его строки резервируются в таблице
+stock_reservations (ключ order_id + product_id) в пределах свободного остатка:
+остаток минус действующие резервы других черновиков. Резерв живет RESERVATION_TTL,
+продлевается при каждом сохранении черновика и снимается при подтверждении или отмене.
+Просроченные резервы удаляет фоновый sweeper.
+
+Функции reserve_*/release_*/get_reserved_by_others работают с переданным соединением
+и должны вызываться внутри транзакции вызывающего кода.
+"""
+
+import asyncio
+import logging
+from datetime import timedelta
+from decimal import Decimal
+from typing import NamedTuple
+
+import asyncpg
+
+logger = logging.getLogger(__name__)
+
+# Сколько живет резерв черновика без повторного сохранения
+RESERVATION_TTL = timedelta(hours=48)
+
+# Как часто удалять просроченные резервы
+SWEEP_INTERVAL_SECONDS = 300
+
+
+class ReservationResult(NamedTuple):
+    reserved: dict      # product_id -> зарезервированное количество
+    shortfall: dict     # product_id -> сколько не удалось зарезервировать
+
+
+async def lock_stock_rows(conn: asyncpg.Connection, product_ids) -> dict[int, Decimal]:
+    """
+    Блокирует строки stock по товарам (в порядке product_id, чтобы не было взаимоблокировок)
+    и возвращает их остатки. Товары без строки в stock считаются с нулевым остатком.
+    """
+    product_ids = sorted(set(product_ids))
+    rows = await conn.fetch(
+        "SELECT product_id, quantity FROM stock WHERE product_id = ANY($1::int[]) ORDER BY product_id FOR UPDATE",
+        product_ids
+    )
+    on_hand = {product_id: Decimal('0') for product_id in product_ids}
+    on_hand.update({row['product_id']: row['quantity'] for row in rows})
+    return on_hand
+
+
+async def get_reserved_by_others(conn: asyncpg.Connection, order_id: int, product_ids) -> dict[int, Decimal]:
+    """Действующие резервы других заказов по указанным товарам."""
+    rows = await conn.fetch("""
+        SELECT product_id, SUM(quantity) AS quantity
+        FROM stock_reservations
+        WHERE product_id = ANY($1::int[]) AND order_id <> $2 AND expires_at > now()
+        GROUP BY product_id;
+    """, list(set(product_ids)), order_id)
+    return {row['product_id']: row['quantity'] for row in rows}
+
+
+async def reserve_order_lines(conn: asyncpg.Connection, order_id: int, quantities: dict, ttl: timedelta = RESERVATION_TTL) -> ReservationResult:
+    """
+    Пересоздает резервы черновика по его строкам (product_id -> количество).
+    Резервируется не больше свободного остатка; недостающее возвращается в shortfall.
+    """
+    await conn.execute("DELETE FROM stock_reservations WHERE order_id = $1;", order_id)
+    if not quantities:
+        return ReservationResult({}, {})
+
+    on_hand = await lock_stock_rows(conn, quantities)
+    reserved_by_others = await get_reserved_by_others(conn, order_id, quantities)
+
+    reserved, shortfall = {}, {}
+    for product_id, requested in quantities.items():
+        free = max(on_hand[product_id] - reserved_by_others.get(product_id, Decimal('0')), Decimal('0'))
+        to_reserve = min(Decimal(requested), free)
+        if to_reserve > 0:
+            reserved[product_id] = to_reserve
+        if to_reserve < requested:
+            shortfall[product_id] = Decimal(requested) - to_reserve
+
+    if reserved:
+        await conn.execute("""
+            INSERT INTO stock_reservations (order_id, product_id, quantity, expires_at)
+            SELECT $1, product_id, quantity, now() + $4::interval
+            FROM unnest($2::int[], $3::numeric[]) AS r(product_id, quantity);
+        """, order_id, list(reserved), list(reserved.values()), ttl)
+
+    if shortfall:
+        logger.info(f"Черновик #{order_id}: зарезервировано не полностью, нехватка {shortfall}.")
+    return ReservationResult(reserved, shortfall)
+
+
+async def release_order_reservations(conn: asyncpg.Connection, order_ids) -> None:
+    """Снимает резервы заказов (при подтверждении или отмене)."""
+    await conn.execute("DELETE FROM stock_reservations WHERE order_id = ANY($1::int[]);", list(order_ids))
+
+
+async def sweep_expired_reservations(pool) -> list[int]:
+    """Удаляет просроченные резервы. Возвращает ID заказов, чьи резервы удалены."""
+    conn = None
+    try:
+        conn = await pool.acquire()
+        rows = await conn.fetch("DELETE FROM stock_reservations WHERE expires_at <= now() RETURNING order_id;")
+        order_ids = sorted({row['order_id'] for row in rows})
+        if order_ids:
+            logger.info(f"Удалены просроченные резервы черновиков: {order_ids}.")
+        return order_ids
+    except asyncpg.exceptions.PostgresError as e:
+        logger.error(f"Ошибка asyncpg при удалении просроченных резервов: {e}", exc_info=True)
+        return []
+    finally:
+        if conn:
+            await pool.release(conn)
+
+
+async def run_reservation_sweeper(pool, interval: float = SWEEP_INTERVAL_SECONDS) -> None:
+    """Фоновая задача: периодически удаляет просроченные резервы и снимает их из снимка доступности."""
+    from db_operations.stock_availability import stock_availability
+
+    while True:
+        expired_order_ids = await sweep_expired_reservations(pool)
+        if expired_order_ids:
+            stock_availability.release_orders(expired_order_ids)
+        await asyncio.sleep(interval)
@@ -6,6 +6,11 @@ from typing import List, Dict, Optional, NamedTuple
 from datetime import date, datetime
 from decimal import Decimal
 
+from db_operations.product_operations import record_stock_movement
+from db_operations.outbox import STOCK_RECEIVED, add_event
+from db_operations.replica import reads_from_replica, replica
+from db_operations.query_classes import REPORT, with_query_class
+
 logger = logging.getLogger(__name__)
 
 # --- ОБНОВЛЕННЫЕ ОПРЕДЕЛЕНИЯ NAMEDTUPLE ---
@@ -180,7 +185,7 @@ async def get_all_suppliers(pool: asyncpg.Pool) -> List[Dict]:
     conn = None
     try:
         conn = await pool.acquire()
-        suppliers = await conn.fetch("SELECT supplier_id, name FROM suppliers ORDER BY name LIMIT 10;") # Ограничиваем 10, как запрошено
+        suppliers = await conn.fetch("SELECT supplier_id, name FROM suppliers ORDER BY name;")
         return [dict(s) for s in suppliers]
     except Exception as e:
         logger.error(f"Ошибка при получении списка поставщиков: {e}", exc_info=True)
@@ -334,9 +339,7 @@ async def record_incoming_delivery(
             if not delivery_line_id:
                 raise Exception("Не удалось создать запись о позиции поступления в incoming_deliveries.")
 
-            import db_operations.product_operations
-
-            success = await db_operations.product_operations.record_stock_movement(
+            success = await record_stock_movement(
                 db_pool=pool,
                 product_id=product_id,
                 quantity=quantity,
@@ -349,6 +352,9 @@ async def record_incoming_delivery(
             if not success:
                 raise Exception(f"Не удалось записать движение на складе для продукта {product_id}.")
 
+            await add_event(conn, STOCK_RECEIVED, product_id, {"quantity": quantity, "delivery_id": delivery_line_id})
+            replica.note_write()
+
             logger.info(f"Записана позиция поступления ID {delivery_line_id} для накладной поставщика {supplier_invoice_id or 'без номера'}.")
             return delivery_line_id
     except asyncpg.exceptions.PostgresError as e:
@@ -399,6 +405,8 @@ async def get_supplier_incoming_deliveries(pool: asyncpg.Pool, supplier_id: int)
         if conn:
             await pool.release(conn)
 
+@reads_from_replica
+@with_query_class(REPORT)
 async def get_incoming_deliveries_for_date(pool: asyncpg.Pool, target_date: date) -> List[IncomingDeliveryReportItem]:
     """
     Получает отчет о поступлениях товара за указанную дату.
@@ -439,6 +447,8 @@ async def get_incoming_deliveries_for_date(pool: asyncpg.Pool, target_date: date
         if conn:
             await pool.release(conn)
 
+@reads_from_replica
+@with_query_class(REPORT)
 async def get_supplier_payments_for_date(pool: asyncpg.Pool, target_date: date) -> List[SupplierPaymentReportItem]:
     """
     Получает отчет об оплатах поставщикам за указанную дату.
@@ -0,0 +1,298 @@
+# db_operations/write_journal.py
+"""
+Локальный журнал записей на время недоступности PostgreSQL.
+
+Сохранение заказа и действия с оплатами выполняются через write_journal.write(...). Каждая запись
+получает ключ идемпотентности (uuid, db_operations/client_keys.py). Если БД недоступна
+(DB_UNAVAILABLE_ERRORS), действие с этим ключом дописывается в SQLite-файл WRITE_JOURNAL_PATH
+(WAL, synchronous=FULL — запись переживает перезапуск бота), а пользователь продолжает работу.
+
+Фоновый проигрыватель раз в REPLAY_INTERVAL_SECONDS пробует применить журнал строго по порядку,
+пачками по REPLAY_BATCH_SIZE: одна транзакция на пачку, точка сохранения на каждую запись.
+Запись, которую БД отклонила (например, накладная уже отменена), помечается failed и не
+блокирует остальные; сотрудник получает итог по своим записям в Telegram.
+Повтор записи, которая уже дошла до БД (обрыв связи во время COMMIT), пропускается по ключу.
+
+Пока в журнале есть записи, новые записи сначала проигрывают его, чтобы не обогнать более ранние
+действия (например, отмена оплаты не должна попасть в БД раньше самой оплаты).
+"""
+
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import uuid
+from datetime import datetime
+from decimal import Decimal
+from typing import Any, Awaitable, Callable, NamedTuple, Optional
+
+import asyncpg
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError
+
+from config import WRITE_JOURNAL_PATH
+from db_operations import DB_UNAVAILABLE_ERRORS
+from db_operations.order_saving import ORDER_SAVE, OrderToSave, after_order_saved, save_order
+from db_operations.report_payment_operations import (
+    PAYMENT_FULL, PAYMENT_PARTIAL, PAYMENT_REVERSE,
+    apply_full_payment, apply_partial_payment, apply_payment_reversal
+)
+from utils.markdown_utils import escape_markdown_v2
+from utils.metrics import JOURNAL_ENTRIES_TOTAL
+
+logger = logging.getLogger(__name__)
+
+REPLAY_BATCH_SIZE = 200
+REPLAY_INTERVAL_SECONDS = 10
+
+_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS journal (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        client_key TEXT NOT NULL UNIQUE,
+        kind TEXT NOT NULL,
+        payload TEXT NOT NULL,
+        telegram_id INTEGER,
+        chat_id INTEGER,
+        created_at TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'pending',
+        last_error TEXT
+    );
+    CREATE INDEX IF NOT EXISTS journal_status_seq ON journal (status, seq);
+"""
+
+
+class JournalEntry(NamedTuple):
+    seq: int
+    client_key: str
+    kind: str
+    payload: dict
+    telegram_id: Optional[int]
+    chat_id: Optional[int]
+    created_at: datetime
+
+
+class JournalWrite(NamedTuple):
+    result: Any                 # результат записи в БД; None, если действие ушло в журнал
+    journaled: bool
+
+
+class _Applied(NamedTuple):
+    entry: JournalEntry
+    ok: bool
+    text: str
+    saved_order: Any = None     # SavedOrder для after_order_saved после коммита пачки
+
+
+def _describe(entry: JournalEntry) -> str:
+    payload = entry.payload
+    if entry.kind == ORDER_SAVE:
+        if payload.get("editing_order_id"):
+            return f"Изменение заказа №{payload['editing_order_id']}"
+        return f"Заказ от {entry.created_at:%d.%m %H:%M}"
+    if entry.kind == PAYMENT_FULL:
+        return f"Оплата накладной #{payload['order_id']}"
+    if entry.kind == PAYMENT_PARTIAL:
+        return f"Частичная оплата {payload['amount']} грн по накладной #{payload['order_id']}"
+    return f"Отмена оплаты накладной #{payload['order_id']}"
+
+
+async def _apply_entry(conn: asyncpg.Connection, entry: JournalEntry) -> _Applied:
+    payload = entry.payload
+    if entry.kind == ORDER_SAVE:
+        saved = await save_order(conn, OrderToSave.from_payload(payload), entry.client_key)
+        if saved is None:
+            return _Applied(entry, False, f"{_describe(entry)}: сотрудник не найден")
+        verb = "обновлен" if payload.get("editing_order_id") else "сохранен"
+        return _Applied(entry, True, f"Заказ №{saved.order_id} {verb}", saved)
+    if entry.kind == PAYMENT_FULL:
+        ok = await apply_full_payment(conn, payload["order_id"], entry.client_key, entry.created_at)
+    elif entry.kind == PAYMENT_PARTIAL:
+        ok = await apply_partial_payment(conn, payload["order_id"], Decimal(payload["amount"]), entry.client_key, entry.created_at)
+    elif entry.kind == PAYMENT_REVERSE:
+        ok = await apply_payment_reversal(conn, payload["order_id"], entry.client_key, entry.created_at)
+    else:
+        return _Applied(entry, False, f"неизвестный тип записи {entry.kind}")
+    if ok:
+        return _Applied(entry, True, _describe(entry))
+    return _Applied(entry, False, f"{_describe(entry)}: накладная не найдена или не подтверждена")
+
+
+class WriteJournal:
+    def __init__(self, path: str = WRITE_JOURNAL_PATH, batch_size: int = REPLAY_BATCH_SIZE,
+                 interval: float = REPLAY_INTERVAL_SECONDS):
+        self.path = path
+        self.batch_size = batch_size
+        self.interval = interval
+        self.pool = None
+        self.bot: Optional[Bot] = None
+        self._db: Optional[sqlite3.Connection] = None
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    # --- SQLite ---
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._db is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            db = sqlite3.connect(self.path, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=FULL")
+            db.executescript(_SCHEMA)
+            self._db = db
+        return self._db
+
+    def append(self, kind: str, client_key: str, payload: dict, telegram_id: Optional[int], chat_id: Optional[int]) -> None:
+        """Дописывает действие в журнал. Повтор того же ключа (двойное нажатие) игнорируется."""
+        self._connect().execute(
+            "INSERT OR IGNORE INTO journal (client_key, kind, payload, telegram_id, chat_id, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (client_key, kind, json.dumps(payload, ensure_ascii=False, default=str), telegram_id, chat_id, datetime.now().isoformat())
+        )
+        JOURNAL_ENTRIES_TOTAL.inc("journaled")
+
+    def pending_count(self) -> int:
+        return self._connect().execute("SELECT COUNT(*) FROM journal WHERE status = 'pending'").fetchone()[0]
+
+    def _pending(self, limit: int) -> list[JournalEntry]:
+        rows = self._connect().execute(
+            "SELECT seq, client_key, kind, payload, telegram_id, chat_id, created_at FROM journal "
+            "WHERE status = 'pending' ORDER BY seq LIMIT ?", (limit,)
+        ).fetchall()
+        return [
+            JournalEntry(seq, client_key, kind, json.loads(payload), telegram_id, chat_id, datetime.fromisoformat(created_at))
+            for seq, client_key, kind, payload, telegram_id, chat_id, created_at in rows
+        ]
+
+    def _finish(self, applied: list[_Applied]) -> None:
+        db = self._connect()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            db.executemany("DELETE FROM journal WHERE seq = ?", [(a.entry.seq,) for a in applied if a.ok])
+            db.executemany(
+                "UPDATE journal SET status = 'failed', last_error = ? WHERE seq = ?",
+                [(a.text, a.entry.seq) for a in applied if not a.ok]
+            )
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+
+    # --- Запись и проигрывание ---
+
+    async def write(
+        self,
+        pool,
+        kind: str,
+        payload: dict,
+        write: Callable[[str], Awaitable[Any]],
+        telegram_id: Optional[int] = None,
+        chat_id: Optional[int] = None,
+        client_key: Optional[str] = None
+    ) -> JournalWrite:
+        """
+        Выполняет write(client_key) в БД. Если БД недоступна — записывает действие в журнал
+        и возвращает JournalWrite(None, journaled=True).
+        """
+        client_key = client_key or str(uuid.uuid4())
+        try:
+            if self.pending_count():
+                # Сначала более ранние действия из журнала, чтобы не нарушить порядок
+                await self.replay(pool)
+                if self.pending_count():
+                    raise ConnectionError("журнал не проигран до конца")
+            return JournalWrite(await write(client_key), journaled=False)
+        except DB_UNAVAILABLE_ERRORS as e:
+            self.append(kind, client_key, payload, telegram_id, chat_id)
+            logger.warning("БД недоступна (%s), действие %s записано в локальный журнал (ключ %s).", e, kind, client_key)
+            return JournalWrite(None, journaled=True)
+
+    async def replay(self, pool) -> int:
+        """
+        Проигрывает журнал пачками, пока он не опустеет. Возвращает число обработанных записей.
+        При недоступности БД пробрасывает ошибку из DB_UNAVAILABLE_ERRORS (пачка откатывается целиком).
+        """
+        processed = 0
+        async with self._lock:
+            while True:
+                entries = self._pending(self.batch_size)
+                if not entries:
+                    break
+                applied = await self._apply_batch(pool, entries)
+                self._finish(applied)
+                for item in applied:
+                    if item.saved_order is not None:
+                        after_order_saved(item.saved_order)
+                    JOURNAL_ENTRIES_TOTAL.inc("replayed" if item.ok else "failed")
+                processed += len(applied)
+                await self._notify(applied)
+        if processed:
+            logger.info("Локальный журнал проигран: %d записей.", processed)
+        return processed
+
+    async def _apply_batch(self, pool, entries: list[JournalEntry]) -> list[_Applied]:
+        applied = []
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                for entry in entries:
+                    try:
+                        # Точка сохранения: ошибка одной записи не откатывает остальные
+                        async with conn.transaction():
+                            applied.append(await _apply_entry(conn, entry))
+                    except DB_UNAVAILABLE_ERRORS:
+                        raise
+                    except (asyncpg.exceptions.PostgresError, KeyError, ValueError) as e:
+                        logger.error("Запись журнала #%d (%s) отклонена: %s", entry.seq, entry.kind, e)
+                        applied.append(_Applied(entry, False, f"{_describe(entry)}: {e}"))
+        return applied
+
+    async def _notify(self, applied: list[_Applied]) -> None:
+        if self.bot is None:
+            return
+        by_chat: dict[int, list[str]] = {}
+        for item in applied:
+            if item.entry.chat_id is not None:
+                by_chat.setdefault(item.entry.chat_id, []).append(("✅ " if item.ok else "❌ ") + item.text)
+        for chat_id, lines in by_chat.items():
+            try:
+                await self.bot.send_message(
+                    chat_id,
+                    escape_markdown_v2("🔄 Связь с базой восстановлена. Действия из журнала:\n" + "\n".join(lines)),
+                    parse_mode="MarkdownV2"
+                )
+            except TelegramAPIError as e:
+                logger.warning("Не удалось отправить итог проигрывания журнала в чат %s: %s", chat_id, e)
+
+    # --- Фоновый проигрыватель ---
+
+    async def start(self, pool, bot: Optional[Bot] = None) -> None:
+        self.pool, self.bot = pool, bot
+        pending = self.pending_count()
+        if pending:
+            logger.warning("В локальном журнале %d непроигранных записей.", pending)
+        self._task = asyncio.create_task(self._replay_loop())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    async def _replay_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            if not self.pending_count():
+                continue
+            try:
+                await self.replay(self.pool)
+            except DB_UNAVAILABLE_ERRORS as e:
+                logger.info("БД все еще недоступна, журнал будет проигран позже: %s", e)
+            except Exception as e:
+                logger.error("Ошибка при проигрывании локального журнала: %s", e, exc_info=True)
+
+
+# Глобальный экземпляр
+write_journal = WriteJournal()
@@ -1,40 +1,110 @@
 # handlers/__init__.py
 
-# handlers/__init__.py
+import importlib
+import logging
+import time
+
+logger = logging.getLogger(__name__)
 
-from .orders.client_selection import router as client_router
-from .orders.addresses_selection import router as address_router
-from .orders.product_selection import router as product_router
-from .orders.order_editor import router as editor_router
-from .main_menu import router as main_menu_router # <--- Этот импорт вызывает ошибку
-from .reports.order_confirmation_report import router as order_confirmation_report_router 
-from .reports.my_orders_report import router as my_orders_report_router
-from .reports.client_payments_report import router as client_payments_report_router
-from .reports.supplier_reports import router as supplier_reports_router
-from .reports.inventory_report import router as inventory_report_router 
-from .reports.add_delivery_handler import router as add_delivery_handler_router
-from .admin_orders.admin_order_editor import router as admin_order_editor_router
-from .inventory_adjustments.main_adjustment_menu import router as main_adjustment_menu_router
-from .inventory_adjustments.client_returns_handler import router as client_returns_router
-from .inventory_adjustments.supplier_returns_handler import router as supplier_returns_router
-from .inventory_adjustments.stock_adjustments_handler import router as stock_adjustments_router
-
-# Собираем все router-ы в список
-order_routers = [
-    client_router,
-    address_router,
-    product_router,
-    editor_router,
-    main_menu_router,
-    order_confirmation_report_router, 
-    my_orders_report_router,
-    client_payments_report_router,
-    supplier_reports_router,
-    inventory_report_router,    
-    add_delivery_handler_router,
-    admin_order_editor_router,
-    main_adjustment_menu_router,
-    client_returns_router,
-    supplier_returns_router,
-    stock_adjustments_router
+# Модули с роутерами в порядке подключения к диспетчеру.
+# Порядок важен: он определяет приоритет хендлеров при совпадении фильтров.
+ROUTER_MODULES = [
+    # Выбор из inline-поиска должен обрабатываться раньше текстового ввода шагов заказа
+    "handlers.orders.inline_search",
+    "handlers.orders.client_selection",
+    "handlers.orders.addresses_selection",
+    "handlers.orders.product_selection",
+    "handlers.orders.order_editor",
+    "handlers.main_menu",
+    "handlers.reports.order_confirmation_report",
+    "handlers.reports.my_orders_report",
+    "handlers.reports.sales_report",
+    "handlers.reports.client_payments_report",
+    "handlers.reports.supplier_reports",
+    "handlers.reports.inventory_report",
+    "handlers.reports.add_delivery_handler",
+    "handlers.admin_orders.admin_order_editor",
+    "handlers.inventory_adjustments.main_adjustment_menu",
+    "handlers.inventory_adjustments.client_returns_handler",
+    "handlers.inventory_adjustments.supplier_returns_handler",
+    "handlers.inventory_adjustments.stock_adjustments_handler",
 ]
+
+# Права, необходимые для работы с роутером: модуль -> (раздел, пункт) из access_control.ROLE_PERMISSIONS.
+# Фильтр вешается на роутер целиком, поэтому апдейты от пользователей без нужной роли
+# отбрасываются до выполнения хендлеров и запросов к БД. Модули без записи доступны всем.
+ROUTER_ACCESS = {
+    "handlers.orders.inline_search": ("orders", "create"),
+    "handlers.orders.client_selection": ("orders", "create"),
+    "handlers.orders.addresses_selection": ("orders", "create"),
+    "handlers.orders.product_selection": ("orders", "create"),
+    "handlers.orders.order_editor": ("orders", "create"),
+    "handlers.reports.order_confirmation_report": ("orders", "confirm"),
+    "handlers.reports.my_orders_report": ("reports", "sales"),
+    "handlers.reports.sales_report": ("reports", "sales"),
+    "handlers.reports.client_payments_report": ("reports", "clients"),
+    "handlers.reports.supplier_reports": ("reports", "inventory"),
+    "handlers.reports.inventory_report": ("reports", "inventory"),
+    "handlers.reports.add_delivery_handler": ("inventory", "deliveries"),
+    "handlers.admin_orders.admin_order_editor": ("orders", "edit_any"),
+    "handlers.inventory_adjustments.main_adjustment_menu": ("inventory", "adjustments"),
+    "handlers.inventory_adjustments.client_returns_handler": ("inventory", "adjustments"),
+    "handlers.inventory_adjustments.supplier_returns_handler": ("inventory", "adjustments"),
+    "handlers.inventory_adjustments.stock_adjustments_handler": ("inventory", "adjustments"),
+}
+
+# Время импорта каждого модуля в секундах (включая впервые подтянутые им зависимости).
+# Заполняется при первом вызове load_routers().
+ROUTER_IMPORT_TIMES: dict[str, float] = {}
+
+_order_routers = None
+
+
+def load_routers() -> list:
+    """
+    Импортирует модули хендлеров и возвращает список их роутеров.
+    Импорт выполняется один раз; повторные вызовы возвращают тот же список.
+    """
+    global _order_routers
+    if _order_routers is not None:
+        return _order_routers
+
+    from access_control import RoleAccessFilter
+    from utils.metrics import HandlerMetricsMiddleware
+
+    routers = []
+    for module_name in ROUTER_MODULES:
+        started = time.perf_counter()
+        module = importlib.import_module(module_name)
+        ROUTER_IMPORT_TIMES[module_name] = time.perf_counter() - started
+        router = module.router
+        if module_name in ROUTER_ACCESS:
+            access_filter = RoleAccessFilter(*ROUTER_ACCESS[module_name])
+            router.message.filter(access_filter)
+            router.callback_query.filter(access_filter)
+            router.inline_query.filter(access_filter)
+        # Метрики хендлеров по роутерам: метка — имя модуля без пакета handlers
+        metrics_middleware = HandlerMetricsMiddleware(module_name.removeprefix("handlers."))
+        router.message.middleware(metrics_middleware)
+        router.callback_query.middleware(metrics_middleware)
+        router.inline_query.middleware(metrics_middleware)
+        routers.append(router)
+
+    _order_routers = routers
+
+    total = sum(ROUTER_IMPORT_TIMES.values())
+    slowest = sorted(ROUTER_IMPORT_TIMES.items(), key=lambda item: item[1], reverse=True)[:3]
+    logger.info(
+        "Загружено %d роутеров за %.1f мс. Самые тяжелые модули: %s",
+        len(routers), total * 1000,
+        ", ".join(f"{name} ({seconds * 1000:.1f} мс)" for name, seconds in slowest)
+    )
+    return _order_routers
+
+
+def __getattr__(name):
+    # Совместимость: `from handlers import order_routers` продолжает работать,
+    # но модули хендлеров импортируются только при первом обращении.
+    if name == "order_routers":
+        return load_routers()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
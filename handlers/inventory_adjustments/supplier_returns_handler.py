@@ -16,9 +16,11 @@ from states.order import OrderFSM # Убедитесь, что OrderFSM импо
 # ИМПОРТЫ ИЗ db_operations
 from db_operations.product_operations import get_all_products_for_selection, ProductItem, record_stock_movement, get_product_by_id
 from db_operations.supplier_operations import (
-    find_suppliers_by_name, get_supplier_by_id, get_supplier_incoming_deliveries,
+    get_supplier_incoming_deliveries,
     record_supplier_payment_or_return, IncomingDeliveryLine, Supplier, SupplierInvoice
 )
+from db_operations.reference_cache import reference_cache
+from keyboards.inline_keyboards import build_supplier_page_keyboard
 
 router = Router()
 logger = logging.getLogger(__name__)
@@ -27,13 +29,12 @@ MAX_RESULTS_TO_SHOW = 10
 
 # --- Клавиатуры ---
 
-def build_supplier_selection_keyboard(suppliers: List[Supplier]) -> InlineKeyboardMarkup:
-    """Строит клавиатуру для выбора поставщиков (MAX_RESULTS_TO_SHOW)."""
-    buttons = []
-    for supplier in suppliers[:MAX_RESULTS_TO_SHOW]:
-        buttons.append([InlineKeyboardButton(text=escape_markdown_v2(supplier.name), callback_data=f"select_supplier_return_supplier_{supplier.supplier_id}")])
-    buttons.append([InlineKeyboardButton(text="❌ Отмена", callback_data="cancel_any_adjustment_flow")])
-    return InlineKeyboardMarkup(inline_keyboard=buttons)
+def build_supplier_selection_keyboard(suppliers: List[Supplier], offset: int = 0) -> InlineKeyboardMarkup:
+    """Строит клавиатуру для выбора поставщиков (постранично по MAX_RESULTS_TO_SHOW)."""
+    return build_supplier_page_keyboard(
+        suppliers, offset, "select_supplier_return_supplier_", "return_suppliers_page",
+        "cancel_any_adjustment_flow", page_size=MAX_RESULTS_TO_SHOW
+    )
 
 def build_incoming_delivery_selection_keyboard(deliveries: List[IncomingDeliveryLine]) -> InlineKeyboardMarkup:
     """Строит клавиатуру для выбора входящих поставок от поставщика (MAX_RESULTS_TO_SHOW)."""
@@ -101,7 +102,7 @@ async def start_supplier_return_flow(message: Message, state: FSMContext, db_poo
 @router.message(StateFilter(OrderFSM.supplier_return_waiting_for_supplier_name))
 async def process_supplier_return_supplier_name_input(message: Message, state: FSMContext, db_pool):
     supplier_name_query = message.text.strip()
-    suppliers = await find_suppliers_by_name(db_pool, supplier_name_query)
+    suppliers = await reference_cache.find_suppliers(db_pool, supplier_name_query)
 
     if suppliers:
         if len(suppliers) == 1:
@@ -111,19 +112,27 @@ async def process_supplier_return_supplier_name_input(message: Message, state: F
             
             await message.answer(escape_markdown_v2("Введите номер поставки для возврата (или часть номера), или 'нет', если без привязки к поставке:"), parse_mode="MarkdownV2")
             await state.set_state(OrderFSM.supplier_return_waiting_for_delivery_selection)
-        elif 1 < len(suppliers) <= MAX_RESULTS_TO_SHOW:
-            keyboard = build_supplier_selection_keyboard(suppliers)
-            await message.answer(escape_markdown_v2("Найдено несколько поставщиков. Выберите одного:"), reply_markup=keyboard, parse_mode="MarkdownV2")
         else:
-            await message.answer(escape_markdown_v2(f"Найдено слишком много поставщиков ({len(suppliers)}). Пожалуйста, уточните запрос (введите больше символов имени)."), parse_mode="MarkdownV2")
+            # Запрос сохраняется для листания: страницы строятся из кэша без обращения к БД
+            await state.update_data(supplier_search_query=supplier_name_query)
+            keyboard = build_supplier_selection_keyboard(suppliers)
+            await message.answer(escape_markdown_v2(f"Найдено поставщиков: {len(suppliers)}. Выберите одного:"), reply_markup=keyboard, parse_mode="MarkdownV2")
     else:
         await message.answer("Поставщик с таким именем не найден. Пожалуйста, попробуйте еще раз или введите другое имя.")
 
+@router.callback_query(StateFilter(OrderFSM.supplier_return_waiting_for_supplier_name), F.data.startswith("return_suppliers_page:"))
+async def page_suppliers_for_return(callback: CallbackQuery, state: FSMContext, db_pool):
+    await callback.answer()
+    offset = int(callback.data.split(":")[1])
+    supplier_name_query = (await state.get_data()).get('supplier_search_query', '')
+    suppliers = await reference_cache.find_suppliers(db_pool, supplier_name_query)
+    await callback.message.edit_reply_markup(reply_markup=build_supplier_selection_keyboard(suppliers, offset))
+
 @router.callback_query(StateFilter(OrderFSM.supplier_return_waiting_for_supplier_name), F.data.startswith("select_supplier_return_supplier_"))
 async def select_supplier_for_return_from_list(callback: CallbackQuery, state: FSMContext, db_pool):
     await callback.answer()
     supplier_id = int(callback.data.split("_")[4])
-    supplier = await get_supplier_by_id(db_pool, supplier_id)
+    supplier = await reference_cache.get_supplier(db_pool, supplier_id)
     
     if supplier:
         await state.update_data(adj_supplier_id=supplier.supplier_id, adj_supplier_name=supplier.name)
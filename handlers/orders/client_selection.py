@@ -10,6 +10,7 @@ from utils.markdown_utils import escape_markdown_v2
 import asyncpg.exceptions 
 
 from utils.order_cache import order_cache, calculate_default_delivery_date
+from db_operations.reference_cache import reference_cache
 from handlers.orders.addresses_selection import build_address_keyboard 
 from handlers.orders.product_selection import send_all_products 
 # from handlers.orders.order_editor import escape_markdown_v2 # <- Если escape_markdown_v2 определена ниже, этот импорт не нужен
@@ -37,13 +38,17 @@ async def start_order_process(message: Message, state: FSMContext, db_pool):
             cart=cached_data.get("cart"),
             delivery_date=cached_data.get("delivery_date")
         )
-        logger.info(f"Loaded cached order for user {user_id}: {await state.get_data()}")
+        # Весь словарь FSM не логируем: корзина может быть большой, а строка собиралась бы в event loop
+        logger.info(
+            "Loaded cached order for user %s: client_id=%s, address_id=%s, cart items=%d",
+            user_id, cached_data.get("client_id"), cached_data.get("address_id"), len(cached_data.get("cart") or [])
+        )
     
     state_data_after_cache_load = await state.get_data()
     if not state_data_after_cache_load.get("delivery_date"):
         default_date = calculate_default_delivery_date()
         await state.update_data(delivery_date=default_date)
-        logger.info(f"Set default delivery date for user {user_id}: {default_date}")
+        logger.info("Set default delivery date for user %s: %s", user_id, default_date)
 
     await message.answer("Пожалуйста, введите имя или название клиента для поиска:")
     await state.set_state(OrderFSM.entering_client_name)
@@ -63,7 +68,7 @@ async def process_client_name_input(message: Message, state: FSMContext, db_pool
                 await state.update_data(client_id=client['client_id'], client_name=client['name']) # <-- ИЗМЕНЕНО: client['client_id'], client['name']
                 await message.answer(f"✅ Выбран клиент: *{escape_markdown_v2(client['name'])}*", parse_mode="MarkdownV2") # <-- ИЗМЕНЕНО: client['name']
                 
-                addresses = await conn.fetch("SELECT address_id, address_text FROM addresses WHERE client_id = $1", client['client_id']) # <-- ИЗМЕНЕНО: client['client_id']
+                addresses = await reference_cache.get_client_addresses(db_pool, client['client_id'])
 
                 if addresses:
                     await message.answer("Выберите адрес доставки:", reply_markup=build_address_keyboard(addresses))
@@ -108,7 +113,7 @@ async def select_client_from_list(callback: CallbackQuery, state: FSMContext, db
             await callback.answer(f"Клиент выбран: {client['name']}", show_alert=True) # <-- ИЗМЕНЕНО: client['name']
             await callback.message.edit_text(f"✅ Выбран клиент: *{escape_markdown_v2(client['name'])}*", parse_mode="MarkdownV2", reply_markup=None) # <-- ИЗМЕНЕНО: client['name']
             
-            addresses = await conn.fetch("SELECT address_id, address_text FROM addresses WHERE client_id = $1", client_id)
+            addresses = await reference_cache.get_client_addresses(db_pool, client_id)
 
             if addresses:
                 await callback.message.answer("Выберите адрес доставки:", reply_markup=build_address_keyboard(addresses))
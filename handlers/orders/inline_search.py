@@ -0,0 +1,138 @@
+# handlers/orders/inline_search.py
+"""
+Inline-режим: @bot <текст> ищет товары или клиентов по индексу в памяти (db_operations/catalog_search.py).
+
+Что ищется, зависит от шага заказа: на шаге выбора клиента — клиенты, в остальных случаях — товары.
+Выбранный результат отправляется в чат сообщением "🛒 Товар #<id>: ..." / "👤 Клиент #<id>: ...",
+которое здесь же передается в текущий шаг заказа: товар — на ввод количества, клиент — на выбор адреса.
+
+Inline-режим должен быть включен у бота в @BotFather (/setinline).
+"""
+import logging
+
+from aiogram import Router, F
+from aiogram.fsm.context import FSMContext
+from aiogram.types import InlineQuery, InlineQueryResultArticle, InputTextMessageContent, Message
+
+from states.order import OrderFSM
+from db_operations.catalog_search import CLIENTS, PRODUCTS, catalog_search
+from db_operations.reference_cache import reference_cache
+from db_operations.stock_availability import stock_availability, format_quantity
+from handlers.orders.addresses_selection import build_address_keyboard
+from utils.markdown_utils import escape_markdown_v2
+
+router = Router()
+logger = logging.getLogger(__name__)
+
+# Результатов на одну страницу ответа (Telegram допускает до 50)
+INLINE_PAGE_SIZE = 20
+
+# Шаги заказа, на которых inline-поиск ищет клиентов
+CLIENT_STATES = {OrderFSM.entering_client_name.state, OrderFSM.selecting_multiple_clients.state}
+
+# Шаги заказа, на которых можно добавить товар из inline-поиска
+PRODUCT_STATES = {
+    OrderFSM.selecting_product.state, OrderFSM.entering_quantity.state,
+    OrderFSM.choosing_next_action.state, OrderFSM.editing_order.state,
+}
+
+PRODUCT_MESSAGE_PREFIX = "🛒 Товар #"
+CLIENT_MESSAGE_PREFIX = "👤 Клиент #"
+
+
+def _product_result(entry, editing_order_id) -> InlineQueryResultArticle:
+    description = f"{entry.price:.2f}₴" if entry.price is not None else ""
+    available = stock_availability.available(entry.entry_id, exclude_order_id=editing_order_id)
+    if available is not None:
+        description += f" · доступно: {format_quantity(max(available, 0))} шт."
+    return InlineQueryResultArticle(
+        id=f"p{entry.entry_id}",
+        title=entry.name,
+        description=description,
+        input_message_content=InputTextMessageContent(
+            message_text=f"{PRODUCT_MESSAGE_PREFIX}{entry.entry_id}: {entry.name}",
+            parse_mode=None  # обычный текст: по умолчанию бот отправляет MarkdownV2, а '#' и имя не экранированы
+        )
+    )
+
+
+def _client_result(entry) -> InlineQueryResultArticle:
+    return InlineQueryResultArticle(
+        id=f"c{entry.entry_id}",
+        title=entry.name,
+        input_message_content=InputTextMessageContent(
+            message_text=f"{CLIENT_MESSAGE_PREFIX}{entry.entry_id}: {entry.name}",
+            parse_mode=None
+        )
+    )
+
+
+@router.inline_query()
+async def search_inline(inline_query: InlineQuery, state: FSMContext):
+    offset = int(inline_query.offset) if inline_query.offset.isdigit() else 0
+    current_state = await state.get_state()
+    kind = CLIENTS if current_state in CLIENT_STATES else PRODUCTS
+
+    entries, next_offset = catalog_search.search(kind, inline_query.query, offset, INLINE_PAGE_SIZE)
+    if kind == PRODUCTS:
+        editing_order_id = (await state.get_data()).get("editing_order_id")
+        results = [_product_result(entry, editing_order_id) for entry in entries]
+    else:
+        results = [_client_result(entry) for entry in entries]
+
+    # Результаты зависят от шага заказа и остатков, поэтому кэш Telegram короткий и личный
+    await inline_query.answer(
+        results,
+        cache_time=5,
+        is_personal=True,
+        next_offset=str(next_offset) if next_offset is not None else ""
+    )
+
+
+def _parse_selected_id(text: str, prefix: str) -> int | None:
+    head = text.removeprefix(prefix).split(":", 1)[0]
+    return int(head) if head.isdigit() else None
+
+
+@router.message(F.via_bot, F.text.startswith(PRODUCT_MESSAGE_PREFIX))
+async def process_inline_product(message: Message, state: FSMContext):
+    if await state.get_state() not in PRODUCT_STATES:
+        await message.answer(escape_markdown_v2("Чтобы добавить товар, начните заказ: /new_order"), parse_mode="MarkdownV2")
+        return
+
+    entry = catalog_search.get(PRODUCTS, _parse_selected_id(message.text, PRODUCT_MESSAGE_PREFIX))
+    if entry is None:
+        await message.answer(escape_markdown_v2("Товар не найден. Попробуйте выбрать его еще раз."), parse_mode="MarkdownV2")
+        return
+
+    # Тот же формат, что и при выборе из списка (product_selection.process_product_selection)
+    await state.update_data(selected_product={"product_id": entry.entry_id, "name": entry.name, "price": entry.price})
+    editing_order_id = (await state.get_data()).get("editing_order_id")
+    available = stock_availability.available(entry.entry_id, exclude_order_id=editing_order_id)
+    available_text = f" \\(доступно: *{escape_markdown_v2(format_quantity(available))}* шт\\.\\)" if available is not None else ""
+    await message.answer(f"Введите количество для *{escape_markdown_v2(entry.name)}*{available_text}:", parse_mode="MarkdownV2")
+    await state.set_state(OrderFSM.entering_quantity)
+
+
+@router.message(F.via_bot, F.text.startswith(CLIENT_MESSAGE_PREFIX))
+async def process_inline_client(message: Message, state: FSMContext, db_pool):
+    if await state.get_state() not in CLIENT_STATES:
+        await message.answer(escape_markdown_v2("Чтобы выбрать клиента, начните заказ: /new_order"), parse_mode="MarkdownV2")
+        return
+
+    entry = catalog_search.get(CLIENTS, _parse_selected_id(message.text, CLIENT_MESSAGE_PREFIX))
+    if entry is None:
+        await message.answer(escape_markdown_v2("Клиент не найден. Попробуйте выбрать его еще раз."), parse_mode="MarkdownV2")
+        return
+
+    # Дальше — как при выборе единственного найденного клиента (client_selection.process_client_name_input)
+    await state.update_data(client_id=entry.entry_id, client_name=entry.name)
+    await message.answer(f"✅ Выбран клиент: *{escape_markdown_v2(entry.name)}*", parse_mode="MarkdownV2")
+    addresses = await reference_cache.get_client_addresses(db_pool, entry.entry_id)
+    if addresses:
+        await message.answer("Выберите адрес доставки:", reply_markup=build_address_keyboard(addresses))
+        await state.set_state(OrderFSM.selecting_address)
+    else:
+        await message.answer(f"Для клиента *{escape_markdown_v2(entry.name)}* не найдено адресов\\. Пожалуйста, добавьте адрес вручную или выберите другого клиента\\.", parse_mode="MarkdownV2")
+        await state.clear()
+        await message.answer(escape_markdown_v2("Вы можете начать новый заказ."), parse_mode="MarkdownV2")
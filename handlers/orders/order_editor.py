@@ -1,8 +1,8 @@
 # handlers/orders/order_editor.py
 import logging
+import uuid
 from decimal import Decimal
 from datetime import date, timedelta
-import re 
 from utils.markdown_utils import escape_markdown_v2
 
 from aiogram import F, Router
@@ -14,9 +14,11 @@ from aiogram.exceptions import TelegramBadRequest
 # ОБНОВЛЕННЫЕ ИМПОРТЫ
 from handlers.orders.order_helpers import _get_cart_summary_text 
 from utils.order_cache import order_cache 
+from utils.cart_view import cart_view, format_cart_summary, is_not_modified_error, own_cart_edit, view_digest
 
-# Теперь импортируем только get_employee_id. db_pool будет передаваться.
-from db_operations import get_employee_id # <--- ИЗМЕНЕНО
+from db_operations.order_saving import ORDER_SAVE, OrderStatusChanged, OrderToSave, after_order_saved, save_order
+from db_operations.stock_availability import stock_availability, format_shortage_warning, format_quantity
+from db_operations.write_journal import write_journal
 import asyncpg.exceptions # Добавляем импорт для асинхронных ошибок БД
 
 from keyboards.inline_keyboards import build_cart_keyboard, delivery_date_keyboard, build_edit_item_menu_keyboard
@@ -31,8 +33,14 @@ async def show_cart_menu(message: Message, state: FSMContext, db_pool): # <--- 
     Показывает меню корзины с текущей сводкой.
     Пытается редактировать предыдущее сообщение корзины, если возможно, иначе отправляет новое.
     Данные корзины берутся из FSM-состояния.
+    Отрисовка идет через cart_view: правка пропускается, если корзина уже показана в том же виде,
+    а частые изменения подряд склеиваются в одну правку.
     """
-    user_id = message.from_user.id
+    await cart_view.refresh(message.chat.id, lambda: _render_cart_message(message, state))
+    await state.set_state(OrderFSM.editing_order)
+
+
+async def _render_cart_message(message: Message, state: FSMContext):
     state_data = await state.get_data()
     cart_items = state_data.get("cart", [])
     delivery_date = state_data.get("delivery_date")
@@ -43,66 +51,53 @@ async def show_cart_menu(message: Message, state: FSMContext, db_pool): # <--- 
     last_cart_chat_id = state_data.get("last_cart_chat_id")
 
     raw_summary_content = await _get_cart_summary_text(cart_items, delivery_date, client_name, address_text)
-
-    formatted_summary_lines = []
-    lines = raw_summary_content.split('\n')
-    for line in lines:
-        if line.startswith("---"):
-            formatted_summary_lines.append(line)
-        elif line.startswith("Клиент:"): 
-            formatted_summary_lines.append(f"*{line}*")
-        elif line.startswith("Адрес:"): 
-            formatted_summary_lines.append(f"*{line}*")
-        elif line.startswith("Дата доставки:"):
-            formatted_summary_lines.append(f"*{line}*")
-        elif line.startswith("--- ТОВАРЫ ---"):
-            formatted_summary_lines.append(line)
-        elif line.startswith("ИТОГО:"):
-            formatted_summary_lines.append(f"*{line}*")
-        elif line.startswith("  Корзина пуста."):
-            formatted_summary_lines.append(line)
-        elif re.match(r"^\d+\.", line): 
-            formatted_summary_lines.append(line)
-        else:
-            formatted_summary_lines.append(line)
-
-    pre_escaped_text = "\n".join(formatted_summary_lines)
-    summary_text_escaped = escape_markdown_v2(pre_escaped_text)
+    summary_text_escaped = format_cart_summary(raw_summary_content)
 
     # Строим клавиатуру, передавая количество товаров для условного отображения кнопки "Изменить строку"
     keyboard = build_cart_keyboard(len(cart_items))
+    digest = view_digest(summary_text_escaped, keyboard)
 
-    try:
-        if last_cart_message_id and last_cart_chat_id:
-            await message.bot.edit_message_text(
-                chat_id=last_cart_chat_id,
-                message_id=last_cart_message_id,
-                text=summary_text_escaped,
-                reply_markup=keyboard,
-                parse_mode="MarkdownV2"
-            )
-        else:
-            sent_message = await message.answer(
-                summary_text_escaped,
-                reply_markup=keyboard,
-                parse_mode="MarkdownV2"
-            )
-            await state.update_data(last_cart_message_id=sent_message.message_id, last_cart_chat_id=sent_message.chat.id)
+    if last_cart_message_id and last_cart_chat_id and cart_view.is_shown(last_cart_chat_id, last_cart_message_id, digest):
+        cart_view.skipped += 1
+        return
 
-    except TelegramBadRequest as e:
-        logger.warning(f"TelegramBadRequest when editing cart message: {e}. Sending new message.")
+    async def send_new_cart_message():
+        generation = cart_view.generation(message.chat.id)
         sent_message = await message.answer(
             summary_text_escaped,
             reply_markup=keyboard,
             parse_mode="MarkdownV2"
         )
         await state.update_data(last_cart_message_id=sent_message.message_id, last_cart_chat_id=sent_message.chat.id)
+        cart_view.remember(sent_message.chat.id, sent_message.message_id, digest, generation)
+
+    try:
+        if last_cart_message_id and last_cart_chat_id:
+            generation = cart_view.generation(last_cart_chat_id)
+            with own_cart_edit():
+                await message.bot.edit_message_text(
+                    chat_id=last_cart_chat_id,
+                    message_id=last_cart_message_id,
+                    text=summary_text_escaped,
+                    reply_markup=keyboard,
+                    parse_mode="MarkdownV2"
+                )
+            cart_view.remember(last_cart_chat_id, last_cart_message_id, digest, generation)
+        else:
+            await send_new_cart_message()
+        cart_view.rendered += 1
+
+    except TelegramBadRequest as e:
+        if is_not_modified_error(e):
+            # Сообщение уже показывает эту корзину
+            cart_view.remember(last_cart_chat_id, last_cart_message_id, digest, generation)
+            return
+        logger.warning("TelegramBadRequest when editing cart message: %s. Sending new message.", e)
+        await send_new_cart_message()
     except Exception as e:
-        logger.error(f"Error in show_cart_menu: {e}")
+        logger.error("Error in show_cart_menu: %s", e)
         await message.answer("Произошла ошибка при отображении корзины. Пожалуйста, попробуйте снова.")
 
-    await state.set_state(OrderFSM.editing_order)
-
 
 # Добавили db_pool как аргумент функции
 @router.callback_query(F.data == "confirm_order")
@@ -140,82 +135,37 @@ async def confirm_order(callback: CallbackQuery, state: FSMContext, db_pool):
         return
     # --- КОНЕЦ ПРОВЕРОК ---
 
-    # Вычисляем общую сумму заказа
-    total = sum(item["quantity"] * item["price"] for item in cart_items)
-    
-    # Получаем ID сотрудника
-    employee_id = await get_employee_id(db_pool, user_id) 
+    order = OrderToSave.from_state(user_id, state_data)
+    # Ключ идемпотентности корзины: повторное нажатие или проигрывание журнала не создаст второй заказ
+    client_key = state_data.get("order_client_key") or str(uuid.uuid4())
+    await state.update_data(order_client_key=client_key)
 
-    if employee_id is None:
-        logger.error(f"Не удалось получить employee_id для пользователя {user_id}. Заказ не сохранен.")
-        await callback.answer("Ошибка: Не удалось определить сотрудника. Заказ не может быть сохранен.", show_alert=True)
-        await callback.message.edit_text(
-            f"{escape_markdown_v2('❌ Ошибка при подтверждении заказа: Не удалось определить сотрудника. Пожалуйста, обратитесь к администратору.')}",
-            parse_mode="MarkdownV2",
-            reply_markup=None
-        )
-        await state.clear() 
-        return
+    async def write(key: str):
+        conn = await db_pool.acquire()
+        try:
+            async with conn.transaction(): # Используем асинхронную транзакцию
+                saved = await save_order(conn, order, key)
+        finally:
+            await db_pool.release(conn)
+        if saved is not None:
+            after_order_saved(saved)
+        return saved
 
-    conn = None 
     try:
-        conn = await db_pool.acquire()
-        async with conn.transaction(): # Используем асинхронную транзакцию
-            if editing_order_id: # Если редактируем существующий заказ
-                logger.info(f"Обновление существующего заказа #{editing_order_id} пользователем {user_id}.")
-                
-                # Обновляем основные поля заказа
-                await conn.execute("""
-                    UPDATE orders
-                    SET delivery_date = $1, client_id = $2, address_id = $3, total_amount = $4, status = $5
-                    WHERE order_id = $6;
-                """, delivery_date, client_id, address_id, total, original_order_status, editing_order_id)
-                
-                # Удаляем все старые строки заказа
-                await conn.execute("DELETE FROM order_lines WHERE order_id = $1;", editing_order_id)
-
-                # Вставляем все новые/измененные строки заказа
-                for item in cart_items:
-                    await conn.execute("""
-                        INSERT INTO order_lines (order_id, product_id, quantity, unit_price)
-                        VALUES ($1, $2, $3, $4)
-                    """, editing_order_id, item["product_id"], item["quantity"], item["price"])
-                
-                order_id_for_message = editing_order_id # Используем ID существующего заказа для сообщения
-                text_to_send = f"✅ *Заказ №{order_id_for_message}* успешно *обновлен* в базе данных.\nОбщая сумма: *{total:.2f}* грн.\n"
-
-            else: # Если создаем новый заказ
-                logger.info(f"Создание нового заказа пользователем {user_id}.")
-                
-                # Вставка в таблицу orders с начальным статусом 'draft'
-                order_row = await conn.fetchrow("""
-                    INSERT INTO orders (order_date, delivery_date, employee_id, client_id, address_id, total_amount, status)
-                    VALUES ($1, $2, $3, $4, $5, $6, 'draft')
-                    RETURNING order_id;
-                """, date.today(), delivery_date, employee_id, client_id, address_id, total)
-                order_id_for_message = order_row['order_id'] # Получаем ID нового заказа
-
-                # Вставка строк заказа
-                for item in cart_items:
-                    await conn.execute("""
-                        INSERT INTO order_lines (order_id, product_id, quantity, unit_price)
-                        VALUES ($1, $2, $3, $4)
-                    """, order_id_for_message, item["product_id"], item["quantity"], item["price"])
-                
-                text_to_send = f"✅ *Заказ №{order_id_for_message}* успешно *сформирован* и сохранен в базе данных.\nОбщая сумма: *{total:.2f}* грн.\n"
-
-        # --- Общий код после успешной транзакции (для обоих случаев: новый или обновленный) ---
-        await callback.answer("✅ Операция с заказом успешно завершена!", show_alert=False) 
-        escaped_text_to_send = escape_markdown_v2(text_to_send)
+        outcome = await write_journal.write(
+            db_pool, ORDER_SAVE, order.to_payload(), write,
+            telegram_id=user_id, chat_id=callback.message.chat.id, client_key=client_key
+        )
+    except OrderStatusChanged as e:
+        logger.warning(f"Заказ {editing_order_id} изменен другим пользователем, сохранение отклонено: {e}")
+        await callback.answer("Заказ уже подтвержден или отменен, изменения не сохранены.", show_alert=True)
         await callback.message.edit_text(
-            escaped_text_to_send,
+            escape_markdown_v2(f"❌ Заказ №{editing_order_id} уже подтвержден или отменен другим пользователем. Изменения не сохранены."),
             parse_mode="MarkdownV2",
-            reply_markup=None 
+            reply_markup=None
         )
-
-        order_cache.pop(user_id, None) 
         await state.clear()
-
+        return
     except asyncpg.exceptions.PostgresError as e: 
         logger.error(f"Ошибка БД при сохранении/обновлении заказа для пользователя {user_id} (заказ ID {editing_order_id or 'новый'}): {e}", exc_info=True)
         await callback.answer("Произошла ошибка при сохранении заказа. Пожалуйста, попробуйте снова.", show_alert=True)
@@ -236,9 +186,58 @@ async def confirm_order(callback: CallbackQuery, state: FSMContext, db_pool):
         )
         await state.clear() 
         return
-    finally:
-        if conn:
-            await db_pool.release(conn)
+
+    if outcome.journaled:
+        # БД недоступна: заказ сохранен локально, корзина больше не нужна
+        await callback.answer("📝 Заказ принят и будет сохранен, когда база данных станет доступна.", show_alert=True)
+        await callback.message.edit_text(
+            escape_markdown_v2(
+                f"📝 База данных сейчас недоступна. Заказ на сумму {order.total:.2f} грн записан в журнал "
+                "и будет сохранен автоматически — номер заказа придет отдельным сообщением."
+            ),
+            parse_mode="MarkdownV2",
+            reply_markup=None
+        )
+        order_cache.pop(user_id, None)
+        await state.clear()
+        return
+
+    saved = outcome.result
+    if saved is None:
+        await callback.answer("Ошибка: Не удалось определить сотрудника. Заказ не может быть сохранен.", show_alert=True)
+        await callback.message.edit_text(
+            f"{escape_markdown_v2('❌ Ошибка при подтверждении заказа: Не удалось определить сотрудника. Пожалуйста, обратитесь к администратору.')}",
+            parse_mode="MarkdownV2",
+            reply_markup=None
+        )
+        await state.clear() 
+        return
+
+    if saved.duplicate:
+        text_to_send = f"✅ *Заказ №{saved.order_id}* уже сохранен в базе данных.\n"
+    elif editing_order_id:
+        text_to_send = f"✅ *Заказ №{saved.order_id}* успешно *обновлен* в базе данных.\nОбщая сумма: *{order.total:.2f}* грн.\n"
+    else:
+        text_to_send = f"✅ *Заказ №{saved.order_id}* успешно *сформирован* и сохранен в базе данных.\nОбщая сумма: *{order.total:.2f}* грн.\n"
+
+    if saved.reservation is not None and saved.reservation.shortfall:
+        product_names = {item["product_id"]: item["product_name"] for item in cart_items}
+        text_to_send += "\n⚠️ Не хватает на складе (не зарезервировано):\n" + "\n".join(
+            f"- {product_names.get(product_id, product_id)}: {format_quantity(missing)} шт."
+            for product_id, missing in saved.reservation.shortfall.items()
+        )
+
+    # --- Общий код после успешной транзакции (для обоих случаев: новый или обновленный) ---
+    await callback.answer("✅ Операция с заказом успешно завершена!", show_alert=False) 
+    escaped_text_to_send = escape_markdown_v2(text_to_send)
+    await callback.message.edit_text(
+        escaped_text_to_send,
+        parse_mode="MarkdownV2",
+        reply_markup=None 
+    )
+
+    order_cache.pop(user_id, None) 
+    await state.clear()
 
 
 # Добавили db_pool как аргумент функции
@@ -435,11 +434,13 @@ async def process_new_quantity_input(message: Message, state: FSMContext, db_poo
             await message.answer("❌ Количество не может быть отрицательным. Попробуйте ещё раз.")
             return
         
-        # --- УДАЛЯЕМ ВСЮ ЛОГИКУ ПРОВЕРКИ И КОРРЕКЦИИ ОСТАТКОВ ЗДЕСЬ ---
-        # product_id = cart_items[item_index]["product_id"]
-        # available_stock = await get_product_current_stock(db_pool, product_id)
-        # ... (весь if/elif/else блок, который был здесь для проверки остатков) ...
-        # --- КОНЕЦ УДАЛЯЕМОЙ ЛОГИКИ ---
+        # Мягкая проверка остатков по снимку в памяти (без запроса к БД)
+        available = stock_availability.available(
+            cart_items[item_index]["product_id"], exclude_order_id=state_data.get("editing_order_id")
+        )
+        shortage_warning = format_shortage_warning(cart_items[item_index]["product_name"], new_quantity, available)
+        if shortage_warning:
+            await message.answer(escape_markdown_v2(shortage_warning), parse_mode="MarkdownV2")
 
         if new_quantity == 0:
             # Если введено 0, удаляем товар
@@ -14,6 +14,8 @@ import asyncpg.exceptions
 from decimal import Decimal
 
 from handlers.orders.order_helpers import _get_cart_summary_text 
+from db_operations.stock_availability import stock_availability, format_shortage_warning, format_quantity
+from db_operations.product_operations import ReorderItem, get_reorder_suggestions
 
 router = Router()
 logger = logging.getLogger(__name__)
@@ -48,7 +50,7 @@ async def send_all_products(message: Message, state: FSMContext, db_pool):
             await state.clear()
             return
 
-        product_buttons = []
+        product_buttons = await _build_reorder_rows(state, db_pool)
         for product in products:
             # Используем InlineKeyboardButton для выбора продукта
             # Экранируем имя продукта и цену для корректного отображения в кнопке
@@ -70,6 +72,95 @@ async def send_all_products(message: Message, state: FSMContext, db_pool):
             await db_pool.release(conn)
 
 
+async def _build_reorder_rows(state: FSMContext, db_pool) -> list:
+    """
+    Кнопки повтора заказа над списком товаров: для выбранного клиента и пустой корзины
+    предлагаются его последний заказ и часто покупаемые товары.
+    """
+    data = await state.get_data()
+    client_id = data.get("client_id")
+    if not client_id or data.get("cart"):
+        return []
+    suggestions = await get_reorder_suggestions(db_pool, client_id)
+    if suggestions is None:
+        return []
+
+    rows = []
+    if suggestions.last_order:
+        rows.append([InlineKeyboardButton(
+            text=f"🔁 Повторить заказ №{suggestions.last_order_id} от {suggestions.last_order_date:%d.%m} ({len(suggestions.last_order)} поз.)",
+            callback_data="reorder:last"
+        )])
+    if suggestions.frequent:
+        rows.append([InlineKeyboardButton(
+            text=f"⭐ Часто покупаемые ({len(suggestions.frequent)} поз.)",
+            callback_data="reorder:frequent"
+        )])
+    return rows
+
+
+def add_reorder_items_to_cart(cart: list, items: list[ReorderItem], editing_order_id=None) -> tuple[list, list[str], list[str]]:
+    """
+    Добавляет позиции в корзину по текущим ценам. Товары, которых нет в наличии, пропускаются.
+    Возвращает (корзина, пропущенные товары, предупреждения о нехватке).
+    """
+    skipped, warnings = [], []
+    for item in items:
+        available = stock_availability.available(item.product_id, exclude_order_id=editing_order_id)
+        if available is not None and available <= 0:
+            skipped.append(item.product_name)
+            continue
+
+        cart_item = next((line for line in cart if line["product_id"] == item.product_id), None)
+        if cart_item is None:
+            cart_item = {
+                "product_id": item.product_id,
+                "product_name": item.product_name,
+                "quantity": 0,
+                "price": item.price
+            }
+            cart.append(cart_item)
+        cart_item["quantity"] += item.quantity
+
+        shortage_warning = format_shortage_warning(item.product_name, cart_item["quantity"], available)
+        if shortage_warning:
+            warnings.append(shortage_warning)
+    return cart, skipped, warnings
+
+
+@router.callback_query(F.data.in_({"reorder:last", "reorder:frequent"}), StateFilter(OrderFSM.selecting_product))
+async def process_reorder(callback: CallbackQuery, state: FSMContext, db_pool):
+    """Заполняет корзину позициями последнего заказа клиента или его часто покупаемыми товарами."""
+    data = await state.get_data()
+    client_id = data.get("client_id")
+    suggestions = await get_reorder_suggestions(db_pool, client_id) if client_id else None
+    if suggestions is None:
+        await callback.answer("Не удалось загрузить историю заказов клиента.", show_alert=True)
+        return
+
+    items = suggestions.last_order if callback.data == "reorder:last" else suggestions.frequent
+    if not items:
+        await callback.answer("У клиента нет подходящих заказов.", show_alert=True)
+        return
+
+    cart, skipped, warnings = add_reorder_items_to_cart(data.get("cart", []), items, data.get("editing_order_id"))
+    await state.update_data(cart=cart)
+    await callback.answer(f"Добавлено позиций: {len(items) - len(skipped)}")
+    logger.info(
+        "Пользователь %s заполнил корзину клиента %s из истории (%s): %d поз., пропущено %d.",
+        callback.from_user.id, client_id, callback.data, len(items) - len(skipped), len(skipped)
+    )
+
+    notes = list(warnings)
+    if skipped:
+        notes.append("Нет в наличии, не добавлены: " + ", ".join(skipped))
+    if notes:
+        await callback.message.answer(escape_markdown_v2("\n".join(notes)), parse_mode="MarkdownV2")
+
+    from handlers.orders.order_editor import show_cart_menu
+    await show_cart_menu(callback.message, state, db_pool)
+
+
 @router.callback_query(F.data.startswith("select_product_"), StateFilter(OrderFSM.selecting_product))
 async def process_product_selection(callback: CallbackQuery, state: FSMContext, db_pool):
     await callback.answer()
@@ -84,7 +175,11 @@ async def process_product_selection(callback: CallbackQuery, state: FSMContext,
             await state.update_data(selected_product=selected_product)
             # Экранируем имя продукта перед использованием в MarkdownV2
             product_name_escaped = escape_markdown_v2(selected_product['name'])
-            await callback.message.edit_text(f"Введите количество для *{product_name_escaped}*:", parse_mode="MarkdownV2")
+            # Доступность берется из снимка в памяти, без запроса к БД
+            editing_order_id = (await state.get_data()).get("editing_order_id")
+            available = stock_availability.available(product_id, exclude_order_id=editing_order_id)
+            available_text = f" \\(доступно: *{escape_markdown_v2(format_quantity(available))}* шт\\.\\)" if available is not None else ""
+            await callback.message.edit_text(f"Введите количество для *{product_name_escaped}*{available_text}:", parse_mode="MarkdownV2")
             await state.set_state(OrderFSM.entering_quantity)
         else:
             await callback.message.edit_text("Неизвестный товар. Пожалуйста, выберите из списка.", parse_mode="MarkdownV2")
@@ -117,16 +212,12 @@ async def process_quantity_input(message: Message, state: FSMContext):
             await state.clear() 
             return
 
-        # --- УДАЛЯЕМ ВСЮ ЛОГИКУ ПРОВЕРКИ И КОРРЕКЦИИ ОСТАТКОВ ЗДЕСЬ ---
-        # product_id = selected_product["product_id"]
-        # available_stock = await get_product_current_stock(db_pool, product_id) # Этот вызов также удалить
-        # ... (весь if/elif/else блок, который был здесь для проверки остатков) ...
-        # --- КОНЕЦ УДАЛЯЕМОЙ ЛОГИКИ ---
-
         item_found_and_updated = False
+        quantity_in_cart = quantity
         for item in cart:
             if item["product_id"] == selected_product["product_id"]:
                 item["quantity"] += quantity 
+                quantity_in_cart = item["quantity"]
                 item_found_and_updated = True
                 break
         
@@ -141,6 +232,13 @@ async def process_quantity_input(message: Message, state: FSMContext):
         
         await state.update_data(cart=cart) 
 
+        # Мягкая проверка остатков по снимку в памяти: товар добавляется, но продавец сразу видит нехватку.
+        # Окончательная корректировка по складу выполняется при подтверждении заказа.
+        available = stock_availability.available(selected_product["product_id"], exclude_order_id=data.get("editing_order_id"))
+        shortage_warning = format_shortage_warning(selected_product["name"], quantity_in_cart, available)
+        if shortage_warning:
+            await message.answer(escape_markdown_v2(shortage_warning), parse_mode="MarkdownV2")
+
         # Отправляем сообщение об успешном добавлении
         # Экранируем имя продукта перед использованием в MarkdownV2
         product_name_escaped_for_confirm = escape_markdown_v2(selected_product['name'])
@@ -16,10 +16,11 @@ from states.order import OrderFSM
 # ИМПОРТЫ ИЗ db_operations
 from db_operations.product_operations import get_all_products_for_selection, ProductItem, get_product_by_id
 from db_operations.supplier_operations import (
-    find_suppliers_by_name, Supplier, create_supplier_invoice,
-    record_incoming_delivery as record_incoming_delivery_line,
-    get_supplier_by_id
+    Supplier, create_supplier_invoice,
+    record_incoming_delivery as record_incoming_delivery_line
 )
+from db_operations.reference_cache import reference_cache
+from keyboards.inline_keyboards import build_supplier_page_keyboard
 
 router = Router()
 logger = logging.getLogger(__name__)
@@ -46,13 +47,12 @@ def build_date_selection_keyboard(current_date: date) -> InlineKeyboardMarkup:
     buttons.append([InlineKeyboardButton(text="❌ Отмена", callback_data="cancel_new_supplier_invoice")])
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
-def build_supplier_selection_keyboard(suppliers: List[Supplier]) -> InlineKeyboardMarkup:
-    """Строит клавиатуру для выбора поставщика."""
-    buttons = []
-    for supplier in suppliers[:MAX_RESULTS_TO_SHOW]:
-        buttons.append([InlineKeyboardButton(text=escape_markdown_v2(supplier.name), callback_data=f"select_supplier_for_new_inv_{supplier.supplier_id}")])
-    buttons.append([InlineKeyboardButton(text="❌ Отмена", callback_data="cancel_new_supplier_invoice")])
-    return InlineKeyboardMarkup(inline_keyboard=buttons)
+def build_supplier_selection_keyboard(suppliers: List[Supplier], offset: int = 0) -> InlineKeyboardMarkup:
+    """Строит клавиатуру для выбора поставщика (постранично по MAX_RESULTS_TO_SHOW)."""
+    return build_supplier_page_keyboard(
+        suppliers, offset, "select_supplier_for_new_inv_", "new_inv_suppliers_page",
+        "cancel_new_supplier_invoice", page_size=MAX_RESULTS_TO_SHOW
+    )
 
 def build_products_keyboard(products: List[ProductItem]) -> InlineKeyboardMarkup:
     """Строит клавиатуру для выбора продукта."""
@@ -154,7 +154,7 @@ async def process_new_supplier_invoice_date_selection(callback: CallbackQuery, s
 async def process_new_supplier_invoice_supplier_input(message: Message, state: FSMContext, db_pool):
     """Обрабатывает ввод имени поставщика для новой накладной."""
     supplier_name_query = message.text.strip()
-    suppliers = await find_suppliers_by_name(db_pool, supplier_name_query)
+    suppliers = await reference_cache.find_suppliers(db_pool, supplier_name_query)
 
     if suppliers:
         if len(suppliers) == 1:
@@ -163,20 +163,29 @@ async def process_new_supplier_invoice_supplier_input(message: Message, state: F
             await message.answer(f"✅ Выбран поставщик: *{escape_markdown_v2(supplier.name)}*", parse_mode="MarkdownV2")
             await message.answer(escape_markdown_v2("Введите номер накладной поставщика:"), parse_mode="MarkdownV2")
             await state.set_state(OrderFSM.waiting_for_new_supplier_invoice_number)
-        elif 1 < len(suppliers) <= MAX_RESULTS_TO_SHOW:
-            keyboard = build_supplier_selection_keyboard(suppliers)
-            await message.answer(escape_markdown_v2("Найдено несколько поставщиков. Выберите одного:"), reply_markup=keyboard, parse_mode="MarkdownV2")
         else:
-            await message.answer(escape_markdown_v2(f"Найдено слишком много поставщиков ({len(suppliers)}). Пожалуйста, уточните запрос."), parse_mode="MarkdownV2")
+            # Запрос сохраняется для листания: страницы строятся из кэша без обращения к БД
+            await state.update_data(supplier_search_query=supplier_name_query)
+            keyboard = build_supplier_selection_keyboard(suppliers)
+            await message.answer(escape_markdown_v2(f"Найдено поставщиков: {len(suppliers)}. Выберите одного:"), reply_markup=keyboard, parse_mode="MarkdownV2")
     else:
         await message.answer("Поставщик с таким именем не найден. Пожалуйста, попробуйте еще раз.")
 
+@router.callback_query(StateFilter(OrderFSM.waiting_for_new_supplier_invoice_supplier), F.data.startswith("new_inv_suppliers_page:"))
+async def page_new_supplier_invoice_suppliers(callback: CallbackQuery, state: FSMContext, db_pool):
+    """Листает список найденных поставщиков."""
+    await callback.answer()
+    offset = int(callback.data.split(":")[1])
+    supplier_name_query = (await state.get_data()).get('supplier_search_query', '')
+    suppliers = await reference_cache.find_suppliers(db_pool, supplier_name_query)
+    await callback.message.edit_reply_markup(reply_markup=build_supplier_selection_keyboard(suppliers, offset))
+
 @router.callback_query(StateFilter(OrderFSM.waiting_for_new_supplier_invoice_supplier), F.data.startswith("select_supplier_for_new_inv_"))
 async def select_new_supplier_invoice_supplier(callback: CallbackQuery, state: FSMContext, db_pool):
     """Обрабатывает выбор поставщика из списка для новой накладной."""
     await callback.answer()
     supplier_id = int(callback.data.split("_")[4])
-    supplier = await get_supplier_by_id(db_pool, supplier_id)
+    supplier = await reference_cache.get_supplier(db_pool, supplier_id)
     
     if supplier:
         await state.update_data(new_supplier_id=supplier.supplier_id, new_supplier_name=supplier.name)
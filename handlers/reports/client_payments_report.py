@@ -2,6 +2,7 @@
 
 import logging
 import re
+import uuid
 from datetime import date, datetime
 from decimal import Decimal
 from typing import Optional, List, Dict
@@ -9,7 +10,7 @@ from typing import Optional, List, Dict
 from aiogram import Router, F
 from aiogram.types import CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton, Message, ReplyKeyboardRemove
 from aiogram.fsm.context import FSMContext
-from aiogram.filters import Command, StateFilter
+from aiogram.filters import Command, CommandObject, StateFilter
 
 # ИМПОРТИРУЕМ ИЗМЕНЕННУЮ ФУНКЦИЮ ЭКРАНИРОВАНИЯ
 from utils.markdown_utils import escape_markdown_v2 # <-- ИСПРАВЛЕНО: используем встроенный aiogram.utils.markdown
@@ -22,17 +23,39 @@ from db_operations.report_payment_operations import (
     reverse_payment_in_db,
     get_today_paid_invoices,
     get_single_unpaid_invoice_details,
+    PAYMENT_FULL,
+    PAYMENT_PARTIAL,
+    PAYMENT_REVERSE,
     UnpaidInvoice,
     TodayPaidInvoice
 )
+from db_operations.documents import UNPAID_INVOICES_EXPORT_QUERY, find_order_by_invoice, get_invoice_document
 from states.order import OrderFSM 
+from utils.documents import TableColumn, content_key, documents, render_invoice_pdf
+from utils.slow_reports import run_report
+from db_operations.write_journal import write_journal
 
 
 router = Router()
 logger = logging.getLogger(__name__)
 
+# Ответ, если БД недоступна и действие с оплатой записано в локальный журнал (db_operations/write_journal.py)
+JOURNALED_PAYMENT_TEXT = "📝 База данных недоступна. Действие записано в журнал и будет проведено автоматически."
+
 # --- Вспомогательные функции для клавиатуры и форматирования ---
 
+async def get_payment_client_key(state: FSMContext, order_id: int, kind: str) -> Optional[str]:
+    """
+    Ключ идемпотентности действия с оплатой открытой накладной. Ключи создаются при открытии
+    накладной, поэтому повторное нажатие той же кнопки не проведет оплату второй раз.
+    None — накладная открыта не через это сообщение (будет создан новый ключ).
+    """
+    data = await state.get_data()
+    if data.get("current_invoice_id") != order_id:
+        return None
+    return (data.get("payment_client_keys") or {}).get(kind)
+
+
 def build_unpaid_invoices_keyboard(invoices: List[UnpaidInvoice]) -> InlineKeyboardMarkup:
     """
     Строит инлайн-клавиатуру для списка неоплаченных накладных.
@@ -54,6 +77,7 @@ def build_unpaid_invoices_keyboard(invoices: List[UnpaidInvoice]) -> InlineKeybo
     
     buttons.append([
         InlineKeyboardButton(text="🔄 Обновить список", callback_data="refresh_unpaid_invoices"),
+        InlineKeyboardButton(text="📥 Excel", callback_data="export_unpaid_xlsx"),
         InlineKeyboardButton(text="⬅️ Назад", callback_data="back_to_main_menu")
     ])
     return InlineKeyboardMarkup(inline_keyboard=buttons)
@@ -67,6 +91,7 @@ def build_invoice_details_keyboard(order_id: int) -> InlineKeyboardMarkup:
         [InlineKeyboardButton(text="✅ Оплачено полностью", callback_data=f"confirm_payment_{order_id}")],
         [InlineKeyboardButton(text="✍️ Частичная оплата", callback_data=f"partial_payment_{order_id}")],
         [InlineKeyboardButton(text="↩️ Отменить оплату", callback_data=f"reverse_payment_{order_id}")],
+        [InlineKeyboardButton(text="📄 Накладная (PDF)", callback_data=f"invoice_pdf_{order_id}")],
         [InlineKeyboardButton(text="⬅️ Назад к списку", callback_data="back_to_unpaid_list")]
     ]
     return InlineKeyboardMarkup(inline_keyboard=buttons)
@@ -158,36 +183,38 @@ async def show_client_payments_report(callback_or_message, state: FSMContext, db
         return
 
     await state.clear()
-    
-    invoices = await get_unpaid_invoices(db_pool)
 
-    keyboard = build_unpaid_invoices_keyboard(invoices)
+    async def send_unpaid_list(invoices: List[UnpaidInvoice]):
+        keyboard = build_unpaid_invoices_keyboard(invoices)
 
-    if not invoices:
-        report_text = escape_markdown_v2("Нет неоплаченных накладных.")
+        if not invoices:
+            report_text = escape_markdown_v2("Нет неоплаченных накладных.")
         
+            if is_callback:
+                try:
+                    await message_object.edit_text(report_text, parse_mode="MarkdownV2")
+                except Exception as e:
+                    logger.warning(f"Не удалось отредактировать сообщение для пустого отчета (вероятно, сообщение слишком старое): {e}")
+                    await message_object.answer(report_text, parse_mode="MarkdownV2")
+            else:
+                await message_object.answer(report_text, parse_mode="MarkdownV2")
+            return
+
+        header_text = escape_markdown_v2("Список неоплаченных накладных:")
+
         if is_callback:
             try:
-                await message_object.edit_text(report_text, parse_mode="MarkdownV2")
+                await message_object.edit_text(header_text, reply_markup=keyboard, parse_mode="MarkdownV2")
             except Exception as e:
-                logger.warning(f"Не удалось отредактировать сообщение для пустого отчета (вероятно, сообщение слишком старое): {e}")
-                await message_object.answer(report_text, parse_mode="MarkdownV2")
+                logger.warning(f"Не удалось отредактировать сообщение (вероятно, слишком старое) при возврате к списку: {e}")
+                await message_object.answer(header_text, reply_markup=keyboard, parse_mode="MarkdownV2")
         else:
-            await message_object.answer(report_text, parse_mode="MarkdownV2")
-        return
-
-    header_text = escape_markdown_v2("Список неоплаченных накладных:")
-
-    if is_callback:
-        try:
-            await message_object.edit_text(header_text, reply_markup=keyboard, parse_mode="MarkdownV2")
-        except Exception as e:
-            logger.warning(f"Не удалось отредактировать сообщение (вероятно, слишком старое) при возврате к списку: {e}")
             await message_object.answer(header_text, reply_markup=keyboard, parse_mode="MarkdownV2")
-    else:
-        await message_object.answer(header_text, reply_markup=keyboard, parse_mode="MarkdownV2")
     
-    await state.set_state(OrderFSM.viewing_unpaid_invoices_list)
+        await state.set_state(OrderFSM.viewing_unpaid_invoices_list)
+
+    # Долгий расчет задолженностей досчитывается в фоне, список придет отдельным сообщением
+    await run_report(message_object, lambda: get_unpaid_invoices(db_pool), send_unpaid_list, "Список неоплаченных накладных")
 
 
 @router.message(Command("financial_report_today"))
@@ -232,7 +259,10 @@ async def view_invoice_details(callback: CallbackQuery, state: FSMContext, db_po
     invoice = await get_single_unpaid_invoice_details(db_pool, order_id)
 
     if invoice:
-        await state.update_data(current_invoice_id=order_id)
+        await state.update_data(
+            current_invoice_id=order_id,
+            payment_client_keys={PAYMENT_FULL: str(uuid.uuid4()), PAYMENT_REVERSE: str(uuid.uuid4())}
+        )
         details_text_raw = format_unpaid_invoice_details(invoice) # Получаем необработанный текст
         
         # --- НОВОЕ: Оборачиваем весь текст в обратные апострофы, чтобы избежать ошибок парсинга MarkdownV2 ---
@@ -253,8 +283,14 @@ async def view_invoice_details(callback: CallbackQuery, state: FSMContext, db_po
 async def handle_confirm_payment(callback: CallbackQuery, state: FSMContext, db_pool):
     order_id = int(callback.data.split("confirm_payment_")[1])
     
-    success = await confirm_payment_in_db(db_pool, order_id)
-    if success:
+    outcome = await write_journal.write(
+        db_pool, PAYMENT_FULL, {"order_id": order_id}, lambda key: confirm_payment_in_db(db_pool, order_id, key),
+        telegram_id=callback.from_user.id, chat_id=callback.message.chat.id,
+        client_key=await get_payment_client_key(state, order_id, PAYMENT_FULL)
+    )
+    if outcome.journaled:
+        await callback.answer(JOURNALED_PAYMENT_TEXT, show_alert=True)
+    elif outcome.result:
         await callback.answer("✅ Оплата подтверждена!", show_alert=True)
         await show_client_payments_report(callback.message, state, db_pool)
     else:
@@ -264,7 +300,8 @@ async def handle_confirm_payment(callback: CallbackQuery, state: FSMContext, db_
 @router.callback_query(F.data.startswith("partial_payment_"), StateFilter(OrderFSM.viewing_unpaid_invoices_list))
 async def handle_partial_payment_input(callback: CallbackQuery, state: FSMContext):
     order_id = int(callback.data.split("partial_payment_")[1])
-    await state.update_data(order_to_partial_pay=order_id)
+    # Один ключ на запрос суммы: повторно отправленная сумма не будет проведена дважды
+    await state.update_data(order_to_partial_pay=order_id, partial_payment_client_key=str(uuid.uuid4()))
     
     await callback.message.edit_text(escape_markdown_v2("Введите сумму частичной оплаты:"), parse_mode="MarkdownV2")
     await state.set_state(OrderFSM.entering_partial_payment_amount)
@@ -291,8 +328,14 @@ async def process_partial_payment_amount(message: Message, state: FSMContext, db
         await state.clear()
         return
 
-    success = await update_partial_payment_in_db(db_pool, order_id, partial_amount)
-    if success:
+    outcome = await write_journal.write(
+        db_pool, PAYMENT_PARTIAL, {"order_id": order_id, "amount": str(partial_amount)},
+        lambda key: update_partial_payment_in_db(db_pool, order_id, partial_amount, key),
+        telegram_id=message.from_user.id, chat_id=message.chat.id, client_key=data.get("partial_payment_client_key")
+    )
+    if outcome.journaled:
+        await message.answer(escape_markdown_v2(JOURNALED_PAYMENT_TEXT), parse_mode="MarkdownV2")
+    elif outcome.result:
         await message.answer(escape_markdown_v2(f"✅ Частичная оплата в размере `{partial_amount:.2f}` грн для накладной #{order_id} обновлена."), parse_mode="MarkdownV2")
         await show_client_payments_report(message, state, db_pool)
     else:
@@ -304,14 +347,93 @@ async def process_partial_payment_amount(message: Message, state: FSMContext, db
 async def handle_reverse_payment(callback: CallbackQuery, state: FSMContext, db_pool):
     order_id = int(callback.data.split("reverse_payment_")[1])
     
-    success = await reverse_payment_in_db(db_pool, order_id)
-    if success:
+    outcome = await write_journal.write(
+        db_pool, PAYMENT_REVERSE, {"order_id": order_id}, lambda key: reverse_payment_in_db(db_pool, order_id, key),
+        telegram_id=callback.from_user.id, chat_id=callback.message.chat.id,
+        client_key=await get_payment_client_key(state, order_id, PAYMENT_REVERSE)
+    )
+    if outcome.journaled:
+        await callback.answer(JOURNALED_PAYMENT_TEXT, show_alert=True)
+    elif outcome.result:
         await callback.answer("↩️ Оплата отменена/сброшена.", show_alert=True)
         await show_client_payments_report(callback.message, state, db_pool)
     else:
         await callback.answer("❌ Ошибка отмены оплаты.", show_alert=True)
     await callback.answer()
 
+# --- Печатные документы (utils/documents.py) ---
+
+UNPAID_INVOICES_COLUMNS = (
+    TableColumn("Накладная", 22),
+    TableColumn("Дата", 12, "DD.MM.YYYY"),
+    TableColumn("Срок оплаты", 12, "DD.MM.YYYY"),
+    TableColumn("Клиент", 35),
+    TableColumn("Сумма", 12, "0.00"),
+    TableColumn("Оплачено", 12, "0.00"),
+    TableColumn("Долг", 12, "0.00"),
+    TableColumn("Статус", 15),
+)
+
+INVOICE_PDF_ERROR_TEXT = "❌ Не удалось сформировать накладную. Попробуйте позже."
+EXPORT_ERROR_TEXT = "❌ Не удалось сформировать выгрузку. Попробуйте позже."
+
+
+async def send_invoice_pdf(message: Message, db_pool, order_id: int) -> bool:
+    invoice = await get_invoice_document(db_pool, order_id)
+    if invoice is None:
+        return False
+    await documents.send(
+        message.bot, db_pool, message.chat.id, content_key("invoice", invoice),
+        f"{invoice.invoice_number}.pdf", render_invoice_pdf, invoice
+    )
+    return True
+
+
+@router.message(Command("invoice"))
+async def invoice_pdf_command(message: Message, command: CommandObject, db_pool):
+    """/invoice <номер накладной или ID заказа> — PDF накладной."""
+    if not command.args:
+        await message.answer(escape_markdown_v2("Формат: /invoice INV-20250301-15 или /invoice 15"), parse_mode="MarkdownV2")
+        return
+    try:
+        order_id = await find_order_by_invoice(db_pool, command.args.strip())
+        sent = order_id is not None and await send_invoice_pdf(message, db_pool, order_id)
+    except Exception as e:
+        logger.error(f"Ошибка при формировании PDF накладной '{command.args.strip()}': {e}", exc_info=True)
+        await message.answer(escape_markdown_v2(INVOICE_PDF_ERROR_TEXT), parse_mode="MarkdownV2")
+        return
+    if not sent:
+        await message.answer(escape_markdown_v2("❌ Накладная не найдена или заказ еще не подтвержден."), parse_mode="MarkdownV2")
+
+
+@router.callback_query(F.data.startswith("invoice_pdf_"))
+async def invoice_pdf_callback(callback: CallbackQuery, db_pool):
+    order_id = int(callback.data.split("invoice_pdf_")[1])
+    await callback.answer("Формирую накладную...")
+    try:
+        sent = await send_invoice_pdf(callback.message, db_pool, order_id)
+    except Exception as e:
+        logger.error(f"Ошибка при формировании PDF накладной для заказа {order_id}: {e}", exc_info=True)
+        await callback.message.answer(escape_markdown_v2(INVOICE_PDF_ERROR_TEXT), parse_mode="MarkdownV2")
+        return
+    if not sent:
+        await callback.message.answer(escape_markdown_v2("❌ Накладная не найдена."), parse_mode="MarkdownV2")
+
+
+@router.callback_query(F.data == "export_unpaid_xlsx")
+async def export_unpaid_invoices_xlsx(callback: CallbackQuery, db_pool):
+    await callback.answer("Формирую выгрузку...")
+    try:
+        await documents.send_table(
+            callback.bot, db_pool, callback.message.chat.id, "unpaid_xlsx", UNPAID_INVOICES_EXPORT_QUERY,
+            "Неоплаченные накладные", UNPAID_INVOICES_COLUMNS,
+            f"unpaid_invoices_{date.today():%Y%m%d}.xlsx", sum_columns=(4, 5, 6)
+        )
+    except Exception as e:
+        logger.error(f"Ошибка при выгрузке неоплаченных накладных в XLSX: {e}", exc_info=True)
+        await callback.message.answer(escape_markdown_v2(EXPORT_ERROR_TEXT), parse_mode="MarkdownV2")
+
+
 @router.callback_query(F.data == "back_to_main_menu")
 async def back_to_main_menu_from_payments(callback: CallbackQuery, state: FSMContext):
     await state.clear()
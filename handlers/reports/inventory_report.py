@@ -2,26 +2,39 @@
 
 import logging
 import re
+from datetime import date
 from typing import List
 
 from aiogram import Router, F
-from aiogram.types import Message
+from aiogram.types import CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup, Message
 from aiogram.filters import Command
 from utils.markdown_utils import escape_markdown_v2
+from utils.send_queue import SendPriorityMiddleware, Priority
 
 # Импортируем функции из нового файла операций с продуктами
 from db_operations.product_operations import get_all_product_stock, ProductStockItem
+from db_operations.documents import INVENTORY_EXPORT_QUERY
+from utils.documents import TableColumn, documents
+from utils.slow_reports import run_report
 
 router = Router()
+# Длинные отчеты уступают очередь отправки интерактивным ответам
+router.message.middleware(SendPriorityMiddleware(Priority.BULK))
 logger = logging.getLogger(__name__)
 
 @router.message(Command("inventory_report"))
 async def show_inventory_report(message: Message, db_pool):
     """
     Показывает отчет о текущих остатках товаров на складе.
+    Если расчет не укладывается в таймаут отчета, остатки присылаются позже (utils/slow_reports.py).
     """
-    stock_items = await get_all_product_stock(db_pool)
-    
+    await run_report(
+        message, lambda: get_all_product_stock(db_pool),
+        lambda stock_items: _send_inventory_report(message, stock_items), "Отчет об остатках"
+    )
+
+
+async def _send_inventory_report(message: Message, stock_items: List[ProductStockItem]):
     report_parts = []
     report_parts.append(f"📦 *Текущие остатки товаров на складе:*\n\n")
     
@@ -38,4 +51,32 @@ async def show_inventory_report(message: Message, db_pool):
         
     final_report_text = "".join(report_parts)
     
-    await message.answer(final_report_text, parse_mode="MarkdownV2")
\ No newline at end of file
+    export_keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="📥 Выгрузить в Excel", callback_data="export_inventory_xlsx")]
+    ])
+    await message.answer(final_report_text, parse_mode="MarkdownV2", reply_markup=export_keyboard)
+
+
+INVENTORY_COLUMNS = (
+    TableColumn("Товар", 40),
+    TableColumn("Категория", 20),
+    TableColumn("Остаток", 10, "0"),
+    TableColumn("Себестоимость", 14, "0.00"),
+    TableColumn("Сумма остатка", 14, "0.00"),
+)
+
+
+@router.callback_query(F.data == "export_inventory_xlsx")
+async def export_inventory_xlsx(callback: CallbackQuery, db_pool):
+    """Остатки в XLSX (верстка в пуле процессов, повторная выгрузка без изменений — по file_id)."""
+    await callback.answer("Формирую выгрузку...")
+    try:
+        await documents.send_table(
+            callback.bot, db_pool, callback.message.chat.id, "inventory_xlsx", INVENTORY_EXPORT_QUERY,
+            "Остатки", INVENTORY_COLUMNS, f"inventory_{date.today():%Y%m%d}.xlsx", sum_columns=(2, 4)
+        )
+    except Exception as e:
+        logger.error(f"Ошибка при выгрузке остатков в XLSX: {e}", exc_info=True)
+        await callback.message.answer(
+            escape_markdown_v2("❌ Не удалось сформировать выгрузку. Попробуйте позже."), parse_mode="MarkdownV2"
+        )
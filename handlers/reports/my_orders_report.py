@@ -9,7 +9,8 @@ from aiogram.types import CallbackQuery, InlineKeyboardMarkup, InlineKeyboardBut
 from aiogram.fsm.context import FSMContext
 from utils.markdown_utils import escape_markdown_v2
 
-from db_operations.report_my_orders import get_my_orders_for_today, get_order_full_details, OrderDetail
+from db_operations.report_my_orders import get_my_orders_for_today
+from db_operations.order_details import get_order_details
 
 router = Router()
 logger = logging.getLogger(__name__)
@@ -64,24 +65,28 @@ async def view_my_order_details(callback: CallbackQuery, state: FSMContext, db_p
     order_id = int(callback.data.split("_")[-1])
     logger.info(f"Пользователь {callback.from_user.id} запросил детали заказа №{order_id}.")
 
-    order_details = await get_order_full_details(db_pool, order_id)
+    try:
+        order = await get_order_details(db_pool, order_id)
+    except Exception as e:
+        logger.error(f"Ошибка при получении полной информации о заказе {order_id}: {e}", exc_info=True)
+        order = None
 
-    if not order_details:
+    if not order:
         await callback.message.edit_text(escape_markdown_v2(f"❌ Не удалось найти детали для заказа №{order_id}."), parse_mode="MarkdownV2")
         return
 
     # Формируем текст сводки заказа
     summary_lines = []
-    summary_lines.append(f"*{escape_markdown_v2(f'Сводка заказа №{order_details["order_id"]}:')}*\n")
-    summary_lines.append(f"Дата заказа: *{escape_markdown_v2(order_details['order_date'].strftime('%d.%m.%Y'))}*")
-    summary_lines.append(f"Дата доставки: *{escape_markdown_v2(order_details['delivery_date'].strftime('%d.%m.%Y'))}*")
-    summary_lines.append(f"Клиент: *{escape_markdown_v2(order_details['client_name'])}*")
-    summary_lines.append(f"Адрес: *{escape_markdown_v2(order_details['address_text'])}*")
-    summary_lines.append(f"Статус: *{escape_markdown_v2(order_details['status'])}*")
+    summary_lines.append(f"*{escape_markdown_v2(f'Сводка заказа №{order.order_id}:')}*\n")
+    summary_lines.append(f"Дата заказа: *{escape_markdown_v2(order.order_date.strftime('%d.%m.%Y'))}*")
+    summary_lines.append(f"Дата доставки: *{escape_markdown_v2(order.delivery_date.strftime('%d.%m.%Y'))}*")
+    summary_lines.append(f"Клиент: *{escape_markdown_v2(order.client_name)}*")
+    summary_lines.append(f"Адрес: *{escape_markdown_v2(order.address_text)}*")
+    summary_lines.append(f"Статус: *{escape_markdown_v2(order.status)}*")
     summary_lines.append(escape_markdown_v2("--- ТОВАРЫ ---"))
 
-    if order_details["items"]:
-        for i, item in enumerate(order_details["items"]):
+    if order.lines:
+        for i, item in enumerate(order.lines):
             item_line = (
                 f"{i+1}\\. {escape_markdown_v2(item.product_name)} "
                 f"\\({escape_markdown_v2(f'{item.quantity:.2f}')} ед\\. x "
@@ -93,7 +98,7 @@ async def view_my_order_details(callback: CallbackQuery, state: FSMContext, db_p
         summary_lines.append(escape_markdown_v2("  В этом заказе нет товаров."))
 
     summary_lines.append(escape_markdown_v2("----------------------------------"))
-    summary_lines.append(f"*{escape_markdown_v2(f'ИТОГО: {order_details["total_amount"]:.2f} грн')}*")
+    summary_lines.append(f"*{escape_markdown_v2(f'ИТОГО: {order.total_amount:.2f} грн')}*")
 
     final_summary_text = "\n".join(summary_lines)
 
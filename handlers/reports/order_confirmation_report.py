@@ -2,10 +2,11 @@
 
 import logging
 import re
-from datetime import date
+from datetime import date, timedelta
 from decimal import Decimal
 from typing import Optional, List, Dict # Убедитесь, что все импорты на месте
 from utils.markdown_utils import escape_markdown_v2
+from utils.send_queue import bulk_sends
 
 from aiogram import Router, F
 from aiogram.types import CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton, Message, ReplyKeyboardRemove
@@ -14,55 +15,124 @@ from aiogram.filters import Command
 
 # Импортируем все необходимое из db_operations/report_order_confirmation
 from db_operations.report_order_confirmation import (
-    get_unconfirmed_orders,
     confirm_order_in_db,
     cancel_order_in_db,
     confirm_all_orders_in_db,
     cancel_all_orders_in_db,
-    get_unconfirmed_order_full_details, # Новая функция для деталей
     UnconfirmedOrder, # Используем namedtuple для сводки
-    OrderDetail # Используем namedtuple для деталей товаров
 )
+from db_operations.order_details import get_order_details
 
-# keyboards.inline_keyboards - пока не используем, но оставим импорт
-# Если create_confirm_report_keyboard создавала бы кнопки для индивидуального просмотра,
-# мы бы ее переписали. Пока будем генерировать клавиатуру прямо здесь.
-# from keyboards.inline_keyboards import create_confirm_report_keyboard
+from db_operations.draft_orders import OrderListFilter, OrderPage, get_orders_page, get_order_ids
+from db_operations import get_employee_id
+from keyboards.inline_keyboards import build_order_page_keyboard
 
 
 router = Router()
 logger = logging.getLogger(__name__)
 
-def build_order_list_keyboard(orders: List[UnconfirmedOrder]) -> InlineKeyboardMarkup:
+# Ключи данных FSM: текущий фильтр списка, курсор открытой страницы и число заказов по фильтру
+REPORT_FILTER_KEY = "confirm_report_filter"
+REPORT_CURSOR_KEY = "confirm_report_cursor"
+REPORT_TOTAL_KEY = "confirm_report_total"
+
+
+def build_order_list_keyboard(page: OrderPage, order_filter: OrderListFilter) -> InlineKeyboardMarkup:
     """
-    Строит клавиатуру со списком неподтвержденных заказов.
-    Каждая кнопка ведет на детали конкретного заказа.
-    Также добавляет кнопки массовых действий.
+    Строит клавиатуру для одной страницы неподтвержденных заказов.
+    Сверху — фильтры по дате доставки и сотруднику, ниже — заказы страницы и листание,
+    в конце — кнопки массовых действий над всеми заказами, подходящими под фильтр.
     """
-    buttons = []
-    
-    # Кнопки для просмотра индивидуальных заказов
-    for order in orders:
-        escaped_client_name = escape_markdown_v2(order.client_name)
-        buttons.append([
+    today = date.today()
+    tomorrow = today + timedelta(days=1)
+
+    def mark(text: str, selected: bool) -> str:
+        return f"• {text}" if selected else text
+
+    header_rows = [
+        [
+            InlineKeyboardButton(text=mark("📅 Сегодня", order_filter.delivery_date == today), callback_data="uco_filter:date:today"),
+            InlineKeyboardButton(text=mark("📅 Завтра", order_filter.delivery_date == tomorrow), callback_data="uco_filter:date:tomorrow"),
+            InlineKeyboardButton(text=mark("📅 Все даты", order_filter.delivery_date is None), callback_data="uco_filter:date:all"),
+        ],
+        [
             InlineKeyboardButton(
-                text=f"Заказ №{order.order_id} ({escaped_client_name}) - {order.total_amount:.2f}₴",
-                callback_data=f"view_unconfirmed_order_details_{order.order_id}" # Изменили callback_data
+                text="👥 Все сотрудники" if order_filter.employee_id is not None else "👤 Только мои",
+                callback_data="uco_filter:employee:all" if order_filter.employee_id is not None else "uco_filter:employee:mine"
             )
-        ])
-    
-    # Кнопки массовых действий, если есть заказы
-    if orders:
-        buttons.append([InlineKeyboardButton(text="✅ Подтвердить все заказы", callback_data="confirm_all_orders")])
-        buttons.append([InlineKeyboardButton(text="❌ Отменить все заказы", callback_data="cancel_all_orders")])
-    
-    return InlineKeyboardMarkup(inline_keyboard=buttons)
+        ]
+    ]
+
+    footer_rows = []
+    if page.total_count:
+        footer_rows.append([InlineKeyboardButton(text=f"✅ Подтвердить все заказы ({page.total_count})", callback_data="confirm_all_orders")])
+        footer_rows.append([InlineKeyboardButton(text=f"❌ Отменить все заказы ({page.total_count})", callback_data="cancel_all_orders")])
+
+    return build_order_page_keyboard(
+        page,
+        item_callback_prefix="view_unconfirmed_order_details_",
+        page_callback_prefix="uco_page",
+        header_rows=header_rows,
+        footer_rows=footer_rows
+    )
+
+
+async def _get_report_filter(state: FSMContext) -> OrderListFilter:
+    data = await state.get_data()
+    return OrderListFilter.from_state(data.get(REPORT_FILTER_KEY))
+
+
+async def _send_or_edit(message_object: Message, is_callback: bool, text: str, reply_markup=None):
+    if is_callback:
+        try:
+            await message_object.edit_text(text, reply_markup=reply_markup, parse_mode="MarkdownV2")
+            return
+        except Exception as e:
+            logger.warning(f"Не удалось отредактировать сообщение (вероятно, слишком старое) при показе списка: {e}")
+    await message_object.answer(text, reply_markup=reply_markup, parse_mode="MarkdownV2")
+
+
+async def render_unconfirmed_orders_page(message_object: Message, is_callback: bool, state: FSMContext, db_pool,
+                                         after: Optional[str] = None, before: Optional[str] = None,
+                                         reuse_total: bool = False):
+    """
+    Показывает одну страницу неподтвержденных заказов с учетом фильтра из FSM.
+    Положение страницы запоминается, чтобы после действий над заказом вернуться на нее же.
+    reuse_total — листание: число заказов берется из FSM, а не считается заново.
+    """
+    data = await state.get_data()
+    order_filter = OrderListFilter.from_state(data.get(REPORT_FILTER_KEY))
+    total_count = data.get(REPORT_TOTAL_KEY) if reuse_total else None
+    page = await get_orders_page(db_pool, order_filter, after=after, before=before, total_count=total_count)
+
+    if not page.orders and (after or before):
+        # Страница опустела (заказы подтверждены/отменены) — показываем первую и пересчитываем заказы
+        after = before = None
+        page = await get_orders_page(db_pool, order_filter)
+
+    await state.update_data({REPORT_CURSOR_KEY: {"after": after, "before": before}, REPORT_TOTAL_KEY: page.total_count})
+
+    if not page.orders and order_filter == OrderListFilter():
+        await _send_or_edit(message_object, is_callback, escape_markdown_v2("На сегодня нет неподтвержденных заказов."))
+        return
+
+    if page.orders:
+        initial_text = escape_markdown_v2(
+            f"Неподтвержденных заказов: {page.total_count}. "
+            "Выберите заказ для просмотра деталей или выполните массовое действие:"
+        )
+    else:
+        initial_text = escape_markdown_v2("Нет неподтвержденных заказов по выбранному фильтру.")
+
+    await _send_or_edit(message_object, is_callback, initial_text, build_order_list_keyboard(page, order_filter))
+
 
 @router.message(F.text == "/show_unconfirmed_orders")
 @router.callback_query(F.data == "show_unconfirmed_orders_report_list") # Изменили callback_data для возврата к списку
 async def show_unconfirmed_orders_report(callback_or_message, state: FSMContext, db_pool):
     """
-    Показывает отчет о неподтвержденных заказах за сегодняшний день в виде кнопок.
+    Показывает отчет о неподтвержденных заказах в виде кнопок (постранично).
+    Команда открывает первую страницу, возврат к списку — последнюю открытую.
     """
     message_object: Message | None = None
     is_callback = isinstance(callback_or_message, CallbackQuery)
@@ -82,34 +152,42 @@ async def show_unconfirmed_orders_report(callback_or_message, state: FSMContext,
         return
 
     logger.info("Показ отчета о неподтвержденных заказов.")
-    
-    unconfirmed_orders = await get_unconfirmed_orders(db_pool)
 
-    if not unconfirmed_orders:
-        report_text = escape_markdown_v2("На сегодня нет неподтвержденных заказов.")
-        
-        # Если это колбэк, пытаемся отредактировать предыдущее сообщение
-        if is_callback:
-            try:
-                await message_object.edit_text(report_text, parse_mode="MarkdownV2")
-            except Exception as e:
-                logger.warning(f"Не удалось отредактировать сообщение для пустого отчета (вероятно, сообщение слишком старое): {e}")
-                await message_object.answer(report_text, parse_mode="MarkdownV2")
-        else:
-            await message_object.answer(report_text, parse_mode="MarkdownV2")
-        return
+    after = before = None
+    if is_callback:
+        cursor = (await state.get_data()).get(REPORT_CURSOR_KEY) or {}
+        after, before = cursor.get("after"), cursor.get("before")
 
-    initial_text = escape_markdown_v2("Выберите неподтвержденный заказ для просмотра деталей или выполните массовое действие:")
-    keyboard = build_order_list_keyboard(unconfirmed_orders) # Используем нашу новую функцию
+    await render_unconfirmed_orders_page(message_object, is_callback, state, db_pool, after=after, before=before)
 
-    if is_callback:
-        try:
-            await message_object.edit_text(initial_text, reply_markup=keyboard, parse_mode="MarkdownV2")
-        except Exception as e:
-            logger.warning(f"Не удалось отредактировать сообщение (вероятно, слишком старое) при возврате к списку: {e}")
-            await message_object.answer(initial_text, reply_markup=keyboard, parse_mode="MarkdownV2")
+
+@router.callback_query(F.data.startswith("uco_page:"))
+async def paginate_unconfirmed_orders(callback: CallbackQuery, state: FSMContext, db_pool):
+    """Листание списка неподтвержденных заказов."""
+    await callback.answer()
+    _, direction, cursor = callback.data.split(":", 2)
+    if direction == "next":
+        await render_unconfirmed_orders_page(callback.message, True, state, db_pool, after=cursor, reuse_total=True)
     else:
-        await message_object.answer(initial_text, reply_markup=keyboard, parse_mode="MarkdownV2")
+        await render_unconfirmed_orders_page(callback.message, True, state, db_pool, before=cursor, reuse_total=True)
+
+
+@router.callback_query(F.data.startswith("uco_filter:"))
+async def change_unconfirmed_orders_filter(callback: CallbackQuery, state: FSMContext, db_pool):
+    """Переключение фильтров списка (дата доставки, только свои заказы)."""
+    await callback.answer()
+    _, field, value = callback.data.split(":", 2)
+    order_filter = await _get_report_filter(state)
+
+    if field == "date":
+        delivery_date = {"today": date.today(), "tomorrow": date.today() + timedelta(days=1)}.get(value)
+        order_filter = order_filter._replace(delivery_date=delivery_date)
+    elif field == "employee":
+        employee_id = await get_employee_id(db_pool, callback.from_user.id) if value == "mine" else None
+        order_filter = order_filter._replace(employee_id=employee_id)
+
+    await state.update_data({REPORT_FILTER_KEY: order_filter.to_state()})
+    await render_unconfirmed_orders_page(callback.message, True, state, db_pool)
 
 
 @router.callback_query(F.data.startswith("view_unconfirmed_order_details_")) # Изменили F.data
@@ -122,24 +200,29 @@ async def view_unconfirmed_order_details(callback: CallbackQuery, state: FSMCont
     order_id = int(callback.data.split("_")[-1])
     logger.info(f"Администратор {callback.from_user.id} запросил детали неподтвержденного заказа №{order_id}.")
 
-    order_details = await get_unconfirmed_order_full_details(db_pool, order_id) # Используем новую функцию
+    try:
+        # Заказ в другом статусе (уже подтвержден или отменен) считается ненайденным
+        order = await get_order_details(db_pool, order_id, statuses=("draft",))
+    except Exception as e:
+        logger.error(f"Неизвестная ошибка при получении деталей неподтвержденного заказа #{order_id}: {e}", exc_info=True)
+        order = None
 
-    if not order_details:
+    if not order:
         await callback.message.edit_text(escape_markdown_v2(f"❌ Не удалось найти детали для неподтвержденного заказа №{order_id}. Возможно, он уже был обработан или удален."), parse_mode="MarkdownV2")
         return
 
     # Формируем текст сводки заказа
     summary_lines = []
-    summary_lines.append(f"*{escape_markdown_v2(f'Сводка неподтвержденного заказа №{order_details["order_id"]}:')}*\n")
-    summary_lines.append(f"Дата заказа: *{escape_markdown_v2(order_details['order_date'].strftime('%d.%m.%Y'))}*")
-    summary_lines.append(f"Дата доставки: *{escape_markdown_v2(order_details['delivery_date'].strftime('%d.%m.%Y'))}*")
-    summary_lines.append(f"Клиент: *{escape_markdown_v2(order_details['client_name'])}*")
-    summary_lines.append(f"Адрес: *{escape_markdown_v2(order_details['address_text'])}*")
-    summary_lines.append(f"Статус: *{escape_markdown_v2(order_details['status'])}*")
+    summary_lines.append(f"*{escape_markdown_v2(f'Сводка неподтвержденного заказа №{order.order_id}:')}*\n")
+    summary_lines.append(f"Дата заказа: *{escape_markdown_v2(order.order_date.strftime('%d.%m.%Y'))}*")
+    summary_lines.append(f"Дата доставки: *{escape_markdown_v2(order.delivery_date.strftime('%d.%m.%Y'))}*")
+    summary_lines.append(f"Клиент: *{escape_markdown_v2(order.client_name)}*")
+    summary_lines.append(f"Адрес: *{escape_markdown_v2(order.address_text)}*")
+    summary_lines.append(f"Статус: *{escape_markdown_v2(order.status)}*")
     summary_lines.append(escape_markdown_v2("--- ТОВАРЫ ---"))
 
-    if order_details["items"]:
-        for i, item in enumerate(order_details["items"]):
+    if order.lines:
+        for i, item in enumerate(order.lines):
             item_line = (
                 f"{i+1}\\. {escape_markdown_v2(item.product_name)} "
                 f"\\({escape_markdown_v2(f'{item.quantity:.2f}')} ед\\. x "
@@ -151,7 +234,7 @@ async def view_unconfirmed_order_details(callback: CallbackQuery, state: FSMCont
         summary_lines.append(escape_markdown_v2("  В этом заказе нет товаров."))
 
     summary_lines.append(escape_markdown_v2("----------------------------------"))
-    summary_lines.append(f"*{escape_markdown_v2(f'ИТОГО: {order_details["total_amount"]:.2f} грн')}*")
+    summary_lines.append(f"*{escape_markdown_v2(f'ИТОГО: {order.total_amount:.2f} грн')}*")
 
     final_summary_text = "\n".join(summary_lines)
 
@@ -216,34 +299,36 @@ async def handle_confirm_all_orders(callback: CallbackQuery, state: FSMContext,
     """
     Обрабатывает нажатие на кнопку "Подтвердить все заказы".
     """
-    orders_to_confirm = await get_unconfirmed_orders(db_pool)
-    order_ids = [order.order_id for order in orders_to_confirm] # Теперь order.order_id, так как UnconfirmedOrder - namedtuple
-
-    if not order_ids:
-        await callback.answer("Нет заказов для подтверждения.", show_alert=True)
-        # Если нет заказов, можно отредактировать сообщение, чтобы оно было актуальным
-        try:
-            await callback.message.edit_text(escape_markdown_v2("Нет неподтвержденных заказов."), parse_mode="MarkdownV2")
-        except Exception:
-            pass # Игнорируем ошибку, если сообщение уже исчезло или не может быть отредактировано
-        return
-
-    success = await confirm_all_orders_in_db(db_pool, order_ids)
-    if success:
-        await callback.answer(f"✅ Все {len(order_ids)} заказов успешно подтверждены!", show_alert=False)
-        try:
-            await callback.message.edit_text(escape_markdown_v2(f"✅ Все {len(order_ids)} неподтвержденных заказов успешно подтверждены!"), parse_mode="MarkdownV2")
-        except Exception:
-            pass
-    else:
-        await callback.answer("❌ Произошла ошибка при подтверждении всех заказов.", show_alert=True)
-        try:
-            await callback.message.edit_text(escape_markdown_v2("❌ Произошла ошибка при подтверждении всех заказов."), parse_mode="MarkdownV2")
-        except Exception:
-            pass
+    # Массовое действие и обновление отчета идут в низкоприоритетной очереди отправки
+    with bulk_sends():
+        # Подтверждаются все заказы, подходящие под текущий фильтр (а не только видимая страница)
+        order_ids = await get_order_ids(db_pool, await _get_report_filter(state))
+
+        if not order_ids:
+            await callback.answer("Нет заказов для подтверждения.", show_alert=True)
+            # Если нет заказов, можно отредактировать сообщение, чтобы оно было актуальным
+            try:
+                await callback.message.edit_text(escape_markdown_v2("Нет неподтвержденных заказов."), parse_mode="MarkdownV2")
+            except Exception:
+                pass # Игнорируем ошибку, если сообщение уже исчезло или не может быть отредактировано
+            return
+
+        success = await confirm_all_orders_in_db(db_pool, order_ids)
+        if success:
+            await callback.answer(f"✅ Все {len(order_ids)} заказов успешно подтверждены!", show_alert=False)
+            try:
+                await callback.message.edit_text(escape_markdown_v2(f"✅ Все {len(order_ids)} неподтвержденных заказов успешно подтверждены!"), parse_mode="MarkdownV2")
+            except Exception:
+                pass
+        else:
+            await callback.answer("❌ Произошла ошибка при подтверждении всех заказов.", show_alert=True)
+            try:
+                await callback.message.edit_text(escape_markdown_v2("❌ Произошла ошибка при подтверждении всех заказов."), parse_mode="MarkdownV2")
+            except Exception:
+                pass
     
-    # После подтверждения/отмены, обновите отчет
-    await show_unconfirmed_orders_report(callback, state, db_pool)
+        # После подтверждения/отмены, обновите отчет
+        await show_unconfirmed_orders_report(callback, state, db_pool)
 
 
 @router.callback_query(F.data == "cancel_all_orders")
@@ -251,30 +336,31 @@ async def handle_cancel_all_orders(callback: CallbackQuery, state: FSMContext, d
     """
     Обрабатывает нажатие на кнопку "Отменить все заказы".
     """
-    orders_to_cancel = await get_unconfirmed_orders(db_pool)
-    order_ids = [order.order_id for order in orders_to_cancel] # Теперь order.order_id
-
-    if not order_ids:
-        await callback.answer("Нет заказов для отмены.", show_alert=True)
-        try:
-            await callback.message.edit_text(escape_markdown_v2("Нет неподтвержденных заказов."), parse_mode="MarkdownV2")
-        except Exception:
-            pass
-        return
+    # Массовое действие и обновление отчета идут в низкоприоритетной очереди отправки
+    with bulk_sends():
+        order_ids = await get_order_ids(db_pool, await _get_report_filter(state))
 
-    success = await cancel_all_orders_in_db(db_pool, order_ids)
-    if success:
-        await callback.answer(f"🗑️ Все {len(order_ids)} заказов успешно отменены!", show_alert=False)
-        try:
-            await callback.message.edit_text(escape_markdown_v2(f"🗑️ Все {len(order_ids)} неподтвержденных заказов успешно отменены и удалены."), parse_mode="MarkdownV2")
-        except Exception:
-            pass
-    else:
-        await callback.answer("❌ Произошла ошибка при отмене всех заказов.", show_alert=True)
-        try:
-            await callback.message.edit_text(escape_markdown_v2("❌ Произошла ошибка при отмене всех заказов."), parse_mode="MarkdownV2")
-        except Exception:
-            pass
+        if not order_ids:
+            await callback.answer("Нет заказов для отмены.", show_alert=True)
+            try:
+                await callback.message.edit_text(escape_markdown_v2("Нет неподтвержденных заказов."), parse_mode="MarkdownV2")
+            except Exception:
+                pass
+            return
+
+        success = await cancel_all_orders_in_db(db_pool, order_ids)
+        if success:
+            await callback.answer(f"🗑️ Все {len(order_ids)} заказов успешно отменены!", show_alert=False)
+            try:
+                await callback.message.edit_text(escape_markdown_v2(f"🗑️ Все {len(order_ids)} неподтвержденных заказов успешно отменены и удалены."), parse_mode="MarkdownV2")
+            except Exception:
+                pass
+        else:
+            await callback.answer("❌ Произошла ошибка при отмене всех заказов.", show_alert=True)
+            try:
+                await callback.message.edit_text(escape_markdown_v2("❌ Произошла ошибка при отмене всех заказов."), parse_mode="MarkdownV2")
+            except Exception:
+                pass
     
-    # После подтверждения/отмены, обновите отчет
-    await show_unconfirmed_orders_report(callback, state, db_pool)
\ No newline at end of file
+        # После подтверждения/отмены, обновите отчет
+        await show_unconfirmed_orders_report(callback, state, db_pool)
\ No newline at end of file
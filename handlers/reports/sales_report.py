@@ -0,0 +1,143 @@
+# handlers/reports/sales_report.py
+"""
+/sales_report — продажи за период по дневным агрегатам (db_operations/sales_rollups.py).
+
+/sales_report                       — текущий месяц
+/sales_report 05.03.2025            — один день
+/sales_report 01.03.2025 31.03.2025 — период
+Кнопки под отчетом переключают быстрые периоды.
+"""
+import logging
+from datetime import date, datetime, timedelta
+from typing import Optional
+
+from aiogram import Router, F
+from aiogram.filters import Command, CommandObject
+from aiogram.types import CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton, Message
+from aiogram.exceptions import TelegramBadRequest
+
+from db_operations.sales_rollups import SalesBreakdownRow, SalesReport, get_sales_report
+from utils.cart_view import is_not_modified_error
+from utils.markdown_utils import escape_markdown_v2
+
+router = Router()
+logger = logging.getLogger(__name__)
+
+DATE_FORMAT = "%d.%m.%Y"
+
+# Максимальная длина периода отчета в днях
+MAX_REPORT_DAYS = 3660
+
+
+def parse_report_period(args: Optional[str], today: Optional[date] = None) -> tuple[date, date]:
+    """Аргументы команды -> (начало, конец). ValueError при неверном формате."""
+    today = today or date.today()
+    parts = (args or "").split()
+    if not parts:
+        return today.replace(day=1), today
+    if len(parts) > 2:
+        raise ValueError("слишком много аргументов")
+    dates = [datetime.strptime(part, DATE_FORMAT).date() for part in parts]
+    date_from, date_to = dates[0], dates[-1]
+    if date_from > date_to:
+        date_from, date_to = date_to, date_from
+    if (date_to - date_from).days > MAX_REPORT_DAYS:
+        raise ValueError("слишком длинный период")
+    return date_from, date_to
+
+
+def build_period_keyboard(today: Optional[date] = None) -> InlineKeyboardMarkup:
+    today = today or date.today()
+    month_start = today.replace(day=1)
+    last_month_end = month_start - timedelta(days=1)
+    presets = [
+        ("Сегодня", today, today),
+        ("7 дней", today - timedelta(days=6), today),
+        ("Этот месяц", month_start, today),
+        ("Прошлый месяц", last_month_end.replace(day=1), last_month_end),
+    ]
+    buttons = [
+        InlineKeyboardButton(text=title, callback_data=f"sales_report:{date_from.isoformat()}:{date_to.isoformat()}")
+        for title, date_from, date_to in presets
+    ]
+    return InlineKeyboardMarkup(inline_keyboard=[buttons[:2], buttons[2:]])
+
+
+def _format_breakdown(title: str, rows: list[SalesBreakdownRow]) -> list[str]:
+    if not rows:
+        return []
+    lines = [f"\n*{escape_markdown_v2(title)}*"]
+    for row in rows:
+        lines.append(escape_markdown_v2(
+            f"• {row.name}: {row.amount:.2f} грн ({row.orders_count} зак., {row.quantity:g} шт.)"
+        ))
+    return lines
+
+
+def format_sales_report(report: SalesReport) -> str:
+    if report.date_from == report.date_to:
+        period = report.date_from.strftime(DATE_FORMAT)
+    else:
+        period = f"{report.date_from.strftime(DATE_FORMAT)} – {report.date_to.strftime(DATE_FORMAT)}"
+
+    lines = [f"*{escape_markdown_v2(f'📊 Продажи за {period}')}*\n"]
+    totals = report.totals
+    if not totals.orders_count:
+        lines.append(escape_markdown_v2("Подтвержденных продаж за период нет."))
+        return "\n".join(lines)
+
+    lines.append(escape_markdown_v2(f"Заказов: {totals.orders_count}"))
+    lines.append(escape_markdown_v2(f"Товаров: {totals.quantity:g} шт."))
+    lines.append(f"Сумма: *{escape_markdown_v2(f'{totals.amount:.2f}')}* грн")
+    if report.own is not None and report.own.orders_count:
+        lines.append(escape_markdown_v2(
+            f"Ваши продажи: {report.own.amount:.2f} грн ({report.own.orders_count} зак.)"
+        ))
+
+    lines += _format_breakdown("По сотрудникам:", report.by_employee)
+    lines += _format_breakdown("Топ клиентов:", report.by_client)
+    lines += _format_breakdown("По категориям:", report.by_category)
+    lines += _format_breakdown("Топ товаров:", report.by_product)
+    return "\n".join(lines)
+
+
+@router.message(Command("sales_report"))
+async def show_sales_report(message: Message, command: CommandObject, db_pool):
+    try:
+        date_from, date_to = parse_report_period(command.args)
+    except ValueError:
+        await message.answer(
+            escape_markdown_v2(
+                "Формат: /sales_report [дд.мм.гггг] [дд.мм.гггг]\n"
+                "Без дат — текущий месяц, одна дата — один день, две — период."
+            ),
+            parse_mode="MarkdownV2"
+        )
+        return
+
+    logger.info("Пользователь %s запросил отчет о продажах за %s - %s.", message.from_user.id, date_from, date_to)
+    report = await get_sales_report(db_pool, date_from, date_to, message.from_user.id)
+    if report is None:
+        await message.answer(escape_markdown_v2("❌ Не удалось построить отчет о продажах."), parse_mode="MarkdownV2")
+        return
+
+    await message.answer(format_sales_report(report), parse_mode="MarkdownV2", reply_markup=build_period_keyboard())
+
+
+@router.callback_query(F.data.startswith("sales_report:"))
+async def switch_sales_report_period(callback: CallbackQuery, db_pool):
+    _, date_from, date_to = callback.data.split(":")
+    report = await get_sales_report(db_pool, date.fromisoformat(date_from), date.fromisoformat(date_to), callback.from_user.id)
+    if report is None:
+        await callback.answer("Не удалось построить отчет о продажах.", show_alert=True)
+        return
+
+    await callback.answer()
+    try:
+        await callback.message.edit_text(
+            format_sales_report(report), parse_mode="MarkdownV2", reply_markup=build_period_keyboard()
+        )
+    except TelegramBadRequest as e:
+        # Тот же период нажат повторно — сообщение не изменилось
+        if not is_not_modified_error(e):
+            raise
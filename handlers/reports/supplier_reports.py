@@ -6,6 +6,7 @@ from datetime import date, datetime
 from decimal import Decimal
 from typing import List
 from utils.markdown_utils import escape_markdown_v2
+from utils.send_queue import SendPriorityMiddleware, Priority
 
 from aiogram import Router, F
 from aiogram.types import Message
@@ -20,6 +21,8 @@ from db_operations.supplier_operations import (
 )
 
 router = Router()
+# Длинные отчеты уступают очередь отправки интерактивным ответам
+router.message.middleware(SendPriorityMiddleware(Priority.BULK))
 logger = logging.getLogger(__name__)
 
 @router.message(Command("incoming_deliveries_today"))
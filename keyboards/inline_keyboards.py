@@ -59,24 +59,80 @@ def delivery_date_keyboard(start_date: date) -> InlineKeyboardMarkup:
 
     return InlineKeyboardMarkup(inline_keyboard=keyboard_buttons)
 
-def create_confirm_report_keyboard(order_ids: list[int]) -> InlineKeyboardMarkup:
+def build_order_page_keyboard(
+    page,
+    item_callback_prefix: str,
+    page_callback_prefix: str,
+    header_rows: list | None = None,
+    footer_rows: list | None = None
+) -> InlineKeyboardMarkup:
     """
-    Создает инлайн-клавиатуру для отчета о неподтвержденных заказах.
-    Включает кнопки для подтверждения/отмены всех заказов и для каждого отдельного заказа.
+    Строит клавиатуру для одной страницы списка заказов (db_operations.draft_orders.OrderPage).
+    Каждая кнопка заказа ведет на callback_data f"{item_callback_prefix}{order_id}",
+    кнопки листания — на f"{page_callback_prefix}:prev:<курсор>" и f"{page_callback_prefix}:next:<курсор>".
     """
-    keyboard_buttons = []
+    from db_operations.draft_orders import encode_cursor
 
-    # Кнопки для всех заказов
-    keyboard_buttons.append([
-        InlineKeyboardButton(text="✅ Подтвердить все", callback_data="confirm_all_orders"),
-        InlineKeyboardButton(text="❌ Отменить все", callback_data="cancel_all_orders")
-    ])
+    keyboard_buttons = list(header_rows or [])
 
-    # Кнопки для каждого отдельного заказа
-    for order_id in order_ids:
+    for order in page.orders:
         keyboard_buttons.append([
-            InlineKeyboardButton(text=f"✅ Подтвердить Заказ #{order_id}", callback_data=f"confirm_order_{order_id}"),
-            InlineKeyboardButton(text=f"❌ Отменить Заказ #{order_id}", callback_data=f"cancel_order_{order_id}")
+            InlineKeyboardButton(
+                text=f"Заказ №{order.order_id} ({order.client_name}) - {order.total_amount:.2f}₴",
+                callback_data=f"{item_callback_prefix}{order.order_id}"
+            )
         ])
-    
-    return InlineKeyboardMarkup(inline_keyboard=keyboard_buttons)
\ No newline at end of file
+
+    navigation_row = []
+    if page.has_prev and page.orders:
+        navigation_row.append(InlineKeyboardButton(
+            text="⬅️ Назад", callback_data=f"{page_callback_prefix}:prev:{encode_cursor(page.orders[0])}"
+        ))
+    if page.has_next and page.orders:
+        navigation_row.append(InlineKeyboardButton(
+            text="Вперед ➡️", callback_data=f"{page_callback_prefix}:next:{encode_cursor(page.orders[-1])}"
+        ))
+    if navigation_row:
+        keyboard_buttons.append(navigation_row)
+
+    keyboard_buttons.extend(footer_rows or [])
+    return InlineKeyboardMarkup(inline_keyboard=keyboard_buttons)
+
+
+# Поставщиков на одной странице выбора
+SUPPLIER_PAGE_SIZE = 10
+
+
+def build_supplier_page_keyboard(
+    suppliers: list,
+    offset: int,
+    item_callback_prefix: str,
+    page_callback_prefix: str,
+    cancel_callback: str,
+    page_size: int = SUPPLIER_PAGE_SIZE
+) -> InlineKeyboardMarkup:
+    """
+    Строит клавиатуру для одной страницы найденных поставщиков (db_operations.supplier_operations.Supplier).
+    Каждая кнопка поставщика ведет на callback_data f"{item_callback_prefix}{supplier_id}",
+    кнопки листания — на f"{page_callback_prefix}:<смещение>".
+    """
+    offset = max(0, min(offset, max(len(suppliers) - 1, 0) // page_size * page_size))
+    keyboard_buttons = [
+        [InlineKeyboardButton(text=supplier.name, callback_data=f"{item_callback_prefix}{supplier.supplier_id}")]
+        for supplier in suppliers[offset:offset + page_size]
+    ]
+
+    navigation_row = []
+    if offset > 0:
+        navigation_row.append(InlineKeyboardButton(
+            text="⬅️ Назад", callback_data=f"{page_callback_prefix}:{max(offset - page_size, 0)}"
+        ))
+    if offset + page_size < len(suppliers):
+        navigation_row.append(InlineKeyboardButton(
+            text="Вперед ➡️", callback_data=f"{page_callback_prefix}:{offset + page_size}"
+        ))
+    if navigation_row:
+        keyboard_buttons.append(navigation_row)
+
+    keyboard_buttons.append([InlineKeyboardButton(text="❌ Отмена", callback_data=cancel_callback)])
+    return InlineKeyboardMarkup(inline_keyboard=keyboard_buttons)
@@ -39,3 +39,350 @@ SELECT SUM(quantity)
 FROM stock;
 
 SELECT product_id, quantity FROM stock;
+
+-- Частичные индексы для постраничных списков заказов (db_operations/draft_orders.py).
+-- Порядок колонок совпадает с ключом keyset-пагинации (order_date, order_id);
+-- в индекс попадают только черновики / редактируемые заказы, поэтому он остается маленьким.
+CREATE INDEX IF NOT EXISTS idx_orders_draft_keyset
+    ON orders (order_date DESC, order_id DESC)
+    WHERE status = 'draft';
+
+CREATE INDEX IF NOT EXISTS idx_orders_editable_keyset
+    ON orders (order_date DESC, order_id DESC)
+    WHERE status IN ('draft', 'confirmed');
+
+-- Уведомления об изменении остатков и черновиков для снимка доступности
+-- (db_operations/stock_availability.py слушает канал stock_changed).
+-- payload = product_id; пустой payload — перечитать снимок целиком.
+CREATE OR REPLACE FUNCTION notify_stock_changed() RETURNS trigger AS $$
+BEGIN
+    IF TG_TABLE_NAME = 'orders' THEN
+        PERFORM pg_notify('stock_changed', '');
+    ELSIF TG_OP = 'DELETE' THEN
+        PERFORM pg_notify('stock_changed', OLD.product_id::text);
+    ELSE
+        PERFORM pg_notify('stock_changed', NEW.product_id::text);
+        IF TG_OP = 'UPDATE' AND OLD.product_id IS DISTINCT FROM NEW.product_id THEN
+            PERFORM pg_notify('stock_changed', OLD.product_id::text);
+        END IF;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_stock_notify ON stock;
+CREATE TRIGGER trg_stock_notify
+    AFTER INSERT OR UPDATE OR DELETE ON stock
+    FOR EACH ROW EXECUTE FUNCTION notify_stock_changed();
+
+DROP TRIGGER IF EXISTS trg_order_lines_notify ON order_lines;
+CREATE TRIGGER trg_order_lines_notify
+    AFTER INSERT OR UPDATE OR DELETE ON order_lines
+    FOR EACH ROW EXECUTE FUNCTION notify_stock_changed();
+
+-- Смена статуса черновика (подтверждение/отмена) снимает его резервы
+DROP TRIGGER IF EXISTS trg_orders_status_notify ON orders;
+CREATE TRIGGER trg_orders_status_notify
+    AFTER UPDATE OF status OR DELETE ON orders
+    FOR EACH ROW EXECUTE FUNCTION notify_stock_changed();
+
+-- Мягкие резервы товара под черновики заказов (db_operations/stock_reservations.py)
+CREATE TABLE IF NOT EXISTS stock_reservations (
+    order_id INTEGER NOT NULL REFERENCES orders(order_id) ON DELETE CASCADE,
+    product_id INTEGER NOT NULL REFERENCES products(product_id),
+    quantity NUMERIC(10, 2) NOT NULL CHECK (quantity > 0),
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    expires_at TIMESTAMPTZ NOT NULL,
+    PRIMARY KEY (order_id, product_id)
+);
+CREATE INDEX IF NOT EXISTS idx_stock_reservations_product ON stock_reservations (product_id, expires_at);
+CREATE INDEX IF NOT EXISTS idx_stock_reservations_expires ON stock_reservations (expires_at);
+
+-- Доступность теперь считается по резервам, а не по строкам черновиков
+DROP TRIGGER IF EXISTS trg_order_lines_notify ON order_lines;
+DROP TRIGGER IF EXISTS trg_orders_status_notify ON orders;
+
+DROP TRIGGER IF EXISTS trg_stock_reservations_notify ON stock_reservations;
+CREATE TRIGGER trg_stock_reservations_notify
+    AFTER INSERT OR UPDATE OR DELETE ON stock_reservations
+    FOR EACH ROW EXECUTE FUNCTION notify_stock_changed();
+
+-- Однократно: резервы для уже существующих черновиков (без учета нехватки остатков)
+INSERT INTO stock_reservations (order_id, product_id, quantity, expires_at)
+SELECT ol.order_id, ol.product_id, SUM(ol.quantity), now() + interval '48 hours'
+FROM order_lines ol
+JOIN orders o ON o.order_id = ol.order_id
+WHERE o.status = 'draft'
+GROUP BY ol.order_id, ol.product_id
+HAVING SUM(ol.quantity) > 0
+ON CONFLICT (order_id, product_id) DO NOTHING;
+
+-- Просроченные накладные (db_operations/overdue_invoices.py).
+-- История переходов статуса оплаты в 'overdue'; notify = первый переход накладной в просрочку,
+-- notified_at — когда ответственный сотрудник получил сводку.
+CREATE TABLE IF NOT EXISTS invoice_overdue_history (
+    history_id BIGSERIAL PRIMARY KEY,
+    order_id INTEGER NOT NULL REFERENCES orders(order_id) ON DELETE CASCADE,
+    previous_status VARCHAR(50) NOT NULL,
+    due_date DATE NOT NULL,
+    amount_due NUMERIC(12, 2) NOT NULL,
+    marked_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    notify BOOLEAN NOT NULL,
+    notified_at TIMESTAMPTZ
+);
+CREATE INDEX IF NOT EXISTS idx_invoice_overdue_history_order ON invoice_overdue_history (order_id);
+CREATE INDEX IF NOT EXISTS idx_invoice_overdue_history_pending
+    ON invoice_overdue_history (history_id)
+    WHERE notify AND notified_at IS NULL;
+
+-- Кандидаты в просрочку: частичный индекс по сроку оплаты только для неоплаченных подтвержденных накладных
+CREATE INDEX IF NOT EXISTS idx_orders_unpaid_due_date
+    ON orders (due_date)
+    WHERE status = 'confirmed' AND payment_status IN ('unpaid', 'partially_paid');
+
+-- Дневные агрегаты продаж (db_operations/sales_rollups.py).
+-- Обновляются в транзакции подтверждения/отмены/редактирования заказа; /sales_report читает только их.
+-- Пустой сотрудник/клиент/категория хранится как 0. Первичное заполнение:
+--   python -m db_operations.sales_rollups
+CREATE TABLE IF NOT EXISTS sales_daily_employee (
+    sale_date DATE NOT NULL,
+    employee_id INTEGER NOT NULL,
+    orders_count INTEGER NOT NULL DEFAULT 0,
+    quantity NUMERIC(14, 2) NOT NULL DEFAULT 0,
+    amount NUMERIC(14, 2) NOT NULL DEFAULT 0,
+    PRIMARY KEY (sale_date, employee_id)
+);
+CREATE TABLE IF NOT EXISTS sales_daily_client (
+    sale_date DATE NOT NULL,
+    client_id INTEGER NOT NULL,
+    orders_count INTEGER NOT NULL DEFAULT 0,
+    quantity NUMERIC(14, 2) NOT NULL DEFAULT 0,
+    amount NUMERIC(14, 2) NOT NULL DEFAULT 0,
+    PRIMARY KEY (sale_date, client_id)
+);
+CREATE TABLE IF NOT EXISTS sales_daily_product (
+    sale_date DATE NOT NULL,
+    product_id INTEGER NOT NULL,
+    orders_count INTEGER NOT NULL DEFAULT 0,
+    quantity NUMERIC(14, 2) NOT NULL DEFAULT 0,
+    amount NUMERIC(14, 2) NOT NULL DEFAULT 0,
+    PRIMARY KEY (sale_date, product_id)
+);
+CREATE TABLE IF NOT EXISTS sales_daily_category (
+    sale_date DATE NOT NULL,
+    category_id INTEGER NOT NULL,
+    orders_count INTEGER NOT NULL DEFAULT 0,
+    quantity NUMERIC(14, 2) NOT NULL DEFAULT 0,
+    amount NUMERIC(14, 2) NOT NULL DEFAULT 0,
+    PRIMARY KEY (sale_date, category_id)
+);
+
+-- Печатные документы (utils/documents.py, db_operations/documents.py):
+-- ключ документа (вид + хэш исходных данных) -> Telegram file_id уже загруженного файла.
+CREATE TABLE IF NOT EXISTS document_files (
+    content_key TEXT PRIMARY KEY,
+    file_name TEXT NOT NULL,
+    file_id TEXT NOT NULL,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+-- Transactional outbox (db_operations/outbox.py): события пишутся в транзакции изменения заказа/оплаты/склада,
+-- фоновая задача рассылает по ним сводные уведомления и отмечает processed_at.
+CREATE TABLE IF NOT EXISTS outbox_events (
+    event_id BIGSERIAL PRIMARY KEY,
+    event_type TEXT NOT NULL,
+    aggregate_id INTEGER,
+    payload JSONB NOT NULL DEFAULT '{}'::jsonb,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    processed_at TIMESTAMPTZ
+);
+CREATE INDEX IF NOT EXISTS idx_outbox_events_pending
+    ON outbox_events (event_type, created_at)
+    WHERE processed_at IS NULL;
+CREATE INDEX IF NOT EXISTS idx_outbox_events_processed_at
+    ON outbox_events (processed_at)
+    WHERE processed_at IS NOT NULL;
+
+-- Версии справочников для кэша db_operations/reference_cache.py:
+-- любое изменение suppliers/categories/addresses увеличивает версию, кэш сбрасывает только этот справочник.
+CREATE TABLE IF NOT EXISTS reference_versions (
+    name TEXT PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 0
+);
+INSERT INTO reference_versions (name) VALUES ('suppliers'), ('categories'), ('addresses')
+ON CONFLICT (name) DO NOTHING;
+
+CREATE OR REPLACE FUNCTION bump_reference_version() RETURNS trigger AS $$
+BEGIN
+    UPDATE reference_versions SET version = version + 1 WHERE name = TG_TABLE_NAME;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_suppliers_version ON suppliers;
+CREATE TRIGGER trg_suppliers_version
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON suppliers
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_reference_version();
+
+DROP TRIGGER IF EXISTS trg_categories_version ON categories;
+CREATE TRIGGER trg_categories_version
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON categories
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_reference_version();
+
+DROP TRIGGER IF EXISTS trg_addresses_version ON addresses;
+CREATE TRIGGER trg_addresses_version
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON addresses
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_reference_version();
+
+-- Матрица клиент × товар для повтора заказа (ведется в db_operations/sales_rollups.py вместе с агрегатами продаж).
+-- Заполнение по истории: python -m db_operations.sales_rollups
+CREATE TABLE IF NOT EXISTS client_product_stats (
+    client_id INTEGER NOT NULL,
+    product_id INTEGER NOT NULL,
+    orders_count INTEGER NOT NULL DEFAULT 0,
+    quantity NUMERIC(14, 2) NOT NULL DEFAULT 0,
+    last_order_date DATE,
+    PRIMARY KEY (client_id, product_id)
+);
+-- Последний подтвержденный заказ клиента
+CREATE INDEX IF NOT EXISTS idx_orders_client_sales
+    ON orders (client_id, delivery_date DESC, order_id DESC)
+    WHERE status IN ('confirmed', 'shipped');
+
+-- Индекс inline-поиска (db_operations/catalog_search.py слушает канал catalog_changed).
+-- payload = "<таблица>:<id>"; индекс перечитывает только эту запись.
+CREATE OR REPLACE FUNCTION notify_catalog_changed() RETURNS trigger AS $$
+DECLARE
+    entry_id INTEGER;
+BEGIN
+    IF TG_TABLE_NAME = 'products' THEN
+        entry_id := CASE WHEN TG_OP = 'DELETE' THEN OLD.product_id ELSE NEW.product_id END;
+    ELSE
+        entry_id := CASE WHEN TG_OP = 'DELETE' THEN OLD.client_id ELSE NEW.client_id END;
+    END IF;
+    PERFORM pg_notify('catalog_changed', TG_TABLE_NAME || ':' || entry_id);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_products_catalog_notify ON products;
+CREATE TRIGGER trg_products_catalog_notify
+    AFTER INSERT OR UPDATE OF name, price OR DELETE ON products
+    FOR EACH ROW EXECUTE FUNCTION notify_catalog_changed();
+
+DROP TRIGGER IF EXISTS trg_clients_catalog_notify ON clients;
+CREATE TRIGGER trg_clients_catalog_notify
+    AFTER INSERT OR UPDATE OF name OR DELETE ON clients
+    FOR EACH ROW EXECUTE FUNCTION notify_catalog_changed();
+
+-- Ключи идемпотентности записей (db_operations/client_keys.py): сохранение заказа и действия с оплатами
+-- выполняются с ключом, созданным ботом. Повтор из локального журнала (db_operations/write_journal.py)
+-- после обрыва связи находит ключ и не применяет запись второй раз. result_id — номер созданного заказа.
+CREATE TABLE IF NOT EXISTS applied_client_keys (
+    client_key UUID PRIMARY KEY,
+    kind VARCHAR(32) NOT NULL,
+    result_id INTEGER,
+    applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+-- Помесячное секционирование inventory_movements по movement_date (db_operations/movement_partitions.py).
+-- Секции inventory_movements_yYYYYmMM создаются заранее на несколько месяцев вперед; строки вне созданных
+-- секций попадают в inventory_movements_default и переносятся в свою секцию при ее создании.
+-- Старые секции выгружаются в сжатые файлы (COPY, gzip) и отсоединяются; средняя стоимость
+-- поступления по ним сохраняется в inventory_movement_archive_totals, чтобы отчет остатков не менялся.
+-- Первичный ключ включает movement_date — этого требует секционирование.
+BEGIN;
+
+ALTER TABLE inventory_movements RENAME TO inventory_movements_legacy;
+ALTER INDEX idx_inventory_movements_product_id RENAME TO idx_inventory_movements_legacy_product_id;
+ALTER INDEX idx_inventory_movements_movement_date RENAME TO idx_inventory_movements_legacy_movement_date;
+ALTER INDEX idx_inventory_movements_source_document RENAME TO idx_inventory_movements_legacy_source_document;
+ALTER SEQUENCE inventory_movements_movement_id_seq OWNED BY NONE;
+ALTER SEQUENCE inventory_movements_movement_id_seq AS BIGINT;
+
+CREATE TABLE inventory_movements (
+    movement_id BIGINT NOT NULL DEFAULT nextval('inventory_movements_movement_id_seq'),
+    product_id INTEGER NOT NULL REFERENCES products(product_id),
+    movement_type VARCHAR(50) NOT NULL,
+    quantity_change INTEGER NOT NULL,
+    movement_date TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    source_document_type VARCHAR(50),
+    source_document_id INTEGER,
+    description TEXT,
+    unit_cost DECIMAL(10, 2),
+    CONSTRAINT chk_quantity_change_not_zero CHECK (quantity_change != 0),
+    PRIMARY KEY (movement_id, movement_date)
+) PARTITION BY RANGE (movement_date);
+ALTER SEQUENCE inventory_movements_movement_id_seq OWNED BY inventory_movements.movement_id;
+
+CREATE TABLE inventory_movements_default PARTITION OF inventory_movements DEFAULT;
+
+-- Индексы на секционированной таблице создаются в каждой секции автоматически
+CREATE INDEX idx_inventory_movements_product_id ON inventory_movements (product_id);
+CREATE INDEX idx_inventory_movements_movement_date ON inventory_movements (movement_date);
+CREATE INDEX idx_inventory_movements_source_document ON inventory_movements (source_document_type, source_document_id);
+-- Средняя стоимость поступления в отчете остатков (get_all_product_stock) читается только из этого индекса
+CREATE INDEX idx_inventory_movements_incoming_cost ON inventory_movements (product_id) INCLUDE (unit_cost)
+    WHERE movement_type = 'incoming';
+
+-- Создает секцию месяца, в который входит month. Строки этого месяца, попавшие в секцию по умолчанию,
+-- переносятся в новую секцию. Возвращает имя секции (ничего не делает, если она уже есть).
+CREATE OR REPLACE FUNCTION create_inventory_movements_partition(for_month DATE) RETURNS TEXT AS $$
+DECLARE
+    range_from DATE := date_trunc('month', for_month)::DATE;
+    range_to DATE := (date_trunc('month', for_month) + INTERVAL '1 month')::DATE;
+    part_name TEXT := format('inventory_movements_y%sm%s', to_char(range_from, 'YYYY'), to_char(range_from, 'MM'));
+BEGIN
+    IF to_regclass(part_name) IS NOT NULL THEN
+        RETURN part_name;
+    END IF;
+    EXECUTE format('CREATE TABLE %I (LIKE inventory_movements INCLUDING DEFAULTS INCLUDING CONSTRAINTS)', part_name);
+    -- Ограничение диапазона заранее: ATTACH не будет сканировать секцию повторно
+    EXECUTE format('ALTER TABLE %I ADD CONSTRAINT %I CHECK (movement_date >= %L AND movement_date < %L)',
+                   part_name, part_name || '_range', range_from, range_to);
+    EXECUTE format('WITH moved AS (DELETE FROM inventory_movements_default WHERE movement_date >= %L AND movement_date < %L RETURNING *) '
+                   'INSERT INTO %I SELECT * FROM moved', range_from, range_to, part_name);
+    EXECUTE format('ALTER TABLE inventory_movements ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                   part_name, range_from, range_to);
+    EXECUTE format('ALTER TABLE %I DROP CONSTRAINT %I', part_name, part_name || '_range');
+    RETURN part_name;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Секции на всю историю и на три месяца вперед, затем перенос строк
+SELECT create_inventory_movements_partition(month::DATE)
+FROM generate_series(
+    date_trunc('month', COALESCE((SELECT MIN(movement_date) FROM inventory_movements_legacy), now())),
+    date_trunc('month', now()) + INTERVAL '3 months',
+    INTERVAL '1 month'
+) AS month;
+
+INSERT INTO inventory_movements (movement_id, product_id, movement_type, quantity_change, movement_date,
+                                 source_document_type, source_document_id, description, unit_cost)
+SELECT movement_id, product_id, movement_type, quantity_change, COALESCE(movement_date, now()),
+       source_document_type, source_document_id, description, unit_cost
+FROM inventory_movements_legacy;
+
+-- Отсоединенные и выгруженные секции: где лежит файл и сколько в нем строк
+CREATE TABLE IF NOT EXISTS inventory_movement_archives (
+    partition_name TEXT PRIMARY KEY,
+    range_from DATE NOT NULL,
+    range_to DATE NOT NULL,
+    rows_count BIGINT NOT NULL,
+    file_path TEXT NOT NULL,
+    archived_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+-- Сумма и число стоимостей поступлений из выгруженных секций (для средней стоимости в отчете остатков)
+CREATE TABLE IF NOT EXISTS inventory_movement_archive_totals (
+    product_id INTEGER PRIMARY KEY,
+    incoming_cost_sum NUMERIC(18, 2) NOT NULL DEFAULT 0,
+    incoming_cost_count BIGINT NOT NULL DEFAULT 0
+);
+
+COMMIT;
+
+ANALYZE inventory_movements;
+-- После сверки числа строк: DROP TABLE inventory_movements_legacy;
+
+-- Дальнейшие изменения схемы — версионные миграции в sql/migrations (db_operations/migrations.py).
@@ -0,0 +1,35 @@
+-- migrate: no-transaction
+-- Индексы горячих запросов. CREATE INDEX CONCURRENTLY не блокирует запись в таблицу, но не может
+-- выполняться в транзакции, поэтому миграция применяется по одному оператору
+-- (db_operations/migrations.py). Индекс, не достроенный при сбое, раннер удалит перед повтором.
+
+-- Строки заказа: детали и редактирование заказа (order_details, order_saving: DELETE/INSERT строк),
+-- списание при подтверждении (product_operations.update_stock_on_order_confirmation),
+-- соединения orders → order_lines в отчетах и агрегатах продаж, каскадное удаление заказа.
+-- Без индекса каждый такой запрос — полный просмотр order_lines.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_order_lines_order_id ON order_lines (order_id);
+
+-- «Мои заказы за сегодня» (report_my_orders: employee_id = $1 AND order_date = $2) и фильтр
+-- по сотруднику в списке черновиков (draft_orders). Просмотр индекса по двум колонкам
+-- вместо всех заказов.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_orders_employee_order_date ON orders (employee_id, order_date);
+
+-- Фильтр status = 'confirmed' в выгрузке неоплаченных накладных (documents), отметке просрочки
+-- (overdue_invoices) и отчетах по оплатам. Полезен, пока подтвержденных заказов мало
+-- по сравнению с отгруженными; для черновиков уже есть частичные индексы keyset-пагинации.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_orders_status ON orders (status);
+
+-- Оплаты накладной: LEFT JOIN client_payments cp ON o.order_id = cp.order_id в отчетах по оплатам
+-- (report_payment_operations). Nested loop по индексу вместо hash join по всей таблице.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_client_payments_order_id ON client_payments (order_id);
+
+-- Адреса клиента (reference_cache: WHERE client_id = $1) при оформлении заказа
+-- и каскадное удаление клиента.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_addresses_client_id ON addresses (client_id);
+
+-- Поступления поставщика (supplier_operations.get_supplier_incoming_deliveries, возвраты поставщику).
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_incoming_deliveries_supplier_id ON incoming_deliveries (supplier_id);
+
+-- Задолженность перед поставщиком
+-- (supplier_operations.get_supplier_outstanding_invoices: supplier_id = $1 AND payment_status IN (...)).
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_supplier_invoices_supplier_payment_status ON supplier_invoices (supplier_id, payment_status);
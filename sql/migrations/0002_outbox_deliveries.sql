@@ -0,0 +1,13 @@
+-- Сводки outbox к отправке (db_operations/outbox.py): пишутся вместе с отметкой событий обработанными
+-- и отправляются вне транзакции. next_attempt_at — аренда на время отправки и пауза перед повтором.
+CREATE TABLE IF NOT EXISTS outbox_deliveries (
+    delivery_id BIGSERIAL PRIMARY KEY,
+    chat_id BIGINT NOT NULL,
+    text TEXT NOT NULL,
+    reply_markup JSONB,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    last_error TEXT,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+CREATE INDEX IF NOT EXISTS idx_outbox_deliveries_next_attempt ON outbox_deliveries (next_attempt_at);
@@ -0,0 +1,4 @@
+-- Кэш справочников (db_operations/reference_cache.py) больше не хранит категории:
+-- версия категорий никем не читается, триггер на categories только лишне обновлял reference_versions.
+DROP TRIGGER IF EXISTS trg_categories_version ON categories;
+DELETE FROM reference_versions WHERE name = 'categories';
@@ -2,66 +2,135 @@
 
 import asyncio
 import logging
+import time
 from aiogram import Bot, Dispatcher
 from aiogram.fsm.storage.memory import MemoryStorage
-from aiogram.types import BotCommand 
-from config import TELEGRAM_TOKEN
+from aiogram.types import BotCommand
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from config import (
+    TELEGRAM_TOKEN, TELEGRAM_API_SERVER, METRICS_HOST, METRICS_PORT,
+    LOG_LEVEL, LOG_JSON, LOG_SAMPLE_BURST, LOG_SAMPLE_INTERVAL, APPLY_MIGRATIONS_ON_STARTUP
+)
 from aiogram.enums import ParseMode
-from aiogram.client.default import DefaultBotProperties 
-from aiogram.types import Message, ReplyKeyboardRemove
+from aiogram.client.default import DefaultBotProperties
 
 # Импортируем функции для работы с пулом базы данных
-from db_operations import init_db_pool, close_db_pool, get_employee_id
-
-# Импортируем все роутеры из общего списка
-from handlers import order_routers # order_routers уже содержит все необходимые роутеры
-
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(message)s"
+from db_operations import init_db_pool, init_replica_pool, close_db_pool
+from db_operations.migrations import apply_migrations
+from db_operations.replica import replica
+from access_control import employee_roles, publish_role_commands
+from db_operations.stock_availability import stock_availability
+from db_operations.catalog_search import catalog_search
+from db_operations.stock_reservations import run_reservation_sweeper
+from db_operations.movement_partitions import run_partition_maintenance
+from db_operations.overdue_invoices import run_overdue_invoice_job
+from db_operations.outbox import run_outbox_dispatcher
+from db_operations.reference_cache import reference_cache
+from db_operations.write_journal import write_journal
+from utils.send_queue import OutboundScheduler
+from utils.logging_setup import setup_logging
+from utils.cart_view import CartViewTracker, cart_view
+from utils.documents import documents
+from utils.metrics import (
+    UpdateMetricsMiddleware, start_metrics_server, watch_cart_view, watch_db_pool, watch_fsm_storage, watch_replica, watch_send_queue,
+    watch_write_journal
 )
 
-# Создание бота
-bot = Bot(
-    token=TELEGRAM_TOKEN, 
-    default=DefaultBotProperties(parse_mode=ParseMode.MARKDOWN_V2)
-)
+# Роутеры подключаются лениво: модули хендлеров импортируются в main(),
+# параллельно с подключением к БД, а не при импорте этого модуля.
+from handlers import load_routers, ROUTER_IMPORT_TIMES
+
+# Логи пишутся фоновым потоком через очередь, чтобы вывод не блокировал event loop
+setup_logging(LOG_LEVEL, json_output=LOG_JSON, sample_burst=LOG_SAMPLE_BURST, sample_interval=LOG_SAMPLE_INTERVAL)
 
 # Создание диспетчера
 dp = Dispatcher(storage=MemoryStorage())
+dp.update.outer_middleware(UpdateMetricsMiddleware())
+watch_fsm_storage(dp.storage)
+watch_cart_view(cart_view)
+
+
+def create_bot(
+    token: str = TELEGRAM_TOKEN,
+    api_server: str | None = TELEGRAM_API_SERVER,
+    scheduler: OutboundScheduler | None = None
+) -> Bot:
+    """
+    Создает экземпляр бота. Вызывается при старте, а не при импорте модуля,
+    чтобы импорт tg_bot (например, в бенчмарках) не требовал сетевой сессии.
+    Все исходящие запросы проходят через OutboundScheduler (лимиты Telegram, Retry-After);
+    бенчмарки могут передать свой экземпляр с другими лимитами.
+    CartViewTracker отмечает правки сообщения корзины, сделанные в обход utils.cart_view.
+    """
+    if api_server:
+        session = AiohttpSession(api=TelegramAPIServer.from_base(api_server))
+    else:
+        session = AiohttpSession()
+    scheduler = scheduler or OutboundScheduler()
+    watch_send_queue(scheduler)
+    # Трекер видит правки сообщений до очереди отправки и сбрасывает запомненную корзину
+    session.middleware(CartViewTracker(cart_view))
+    session.middleware(scheduler)
+    return Bot(
+        token=token,
+        session=session,
+        default=DefaultBotProperties(parse_mode=ParseMode.MARKDOWN_V2)
+    )
+
+
+def include_routers(dispatcher: Dispatcher) -> None:
+    """
+    Подключает все роутеры из handlers.ROUTER_MODULES к диспетчеру (однократно).
+    """
+    if dispatcher.sub_routers:
+        return
+    dispatcher.include_routers(*load_routers())
 
-# Подключение всех роутеров из списка order_routers
-# order_routers уже содержит main_menu.router и add_delivery_handler.router,
-# поэтому нет необходимости включать их отдельно.
-dp.include_routers(
-    *order_routers, # <--- ИСПРАВЛЕНО: Удалены дублирующиеся роутеры
-)
 
 # Функция для установки команд бокового меню
 async def set_main_menu_commands(bot: Bot):
     """
-    Устанавливает команды для бокового меню (меню-гамбургера).
+    Устанавливает команды бокового меню (меню-гамбургера) по умолчанию.
+    Всем пользователям видна только /start; команды разделов публикуются
+    каждому сотруднику отдельно по его роли (см. setup_role_menus).
     """
     commands = [
-        BotCommand(command="/new_order", description="➕ Создать новый заказ"),
-        BotCommand(command="/my_orders", description="📄 Посмотреть мои заказы"),
-        BotCommand(command="/show_unconfirmed_orders", description="📝 Показать draft заказы"),
-        BotCommand(command="/payments", description="💰 Оплаты клиентов"),
-        BotCommand(command="/financial_report_today", description="📊 Отчет об оплатах за сегодня"),
-        BotCommand(command="/add_delivery", description="🚚 Добавить поступление товара"),
-        BotCommand(command="/inventory_report", description="📈 Отчет об остатках товара"),
-        BotCommand(command="/edit_order_admin", description="✍️ Редактировать заказ"),
-        BotCommand(command="/adjust_inventory", description="📦 Корректировка/Возврат по складу")
+        BotCommand(command="/start", description="🏠 Главное меню"),
     ]
     await bot.set_my_commands(commands)
     logging.info("Основные команды меню установлены.")
 
+
+async def setup_role_menus(bot: Bot, db_pool):
+    """
+    Загружает кэш ролей сотрудников и публикует им меню команд по ролям.
+    Выполняется в фоне после старта, чтобы не задерживать запуск поллинга.
+    """
+    try:
+        await employee_roles.refresh(db_pool, force=True)
+        await publish_role_commands(bot)
+    except Exception as e:
+        logging.error("Ошибка при публикации меню команд по ролям: %s", e, exc_info=True)
+
 # Функція для коректного закриття пула БД
 async def on_shutdown_cleanup(dispatcher: Dispatcher):
     """
     Хук, который выполняется при завершении работы диспетчера для закрытия пула БД.
     """
     logging.info("🧹 Выполняем cleanup при завершении работы...")
+    for task_name in ("reservation_sweeper", "overdue_invoice_job", "outbox_dispatcher", "partition_maintenance"):
+        task = dispatcher.get(task_name)
+        if task:
+            task.cancel()
+    metrics_runner = dispatcher.get("metrics_runner")
+    if metrics_runner:
+        await metrics_runner.cleanup()
+    await stock_availability.stop()
+    await catalog_search.stop()
+    await replica.stop()
+    await write_journal.stop()
+    documents.shutdown()
     db_pool = dispatcher.get("db_pool") # Получаем пул из контекста диспетчера
     if db_pool:
         await close_db_pool(db_pool)
@@ -70,28 +139,91 @@ async def on_shutdown_cleanup(dispatcher: Dispatcher):
         logging.warning("Пул базы данных не найден в контексте диспетчера при завершении работы.")
 
 
+async def _timed(name: str, coro, timings: dict):
+    """Выполняет корутину и записывает время ее выполнения в timings[name]."""
+    started = time.perf_counter()
+    try:
+        return await coro
+    finally:
+        timings[name] = time.perf_counter() - started
+
+
 # Основная точка запуска
 async def main():
     logging.info("🚀 Бот запускается...")
-    db_pool = None 
+    startup_started = time.perf_counter()
+    bot = create_bot()
+    db_pool = None
 
     try:
-        logging.info("Инициализация пула базы данных...")
-        db_pool = await init_db_pool()
-        logging.info("Пул базы данных инициализирован.")
+        # Независимые шаги старта выполняются параллельно:
+        # импорт хендлеров (в отдельном потоке, т.к. он синхронный), подключение к БД
+        # и сетевые вызовы Bot API. Старт занимает время самого медленного шага, а не их сумму.
+        timings = {}
+        results = await asyncio.gather(
+            _timed("db_pool", init_db_pool(), timings),
+            _timed("routers", asyncio.to_thread(load_routers), timings),
+            _timed("set_my_commands", set_main_menu_commands(bot), timings),
+            _timed("delete_webhook", bot.delete_webhook(drop_pending_updates=True), timings),
+            _timed("replica_pool", init_replica_pool(), timings),
+            return_exceptions=True
+        )
+        if not isinstance(results[0], BaseException):
+            db_pool = results[0]
+        replica_pool = results[-1] if not isinstance(results[-1], BaseException) else None
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+        include_routers(dp)
+        if APPLY_MIGRATIONS_ON_STARTUP:
+            # Схема должна быть актуальной до первых запросов хендлеров и фоновых задач
+            await _timed("migrations", apply_migrations(db_pool), timings)
 
         dp["db_pool"] = db_pool
+        watch_db_pool(db_pool)
+        if replica_pool is not None:
+            # Отчеты, помеченные @reads_from_replica, читаются с реплики, пока она не отстает
+            await replica.start(replica_pool)
+            watch_replica(replica)
+        if METRICS_PORT:
+            try:
+                dp["metrics_runner"] = await start_metrics_server(METRICS_HOST, METRICS_PORT)
+            except OSError as e:
+                # Занятый порт не должен мешать работе бота
+                logging.error("Не удалось поднять эндпоинт метрик на %s:%s: %s", METRICS_HOST, METRICS_PORT, e)
+        role_menus_task = asyncio.create_task(setup_role_menus(bot, db_pool))
+        # Снимок остатков для проверки корзины грузится в фоне; до загрузки проверка просто пропускается
+        stock_task = asyncio.create_task(stock_availability.start(db_pool))
+        # Справочники (поставщики, категории, адреса активных клиентов); до загрузки читаются из БД по запросу
+        reference_task = asyncio.create_task(reference_cache.warm_up(db_pool))
+        # Индекс inline-поиска товаров и клиентов; до загрузки поиск возвращает пустой список
+        search_task = asyncio.create_task(catalog_search.start(db_pool))
+        dp["reservation_sweeper"] = asyncio.create_task(run_reservation_sweeper(db_pool))
+        dp["overdue_invoice_job"] = asyncio.create_task(run_overdue_invoice_job(bot, db_pool))
+        dp["outbox_dispatcher"] = asyncio.create_task(run_outbox_dispatcher(bot, db_pool))
+        # Секции inventory_movements вперед и выгрузка старых секций в архив
+        dp["partition_maintenance"] = asyncio.create_task(run_partition_maintenance(db_pool))
+        # Заказы и оплаты, принятые без связи с БД, проигрываются из локального журнала
+        await write_journal.start(db_pool, bot)
+        watch_write_journal(write_journal)
+
+        dp.shutdown.register(on_shutdown_cleanup)
+
+        logging.info(
+            "Старт завершен за %.0f мс (%s).",
+            (time.perf_counter() - startup_started) * 1000,
+            ", ".join(f"{name}: {seconds * 1000:.0f} мс" for name, seconds in timings.items())
+        )
+        logging.debug("Время импорта модулей хендлеров: %s", ROUTER_IMPORT_TIMES)
 
-        await set_main_menu_commands(bot) 
-
-        dp.shutdown.register(on_shutdown_cleanup) 
-
-        await bot.delete_webhook(drop_pending_updates=True)
         await dp.start_polling(bot)
     except asyncio.CancelledError:
         logging.warning("⏹️ Бот был остановлен вручную (Ctrl+C)")
     except Exception as e:
-        logging.exception(f"❌ Неожиданная ошибка: {e}")
+        logging.exception("❌ Неожиданная ошибка: %s", e)
     finally:
         logging.info("🧹 Завершение работы бота...")
+        if db_pool and not dp.get("db_pool"):
+            # Пул создан, но до start_polling дело не дошло — закрываем его здесь
+            await close_db_pool(db_pool)
         await bot.session.close()
\ No newline at end of file
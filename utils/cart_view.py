@@ -0,0 +1,159 @@
+# utils/cart_view.py
+"""
+Отрисовка сообщения корзины без лишних запросов к Telegram.
+
+- Для каждого чата запоминается хэш последнего отрисованного текста и клавиатуры корзины.
+  Если новая версия совпадает с тем, что уже показано, правка не отправляется
+  (нет ошибок "message is not modified" и лишнего запроса к API).
+- Быстрые последовательные изменения склеиваются: пока идет отрисовка корзины в чате,
+  новые вызовы только помечают ее устаревшей, и после завершения выполняется одна
+  отрисовка с самым свежим состоянием.
+- Строки сводки экранируются для MarkdownV2 по отдельности и кэшируются,
+  поэтому при изменении одной позиции заново экранируется только она.
+
+Сообщение корзины редактируется и другими хендлерами (меню позиции, выбор даты и т.д.).
+Чтобы не пропустить нужную правку, CartViewTracker (request-middleware сессии бота,
+см. tg_bot.create_bot) сбрасывает запомненный хэш при любой чужой правке или удалении сообщения.
+"""
+
+import hashlib
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import lru_cache
+from typing import Awaitable, Callable, Optional
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.methods import DeleteMessage, EditMessageCaption, EditMessageReplyMarkup, EditMessageText
+from aiogram.types import InlineKeyboardMarkup
+
+from utils.markdown_utils import escape_markdown_v2
+
+logger = logging.getLogger(__name__)
+
+# Префиксы строк сводки, которые выделяются звездочками
+_HIGHLIGHTED_PREFIXES = ("Клиент:", "Адрес:", "Дата доставки:", "ИТОГО:")
+
+_MESSAGE_EDIT_METHODS = (EditMessageText, EditMessageReplyMarkup, EditMessageCaption, DeleteMessage)
+
+# Правки, которые отправляет сама CartView (их трекер не считает чужими)
+_own_edit: ContextVar[bool] = ContextVar("cart_view_own_edit", default=False)
+
+
+@lru_cache(maxsize=4096)
+def _format_line(line: str) -> str:
+    if line.startswith(_HIGHLIGHTED_PREFIXES):
+        line = f"*{line}*"
+    return escape_markdown_v2(line)
+
+
+def format_cart_summary(raw_summary: str) -> str:
+    """Сводка корзины (результат _get_cart_summary_text) -> текст MarkdownV2."""
+    return "\n".join(_format_line(line) for line in raw_summary.split("\n"))
+
+
+def is_not_modified_error(error: Exception) -> bool:
+    """TelegramBadRequest при правке сообщения тем же содержимым."""
+    return "message is not modified" in str(error).lower()
+
+
+def view_digest(text: str, keyboard: Optional[InlineKeyboardMarkup]) -> str:
+    markup = keyboard.model_dump_json(exclude_none=True) if keyboard is not None else ""
+    return hashlib.blake2b(f"{text}\0{markup}".encode("utf-8"), digest_size=16).hexdigest()
+
+
+class _ChatRender:
+    __slots__ = ("running", "pending")
+
+    def __init__(self):
+        self.running = False
+        self.pending: Optional[Callable[[], Awaitable[None]]] = None
+
+
+class CartView:
+    def __init__(self):
+        # chat_id -> (message_id, хэш показанного содержимого)
+        self._shown: dict[int, tuple[int, str]] = {}
+        # chat_id -> счетчик сбросов; защищает от записи хэша после чужой правки во время отрисовки
+        self._generations: dict[int, int] = {}
+        self._renders: dict[int, _ChatRender] = {}
+
+        # Счетчики для логов/метрик
+        self.rendered = 0
+        self.skipped = 0
+        self.batched = 0
+
+    # --- Хэш показанного содержимого ---
+
+    def generation(self, chat_id: int) -> int:
+        return self._generations.get(chat_id, 0)
+
+    def is_shown(self, chat_id: int, message_id: int, digest: str) -> bool:
+        return self._shown.get(chat_id) == (message_id, digest)
+
+    def remember(self, chat_id: int, message_id: int, digest: str, generation: int) -> None:
+        """Запоминает показанное содержимое, если за время отрисовки сообщение не правили другие хендлеры."""
+        if self.generation(chat_id) == generation:
+            self._shown[chat_id] = (message_id, digest)
+
+    def forget(self, chat_id, message_id=None) -> None:
+        shown = self._shown.get(chat_id)
+        if shown is not None and (message_id is None or shown[0] == message_id):
+            del self._shown[chat_id]
+        self._generations[chat_id] = self.generation(chat_id) + 1
+
+    # --- Склейка отрисовок ---
+
+    async def refresh(self, chat_id: int, render: Callable[[], Awaitable[None]]) -> None:
+        """
+        Выполняет render() для чата. Если отрисовка в этом чате уже идет, запоминает
+        последний render и выходит: он будет выполнен один раз после текущей отрисовки.
+        """
+        state = self._renders.get(chat_id)
+        if state is None:
+            state = self._renders[chat_id] = _ChatRender()
+        if state.running:
+            if state.pending is not None:
+                self.batched += 1
+            state.pending = render
+            return
+
+        state.running = True
+        try:
+            while render is not None:
+                try:
+                    await render()
+                except Exception as e:
+                    logger.error("Ошибка при отрисовке корзины в чате %s: %s", chat_id, e, exc_info=True)
+                render, state.pending = state.pending, None
+        finally:
+            self._renders.pop(chat_id, None)
+
+
+@contextmanager
+def own_cart_edit():
+    """Правки внутри блока отправляет сама корзина: трекер не сбрасывает по ним хэш."""
+    token = _own_edit.set(True)
+    try:
+        yield
+    finally:
+        _own_edit.reset(token)
+
+
+class CartViewTracker(BaseRequestMiddleware):
+    """Сбрасывает запомненную корзину при правке или удалении ее сообщения не через CartView."""
+
+    def __init__(self, view: CartView):
+        self.view = view
+
+    async def __call__(self, make_request, bot, method):
+        if isinstance(method, _MESSAGE_EDIT_METHODS) and not _own_edit.get():
+            chat_id = getattr(method, "chat_id", None)
+            if chat_id is not None:
+                self.view.forget(chat_id, getattr(method, "message_id", None))
+        return await make_request(bot, method)
+
+
+# Глобальный экземпляр
+cart_view = CartView()
+
@@ -0,0 +1,321 @@
+# utils/documents.py
+"""
+Печатные документы: PDF накладных и XLSX выгрузки отчетов.
+
+- Верстка выполняется в отдельных процессах (ProcessPoolExecutor), поэтому тяжелая по CPU
+  работа reportlab/openpyxl не блокирует event loop. Пул создается при первом документе
+  и останавливается в on_shutdown (documents.shutdown()).
+- Строки выгрузок не собираются в памяти бота: db_operations.documents.spool_rows читает
+  их курсором и пишет пачками во временный файл, который воркер читает по мере записи XLSX.
+- Готовые документы кэшируются по хэшу исходных данных (db_operations.documents,
+  таблица document_files): если данные не изменились, повторная отправка идет по
+  Telegram file_id — без верстки и без повторной загрузки файла.
+
+reportlab и openpyxl импортируются только в воркерах; шрифт с кириллицей (DOCUMENT_FONT_PATH)
+регистрируется при первой накладной в процессе, поэтому без reportlab или шрифта
+ломается только верстка PDF, а XLSX выгрузки продолжают работать.
+"""
+
+import asyncio
+import hashlib
+import logging
+import multiprocessing
+import os
+import pickle
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import date
+from decimal import Decimal
+from typing import Callable, NamedTuple, Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import BufferedInputFile
+
+from config import DOCUMENT_FONT_BOLD_PATH, DOCUMENT_FONT_PATH, DOCUMENT_WORKERS
+from utils.metrics import DOCUMENT_CACHE_HITS_TOTAL, DOCUMENT_RENDER_DURATION, DOCUMENTS_RENDERED_TOTAL
+
+logger = logging.getLogger(__name__)
+
+# Меняется при изменении верстки: старые file_id перестают совпадать с новыми ключами
+TEMPLATE_VERSION = 1
+
+
+class InvoiceLine(NamedTuple):
+    product_name: str
+    quantity: int
+    unit_price: Decimal
+
+    @property
+    def total(self) -> Decimal:
+        return self.quantity * self.unit_price
+
+
+class InvoiceDocument(NamedTuple):
+    order_id: int
+    invoice_number: str
+    invoice_date: date
+    due_date: Optional[date]
+    client_name: str
+    address_text: str
+    employee_name: Optional[str]
+    total_amount: Decimal
+    lines: tuple  # tuple[InvoiceLine, ...]
+
+
+class TableColumn(NamedTuple):
+    title: str
+    width: int = 15
+    number_format: Optional[str] = None   # формат Excel, например '0.00' или 'DD.MM.YYYY'
+
+
+def content_key(kind: str, *parts) -> str:
+    """Ключ кэша документа: вид, версия верстки и исходные данные."""
+    hasher = hashlib.blake2b(digest_size=20)
+    hasher.update(f"{kind}:{TEMPLATE_VERSION}".encode("utf-8"))
+    for part in parts:
+        hasher.update(part if isinstance(part, bytes) else repr(part).encode("utf-8"))
+    return f"{kind}:{hasher.hexdigest()}"
+
+
+# --- Воркеры (выполняются в дочерних процессах) ---
+
+_FONT = "DocumentFont"
+_FONT_BOLD = "DocumentFont-Bold"
+
+_fonts_registered = False
+
+
+def _register_fonts() -> None:
+    """Регистрирует шрифты reportlab один раз на процесс (при первой накладной)."""
+    global _fonts_registered
+    if _fonts_registered:
+        return
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFont
+
+    pdfmetrics.registerFont(TTFont(_FONT, DOCUMENT_FONT_PATH))
+    pdfmetrics.registerFont(TTFont(_FONT_BOLD, DOCUMENT_FONT_BOLD_PATH))
+    _fonts_registered = True
+
+
+def render_invoice_pdf(invoice: InvoiceDocument) -> bytes:
+    """Накладная A4: шапка, таблица позиций, итог."""
+    from io import BytesIO
+
+    from reportlab.lib import colors
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.styles import ParagraphStyle
+    from reportlab.lib.units import mm
+    from reportlab.platypus import Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+    # Paragraph разбирает разметку, поэтому текст из БД экранируется
+    from xml.sax.saxutils import escape
+
+    _register_fonts()
+    normal = ParagraphStyle("normal", fontName=_FONT, fontSize=10, leading=13)
+    title = ParagraphStyle("title", fontName=_FONT_BOLD, fontSize=14, leading=18, spaceAfter=4 * mm)
+    cell = ParagraphStyle("cell", parent=normal, fontSize=9, leading=11)
+
+    story = [
+        Paragraph(f"Накладная № {escape(invoice.invoice_number)} от {invoice.invoice_date:%d.%m.%Y}", title),
+        Paragraph(f"Клиент: {escape(invoice.client_name)}", normal),
+        Paragraph(f"Адрес доставки: {escape(invoice.address_text)}", normal),
+    ]
+    if invoice.employee_name:
+        story.append(Paragraph(f"Менеджер: {escape(invoice.employee_name)}", normal))
+    if invoice.due_date:
+        story.append(Paragraph(f"Оплатить до: {invoice.due_date:%d.%m.%Y}", normal))
+    story.append(Spacer(1, 6 * mm))
+
+    rows = [["№", "Товар", "Кол-во", "Цена, грн", "Сумма, грн"]]
+    for index, line in enumerate(invoice.lines, start=1):
+        rows.append([str(index), Paragraph(escape(line.product_name), cell), str(line.quantity),
+                     f"{line.unit_price:.2f}", f"{line.total:.2f}"])
+    rows.append(["", "ИТОГО", "", "", f"{invoice.total_amount:.2f}"])
+
+    table = Table(rows, colWidths=[10 * mm, 95 * mm, 20 * mm, 25 * mm, 30 * mm], repeatRows=1)
+    table.setStyle(TableStyle([
+        ("FONTNAME", (0, 0), (-1, -1), _FONT),
+        ("FONTNAME", (0, 0), (-1, 0), _FONT_BOLD),
+        ("FONTNAME", (0, -1), (-1, -1), _FONT_BOLD),
+        ("FONTSIZE", (0, 0), (-1, -1), 9),
+        ("GRID", (0, 0), (-1, -2), 0.5, colors.grey),
+        ("BACKGROUND", (0, 0), (-1, 0), colors.whitesmoke),
+        ("ALIGN", (2, 1), (-1, -1), "RIGHT"),
+        ("VALIGN", (0, 0), (-1, -1), "MIDDLE"),
+    ]))
+    story += [table, Spacer(1, 15 * mm),
+              Paragraph("Отпустил: ____________________        Получил: ____________________", normal)]
+
+    buffer = BytesIO()
+    SimpleDocTemplate(
+        buffer, pagesize=A4, title=f"Накладная {invoice.invoice_number}",
+        leftMargin=15 * mm, rightMargin=15 * mm, topMargin=15 * mm, bottomMargin=15 * mm
+    ).build(story)
+    return buffer.getvalue()
+
+
+def iter_spooled_rows(spool_path: str):
+    """Строки из файла, записанного db_operations.documents.spool_rows (пачки pickle подряд)."""
+    with open(spool_path, "rb") as spool:
+        while True:
+            try:
+                chunk = pickle.load(spool)
+            except EOFError:
+                return
+            yield from chunk
+
+
+def render_table_xlsx(spool_path: str, title: str, columns: tuple, totals: Optional[tuple] = None) -> bytes:
+    """
+    Выгрузка таблицы в XLSX. Строки читаются из spool-файла потоком и пишутся
+    в режиме write_only, поэтому память воркера не зависит от числа строк.
+    """
+    from io import BytesIO
+
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Font
+    from openpyxl.utils import get_column_letter
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet(title=title[:31])
+    sheet.freeze_panes = "A2"
+    for index, column in enumerate(columns):
+        sheet.column_dimensions[get_column_letter(index + 1)].width = column.width
+
+    bold = Font(bold=True)
+
+    def styled(values, font=None):
+        cells = []
+        for value, column in zip(values, columns):
+            cell = WriteOnlyCell(sheet, value=value)
+            if column.number_format and value is not None:
+                cell.number_format = column.number_format
+            if font is not None:
+                cell.font = font
+            cells.append(cell)
+        return cells
+
+    sheet.append(styled([column.title for column in columns], bold))
+    for row in iter_spooled_rows(spool_path):
+        sheet.append(styled(row))
+    if totals:
+        sheet.append(styled(totals, bold))
+
+    buffer = BytesIO()
+    workbook.save(buffer)
+    return buffer.getvalue()
+
+
+# --- Сервис в процессе бота ---
+
+def _worker_context():
+    """
+    В процессе бота уже работают потоки (логи), поэтому fork небезопасен: воркеры запускаются
+    через forkserver (на Windows — spawn). Они стартуют один раз и живут до documents.shutdown().
+    """
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("forkserver")
+    return multiprocessing.get_context("spawn")
+
+
+class DocumentService:
+    def __init__(self, workers: int = DOCUMENT_WORKERS):
+        self.workers = workers
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=_worker_context(),
+            )
+        return self._executor
+
+    async def render(self, kind: str, func: Callable[..., bytes], *args) -> bytes:
+        """Выполняет func(*args) в пуле процессов."""
+        started = time.perf_counter()
+        executor = self._get_executor()
+        try:
+            data = await asyncio.get_running_loop().run_in_executor(executor, func, *args)
+        except BrokenProcessPool:
+            # Воркер упал (например, по памяти) — сломанный пул больше не принимает задачи,
+            # следующий документ создаст новый
+            logger.error("Пул верстки документов сломан, будет создан заново.")
+            if self._executor is executor:
+                self._executor = None
+                executor.shutdown(wait=False, cancel_futures=True)
+            raise
+        elapsed = time.perf_counter() - started
+        DOCUMENTS_RENDERED_TOTAL.inc(kind)
+        DOCUMENT_RENDER_DURATION.observe(elapsed, kind)
+        logger.info("Документ %s сформирован за %.2f с (%d байт).", kind, elapsed, len(data))
+        return data
+
+    async def send(self, bot: Bot, pool, chat_id: int, key: str, file_name: str,
+                   func: Callable[..., bytes], *args, caption: Optional[str] = None) -> None:
+        """
+        Отправляет документ. Если документ с таким ключом уже отправлялся, используется
+        сохраненный file_id; иначе документ верстается в пуле и загружается, а его file_id сохраняется.
+        """
+        from db_operations.documents import forget_document_file_id, get_document_file_id, save_document_file_id
+
+        kind = key.split(":", 1)[0]
+        file_id = await get_document_file_id(pool, key)
+        if file_id is not None:
+            try:
+                await bot.send_document(chat_id, file_id, caption=caption)
+                DOCUMENT_CACHE_HITS_TOTAL.inc(kind)
+                return
+            except TelegramBadRequest as e:
+                # file_id другого бота или удаленный файл — загружаем заново
+                logger.warning("file_id документа %s не принят Telegram (%s), файл будет загружен заново.", key, e)
+                await forget_document_file_id(pool, key)
+
+        await bot.send_chat_action(chat_id, "upload_document")
+        data = await self.render(kind, func, *args)
+        message = await bot.send_document(chat_id, BufferedInputFile(data, filename=file_name), caption=caption)
+        if message.document is not None:
+            await save_document_file_id(pool, key, file_name, message.document.file_id)
+
+    async def send_table(self, bot: Bot, pool, chat_id: int, kind: str, query: str, title: str,
+                         columns: tuple, file_name: str, sum_columns: tuple = (), caption: Optional[str] = None) -> int:
+        """
+        Выгрузка результата запроса в XLSX: строки читаются курсором во временный файл,
+        документ отправляется через send(). В последней строке — суммы столбцов sum_columns.
+        Возвращает число строк.
+        """
+        from db_operations.documents import spool_rows
+
+        spooled = await spool_rows(pool, kind, query, sum_columns=sum_columns)
+        try:
+            totals = None
+            if sum_columns:
+                totals = [None] * len(columns)
+                totals[0] = "ИТОГО"
+                for column, value in zip(sum_columns, spooled.sums):
+                    totals[column] = value
+                totals = tuple(totals)
+            await self.send(bot, pool, chat_id, spooled.key, file_name,
+                            render_table_xlsx, spooled.path, title, columns, totals, caption=caption)
+        finally:
+            remove_spool(spooled.path)
+        return spooled.row_count
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+def remove_spool(spool_path: str) -> None:
+    try:
+        os.unlink(spool_path)
+    except OSError:
+        pass
+
+
+# Глобальный экземпляр
+documents = DocumentService()
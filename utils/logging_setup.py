@@ -0,0 +1,154 @@
+# utils/logging_setup.py
+"""
+Неблокирующий вывод логов.
+
+Хендлеры в event loop только кладут запись в очередь (QueueHandler), а форматирование
+и запись в stdout выполняет фоновый поток (QueueListener). Поэтому медленный терминал,
+журнал systemd или docker не тормозят обработку апдейтов.
+
+- Сообщения форматируются лениво: logger.info("... %s", value) собирается в фоновом потоке.
+  Если среди аргументов есть изменяемые объекты (dict, list, ...), строка собирается сразу,
+  чтобы в лог попало состояние на момент вызова.
+- Формат вывода — JSON по строке на запись (LOG_JSON в config.py) или обычный текст.
+- Частые сообщения уровня INFO/DEBUG (построчные записи в отчетах и массовых операциях)
+  ограничиваются SamplingFilter: не больше LOG_SAMPLE_BURST одинаковых сообщений
+  за LOG_SAMPLE_INTERVAL секунд с одного места вызова; о пропущенных сообщает следующая запись.
+"""
+
+import atexit
+import json
+import logging
+import queue
+import sys
+from datetime import date, datetime
+from decimal import Decimal
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional
+
+# Типы аргументов, которые можно передать в фоновый поток без копирования
+_IMMUTABLE_ARG_TYPES = (str, int, float, bool, Decimal, date, datetime, bytes, type(None))
+
+# Стандартные атрибуты LogRecord; все остальные пришли через extra= и попадают в JSON
+_STANDARD_RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "sampled_out"}
+
+TEXT_FORMAT = "%(asctime)s [%(levelname)s] %(message)s"
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        sampled_out = getattr(record, "sampled_out", 0)
+        if sampled_out:
+            entry["sampled_out"] = sampled_out
+        for key, value in vars(record).items():
+            if key not in _STANDARD_RECORD_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc_info"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        sampled_out = getattr(record, "sampled_out", 0)
+        if sampled_out:
+            text += f" (пропущено похожих сообщений: {sampled_out})"
+        return text
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Ограничивает частые сообщения ниже WARNING с одного места вызова (файл и строка),
+    например построчный лог отчета или массового подтверждения. Предупреждения и ошибки проходят всегда.
+    """
+
+    def __init__(self, burst: int, interval: float):
+        super().__init__()
+        self.burst = burst
+        self.interval = interval
+        # ключ -> [начало окна, пропущено в окне, пропущено и еще не сообщено]
+        self._windows: dict[tuple, list] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        key = (record.pathname, record.lineno)
+        now = record.created
+        window = self._windows.get(key)
+        if window is None or now - window[0] >= self.interval:
+            if window is None and len(self._windows) > 10000:
+                self._windows.clear()
+            window = self._windows[key] = [now, 0, window[2] if window else 0]
+        window[1] += 1
+        if window[1] > self.burst:
+            window[2] += 1
+            return False
+        if window[2]:
+            record.sampled_out = window[2]
+            window[2] = 0
+        return True
+
+
+class LazyQueueHandler(QueueHandler):
+    """
+    QueueHandler без форматирования в вызывающем потоке: стандартный prepare() собирает
+    строку сообщения сразу, а нам нужно отдать это фоновому потоку.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        if record.args and not all(isinstance(arg, _IMMUTABLE_ARG_TYPES) for arg in _iter_args(record.args)):
+            record.msg = record.getMessage()
+            record.args = None
+        return record
+
+
+def _iter_args(args):
+    return args.values() if isinstance(args, dict) else args
+
+
+_listener: Optional[QueueListener] = None
+
+
+def setup_logging(level: int | str = logging.INFO, json_output: bool = True,
+                  sample_burst: int = 20, sample_interval: float = 1.0) -> QueueListener:
+    """
+    Настраивает корневой логгер: QueueHandler (+ SamplingFilter) -> очередь -> фоновый поток -> stdout.
+    Повторный вызов возвращает уже запущенный listener. Остановка — stop_logging() (зарегистрирована в atexit).
+    """
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(JsonFormatter() if json_output else TextFormatter(TEXT_FORMAT))
+
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    queue_handler = LazyQueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter(sample_burst, sample_interval))
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    _listener = QueueListener(log_queue, output, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+    return _listener
+
+
+def stop_logging() -> None:
+    """Дописывает оставшиеся в очереди записи и останавливает фоновый поток."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
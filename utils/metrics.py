@@ -0,0 +1,411 @@
+# utils/metrics.py
+"""
+Метрики бота в текстовом формате Prometheus (exposition format 0.0.4).
+
+Собственный небольшой реестр без внешних зависимостей: счетчики и гистограммы
+обновляются в горячем пути (middleware, логгер запросов asyncpg) за несколько
+операций со словарем, а гейджи (пул БД, очередь отправки, FSM) считаются только
+в момент запроса /metrics через функции обратного вызова.
+
+Что собирается:
+- апдейты по типам и время их обработки (UpdateMetricsMiddleware, outer middleware диспетчера);
+- вызовы, ошибки и время хендлеров по роутерам (HandlerMetricsMiddleware, вешается в handlers.load_routers);
+- callback-запросы по префиксу callback_data;
+- SQL-запросы по имени «операция_таблица» (observe_query — логгер запросов соединений пула);
+- состояние пула БД, очереди исходящих запросов и число пользователей в каждом состоянии FSM;
+- бизнес-счетчики: созданные/подтвержденные/отмененные заказы, проведенные оплаты.
+
+Эндпоинт поднимается start_metrics_server() на METRICS_HOST:METRICS_PORT из config.py.
+"""
+
+import logging
+import re
+import time
+from bisect import bisect_left
+from functools import lru_cache
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional
+
+from aiogram import BaseMiddleware
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+PREFIX = "tg_bot_"
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Границы гистограмм времени (сек): от быстрых ответов из кэша до тяжелых отчетов
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Сколько разных значений метки допускается для динамических имен (префиксы callback, SQL-запросы).
+# Остальные попадают в OTHER_LABEL, чтобы ошибка в генерации callback_data не раздула реестр.
+MAX_DYNAMIC_LABELS = 200
+OTHER_LABEL = "other"
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = PREFIX + name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def header(self) -> list[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+    def samples(self) -> list[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, *labels, amount: float = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self) -> list[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+            for labels, value in sorted(self._values.items())
+        ]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        # labels -> [счетчики по корзинам (последняя — +Inf), сумма]
+        self._values: dict[tuple, list] = {}
+
+    def observe(self, value: float, *labels) -> None:
+        entry = self._values.get(labels)
+        if entry is None:
+            entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        entry[0][bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+
+    def samples(self) -> list[str]:
+        lines = []
+        for labels, (counts, total) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+class CallbackMetric(_Metric):
+    """
+    Метрика, значения которой вычисляются при каждом запросе /metrics.
+    func возвращает [(значения меток, значение), ...]; пока источник не подключен — пустой список.
+    """
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), kind: str = "gauge"):
+        super().__init__(name, documentation, labelnames)
+        self.kind = kind
+        self.func: Optional[Callable[[], Iterable[tuple]]] = None
+
+    def samples(self) -> list[str]:
+        if self.func is None:
+            return []
+        try:
+            values = list(self.func())
+        except Exception as e:
+            logger.warning("Не удалось вычислить метрику %s: %s", self.name, e)
+            return []
+        return [
+            f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+            for labels, value in values
+        ]
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: list[_Metric] = []
+
+    def _register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: tuple = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def callback(self, name: str, documentation: str, labelnames: tuple = (), kind: str = "gauge") -> CallbackMetric:
+        return self._register(CallbackMetric(name, documentation, labelnames, kind))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.header())
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+# Глобальный реестр
+registry = MetricsRegistry()
+
+# --- Апдейты и хендлеры ---
+UPDATES_TOTAL = registry.counter("updates_total", "Обработанные апдейты по типу.", ("type",))
+UPDATE_ERRORS_TOTAL = registry.counter("update_errors_total", "Апдейты, обработка которых завершилась исключением.", ("type",))
+UPDATE_DURATION = registry.histogram("update_duration_seconds", "Время обработки апдейта диспетчером.", ("type",))
+
+HANDLER_CALLS_TOTAL = registry.counter("handler_calls_total", "Вызовы хендлеров.", ("router", "handler"))
+HANDLER_ERRORS_TOTAL = registry.counter("handler_errors_total", "Исключения в хендлерах.", ("router", "handler"))
+HANDLER_DURATION = registry.histogram("handler_duration_seconds", "Время выполнения хендлера.", ("router", "handler"))
+
+CALLBACK_QUERIES_TOTAL = registry.counter("callback_queries_total", "Callback-запросы по префиксу callback_data.", ("prefix",))
+CALLBACK_DURATION = registry.histogram("callback_duration_seconds", "Время обработки callback-запроса.", ("prefix",))
+ROLE_FILTER_REJECTIONS_TOTAL = registry.counter("role_filter_rejections_total", "Апдейты, не прошедшие фильтр роли роутера, по разделу.", ("section",))
+
+# --- БД ---
+DB_QUERIES_TOTAL = registry.counter("db_queries_total", "SQL-запросы по имени (операция_таблица).", ("query",))
+DB_QUERY_ERRORS_TOTAL = registry.counter("db_query_errors_total", "SQL-запросы, завершившиеся ошибкой.", ("query",))
+DB_QUERY_DURATION = registry.histogram("db_query_duration_seconds", "Время выполнения SQL-запроса.", ("query",))
+DB_POOL_CONNECTIONS = registry.callback("db_pool_connections", "Соединения пула asyncpg: size, idle, in_use, max.", ("state",))
+DB_READS_ROUTED_TOTAL = registry.counter("db_reads_routed_total", "Чтения отчетов по пулу: replica или primary.", ("target",))
+DB_QUERY_TIMEOUTS_TOTAL = registry.counter("db_query_timeouts_total", "Вызовы, снятые по таймауту класса запросов.", ("class",))
+STOCK_LOCK_WAITS_TOTAL = registry.counter("stock_lock_waits_total", "Изменения остатков, ждавшие блокировки строки stock, по товару.", ("product",))
+STOCK_LOCK_WAIT_SECONDS = registry.histogram("stock_lock_wait_seconds", "Ожидание блокировки строки stock при изменении остатка, по товару.", ("product",))
+REPLICA_LAG_SECONDS = registry.callback("replica_lag_seconds", "Отставание реплики для отчетов (db_operations/replica.py).")
+JOURNAL_ENTRIES_TOTAL = registry.counter("journal_entries_total", "Локальный журнал записей: journaled, replayed, failed.", ("event",))
+JOURNAL_PENDING = registry.callback("journal_pending", "Записи локального журнала, ожидающие проигрывания в БД.")
+
+# --- Очередь исходящих запросов (utils/send_queue.py) ---
+SEND_QUEUE_SIZE = registry.callback("send_queue_size", "Запросы, ожидающие отправки в Bot API.", ("queue",))
+SEND_QUEUE_EVENTS_TOTAL = registry.callback(
+    "send_queue_events_total", "События планировщика отправки: sent, coalesced, retry_after.", ("event",), kind="counter"
+)
+
+# --- Корзина (utils/cart_view.py) ---
+CART_VIEW_EVENTS_TOTAL = registry.callback(
+    "cart_view_events_total", "Отрисовки корзины: rendered, skipped (без изменений), batched (склеены).", ("event",), kind="counter"
+)
+
+# --- FSM ---
+FSM_STATES = registry.callback("fsm_states", "Пользователи в каждом состоянии FSM.", ("state",))
+
+# --- Бизнес-счетчики ---
+ORDERS_CREATED_TOTAL = registry.counter("orders_created_total", "Созданные заказы (черновики).")
+ORDERS_CONFIRMED_TOTAL = registry.counter("orders_confirmed_total", "Подтвержденные заказы.")
+ORDERS_CANCELLED_TOTAL = registry.counter("orders_cancelled_total", "Отмененные заказы.")
+PAYMENTS_APPLIED_TOTAL = registry.counter("payments_applied_total", "Проведенные оплаты по накладным.", ("kind",))
+INVOICES_MARKED_OVERDUE_TOTAL = registry.counter("invoices_marked_overdue_total", "Накладные, переведенные в просрочку.")
+OUTBOX_EVENTS_DISPATCHED_TOTAL = registry.counter("outbox_events_dispatched_total", "Обработанные события outbox по типу.", ("type",))
+
+# --- Документы (utils/documents.py) ---
+DOCUMENTS_RENDERED_TOTAL = registry.counter("documents_rendered_total", "Сверстанные документы PDF/XLSX.", ("kind",))
+DOCUMENT_CACHE_HITS_TOTAL = registry.counter("document_cache_hits_total", "Документы, отправленные по сохраненному file_id.", ("kind",))
+DOCUMENT_RENDER_DURATION = registry.histogram("document_render_duration_seconds", "Время верстки документа в пуле процессов.", ("kind",))
+
+
+# --- Имена для меток ---
+
+_callback_suffix_re = re.compile(r"(_[\d\-.]+)+$")
+_seen_callback_prefixes: set[str] = set()
+
+
+def _bounded(value: str, seen: set[str]) -> str:
+    if value in seen:
+        return value
+    if len(seen) >= MAX_DYNAMIC_LABELS:
+        return OTHER_LABEL
+    seen.add(value)
+    return value
+
+
+def callback_prefix(data: Optional[str]) -> str:
+    """
+    Префикс callback_data без идентификаторов: 'confirm_payment_15' -> 'confirm_payment',
+    'select_inv_date_2024-05-01' -> 'select_inv_date', 'edit_quantity:remove:3' -> 'edit_quantity'.
+    """
+    if not data:
+        return "empty"
+    prefix = _callback_suffix_re.sub("", data.split(":", 1)[0]) or "empty"
+    return _bounded(prefix, _seen_callback_prefixes)
+
+
+_seen_lock_products: set[str] = set()
+
+
+def stock_lock_product(product_id: int) -> str:
+    """Метка товара для метрик ожидания блокировки остатка (ждут обычно несколько популярных товаров)."""
+    return _bounded(str(product_id), _seen_lock_products)
+
+
+_sql_comment_re = re.compile(r"--[^\n]*|/\*.*?\*/", re.S)
+_sql_table_patterns = {
+    "select": re.compile(r"\bfrom\s+([\w.\"]+)", re.I),
+    "with": re.compile(r"\bfrom\s+([\w.\"]+)", re.I),
+    "insert": re.compile(r"\binto\s+([\w.\"]+)", re.I),
+    "update": re.compile(r"^update\s+([\w.\"]+)", re.I),
+    "delete": re.compile(r"\bfrom\s+([\w.\"]+)", re.I),
+    "copy": re.compile(r"^copy\s+([\w.\"]+)", re.I),
+}
+_seen_query_names: set[str] = set()
+
+
+@lru_cache(maxsize=1024)
+def sql_query_name(query: str) -> str:
+    """Короткое имя запроса для метки: 'select_orders', 'update_stock', 'insert_order_lines'."""
+    text = _sql_comment_re.sub(" ", query).strip()
+    operation = text.split(None, 1)[0].rstrip(";").lower() if text else "empty"
+    pattern = _sql_table_patterns.get(operation)
+    if pattern is None:
+        return _bounded(operation, _seen_query_names)
+    match = pattern.search(text)
+    table = match.group(1).strip('"').rsplit(".", 1)[-1].lower() if match else "unknown"
+    return _bounded(f"{operation}_{table}", _seen_query_names)
+
+
+def observe_query(record) -> None:
+    """Логгер запросов asyncpg (Connection.add_query_logger): record — asyncpg.connection.LoggedQuery."""
+    name = sql_query_name(record.query)
+    DB_QUERIES_TOTAL.inc(name)
+    if record.exception is not None:
+        DB_QUERY_ERRORS_TOTAL.inc(name)
+    if record.elapsed is not None:
+        DB_QUERY_DURATION.observe(record.elapsed, name)
+
+
+# --- Middleware ---
+
+class UpdateMetricsMiddleware(BaseMiddleware):
+    """Outer middleware диспетчера (dp.update): считает все апдейты, включая отброшенные фильтрами."""
+
+    async def __call__(self, handler: Callable[[Any, Dict[str, Any]], Awaitable[Any]], event: Any, data: Dict[str, Any]) -> Any:
+        update_type = event.event_type
+        prefix = callback_prefix(event.callback_query.data) if event.callback_query is not None else None
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except BaseException:
+            UPDATE_ERRORS_TOTAL.inc(update_type)
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            UPDATES_TOTAL.inc(update_type)
+            UPDATE_DURATION.observe(elapsed, update_type)
+            if prefix is not None:
+                CALLBACK_QUERIES_TOTAL.inc(prefix)
+                CALLBACK_DURATION.observe(elapsed, prefix)
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Inner middleware роутера: вызывается только для сработавшего хендлера этого роутера."""
+
+    def __init__(self, router_name: str):
+        self.router_name = router_name
+
+    async def __call__(self, handler: Callable[[Any, Dict[str, Any]], Awaitable[Any]], event: Any, data: Dict[str, Any]) -> Any:
+        handler_object = data.get("handler")
+        handler_name = getattr(getattr(handler_object, "callback", None), "__name__", "unknown")
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            HANDLER_ERRORS_TOTAL.inc(self.router_name, handler_name)
+            raise
+        finally:
+            HANDLER_CALLS_TOTAL.inc(self.router_name, handler_name)
+            HANDLER_DURATION.observe(time.perf_counter() - started, self.router_name, handler_name)
+
+
+# --- Источники гейджей ---
+
+def watch_db_pool(pool) -> None:
+    def collect():
+        size, idle = pool.get_size(), pool.get_idle_size()
+        return [(("size",), size), (("idle",), idle), (("in_use",), size - idle), (("max",), pool.get_max_size())]
+    DB_POOL_CONNECTIONS.func = collect
+
+
+def watch_replica(router) -> None:
+    REPLICA_LAG_SECONDS.func = lambda: [((), router.lag_seconds)] if router.lag_seconds is not None else []
+
+
+def watch_write_journal(journal) -> None:
+    JOURNAL_PENDING.func = lambda: [((), journal.pending_count())]
+
+
+def watch_send_queue(scheduler) -> None:
+    SEND_QUEUE_SIZE.func = lambda: [
+        (("waiting",), scheduler.gate.queued),
+        (("pending_edits",), scheduler.pending_edits),
+    ]
+    SEND_QUEUE_EVENTS_TOTAL.func = lambda: [
+        (("sent",), scheduler.sent),
+        (("coalesced",), scheduler.coalesced),
+        (("retry_after",), scheduler.retry_after),
+    ]
+
+
+def watch_cart_view(view) -> None:
+    CART_VIEW_EVENTS_TOTAL.func = lambda: [
+        (("rendered",), view.rendered),
+        (("skipped",), view.skipped),
+        (("batched",), view.batched),
+    ]
+
+
+def watch_fsm_storage(storage) -> None:
+    """Число пользователей по состояниям FSM. Поддерживается MemoryStorage (записи лежат в storage.storage)."""
+    records = getattr(storage, "storage", None)
+    if records is None:
+        logger.info("Хранилище FSM %s не поддерживает подсчет состояний, метрика fsm_states отключена.", type(storage).__name__)
+        return
+
+    def collect():
+        counts: dict[str, int] = {}
+        for record in list(records.values()):
+            if record.state:
+                counts[record.state] = counts.get(record.state, 0) + 1
+        return [((state,), count) for state, count in sorted(counts.items())]
+    FSM_STATES.func = collect
+
+
+# --- HTTP-эндпоинт ---
+
+async def _handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(body=registry.render().encode("utf-8"), headers={"Content-Type": CONTENT_TYPE})
+
+
+async def start_metrics_server(host: str, port: int) -> web.AppRunner:
+    """Поднимает GET /metrics. Возвращает runner; остановка — await runner.cleanup()."""
+    app = web.Application()
+    app.router.add_get("/metrics", _handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info("Метрики доступны на http://%s:%s/metrics", host, port)
+    return runner
@@ -0,0 +1,275 @@
+# utils/send_queue.py
+"""
+Планировщик исходящих запросов к Telegram Bot API.
+
+Подключается как request-middleware сессии бота (см. tg_bot.create_bot), поэтому
+все message.answer / edit_text / bot.send_* проходят через него без изменений в хендлерах:
+
+- токен-бакеты: общий на бота и отдельный на каждый чат;
+- запросы в один чат отправляются строго по очереди (порядок сообщений сохраняется);
+- при TelegramRetryAfter чат (или весь бот) ставится на паузу на retry_after секунд
+  и запрос повторяется автоматически;
+- несколько подряд идущих правок одного сообщения, еще не ушедших в API,
+  склеиваются в одну (отправляется последняя версия);
+- приоритеты: интерактивные ответы обгоняют длинные отчеты
+  (см. bulk_sends() и SendPriorityMiddleware).
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from enum import IntEnum
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import (
+    AnswerCallbackQuery, AnswerInlineQuery, DeleteWebhook, EditMessageReplyMarkup,
+    EditMessageText, GetMe, GetUpdates
+)
+
+logger = logging.getLogger(__name__)
+
+# Лимиты Telegram: ~30 сообщений в секунду на бота и ~1 сообщение в секунду в один чат (с небольшим всплеском)
+GLOBAL_RATE_PER_SECOND = 28
+GLOBAL_BURST = 30
+CHAT_RATE_PER_SECOND = 0.9  # с запасом на разброс задержек сети
+CHAT_BURST = 3
+
+# Сколько раз повторять запрос после TelegramRetryAfter
+MAX_RETRY_AFTER_ATTEMPTS = 3
+
+# Методы, которые не ставятся в очередь: long polling и ответы, которые Telegram ждет немедленно
+PASSTHROUGH_METHODS = (GetUpdates, GetMe, DeleteWebhook, AnswerCallbackQuery, AnswerInlineQuery)
+
+# Правки, которые можно склеивать, если предыдущая еще не отправлена
+COALESCIBLE_METHODS = (EditMessageText, EditMessageReplyMarkup)
+
+
+class Priority(IntEnum):
+    INTERACTIVE = 0
+    BULK = 1
+
+
+send_priority: ContextVar[Priority] = ContextVar("send_priority", default=Priority.INTERACTIVE)
+
+
+@contextmanager
+def bulk_sends():
+    """Запросы внутри блока идут в низкоприоритетной очереди (длинные отчеты, массовые действия)."""
+    token = send_priority.set(Priority.BULK)
+    try:
+        yield
+    finally:
+        send_priority.reset(token)
+
+
+class SendPriorityMiddleware(BaseMiddleware):
+    """Middleware роутера: все ответы его хендлеров отправляются с заданным приоритетом."""
+
+    def __init__(self, priority: Priority):
+        self.priority = priority
+
+    async def __call__(self, handler: Callable[[Any, Dict[str, Any]], Awaitable[Any]], event: Any, data: Dict[str, Any]) -> Any:
+        token = send_priority.set(self.priority)
+        try:
+            return await handler(event, data)
+        finally:
+            send_priority.reset(token)
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self) -> float:
+        """Через сколько секунд будет доступен токен (0 — доступен сейчас)."""
+        now = time.monotonic()
+        self._refill(now)
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self) -> None:
+        self.tokens -= 1
+
+    def block(self, seconds: float) -> None:
+        """Пауза после 429: токены не выдаются seconds секунд."""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+    async def acquire(self) -> None:
+        while (delay := self.delay()) > 0:
+            await asyncio.sleep(delay)
+        self.take()
+
+
+class PriorityGate:
+    """Общий бакет бота, выдающий токены ожидающим в порядке (приоритет, очередность)."""
+
+    def __init__(self, bucket: TokenBucket):
+        self.bucket = bucket
+        self._waiters: list = []
+        self._counter = itertools.count()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self, priority: Priority) -> None:
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._counter), future))
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        await future
+
+    async def _run(self) -> None:
+        while self._waiters:
+            delay = self.bucket.delay()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            _, _, future = heapq.heappop(self._waiters)
+            if future.done():  # ожидающий отменен
+                continue
+            self.bucket.take()
+            future.set_result(None)
+
+
+class _PendingEdit:
+    __slots__ = ("method", "future", "joined")
+
+    def __init__(self, method, future):
+        self.method = method
+        self.future = future
+        self.joined = 0
+
+
+class OutboundScheduler(BaseRequestMiddleware):
+    def __init__(
+        self,
+        global_rate: float = GLOBAL_RATE_PER_SECOND,
+        global_burst: float = GLOBAL_BURST,
+        chat_rate: float = CHAT_RATE_PER_SECOND,
+        chat_burst: float = CHAT_BURST,
+        max_retries: int = MAX_RETRY_AFTER_ATTEMPTS
+    ):
+        self.gate = PriorityGate(TokenBucket(global_rate, global_burst))
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self._chat_buckets: dict[Any, TokenBucket] = {}
+        self._chat_locks: dict[Any, asyncio.Lock] = {}
+        self._pending_edits: dict[tuple, _PendingEdit] = {}
+
+        # Счетчики для логов/метрик
+        self.sent = 0
+        self.coalesced = 0
+        self.retry_after = 0
+
+    @property
+    def pending_edits(self) -> int:
+        """Правки, ожидающие отправки (с ними склеиваются новые правки того же сообщения)."""
+        return len(self._pending_edits)
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    def _chat_lock(self, chat_id) -> asyncio.Lock:
+        lock = self._chat_locks.get(chat_id)
+        if lock is None:
+            lock = self._chat_locks[chat_id] = asyncio.Lock()
+        return lock
+
+    async def __call__(self, make_request, bot, method):
+        if isinstance(method, PASSTHROUGH_METHODS):
+            return await make_request(bot, method)
+
+        chat_id = getattr(method, "chat_id", None)
+        priority = send_priority.get()
+
+        message_id = getattr(method, "message_id", None)
+        if not isinstance(method, COALESCIBLE_METHODS) or chat_id is None or message_id is None:
+            return await self._dispatch(make_request, bot, chat_id, priority, lambda: method)
+
+        key = (type(method).__name__, chat_id, message_id)
+        pending = self._pending_edits.get(key)
+        if pending is not None:
+            # Предыдущая правка этого сообщения еще в очереди — отправится наша, более свежая версия
+            pending.method = method
+            pending.joined += 1
+            self.coalesced += 1
+            return await asyncio.shield(pending.future)
+
+        pending = _PendingEdit(method, asyncio.get_running_loop().create_future())
+        self._pending_edits[key] = pending
+
+        def on_dispatch():
+            # С этого момента новые правки встают в очередь отдельно
+            if self._pending_edits.get(key) is pending:
+                del self._pending_edits[key]
+
+        try:
+            result = await self._dispatch(make_request, bot, chat_id, priority, lambda: pending.method, on_dispatch)
+        except BaseException as e:
+            on_dispatch()
+            if pending.joined and not pending.future.done():
+                pending.future.set_exception(e)
+            raise
+        if not pending.future.done():
+            pending.future.set_result(result)
+        return result
+
+    async def _dispatch(self, make_request, bot, chat_id, priority: Priority, get_method, on_dispatch=None):
+        lock = self._chat_lock(chat_id) if chat_id is not None else None
+        if lock is not None:
+            await lock.acquire()
+        try:
+            attempt = 0
+            while True:
+                if chat_id is not None:
+                    await self._chat_bucket(chat_id).acquire()
+                await self.gate.acquire(priority)
+                if on_dispatch is not None:
+                    on_dispatch()
+                    on_dispatch = None
+                method = get_method()
+                try:
+                    result = await make_request(bot, method)
+                    self.sent += 1
+                    return result
+                except TelegramRetryAfter as e:
+                    self.retry_after += 1
+                    attempt += 1
+                    if attempt > self.max_retries:
+                        raise
+                    logger.warning(
+                        "Telegram flood control: %s в чат %s, повтор через %s с (попытка %d/%d)",
+                        type(method).__name__, chat_id, e.retry_after, attempt, self.max_retries
+                    )
+                    if chat_id is not None:
+                        self._chat_bucket(chat_id).block(e.retry_after)
+                    else:
+                        self.gate.bucket.block(e.retry_after)
+        finally:
+            if lock is not None:
+                lock.release()
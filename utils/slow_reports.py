@@ -0,0 +1,58 @@
+# utils/slow_reports.py
+"""
+Отчеты, которые не уложились в таймаут класса report (db_operations/query_classes.py).
+
+run_report(message, build, send, title): build() читает данные отчета, send(result) отправляет его.
+Если build() снят по таймауту, пользователь сразу получает ответ «формируется дольше обычного»,
+а отчет пересчитывается в фоновой задаче с классом bulk и отправляется, когда будет готов.
+Соединение, занятое снятым запросом, к этому моменту уже возвращено в пул.
+"""
+
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable
+
+from aiogram.types import Message
+
+from db_operations.query_classes import BULK, QueryTimeout, query_class_override
+from utils.markdown_utils import escape_markdown_v2
+
+logger = logging.getLogger(__name__)
+
+# Ссылки на фоновые задачи отчетов, чтобы их не собрал сборщик мусора
+_background_tasks: set[asyncio.Task] = set()
+
+
+async def run_report(
+    message: Message,
+    build: Callable[[], Awaitable[Any]],
+    send: Callable[[Any], Awaitable[None]],
+    title: str
+) -> None:
+    """Строит и отправляет отчет; при таймауте досчитывает его в фоне."""
+    try:
+        result = await build()
+    except QueryTimeout:
+        await message.answer(
+            escape_markdown_v2(f"⏳ {title} формируется дольше обычного. Пришлю, как только будет готов."),
+            parse_mode="MarkdownV2"
+        )
+        task = asyncio.create_task(_finish_in_background(message, build, send, title))
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
+        return
+    await send(result)
+
+
+async def _finish_in_background(message: Message, build, send, title: str) -> None:
+    try:
+        with query_class_override(BULK):
+            result = await build()
+        await send(result)
+        logger.info("Отчет «%s» для чата %s досчитан в фоне.", title, message.chat.id)
+    except Exception as e:
+        logger.error("Не удалось досчитать отчет «%s» в фоне: %s", title, e, exc_info=True)
+        await message.answer(
+            escape_markdown_v2(f"❌ {title}: не удалось сформировать отчет. Попробуйте позже."),
+            parse_mode="MarkdownV2"
+        )